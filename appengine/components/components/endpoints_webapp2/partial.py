@@ -282,3 +282,33 @@ def mask(response, fields):
     ParsingError: If fields wasn't a valid partial response string.
   """
   return _apply(response, _parse(fields))
+
+
+def subfields(fields, name):
+  """Returns the subfields of a top level field kept by a fields string.
+
+  It lets a service skip computing the values that would be masked away.
+
+  Args:
+    fields: A fields partial response string.
+    name: The name of a top level field of the response.
+
+  Returns:
+    A set of the names of the subfields of `name` to include, an empty set if
+    `name` is masked away or None if all its subfields are included.
+
+  Raises:
+    ParsingError: If fields wasn't a valid partial response string.
+  """
+  partial = _parse(fields)
+  if name in partial:
+    pointer = partial[name]
+    if pointer:
+      _merge(partial.get('*', {}), pointer)
+  else:
+    pointer = partial.get('*')
+  if pointer is None:
+    return set()
+  if not pointer or '*' in pointer:
+    return None
+  return set(pointer)
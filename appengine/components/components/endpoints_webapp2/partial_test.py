@@ -744,6 +744,27 @@ class ParseTestCase(test_case.TestCase):
         partial._parse(f)
 
 
+class SubfieldsTestCase(test_case.TestCase):
+  """Tests for partial.subfields."""
+
+  def test_subfields(self):
+    self.assertEqual(partial.subfields('a(b,c/d),e', 'a'), {'b', 'c'})
+    self.assertEqual(partial.subfields('a/b,*/c', 'a'), {'b', 'c'})
+    self.assertEqual(partial.subfields('*/c', 'a'), {'c'})
+
+  def test_all(self):
+    self.assertIsNone(partial.subfields('a,e', 'a'))
+    self.assertIsNone(partial.subfields('a/*/c', 'a'))
+    self.assertIsNone(partial.subfields('*', 'a'))
+
+  def test_none(self):
+    self.assertEqual(partial.subfields('e/f', 'a'), set())
+
+  def test_error(self):
+    with self.assertRaises(partial.ParsingError):
+      partial.subfields('a)', 'a')
+
+
 if __name__ == '__main__':
   if '-v' in sys.argv:
     unittest.TestCase.maxDiff = None
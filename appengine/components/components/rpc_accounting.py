@@ -0,0 +1,262 @@
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Per request accounting of the datastore and memcache RPCs.
+
+Wrap a webapp2 application with instrument() to count the API RPCs done by each
+request, grouped by service, call and datastore entity kind, along with the
+bytes sent and received and the wall time spent waiting for them.
+
+The stats of each request are passed to the callbacks registered with
+register_callback(), e.g. to export them as ts_mon metrics. They can also be
+logged or returned in the X-Luci-Rpc-Stats response header.
+
+A fraction of the requests are sampled: for these, the full trace of every RPC
+is recorded and logged.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+
+# Services that are accounted.
+SERVICES = ('datastore_v3', 'memcache')
+
+# Response header containing the summary, when enabled.
+HEADER = 'X-Luci-Rpc-Stats'
+
+# Key used to register the hooks in apiproxy_stub_map.
+_HOOK_KEY = 'rpc_accounting'
+
+# Stats of the request being served by the current thread.
+_local = threading.local()
+
+# Functions called with (handler name, RequestStats) at the end of each request.
+_callbacks = []
+
+
+class RpcStats(object):
+  """Aggregated stats for one (service, call, kind)."""
+  __slots__ = ('count', 'bytes_sent', 'bytes_received', 'wall', 'errors')
+
+  def __init__(self):
+    self.count = 0
+    self.bytes_sent = 0
+    self.bytes_received = 0
+    self.wall = 0.
+    self.errors = 0
+
+
+class RequestStats(object):
+  """RPC stats of a single request."""
+
+  def __init__(self, sampled):
+    self.start = time.time()
+    # (service, call, kind) -> RpcStats.
+    self.rpcs = {}
+    # List of dict, one per RPC, only when sampled.
+    self.trace = [] if sampled else None
+    # id(request proto) -> (start time, kind) for the RPCs in flight.
+    self._inflight = {}
+
+  @property
+  def count(self):
+    return sum(s.count for s in self.rpcs.itervalues())
+
+  @property
+  def wall(self):
+    return sum(s.wall for s in self.rpcs.itervalues())
+
+  def summary(self):
+    """Returns a short one line description of the stats."""
+    items = sorted(
+        (service, call, kind, s) for (service, call, kind), s
+        in self.rpcs.iteritems())
+    return '%d RPCs in %.1fms: %s' % (
+        self.count, self.wall * 1000.,
+        ', '.join(
+            '%s.%s%s=%d' % (service, call, '(%s)' % kind if kind else '',
+                            s.count)
+            for service, call, kind, s in items))
+
+  def _on_start(self, request, kind):
+    self._inflight[id(request)] = (time.time(), kind)
+
+  def _on_end(self, service, call, request, response, error):
+    start, kind = self._inflight.pop(id(request), (None, ''))
+    now = time.time()
+    wall = now - start if start else 0.
+    s = self.rpcs.get((service, call, kind))
+    if not s:
+      s = self.rpcs[(service, call, kind)] = RpcStats()
+    s.count += 1
+    s.wall += wall
+    sent = _byte_size(request)
+    received = _byte_size(response) if not error else 0
+    s.bytes_sent += sent
+    s.bytes_received += received
+    if error:
+      s.errors += 1
+    if self.trace is not None:
+      self.trace.append({
+        'offset_ms': round(((start or now) - self.start) * 1000., 1),
+        'rpc': '%s.%s' % (service, call),
+        'kind': kind,
+        'wall_ms': round(wall * 1000., 1),
+        'bytes_sent': sent,
+        'bytes_received': received,
+        'error': error.__class__.__name__ if error else None,
+      })
+
+
+### Private stuff.
+
+
+def _byte_size(msg):
+  try:
+    return msg.ByteSize()
+  except Exception:  # pylint: disable=broad-except
+    return 0
+
+
+def _key_kind(key):
+  return key.path().element_list()[-1].type()
+
+
+def _datastore_kind(call, request):
+  """Returns the entity kinds involved in a datastore_v3 RPC, comma separated.
+  """
+  try:
+    if call in ('Get', 'Delete'):
+      kinds = set(_key_kind(k) for k in request.key_list())
+    elif call == 'Put':
+      kinds = set(_key_kind(e.key()) for e in request.entity_list())
+    elif call == 'RunQuery':
+      kinds = set([request.kind()]) if request.has_kind() else set()
+    else:
+      return ''
+  except Exception:  # pylint: disable=broad-except
+    return ''
+  return ','.join(sorted(kinds))
+
+
+def _pre_call_hook(service, call, request, _response):
+  stats = getattr(_local, 'stats', None)
+  if stats:
+    kind = _datastore_kind(call, request) if service == 'datastore_v3' else ''
+    stats._on_start(request, kind)
+
+
+def _post_call_hook(service, call, request, response, _rpc, error=None):
+  stats = getattr(_local, 'stats', None)
+  if stats:
+    stats._on_end(service, call, request, response, error)
+
+
+def _install_hooks():
+  """Registers the hooks in the current apiproxy.
+
+  It is a no-op when they are already registered. This is called on each
+  request since the apiproxy is replaced in unit tests.
+  """
+  for service in SERVICES:
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        _HOOK_KEY + service, _pre_call_hook, service)
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        _HOOK_KEY + service, _post_call_hook, service)
+
+
+def _handler_name(request):
+  """Returns the route template that served this request."""
+  route = getattr(request, 'route', None)
+  if not route:
+    return 'unknown'
+  name = getattr(route, 'template', None) or repr(route)
+  # pRPC uses a single route for all the methods.
+  kwargs = getattr(request, 'route_kwargs', None) or {}
+  for k in ('service', 'method'):
+    if k in kwargs:
+      name = name.replace('<%s>' % k, kwargs[k])
+  return name
+
+
+### Public API.
+
+
+def register_callback(callback):
+  """Registers a function called with (handler name, RequestStats) at the end
+  of each instrumented request.
+  """
+  if callback not in _callbacks:
+    _callbacks.append(callback)
+
+
+def get_current():
+  """Returns the RequestStats of the current request or None."""
+  return getattr(_local, 'stats', None)
+
+
+def start_request(sample_rate=0.):
+  """Starts accounting the RPCs done by the current thread.
+
+  Returns:
+    RequestStats.
+  """
+  _install_hooks()
+  _local.stats = RequestStats(random.random() < sample_rate)
+  return _local.stats
+
+
+def end_request():
+  """Stops accounting the RPCs done by the current thread.
+
+  Returns:
+    RequestStats or None if start_request() wasn't called.
+  """
+  stats = getattr(_local, 'stats', None)
+  _local.stats = None
+  return stats
+
+
+def instrument(app, header=False, log=False, sample_rate=0.01):
+  """Wraps an app so the RPCs done by each request are accounted.
+
+  Arguments:
+    app: webapp2.WSGIApplication.
+    header: if True, add the summary as the X-Luci-Rpc-Stats response header.
+    log: if True, log the summary at the end of each request.
+    sample_rate: fraction of the requests for which the full RPC trace is
+        recorded and logged.
+  """
+  old_dispatcher = app.router.dispatch
+  def dispatch_and_account(request, response):
+    start_request(sample_rate)
+    try:
+      rv = old_dispatcher(request, response)
+    finally:
+      stats = end_request()
+    name = _handler_name(request)
+    summary = stats.summary() if (header or log) else None
+    if log:
+      logging.info('%s: %s', name, summary)
+    if header:
+      (rv or response).headers[HEADER] = summary
+    if stats.trace is not None:
+      logging.info(
+          'RPC trace for %s:\n%s', name,
+          '\n'.join(
+              '%(offset_ms)7.1fms %(rpc)s(%(kind)s) %(wall_ms).1fms '
+              '%(bytes_sent)d/%(bytes_received)dB %(error)s' % t
+              for t in stats.trace))
+    for callback in _callbacks:
+      try:
+        callback(name, stats)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('rpc_accounting callback failed')
+    return rv
+  app.router.dispatch = dispatch_and_account
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import logging
+import sys
+import unittest
+
+from test_support import test_env
+test_env.setup_test_env()
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import webapp2
+import webtest
+
+from components import rpc_accounting
+from test_support import test_case
+
+
+class Entity(ndb.Model):
+  # Keep the RPCs predictable.
+  _use_cache = False
+  _use_memcache = False
+  a = ndb.IntegerProperty()
+
+
+class Handler(webapp2.RequestHandler):
+  def get(self):
+    Entity(id=1, a=1).put()
+    Entity.get_by_id(1)
+    memcache.get('foo')
+    self.response.write('ok')
+
+
+class RpcAccountingTest(test_case.TestCase):
+  def setUp(self):
+    super(RpcAccountingTest, self).setUp()
+    self.calls = []
+    self.mock(rpc_accounting, '_callbacks', [])
+    rpc_accounting.register_callback(
+        lambda name, stats: self.calls.append((name, stats)))
+
+  def tearDown(self):
+    rpc_accounting.end_request()
+    super(RpcAccountingTest, self).tearDown()
+
+  def _app(self, **kwargs):
+    app = webapp2.WSGIApplication([webapp2.Route('/foo/<bar>', Handler)])
+    rpc_accounting.instrument(app, **kwargs)
+    return webtest.TestApp(app)
+
+  def test_start_end_request(self):
+    self.assertIsNone(rpc_accounting.get_current())
+    stats = rpc_accounting.start_request()
+    self.assertIs(stats, rpc_accounting.get_current())
+    Entity(id=1, a=1).put()
+    self.assertIs(stats, rpc_accounting.end_request())
+    self.assertIsNone(rpc_accounting.get_current())
+    s = stats.rpcs[('datastore_v3', 'Put', 'Entity')]
+    self.assertEqual(1, s.count)
+    self.assertTrue(s.bytes_sent)
+    self.assertTrue(s.bytes_received)
+    self.assertEqual(0, s.errors)
+    # Not accounted anymore.
+    Entity(id=2, a=1).put()
+    self.assertEqual(1, s.count)
+
+  def test_instrument(self):
+    resp = self._app().get('/foo/1')
+    self.assertEqual('ok', resp.body)
+    self.assertNotIn(rpc_accounting.HEADER, resp.headers)
+    self.assertEqual(1, len(self.calls))
+    name, stats = self.calls[0]
+    self.assertEqual('/foo/<bar>', name)
+    self.assertEqual(
+        1, stats.rpcs[('datastore_v3', 'Put', 'Entity')].count)
+    self.assertEqual(
+        1, stats.rpcs[('datastore_v3', 'Get', 'Entity')].count)
+    self.assertEqual(1, stats.rpcs[('memcache', 'Get', '')].count)
+    self.assertIsNone(stats.trace)
+
+  def test_instrument_header(self):
+    resp = self._app(header=True).get('/foo/1')
+    self.assertTrue(
+        resp.headers[rpc_accounting.HEADER].startswith('3 RPCs in '))
+    self.assertIn(
+        'datastore_v3.Put(Entity)=1', resp.headers[rpc_accounting.HEADER])
+
+  def test_instrument_sampled(self):
+    self._app(sample_rate=1.).get('/foo/1')
+    _, stats = self.calls[0]
+    self.assertEqual(
+        ['datastore_v3.Put', 'datastore_v3.Get', 'memcache.Get'],
+        [t['rpc'] for t in stats.trace])
+    self.assertEqual('Entity', stats.trace[0]['kind'])
+
+  def test_handler_name_prpc(self):
+    request = webapp2.Request.blank('/prpc/a.B/C')
+    request.route = webapp2.Route('/prpc/<service>/<method>', Handler)
+    request.route_kwargs = {'service': 'a.B', 'method': 'C'}
+    self.assertEqual('/prpc/a.B/C', rpc_accounting._handler_name(request))
+
+
+if __name__ == '__main__':
+  if '-v' in sys.argv:
+    unittest.TestCase.maxDiff = None
+  logging.basicConfig(
+      level=logging.DEBUG if '-v' in sys.argv else logging.ERROR)
+  unittest.main()
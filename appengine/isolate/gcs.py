@@ -50,11 +50,25 @@ from components import utils
 CHUNK_SIZE = 512 * 1024
 
 
+# Size of the range requests of read_file_parallel(). It is larger than
+# CHUNK_SIZE to limit the number of requests for very large files.
+SEGMENT_SIZE = 2 * 1024 * 1024
+
+
+# Maximum number of range requests in flight in read_file_parallel(). The
+# memory used is bounded to PARALLEL_READS * SEGMENT_SIZE.
+PARALLEL_READS = 4
+
+
+# Maximum number of deletions in flight in delete_files().
+PARALLEL_DELETES = 20
+
+
 # Return value for get_file_info call.
 FileInfo = collections.namedtuple('FileInfo', ['size'])
 
 
-def list_files(bucket, subdir=None, batch_size=100):
+def list_files(bucket, subdir=None, batch_size=100, marker=None):
   """Yields filenames and stats of files inside subdirectory of a bucket.
 
   It always lists directories recursively.
@@ -62,6 +76,7 @@ def list_files(bucket, subdir=None, batch_size=100):
   Arguments:
     bucket: a bucket to list.
     subdir: subdirectory to list files from or None for an entire bucket.
+    marker: filename to resume listing after, relative to the bucket root.
 
   Yields:
     Tuples of (filename, stats), where filename is relative to the bucket root
@@ -70,7 +85,7 @@ def list_files(bucket, subdir=None, batch_size=100):
   # When listing an entire bucket, gcs expects /<bucket> without ending '/'.
   path_prefix = '/%s/%s' % (bucket, subdir) if subdir else '/%s' % bucket
   bucket_prefix = '/%s/' % bucket
-  marker = None
+  marker = bucket_prefix + marker if marker else None
   retry_params = _make_retry_params()
   while True:
     files_stats = cloudstorage.listbucket(
@@ -97,6 +112,19 @@ def list_files(bucket, subdir=None, batch_size=100):
       break
 
 
+def list_directories(bucket):
+  """Returns the names of the top level directories of a bucket."""
+  bucket_prefix = '/%s/' % bucket
+  return [
+    stat.filename[len(bucket_prefix):].rstrip('/')
+    for stat in cloudstorage.listbucket(
+        path_prefix=bucket_prefix,
+        delimiter='/',
+        retry_params=_make_retry_params())
+    if stat.is_dir
+  ]
+
+
 def delete_file(bucket, filename, ignore_missing=False):
   """Deletes one file stored in GS.
 
@@ -135,22 +163,54 @@ def delete_file(bucket, filename, ignore_missing=False):
       raise
 
 
-def delete_files(bucket, filenames, ignore_missing=False):
+def delete_files(
+    bucket, filenames, ignore_missing=False, parallel_deletes=PARALLEL_DELETES):
   """Deletes multiple files stored in GS.
 
+  Google Cloud Storage client library doesn't support batch deletes, so up to
+  |parallel_deletes| deletions are sent concurrently. The ones that fail are
+  retried one by one with delete_file().
+
   Arguments:
     bucket: a bucket that contains the files.
     filenames: list of file paths to delete (relative to a bucket root).
     ignore_missing: if True, will silently skip missing files, otherwise will
         print a warning to log.
+    parallel_deletes: maximum number of deletions in flight.
 
   Returns:
     An empty list so this function can be used with functions that expect
     the RPC to return a Future.
   """
-  # Sadly Google Cloud Storage client library doesn't support batch deletes,
-  # so do it one by one.
+  # pylint: disable=protected-access
+  api = cloudstorage.storage_api._get_storage_api(
+      retry_params=_make_retry_params())
+  pending = collections.deque()
+  failed = []
+
+  def wait_oldest():
+    filename, future = pending.popleft()
+    try:
+      status = future.get_result()[0]
+    except Exception as e:
+      logging.warning('Failed to delete /%s/%s: %s', bucket, filename, e)
+      status = None
+    if status == 404:
+      if not ignore_missing:
+        logging.warning(
+            'Trying to delete a GS file that\'s not there: /%s/%s',
+            bucket, filename)
+    elif status != 204:
+      failed.append(filename)
+
   for filename in filenames:
+    pending.append(
+        (filename, api.delete_object_async('/%s/%s' % (bucket, filename))))
+    if len(pending) >= parallel_deletes:
+      wait_oldest()
+  while pending:
+    wait_oldest()
+  for filename in failed:
     delete_file(bucket, filename, ignore_missing)
   return []
 
@@ -215,6 +275,65 @@ def read_file(bucket, filename, chunk_size=CHUNK_SIZE):
     file_ref = None
 
 
+def read_file_parallel(
+    bucket, filename, size, segment_size=SEGMENT_SIZE,
+    parallel_reads=PARALLEL_READS):
+  """Reads a file with concurrent range requests and yields its content.
+
+  The next segments are downloaded while the caller processes the current one.
+
+  Arguments:
+    bucket: a bucket that contains the file.
+    filename: name of the file to read.
+    size: size of the file, as returned by get_file_info().
+    segment_size: size of a range request and of the chunks yielded.
+    parallel_reads: maximum number of range requests in flight.
+
+  Yields:
+    Segments of a file (as str objects), in order.
+
+  Raises:
+    ValueError if the file changed while being read.
+  """
+  path = '/%s/%s' % (bucket, filename)
+  # pylint: disable=protected-access
+  api = cloudstorage.storage_api._get_storage_api(
+      retry_params=_make_retry_params())
+  pending = collections.deque()
+  next_offset = 0
+  bytes_read = 0
+  etag = None
+  data = None
+  try:
+    while pending or next_offset < size:
+      while next_offset < size and len(pending) < parallel_reads:
+        end = min(next_offset + segment_size, size) - 1
+        headers = {'Range': 'bytes=%d-%d' % (next_offset, end)}
+        future = api.get_object_async(path, headers=headers)
+        pending.append((headers, end + 1 - next_offset, future))
+        next_offset = end + 1
+      headers, expected, future = pending.popleft()
+      status, resp_headers, data = future.get_result()
+      cloudstorage.errors.check_status(
+          status, [200, 206], path, headers, resp_headers)
+      if etag is None:
+        etag = resp_headers.get('etag')
+      if etag != resp_headers.get('etag') or len(data) != expected:
+        raise ValueError('\'%s\' changed while being read' % path)
+      bytes_read += len(data)
+      yield data
+      # Remove reference to a buffer so it can be GC'ed.
+      data = None
+  except Exception as exc:
+    logging.warning(
+        'Exception while reading \'%s\', read %d bytes: %s %s',
+        path, bytes_read, exc.__class__.__name__, exc)
+    raise
+  finally:
+    data = None
+    pending.clear()
+
+
 def write_file(bucket, filename, content):
   """Stores the given content as a file in Google Storage.
 
@@ -331,17 +450,23 @@ class URLSigner(object):
     return signature
 
   def get_signed_url(self, filename, http_verb, expiration=DEFAULT_EXPIRATION,
-                     content_type='', content_md5=''):
-    """Returns signed URL that can be used by clients to access a file."""
+                     content_type='', content_md5='', extension_headers=None):
+    """Returns signed URL that can be used by clients to access a file.
+
+    |extension_headers| is a dict of x-goog-* headers the client must send.
+    """
     # Prepare data to sign.
     filename = str(filename)
     expires = str(int(time.time() + expiration.total_seconds()))
+    headers = ''.join(
+        '%s:%s\n' % (k.lower(), v)
+        for k, v in sorted((extension_headers or {}).iteritems()))
     data_to_sign = '\n'.join([
         http_verb,
         content_md5,
         content_type,
         expires,
-        '/%s/%s' % (self.bucket, filename),
+        '%s/%s/%s' % (headers, self.bucket, filename),
     ])
     # Construct final URL.
     query_params = urllib.urlencode([
@@ -363,3 +488,14 @@ class URLSigner(object):
     """Returns signed URL that can be used to upload a file."""
     return self.get_signed_url(filename, 'PUT', expiration=expiration,
         content_type=content_type, content_md5=content_md5)
+
+  def get_resumable_upload_url(self, filename, expiration=DEFAULT_EXPIRATION,
+                               content_type=''):
+    """Returns signed URL that can be used to start a resumable upload.
+
+    The client must POST to it with the header 'x-goog-resumable: start', then
+    upload the file to the session URL returned in the Location header.
+    """
+    return self.get_signed_url(filename, 'POST', expiration=expiration,
+        content_type=content_type,
+        extension_headers={'x-goog-resumable': 'start'})
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import logging
+import sys
+import unittest
+
+# pylint: disable=wrong-import-position
+import test_env
+test_env.setup_test_env()
+
+import cloudstorage
+from test_support import test_case
+
+import gcs
+
+
+class _Future(object):
+  def __init__(self, result):
+    self._result = result
+
+  def get_result(self):
+    return self._result
+
+
+class _StorageApi(object):
+  """Serves range requests from a string, records the requests in flight."""
+  def __init__(self, content):
+    self.content = content
+    self.etag = 'etag1'
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.ranges = []
+
+  def get_object_async(self, path, headers):
+    assert path == '/bucket/file', path
+    start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+    self.ranges.append((start, end))
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    data = self.content[start:end+1]
+    api = self
+    class Future(_Future):
+      def get_result(self):
+        api.in_flight -= 1
+        return super(Future, self).get_result()
+    return Future((206, {'etag': self.etag}, data))
+
+
+class GCSTest(test_case.TestCase):
+  APP_DIR = test_env.APP_DIR
+
+  def mock_api(self, content):
+    api = _StorageApi(content)
+    self.mock(
+        cloudstorage.storage_api, '_get_storage_api',
+        lambda retry_params: api)
+    return api
+
+  def test_read_file_parallel(self):
+    content = ''.join(chr(i % 256) for i in xrange(1000))
+    api = self.mock_api(content)
+    chunks = list(gcs.read_file_parallel(
+        'bucket', 'file', len(content), segment_size=100, parallel_reads=3))
+    self.assertEqual(content, ''.join(chunks))
+    self.assertEqual([100] * 10, [len(c) for c in chunks])
+    self.assertEqual([(i, i + 99) for i in xrange(0, 1000, 100)], api.ranges)
+    self.assertEqual(3, api.max_in_flight)
+
+  def test_read_file_parallel_partial_segment(self):
+    api = self.mock_api('abcde')
+    self.assertEqual(
+        ['ab', 'cd', 'e'],
+        list(gcs.read_file_parallel('bucket', 'file', 5, segment_size=2)))
+    self.assertEqual([(0, 1), (2, 3), (4, 4)], api.ranges)
+
+  def test_read_file_parallel_empty(self):
+    api = self.mock_api('')
+    self.assertEqual([], list(gcs.read_file_parallel('bucket', 'file', 0)))
+    self.assertEqual([], api.ranges)
+
+  def test_read_file_parallel_changed(self):
+    api = self.mock_api('abcd')
+    stream = gcs.read_file_parallel(
+        'bucket', 'file', 4, segment_size=1, parallel_reads=1)
+    self.assertEqual('a', stream.next())
+    api.etag = 'etag2'
+    with self.assertRaises(ValueError):
+      stream.next()
+
+  def test_read_file_parallel_not_found(self):
+    api = self.mock_api('abcd')
+    api.get_object_async = lambda _path, headers: _Future((404, {}, ''))
+    with self.assertRaises(gcs.NotFoundError):
+      list(gcs.read_file_parallel('bucket', 'file', 4))
+
+  def test_delete_files(self):
+    statuses = {'a': 204, 'b': 404, 'c': 503}
+    paths = []
+    class Api(object):
+      def delete_object_async(self, path):
+        paths.append(path)
+        return _Future((statuses[path.rsplit('/', 1)[1]], {}, ''))
+    self.mock(
+        cloudstorage.storage_api, '_get_storage_api',
+        lambda retry_params: Api())
+    retried = []
+    self.mock(
+        gcs, 'delete_file',
+        lambda _bucket, filename, _ignore_missing: retried.append(filename))
+    self.assertEqual(
+        [],
+        gcs.delete_files(
+            'bucket', ['a', 'b', 'c'], ignore_missing=True,
+            parallel_deletes=2))
+    self.assertEqual(['/bucket/a', '/bucket/b', '/bucket/c'], paths)
+    # Failures are retried one by one.
+    self.assertEqual(['c'], retried)
+
+
+if __name__ == '__main__':
+  if '-v' in sys.argv:
+    unittest.TestCase.maxDiff = None
+    logging.basicConfig(level=logging.DEBUG)
+  else:
+    logging.basicConfig(level=logging.FATAL)
+  unittest.main()
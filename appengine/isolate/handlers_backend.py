@@ -5,7 +5,9 @@
 """This module defines Isolate Server backend url handlers."""
 
 import binascii
+import datetime
 import hashlib
+import json
 import logging
 import time
 import zlib
@@ -14,12 +16,15 @@ import webapp2
 from google.appengine import runtime
 from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
+from google.appengine.datastore import datastore_query
 from google.appengine.ext import ndb
 
 import config
 import gcs
+import hot
 import mapreduce_jobs
 import model
+import snapshot
 import stats
 import template
 from components import decorators
@@ -30,6 +35,23 @@ from components import utils
 ITEMS_TO_DELETE_ASYNC = 100
 
 
+# Number of concurrent shards of the sweep of expired ContentEntry.
+SWEEP_SHARDS = 16
+
+
+# How long a cleanup shard task runs before checkpointing and enqueuing its
+# continuation. It is well within the task queue request deadline.
+SWEEP_TASK_DURATION = 5*60
+
+
+# A sweep without progress for that long is restarted.
+SWEEP_STALE_DELAY = datetime.timedelta(hours=1)
+
+
+# The maximum number of expired entries counted to report the backlog.
+SWEEP_BACKLOG_COUNT_LIMIT = 100000
+
+
 ### Utility
 
 
@@ -129,8 +151,27 @@ def incremental_delete(query, delete, check=None):
 ### Restricted handlers
 
 
+def log_sweep(shards, now):
+  """Logs the progress of the last sweep of expired ContentEntry."""
+  shards = [s for s in shards if s]
+  if not shards:
+    return
+  deleted = sum(s.deleted for s in shards)
+  done = sum(1 for s in shards if s.done)
+  started = min(s.created_ts for s in shards)
+  end = now if done != len(shards) else max(s.modified_ts for s in shards)
+  duration = max((end - started).total_seconds(), 1.)
+  logging.info(
+      'Sweep started at %s: %d/%d shards done, deleted %d entries, %.1f/s',
+      started, done, len(shards), deleted, deleted / duration)
+
+
 class InternalCleanupOldEntriesWorkerHandler(webapp2.RequestHandler):
-  """Removes the old data from the datastore.
+  """Starts a sweep of the expired ContentEntry.
+
+  The expiration_ts range of the expired entries is split in SWEEP_SHARDS
+  shards, each processed by InternalCleanupExpiredShardWorkerHandler. A new
+  sweep is only started once the previous one completed.
 
   Only a task queue task can use this handler.
   """
@@ -142,11 +183,89 @@ class InternalCleanupOldEntriesWorkerHandler(webapp2.RequestHandler):
       runtime.DeadlineExceededError)
   @decorators.require_taskqueue('cleanup')
   def post(self):
+    now = utils.utcnow()
+    shards = ndb.get_multi(
+        model.expiry_sweep_shard_key(i) for i in xrange(1, SWEEP_SHARDS + 1))
+    log_sweep(shards, now)
+    if any(
+        s and not s.done and now - s.modified_ts < SWEEP_STALE_DELAY
+        for s in shards):
+      logging.info('Previous sweep is still running')
+      return
+
+    q = model.ContentEntry.query(model.ContentEntry.expiration_ts < now)
+    oldest = q.order(model.ContentEntry.expiration_ts).get(
+        projection=[model.ContentEntry.expiration_ts])
+    if not oldest:
+      logging.info('No expired entries')
+      return
+    backlog = q.count(limit=SWEEP_BACKLOG_COUNT_LIMIT)
+    logging.info(
+        'Backlog: %s%d expired entries, oldest expired at %s',
+        '>=' if backlog == SWEEP_BACKLOG_COUNT_LIMIT else '', backlog,
+        oldest.expiration_ts)
+
+    # Entries that expire while sweeping are deleted by the next sweep.
+    step = (now - oldest.expiration_ts) / SWEEP_SHARDS
+    bounds = [oldest.expiration_ts + step * i for i in xrange(SWEEP_SHARDS)]
+    bounds.append(now)
+    ndb.put_multi(
+        model.ExpirySweepShard(
+            key=model.expiry_sweep_shard_key(i + 1), start_ts=bounds[i],
+            end_ts=bounds[i + 1], created_ts=now)
+        for i in xrange(SWEEP_SHARDS))
+    for i in xrange(1, SWEEP_SHARDS + 1):
+      if not utils.enqueue_task(
+          '/internal/taskqueue/cleanup/expired/%d' % i, 'cleanup-shards'):
+        logging.warning('Failed to enqueue sweep shard %d', i)
+
+
+class InternalCleanupExpiredShardWorkerHandler(webapp2.RequestHandler):
+  """Deletes the expired ContentEntry of one shard of a sweep.
+
+  The progress is checkpointed in ExpirySweepShard after each page, so a
+  retried task resumes where the previous one stopped. After
+  SWEEP_TASK_DURATION, the task enqueues its continuation.
+
+  Only a task queue task can use this handler.
+  """
+  # pylint: disable=R0201
+  @decorators.silence(
+      datastore_errors.InternalError,
+      datastore_errors.Timeout,
+      datastore_errors.TransactionFailedError,
+      runtime.DeadlineExceededError)
+  @decorators.require_taskqueue('cleanup-shards')
+  def post(self, shard):
+    sweep = model.expiry_sweep_shard_key(int(shard)).get()
+    if not sweep or sweep.done:
+      return
     q = model.ContentEntry.query(
-        model.ContentEntry.expiration_ts < utils.utcnow()
-        ).iter(keys_only=True)
-    total = incremental_delete(q, delete=model.delete_entry_and_gs_entry)
-    logging.info('Deleting %s expired entries', total)
+        model.ContentEntry.expiration_ts >= sweep.start_ts,
+        model.ContentEntry.expiration_ts < sweep.end_ts)
+    cursor = None
+    if sweep.cursor:
+      cursor = datastore_query.Cursor(urlsafe=sweep.cursor)
+    start = time.time()
+    deleted = 0
+    while not sweep.done and time.time() - start < SWEEP_TASK_DURATION:
+      keys, cursor, more = q.fetch_page(
+          10 * ITEMS_TO_DELETE_ASYNC, start_cursor=cursor, keys_only=True)
+      if keys:
+        model.delete_entry_and_gs_entry(keys)
+      deleted += len(keys)
+      sweep.deleted += len(keys)
+      sweep.cursor = cursor.urlsafe() if more and cursor else None
+      sweep.done = not sweep.cursor
+      sweep.put()
+
+    duration = time.time() - start
+    logging.info(
+        'Shard %s: deleted %d expired entries in %.1fs (%.1f/s), %d total',
+        shard, deleted, duration, deleted / max(duration, 1.), sweep.deleted)
+    if not sweep.done and not utils.enqueue_task(
+        '/internal/taskqueue/cleanup/expired/%s' % shard, 'cleanup-shards'):
+      logging.warning('Failed to enqueue sweep shard %s', shard)
 
 
 class InternalObliterateWorkerHandler(webapp2.RequestHandler):
@@ -163,6 +282,7 @@ class InternalObliterateWorkerHandler(webapp2.RequestHandler):
     incremental_delete(
         model.ContentEntry.query().iter(keys_only=True),
         ndb.delete_multi_async)
+    snapshot.invalidate()
 
     gs_bucket = config.settings().gs_bucket
     logging.info('Deleting GS bucket %s', gs_bucket)
@@ -178,10 +298,10 @@ class InternalObliterateWorkerHandler(webapp2.RequestHandler):
 
 
 class InternalCleanupTrimLostWorkerHandler(webapp2.RequestHandler):
-  """Removes the GS files that are not referenced anymore.
+  """Triggers the removal of the GS files that are not referenced anymore.
 
-  It can happen for example when a ContentEntry is deleted without the file
-  properly deleted.
+  The bucket is split per namespace directory and first hash letter, each
+  processed by InternalCleanupTrimLostShardWorkerHandler.
 
   Only a task queue task can use this handler.
   """
@@ -193,15 +313,58 @@ class InternalCleanupTrimLostWorkerHandler(webapp2.RequestHandler):
       runtime.DeadlineExceededError)
   @decorators.require_taskqueue('cleanup')
   def post(self):
-    """Enumerates all GS files and delete those that do not have an associated
-    ContentEntry.
+    gs_bucket = config.settings().gs_bucket
+    count = 0
+    for directory in gcs.list_directories(gs_bucket):
+      for letter in '0123456789abcdef':
+        url = '/internal/taskqueue/cleanup/trim_lost/%s/%s' % (
+            directory, letter)
+        if utils.enqueue_task(url, 'cleanup-shards'):
+          count += 1
+    logging.info('Enqueued %d shards', count)
+
+
+class InternalCleanupTrimLostShardWorkerHandler(webapp2.RequestHandler):
+  """Removes the GS files that are not referenced anymore under a prefix.
+
+  It can happen for example when a ContentEntry is deleted without the file
+  properly deleted.
+
+  After SWEEP_TASK_DURATION, the task enqueues its continuation with the last
+  listed file as payload.
+
+  Only a task queue task can use this handler.
+  """
+  # pylint: disable=R0201
+  @decorators.silence(
+      datastore_errors.InternalError,
+      datastore_errors.Timeout,
+      datastore_errors.TransactionFailedError,
+      runtime.DeadlineExceededError)
+  @decorators.require_taskqueue('cleanup-shards')
+  def post(self, prefix):
+    """Enumerates the GS files under the prefix and delete those that do not
+    have an associated ContentEntry.
     """
     gs_bucket = config.settings().gs_bucket
+    marker = None
+    if self.request.body:
+      marker = json.loads(self.request.body)['marker']
+    start = time.time()
+    last = []
+
+    def list_files():
+      for filepath, filestats in gcs.list_files(
+          gs_bucket, subdir=prefix, marker=marker):
+        if time.time() - start >= SWEEP_TASK_DURATION:
+          return
+        last[:] = [filepath]
+        yield filepath, filestats
 
     def filter_missing():
       futures = {}
       cutoff = time.time() - 60*60
-      for filepath, filestats in gcs.list_files(gs_bucket):
+      for filepath, filestats in list_files():
         # If the file was uploaded in the last hour, ignore it.
         if filestats.st_ctime >= cutoff:
           continue
@@ -230,7 +393,14 @@ class InternalCleanupTrimLostWorkerHandler(webapp2.RequestHandler):
 
     gs_delete = lambda filenames: gcs.delete_files(gs_bucket, filenames)
     total = incremental_delete(filter_missing(), gs_delete)
-    logging.info('Deleted %d lost GS files', total)
+    duration = time.time() - start
+    logging.info(
+        'Deleted %d lost GS files under %s in %.1fs', total, prefix, duration)
+    if duration >= SWEEP_TASK_DURATION and last:
+      url = '/internal/taskqueue/cleanup/trim_lost/' + prefix
+      payload = utils.encode_to_json({'marker': last[0]})
+      if not utils.enqueue_task(url, 'cleanup-shards', payload=payload):
+        logging.warning('Failed to enqueue the continuation of %s', prefix)
     # TODO(maruel): Find all the empty directories that are old and remove them.
     # We need to safe guard against the race condition where a user would upload
     # to this directory.
@@ -279,16 +449,24 @@ class InternalTagWorkerHandler(webapp2.RequestHandler):
     expiration = config.settings().default_expiration
     try:
       digests = payload_to_hashes(self, namespace)
-      # Requests all the entities at once.
+      # Skips the entities tagged since the task was enqueued, e.g. by another
+      # instance, without reading them.
+      hash_keys = [binascii.hexlify(d) for d in digests]
+      tagged = model.get_tagged(namespace, hash_keys)
+      # Requests all the other entities at once.
       futures = ndb.get_multi_async(
-          model.get_entry_key(namespace, binascii.hexlify(d)) for d in digests)
+          model.get_entry_key(namespace, h)
+          for h in hash_keys if h not in tagged)
 
+      found = []
       to_save = []
       while futures:
         # Return opportunistically the first entity that can be retrieved.
         future = ndb.Future.wait_any(futures)
         futures.remove(future)
         item = future.get_result()
+        if item:
+          found.append(item)
         if item and item.next_tag_ts < now:
           # Update the timestamp. Add a bit of pseudo randomness.
           item.expiration_ts, item.next_tag_ts = model.expiration_jitter(
@@ -296,8 +474,13 @@ class InternalTagWorkerHandler(webapp2.RequestHandler):
           to_save.append(item)
       if to_save:
         ndb.put_multi(to_save)
+      # The next preupload of these entries will neither hit the datastore nor
+      # enqueue a tag until next_tag_ts.
+      model.mark_existing(namespace, found)
+      model.mark_tagged(namespace, found)
       logging.info(
-          'Timestamped %d entries out of %s', len(to_save), len(digests))
+          'Timestamped %d entries out of %s; %d recently tagged',
+          len(to_save), len(digests), len(tagged))
     except Exception as e:
       logging.error('Failed to stamp entries: %s\n%d entries', e, len(digests))
       raise
@@ -308,10 +491,11 @@ class InternalVerifyWorkerHandler(webapp2.RequestHandler):
 
   @staticmethod
   def purge_entry(entry, message, *args):
-    """Logs error message, deletes |entry| from datastore and GS."""
+    """Logs error message, deletes |entry| and invalidates the snapshots."""
     logging.error(
         'Verification failed for %s: %s', entry.key.id(), message % args)
     model.delete_entry_and_gs_entry([entry.key])
+    snapshot.invalidate()
 
   @decorators.silence(
       datastore_errors.InternalError,
@@ -362,8 +546,10 @@ class InternalVerifyWorkerHandler(webapp2.RequestHandler):
     data = None
 
     try:
-      # Start a loop where it reads the data in block.
-      stream = gcs.read_file(gs_bucket, entry.key.id())
+      # Start a loop where it reads the data in block. The next segments are
+      # fetched concurrently while the current one is expanded and hashed.
+      stream = gcs.read_file_parallel(
+          gs_bucket, entry.key.id(), gs_file_info.size)
       if save_to_memcache:
         # Wraps stream with a generator that accumulates the data.
         stream = Accumulator(stream)
@@ -414,6 +600,8 @@ class InternalVerifyWorkerHandler(webapp2.RequestHandler):
     if save_to_memcache:
       model.save_in_memcache(namespace, hash_key, ''.join(stream.accumulated))
     future.wait()
+    if not future.get_exception():
+      model.mark_existing(namespace, [entry])
 
 
 class InternalStatsUpdateHandler(webapp2.RequestHandler):
@@ -432,6 +620,41 @@ class InternalStatsSendToBQHandler(webapp2.RequestHandler):
     stats.cron_send_to_bq()
 
 
+class InternalHotUpdateHandler(webapp2.RequestHandler):
+  """Called every few minutes to promote the hottest entries into memcache."""
+  @decorators.require_cronjob
+  def get(self):
+    hot.cron_update()
+
+
+class InternalSnapshotTriggerHandler(webapp2.RequestHandler):
+  """Starts the build of a snapshot of the digests present."""
+  @decorators.require_cronjob
+  def get(self):
+    snapshot_id = snapshot.cron_trigger()
+    if snapshot_id and not utils.enqueue_task(
+        '/internal/taskqueue/snapshot/build/%d' % snapshot_id, 'snapshot'):
+      self.abort(500, 'Failed to enqueue the snapshot build, see logs')
+
+
+class InternalSnapshotBuildWorkerHandler(webapp2.RequestHandler):
+  """Builds a snapshot of the digests present, see snapshot.build().
+
+  Only a task queue task can use this handler.
+  """
+  # pylint: disable=R0201
+  @decorators.silence(
+      datastore_errors.InternalError,
+      datastore_errors.Timeout,
+      datastore_errors.TransactionFailedError,
+      runtime.DeadlineExceededError)
+  @decorators.require_taskqueue('snapshot')
+  def post(self, snapshot_id):
+    if snapshot.build(int(snapshot_id)) and not utils.enqueue_task(
+        '/internal/taskqueue/snapshot/build/%s' % snapshot_id, 'snapshot'):
+      logging.warning('Failed to enqueue snapshot %s', snapshot_id)
+
+
 ### Mapreduce related handlers
 
 
@@ -471,6 +694,13 @@ def get_routes():
     webapp2.Route(
         r'/internal/taskqueue/cleanup/trim_lost',
         InternalCleanupTrimLostWorkerHandler),
+    webapp2.Route(
+        r'/internal/taskqueue/cleanup/trim_lost/<prefix:%s/[0-9a-f]>' %
+            model.NAMESPACE_RE,
+        InternalCleanupTrimLostShardWorkerHandler),
+    webapp2.Route(
+        r'/internal/taskqueue/cleanup/expired/<shard:\d+>',
+        InternalCleanupExpiredShardWorkerHandler),
 
     # Tasks triggered by other request handlers.
     webapp2.Route(
@@ -485,6 +715,14 @@ def get_routes():
         r'/internal/cron/stats/update', InternalStatsUpdateHandler),
     webapp2.Route(
         r'/internal/cron/stats/send_to_bq', InternalStatsSendToBQHandler),
+    webapp2.Route(r'/internal/cron/hot/update', InternalHotUpdateHandler),
+
+    # Snapshot of the digests present.
+    webapp2.Route(
+        r'/internal/cron/snapshot/trigger', InternalSnapshotTriggerHandler),
+    webapp2.Route(
+        r'/internal/taskqueue/snapshot/build/<snapshot_id:\d+>',
+        InternalSnapshotBuildWorkerHandler),
 
     # Mapreduce related urls.
     webapp2.Route(
@@ -10,6 +10,7 @@ import hashlib
 import logging
 import os
 import re
+import threading
 import time
 import zlib
 
@@ -31,7 +32,9 @@ from components import utils
 import acl
 import config
 import gcs
+import hot
 import model
+import snapshot
 import stats
 
 
@@ -40,6 +43,38 @@ import stats
 MIN_SIZE_FOR_GS = 501
 
 
+# The minimum size, in bytes, an entry must be before the client is given an
+# URL to upload it to Google Cloud Storage with the resumable upload protocol.
+MIN_SIZE_FOR_RESUMABLE = 16*1024*1024
+
+
+# The maximum number of entries that can be retrieved with retrieve_batch.
+MAX_BATCH_DIGESTS = 1000
+
+
+# The maximum number of content bytes returned by retrieve_batch. It is well
+# below the response size limit, even once base64 encoded.
+MAX_BATCH_CONTENT_SIZE = 16*1024*1024
+
+
+# The maximum number of digests in a tag task; the worker reads them in one
+# datastore call.
+TAG_BATCH_SIZE = model.MAX_KEYS_PER_DB_OPS
+
+
+# How long digests to tag are buffered in an instance before a tag task is
+# enqueued, see IsolateService.tag_existing().
+TAG_FLUSH_DELAY = datetime.timedelta(seconds=10)
+
+
+# How long an instance skips digests it has tagged or found tagged.
+TAGGED_CACHE_DURATION = datetime.timedelta(hours=1)
+
+
+# The maximum number of entries in _tagged_cache.
+TAGGED_CACHE_SIZE = 50000
+
+
 ### Request Types
 
 
@@ -86,6 +121,19 @@ class RetrieveRequest(messages.Message):
   offset = messages.IntegerField(3, default=0)
 
 
+class RetrieveBatchRequest(messages.Message):
+  """Request to retrieve many entries at once."""
+  digests = messages.StringField(1, repeated=True)
+  namespace = messages.MessageField(Namespace, 2)
+
+
+class SnapshotPartRequest(messages.Message):
+  """Request to retrieve a part of a snapshot of the digests present."""
+  namespace = messages.MessageField(Namespace, 1)
+  snapshot_id = messages.IntegerField(2, required=True)
+  index = messages.IntegerField(3, default=0)
+
+
 ### Response Types
 
 
@@ -94,6 +142,7 @@ class PreuploadStatus(messages.Message):
   gs_upload_url = messages.StringField(1)
   upload_ticket = messages.StringField(2)
   index = messages.IntegerField(3)
+  gs_resumable_upload_url = messages.StringField(4)
 
 
 class UrlCollection(messages.Message):
@@ -107,6 +156,37 @@ class RetrievedContent(messages.Message):
   url = messages.StringField(2)
 
 
+class RetrievedItem(messages.Message):
+  """Content of an entry retrieved by retrieve_batch, or GS URL.
+
+  When neither is set, the content didn't fit in the response and the entry
+  must be fetched with retrieve.
+  """
+  digest = messages.StringField(1)
+  content = messages.BytesField(2)
+  url = messages.StringField(3)
+
+
+class RetrievedBatch(messages.Message):
+  """Entries retrieved by retrieve_batch. Missing entries are omitted."""
+  items = messages.MessageField(RetrievedItem, 1, repeated=True)
+
+
+class DigestSnapshot(messages.Message):
+  """The current snapshot of the digests present in a namespace.
+
+  Its parts are retrieved with snapshot_part. When there's no snapshot, parts
+  is 0.
+  """
+  snapshot_id = messages.IntegerField(1)
+  parts = messages.IntegerField(2, default=0)
+
+
+class SnapshotPart(messages.Message):
+  """Concatenated binary digests, in no particular order."""
+  digests = messages.BytesField(1)
+
+
 class PushPing(messages.Message):
   """Indicates whether data storage executed successfully."""
   ok = messages.BooleanField(1)
@@ -146,6 +226,40 @@ def store_and_enqueue_verify_task(entry, task_queue_host):
   )
 
 
+# Per instance filter in front of model.get_tagged(), as {(namespace, digest):
+# datetime until which the digest is skipped}.
+_tagged_cache = {}
+
+
+# Digests waiting to be tagged, as {namespace: (datetime of the first one, set
+# of binary digests)}.
+_tag_buffer = {}
+_tag_buffer_lock = threading.Lock()
+
+
+def note_tagged(namespace, digests, now):
+  """Skips these hex digests in this instance for TAGGED_CACHE_DURATION."""
+  expiration = now + TAGGED_CACHE_DURATION
+  for d in digests:
+    if len(_tagged_cache) >= TAGGED_CACHE_SIZE:
+      _tagged_cache.popitem()
+    _tagged_cache[(namespace, d)] = expiration
+
+
+def filter_tagged(namespace, digests, now):
+  """Returns the digests that may need a tag.
+
+  The digests tagged recently are skipped, as seen by this instance first then
+  in memcache. The ones found in memcache are noted for this instance.
+  """
+  candidates = [
+    d for d in set(digests) if _tagged_cache.get((namespace, d), now) <= now
+  ]
+  tagged = model.get_tagged(namespace, candidates) if candidates else set()
+  note_tagged(namespace, tagged, now)
+  return [d for d in candidates if d not in tagged]
+
+
 def entry_key_or_error(namespace, digest):
   try:
     return model.get_entry_key(namespace, digest)
@@ -249,6 +363,12 @@ class IsolateService(remote.Service):
               filename=key.id(),
               content_type='application/octet-stream',
               expiration=DEFAULT_LINK_EXPIRATION)
+          if digest_element.size >= MIN_SIZE_FOR_RESUMABLE:
+            status.gs_resumable_upload_url = (
+                self.gs_url_signer.get_resumable_upload_url(
+                    filename=key.id(),
+                    content_type='application/octet-stream',
+                    expiration=DEFAULT_LINK_EXPIRATION))
 
         response.items.append(status)
 
@@ -305,6 +425,8 @@ class IsolateService(remote.Service):
             'Invalid offset %d. Offset must be between 0 and content length.' %
             offset)
       stats.add_entry(stats.RETURN, len(content) - offset, found)
+      hot.record(
+          request.namespace.namespace, request.digest, len(content) - offset)
       return RetrievedContent(content=content[offset:])
 
     # The data is in GS; log stats and return the URL.
@@ -321,6 +443,73 @@ class IsolateService(remote.Service):
         filename=key.id(),
         expiration=DEFAULT_LINK_EXPIRATION))
 
+  @auth.endpoints_method(RetrieveBatchRequest, RetrievedBatch)
+  @auth.require(acl.isolate_readable)
+  def retrieve_batch(self, request):
+    """Retrieves many entries at once.
+
+    The content of small entries is returned inline, the large ones as GS URLs.
+    """
+    if not request.namespace:
+      raise endpoints.BadRequestException('namespace is required.')
+    if len(request.digests) > MAX_BATCH_DIGESTS:
+      raise endpoints.BadRequestException(
+          'Only up to %d items can be retrieved at once' % MAX_BATCH_DIGESTS)
+    namespace = request.namespace.namespace
+    try:
+      contents = model.get_contents(
+          namespace, request.digests, MAX_BATCH_CONTENT_SIZE)
+    except ValueError as error:
+      raise endpoints.BadRequestException(error.message)
+
+    response = RetrievedBatch()
+    for digest, (content, entry) in zip(request.digests, contents):
+      if content is not None:
+        stats.add_entry(stats.RETURN, len(content), 'batch')
+        hot.record(namespace, digest, len(content))
+        response.items.append(RetrievedItem(digest=digest, content=content))
+      elif entry is None:
+        logging.debug('%s', digest)
+      elif entry.content is None:
+        stats.add_entry(
+            stats.RETURN, entry.compressed_size, 'GS; %s' % entry.key.id())
+        response.items.append(RetrievedItem(
+            digest=digest,
+            url=self.gs_url_signer.get_download_url(
+                filename=entry.key.id(),
+                expiration=DEFAULT_LINK_EXPIRATION)))
+      else:
+        # Too large for this response.
+        response.items.append(RetrievedItem(digest=digest))
+    return response
+
+  @auth.endpoints_method(Namespace, DigestSnapshot)
+  @auth.require(acl.isolate_writable)
+  def snapshot(self, request):
+    """Returns the current snapshot of the digests present in a namespace.
+
+    The entries it lists won't expire for days, so clients can skip their
+    preupload; see snapshot.py.
+    """
+    current = snapshot.get_current()
+    if not current:
+      return DigestSnapshot()
+    return DigestSnapshot(
+        snapshot_id=current.key.integer_id(),
+        parts=current.parts.get(request.namespace, 0))
+
+  @auth.endpoints_method(SnapshotPartRequest, SnapshotPart)
+  @auth.require(acl.isolate_writable)
+  def snapshot_part(self, request):
+    """Returns a part of a snapshot of the digests present in a namespace."""
+    if not request.namespace:
+      raise endpoints.BadRequestException('namespace is required.')
+    digests = snapshot.get_part(
+        request.snapshot_id, request.namespace.namespace, request.index)
+    if digests is None:
+      raise endpoints.NotFoundException('Unknown snapshot part.')
+    return SnapshotPart(digests=digests)
+
   # TODO(kjlubick): Rework these APIs, the http_method part seems to break
   # API explorer.
   @auth.endpoints_method(
@@ -401,6 +590,7 @@ class IsolateService(remote.Service):
       except datastore_errors.Error as e:
         raise endpoints.InternalServerErrorException(
             'Unable to store the entity: %s.' % e.__class__.__name__)
+      model.mark_existing(namespace, [entry])
     else:
       # Enqueue verification task transactionally as the entity is stored.
       try:
@@ -454,29 +644,54 @@ class IsolateService(remote.Service):
   def check_entries_exist(entries):
     """Assess which entities already exist in the datastore.
 
+    The existence markers in memcache are checked first, see
+    model.mark_existing(), so only the remaining digests are looked up in the
+    datastore.
+
     Arguments:
       entries: a DigestCollection to be posted
 
     Yields:
-      (Digest, ContentEntry or None)
+      (Digest, expanded size or None if the entity doesn't exist)
 
     Raises:
       BadRequestException if any digest is not a valid hexadecimal number.
     """
+    namespace = entries.namespace.namespace
+    for digest in entries.items:
+      entry_key_or_error(namespace, digest.digest)
+    existing = model.get_existing(
+        namespace, list(set(d.digest for d in entries.items)))
+    missing = []
+    for digest in entries.items:
+      if digest.digest in existing:
+        yield digest, existing[digest.digest]
+      else:
+        missing.append(digest)
+    logging.debug(
+        'Existence: %d from memcache, %d from the datastore',
+        len(entries.items) - len(missing), len(missing))
+
     # Kick off all queries in parallel. Build mapping Future -> digest.
     def fetch(digest):
-      key = entry_key_or_error(
-          entries.namespace.namespace, digest.digest)
+      key = model.get_entry_key(namespace, digest.digest)
       return key.get_async(use_cache=False)
 
-    return utils.async_apply(entries.items, fetch, unordered=True)
+    found = []
+    for digest, obj in utils.async_apply(missing, fetch, unordered=True):
+      if obj:
+        found.append(obj)
+      yield digest, obj.expanded_size if obj else None
+    # Tags are skipped while the entries are recently tagged, so they can't be
+    # relied upon to refresh the existence markers.
+    model.mark_existing(namespace, found)
 
   @classmethod
   def partition_collection(cls, entries):
     """Create sets of existent and new digests."""
     seen_unseen = [set(), set()]
-    for digest, obj in cls.check_entries_exist(entries):
-      if obj and obj.expanded_size != digest.size:
+    for digest, size in cls.check_entries_exist(entries):
+      if size is not None and size != digest.size:
         # It is important to note that when a file is uploaded to GCS,
         # ContentEntry is only stored in the finalize call, which is (supposed)
         # to be called only after the GCS upload completed successfully.
@@ -504,8 +719,8 @@ class IsolateService(remote.Service):
         logging.error(
             'Upload race.\n%s is not yet fully uploaded.', digest.digest)
         # TODO(maruel): Force the client to upload.
-        #obj = None
-      seen_unseen[bool(obj)].add(digest)
+        #size = None
+      seen_unseen[size is not None].add(digest)
     logging.debug(
         'Hit:%s',
         ''.join(sorted('\n%s' % d.digest for d in seen_unseen[True])))
@@ -540,19 +755,55 @@ class IsolateService(remote.Service):
   def tag_existing(collection):
     """Tag existing digests with new timestamp.
 
+    The digests tagged recently are skipped. The other ones are buffered per
+    namespace and a tag task is enqueued once TAG_BATCH_SIZE digests are
+    buffered or the oldest one waited TAG_FLUSH_DELAY. The buffer is only
+    flushed from here, and is lost if the instance shuts down; the digests are
+    then tagged on a later lookup.
+
+    The digests are only skipped by this instance once their tag task was
+    enqueued. The ones whose task failed to be enqueued are buffered again.
+
     Arguments:
       collection: a DigestCollection containing existing digests
 
     Returns:
-      the enqueued task if there were existing entries; None otherwise
+      the number of tag tasks enqueued
     """
-    if collection.items:
+    now = utils.utcnow()
+    namespace = collection.namespace.namespace
+    digests = filter_tagged(
+        namespace, [d.digest for d in collection.items], now)
+    ready = []
+    with _tag_buffer_lock:
+      if digests:
+        _tag_buffer.setdefault(namespace, (now, set()))[1].update(
+            binascii.unhexlify(d) for d in digests)
+      for ns, (first, buffered) in _tag_buffer.items():
+        if len(buffered) >= TAG_BATCH_SIZE or now - first >= TAG_FLUSH_DELAY:
+          ready.append((ns, first, sorted(buffered)))
+          del _tag_buffer[ns]
+
+    enqueued = 0
+    failed = []
+    for ns, first, buffered in ready:
       url = '/internal/taskqueue/tag/%s/%s' % (
-          collection.namespace.namespace,
-          utils.datetime_to_timestamp(utils.utcnow()))
-      payload = ''.join(
-          binascii.unhexlify(digest.digest) for digest in collection.items)
-      return utils.enqueue_task(url, 'tag', payload=payload)
+          ns, utils.datetime_to_timestamp(now))
+      for i in xrange(0, len(buffered), TAG_BATCH_SIZE):
+        batch = buffered[i:i+TAG_BATCH_SIZE]
+        if utils.enqueue_task(url, 'tag', payload=''.join(batch)):
+          enqueued += 1
+          note_tagged(ns, [binascii.hexlify(d) for d in batch], now)
+        else:
+          failed.append((ns, first, batch))
+
+    if failed:
+      with _tag_buffer_lock:
+        for ns, first, batch in failed:
+          oldest, buffered = _tag_buffer.get(ns, (first, set()))
+          buffered.update(batch)
+          _tag_buffer[ns] = (min(oldest, first), buffered)
+    return enqueued
 
 
 def get_routes():
@@ -4,6 +4,8 @@
 # that can be found in the LICENSE file.
 
 import base64
+import binascii
+import datetime
 import hashlib
 import json
 import logging
@@ -33,6 +35,7 @@ import gcs
 import handlers_backend
 import handlers_endpoints_v1
 import model
+import snapshot
 
 
 def make_private_key():
@@ -138,6 +141,11 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
     make_private_key()
     # Remove the check for dev server in should_push_to_gs().
     self.mock(utils, 'is_local_dev_server', lambda: False)
+    # Enqueue tag tasks right away and forget the digests tagged by previous
+    # tests.
+    self.mock(handlers_endpoints_v1, 'TAG_FLUSH_DELAY', datetime.timedelta())
+    self.mock(handlers_endpoints_v1, '_tagged_cache', {})
+    self.mock(handlers_endpoints_v1, '_tag_buffer', {})
 
   @staticmethod
   def message_to_dict(message):
@@ -183,11 +191,26 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
     message = response.json.get(u'items', [{}])[0]
     self.assertTrue(message.get(u'gs_upload_url', '').startswith(
         self.store_prefix))
+    self.assertNotIn('gs_resumable_upload_url', message)
     expected = validate(
         message.get(u'upload_ticket', ''),
         handlers_endpoints_v1.UPLOAD_MESSAGES[1])
     self.assertEqual(expected, generate_embedded(namespace, digests.items[0]))
 
+  def test_pre_upload_resumable(self):
+    """Assert that large entries get a resumable upload URL."""
+    self.mock(handlers_endpoints_v1, 'MIN_SIZE_FOR_RESUMABLE', 1000)
+    namespace = 'default-gzip'
+    digests = generate_collection(namespace, ['duckling' * 200])
+    response = self.call_api('preupload', self.message_to_dict(digests), 200)
+    message = response.json.get(u'items', [{}])[0]
+    self.assertTrue(message.get(u'gs_upload_url', '').startswith(
+        self.store_prefix))
+    self.assertTrue(message.get(u'gs_resumable_upload_url', '').startswith(
+        self.store_prefix))
+    self.assertNotEqual(
+        message[u'gs_upload_url'], message[u'gs_resumable_upload_url'])
+
   def test_pre_upload_invalid_hash(self):
     """Assert that status 400 is returned when the digest is invalid."""
     bad_collection = handlers_endpoints_v1.DigestCollection(
@@ -247,6 +270,89 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
     # find enqueued tasks
     self.assertEqual(1, self.execute_tasks())
 
+  def test_check_existing_memcache(self):
+    """Assert that existence markers in memcache skip the datastore."""
+    namespace = 'default-gzip'
+    collection = generate_collection(namespace, ['known', 'unknown'])
+    key = model.get_entry_key(namespace, collection.items[0].digest)
+    entry = model.new_content_entry(
+        key, expanded_size=collection.items[0].size, is_verified=True)
+    model.mark_existing(namespace, [entry])
+
+    # The entity is not in the datastore, yet it is reported as present.
+    response = self.call_api(
+        'preupload', self.message_to_dict(collection), 200)
+    self.assertEqual([1], [int(i['index']) for i in response.json['items']])
+    self.assertEqual(1, self.execute_tasks())
+
+  def test_check_existing_coalesces_tags(self):
+    """Assert that digests are tagged in one task after a delay."""
+    delay = datetime.timedelta(seconds=10)
+    self.mock(handlers_endpoints_v1, 'TAG_FLUSH_DELAY', delay)
+    now = self.mock_now(datetime.datetime(2019, 1, 2, 3, 4, 5))
+    namespace = 'default'
+    collections = [generate_collection(namespace, [c]) for c in ('a', 'b')]
+    for collection in collections:
+      model.new_content_entry(
+          model.get_entry_key(namespace, collection.items[0].digest)).put()
+      self.call_api('preupload', self.message_to_dict(collection), 200)
+    self.assertEqual(0, self.execute_tasks())
+
+    # The next lookup flushes the buffer, even if it has nothing to tag.
+    self.mock_now(now, 10)
+    self.call_api('preupload', self.message_to_dict(collections[0]), 200)
+    self.assertEqual(1, self.execute_tasks())
+
+  def test_check_existing_skips_tagged(self):
+    """Assert that digests tagged recently are not enqueued again."""
+    namespace = 'default'
+    collection = generate_collection(namespace, ['some content'])
+    model.new_content_entry(
+        model.get_entry_key(namespace, collection.items[0].digest)).put()
+    self.call_api('preupload', self.message_to_dict(collection), 200)
+    self.assertEqual(1, self.execute_tasks())
+    self.assertEqual(
+        {collection.items[0].digest},
+        model.get_tagged(namespace, [collection.items[0].digest]))
+
+    # Another instance skips it too.
+    self.mock(handlers_endpoints_v1, '_tagged_cache', {})
+    self.call_api('preupload', self.message_to_dict(collection), 200)
+    self.assertEqual(0, self.execute_tasks())
+
+  def test_check_existing_enqueue_failure(self):
+    """Assert that digests whose tag task failed are tagged later."""
+    namespace = 'default'
+    collection = generate_collection(namespace, ['some content'])
+    digest = collection.items[0].digest
+    model.new_content_entry(model.get_entry_key(namespace, digest)).put()
+    self.mock(
+        handlers_endpoints_v1.utils, 'enqueue_task', lambda *_a, **_k: False)
+    self.call_api('preupload', self.message_to_dict(collection), 200)
+    self.assertEqual({}, handlers_endpoints_v1._tagged_cache)
+    self.assertEqual(
+        [binascii.unhexlify(digest)],
+        list(handlers_endpoints_v1._tag_buffer[namespace][1]))
+
+    # The next lookup enqueues it.
+    self.mock(
+        handlers_endpoints_v1.utils, 'enqueue_task', lambda *_a, **_k: True)
+    self.call_api('preupload', self.message_to_dict(collection), 200)
+    self.assertEqual({}, handlers_endpoints_v1._tag_buffer)
+    self.assertEqual(
+        [(namespace, digest)], handlers_endpoints_v1._tagged_cache.keys())
+
+  def test_store_inline_marks_existing(self):
+    """Assert that inline content is known to exist once stored."""
+    namespace = 'default'
+    request = self.store_request(namespace, 'sibilance')
+    embedded = validate(
+        request.upload_ticket, handlers_endpoints_v1.UPLOAD_MESSAGES[0])
+    self.call_api('store_inline', self.message_to_dict(request), 200)
+    self.assertEqual(
+        {embedded['d']: int(embedded['s'])},
+        model.get_existing(namespace, [embedded['d']]))
+
   def test_store_inline_ok(self):
     """Assert that inline content storage completes successfully."""
     namespace = 'default'
@@ -354,7 +460,8 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
     self.assertEqual(int(embedded['s']), stored.expanded_size)
 
     # ensure that verification occurs
-    self.mock(gcs, 'read_file', lambda _bucket, _key: content)
+    self.mock(
+        gcs, 'read_file_parallel', lambda _bucket, _key, _size: [content])
 
     # add a side effect in execute_tasks()
     # TODO(cmassaro): there must be a better way than this
@@ -502,6 +609,38 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
       with self.call_should_fail('400'):
         self.call_api('retrieve', self.message_to_dict(request), 200)
 
+  def test_retrieve_batch_ok(self):
+    """Assert that many entries are retrieved at once."""
+    namespace = 'default'
+    digests = []
+    for content in ('Ode on Melancholy', 'To Autumn'):
+      request = self.store_request(namespace, content)
+      self.call_api('store_inline', self.message_to_dict(request), 200)
+      digests.append(validate(
+          request.upload_ticket, handlers_endpoints_v1.UPLOAD_MESSAGES[0])['d'])
+    # memcache is looked up first.
+    model.save_in_memcache(namespace, digests[0], 'Bright star')
+    missing = hash_content(namespace, 'Hyperion')
+    batch_request = handlers_endpoints_v1.RetrieveBatchRequest(
+        digests=digests + [missing],
+        namespace=handlers_endpoints_v1.Namespace())
+    response = self.call_api(
+        'retrieve_batch', self.message_to_dict(batch_request), 200)
+    expected = [
+      {u'digest': digests[0], u'content': base64.b64encode('Bright star')},
+      {u'digest': digests[1], u'content': base64.b64encode('To Autumn')},
+    ]
+    self.assertEqual(expected, response.json[u'items'])
+
+  def test_retrieve_batch_too_many(self):
+    """Assert that retrieve_batch is limited in size."""
+    self.mock(handlers_endpoints_v1, 'MAX_BATCH_DIGESTS', 1)
+    batch_request = handlers_endpoints_v1.RetrieveBatchRequest(
+        digests=[hash_content('default', c) for c in ('a', 'b')],
+        namespace=handlers_endpoints_v1.Namespace())
+    with self.call_should_fail('400'):
+      self.call_api('retrieve_batch', self.message_to_dict(batch_request), 200)
+
   def test_retrieve_not_found(self):
     """Assert that HTTP 404 response is served when content is absent."""
 
@@ -526,6 +665,36 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
     with self.call_should_fail('404'):
       self.call_api('retrieve', self.message_to_dict(retrieve_request), 200)
 
+  def test_snapshot(self):
+    """Assert that the digests present are listed in the snapshot."""
+    request = {'namespace': 'default'}
+    response = self.call_api('snapshot', request, 200)
+    self.assertEqual({}, response.json)
+
+    digests = []
+    for content in ('Ode on Melancholy', 'To Autumn'):
+      self.call_api(
+          'store_inline',
+          self.message_to_dict(self.store_request('default', content)), 200)
+      digests.append(hashlib.sha1(content).digest())
+    snapshot_id = snapshot.cron_trigger()
+    self.assertFalse(snapshot.build(snapshot_id))
+
+    response = self.call_api('snapshot', request, 200)
+    self.assertEqual(
+        {u'snapshot_id': unicode(snapshot_id), u'parts': u'1'}, response.json)
+    part_request = handlers_endpoints_v1.SnapshotPartRequest(
+        namespace=handlers_endpoints_v1.Namespace(), snapshot_id=snapshot_id)
+    response = self.call_api(
+        'snapshot_part', self.message_to_dict(part_request), 200)
+    actual = base64.b64decode(response.json[u'digests'])
+    self.assertEqual(
+        sorted(digests), sorted([actual[:20], actual[20:]]))
+
+    part_request.index = 1
+    with self.call_should_fail('404'):
+      self.call_api('snapshot_part', self.message_to_dict(part_request), 200)
+
   def test_server_details_ok(self):
     """Assert that server_details returns the correct version."""
     response = self.call_api('server_details', {}, 200).json
@@ -589,7 +758,8 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
     # Upload
     # Simulate that the file is now on GCS.
     self.mock(gcs, 'get_file_info', get_file_info_factory(data))
-    self.mock(gcs, 'read_file', lambda _bucket, _key: data)
+    self.mock(
+        gcs, 'read_file_parallel', lambda _bucket, _key, _size: [data])
     request = handlers_endpoints_v1.FinalizeRequest(
         upload_ticket=message['upload_ticket'])
     self.call_api('finalize_gs_upload', self.message_to_dict(request), 200)
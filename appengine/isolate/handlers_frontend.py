@@ -18,8 +18,10 @@ import acl
 import config
 import gcs
 import handlers_endpoints_v1
+import hot
 import mapreduce_jobs
 import model
+import snapshot
 import stats
 import template
 from components import auth
@@ -152,11 +154,22 @@ class RestrictedPurgeHandler(auth.AuthenticatingHandler):
       key = None
     if key:
       model.delete_entry_and_gs_entry([key])
+      snapshot.invalidate()
       params['message'] = 'Done'
     self.response.write(
         template.render('isolate/restricted_purge.html', params))
 
 
+class RestrictedHotHandler(auth.AuthenticatingHandler):
+  """Reports the hottest entries as JSON, see hot.cron_update()."""
+  @auth.autologin
+  @auth.require(auth.is_admin)
+  def get(self):
+    digests = hot.HotDigests.get_by_id(1) or hot.HotDigests()
+    self.response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    self.response.write(utils.encode_to_json(digests))
+
+
 ### Mapreduce related handlers
 
 
@@ -245,7 +258,9 @@ class ContentHandler(auth.AuthenticatingHandler):
         content = ''.join(model.expand_content(namespace, stream))
       except cloudstorage.NotFoundError:
         logging.error('Entity in DB but not in GCS: deleting entity in DB')
-        entity.key.delete()
+        model.delete_entry_and_gs_entry([entity.key])
+        # Make the clients upload it again.
+        snapshot.invalidate()
         self.abort(404, 'Unable to retrieve the file from GCS')
     else:
       content = ''.join(model.expand_content(namespace, [raw_data]))
@@ -378,6 +393,7 @@ def get_routes():
       # Administrative urls.
       webapp2.Route(r'/restricted/config', RestrictedConfigHandler),
       webapp2.Route(r'/restricted/purge', RestrictedPurgeHandler),
+      webapp2.Route(r'/restricted/hot', RestrictedHotHandler),
 
       # Mapreduce related urls.
       webapp2.Route(
@@ -6,7 +6,9 @@
 
 import datetime
 import logging
+import re
 
+from components import auth
 from components import prpc
 from components.prpc.codes import StatusCode
 from components import stats_framework
@@ -15,6 +17,12 @@ from components import utils
 from proto import isolated_pb2  # pylint: disable=no-name-in-module
 from proto import isolated_prpc_pb2 # pylint: disable=no-name-in-module
 
+import acl
+import config
+import gcs
+import handlers_endpoints_v1
+import hot
+import model
 import stats
 
 
@@ -54,8 +62,65 @@ class IsolatedService(object):
     logging.info('Found %d entities', len(entities))
     return out
 
+  def RetrieveBatch(self, request, context):
+    if not acl.isolate_readable():
+      context.set_code(StatusCode.PERMISSION_DENIED)
+      context.set_details('Access is denied')
+      return None
+
+    if not re.match(r'^%s$' % model.NAMESPACE_RE, request.namespace):
+      context.set_code(StatusCode.INVALID_ARGUMENT)
+      context.set_details('Invalid namespace')
+      return None
+
+    if len(request.digests) > handlers_endpoints_v1.MAX_BATCH_DIGESTS:
+      context.set_code(StatusCode.INVALID_ARGUMENT)
+      context.set_details(
+          'Only up to %d items can be retrieved at once' %
+          handlers_endpoints_v1.MAX_BATCH_DIGESTS)
+      return None
+
+    try:
+      contents = model.get_contents(
+          request.namespace, list(request.digests),
+          handlers_endpoints_v1.MAX_BATCH_CONTENT_SIZE)
+    except ValueError as e:
+      context.set_code(StatusCode.INVALID_ARGUMENT)
+      context.set_details(str(e))
+      return None
+
+    out = isolated_pb2.RetrieveBatchResponse()
+    for digest, (content, entry) in zip(request.digests, contents):
+      if content is not None:
+        stats.add_entry(stats.RETURN, len(content), 'batch')
+        hot.record(request.namespace, digest, len(content))
+        out.items.add(digest=digest, content=content)
+      elif entry is None:
+        logging.debug('%s', digest)
+      elif entry.content is None:
+        stats.add_entry(
+            stats.RETURN, entry.compressed_size, 'GS; %s' % entry.key.id())
+        out.items.add(
+            digest=digest,
+            url=self._gs_url_signer().get_download_url(
+                filename=entry.key.id(),
+                expiration=handlers_endpoints_v1.DEFAULT_LINK_EXPIRATION))
+      else:
+        # Too large for this response.
+        out.items.add(digest=digest)
+    return out
+
+  @staticmethod
+  def _gs_url_signer():
+    settings = config.settings()
+    return gcs.URLSigner(
+        settings.gs_bucket,
+        settings.gs_client_id_email,
+        settings.gs_private_key)
+
 
 def get_routes():
   s = prpc.Server()
+  s.add_interceptor(auth.prpc_interceptor)
   s.add_service(IsolatedService())
   return s.get_routes()
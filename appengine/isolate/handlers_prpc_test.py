@@ -4,6 +4,7 @@
 # that can be found in the LICENSE file.
 
 import datetime
+import hashlib
 import logging
 import sys
 import unittest
@@ -19,7 +20,11 @@ from test_support import test_case
 
 from proto import isolated_pb2  # pylint: disable=no-name-in-module
 
+import acl
+import gcs
+import handlers_endpoints_v1
 import handlers_prpc
+import model
 import stats
 
 
@@ -219,6 +224,52 @@ class PRPCTest(test_case.TestCase):
     now = self.now - datetime.timedelta(minutes=5)
     self._assert_stats(isolated_pb2.MINUTE, 1, now, expected)
 
+  def _retrieve_batch(self, namespace, digests, expect_errors=False):
+    msg = isolated_pb2.RetrieveBatchRequest(
+        namespace=namespace, digests=digests)
+    return self.app.post(
+        '/prpc/isolated.v1.Isolated/RetrieveBatch', _encode(msg),
+        self._headers, expect_errors=expect_errors)
+
+  def test_retrieve_batch(self):
+    self.mock(acl, 'isolate_readable', lambda: True)
+    self.mock(
+        gcs.URLSigner, 'get_download_url',
+        lambda _self, filename, expiration: 'https://gs/' + filename)
+    h = [hashlib.sha1(str(i)).hexdigest() for i in xrange(5)]
+    model.save_in_memcache('default', h[0], 'cached')
+    model.new_content_entry(
+        model.get_entry_key('default', h[1]), content='inline').put()
+    model.new_content_entry(
+        model.get_entry_key('default', h[2]), compressed_size=1000).put()
+    big = 'a' * 20
+    model.new_content_entry(
+        model.get_entry_key('default', h[3]), content=big).put()
+    self.mock(handlers_endpoints_v1, 'MAX_BATCH_CONTENT_SIZE', 19)
+
+    # h[4] doesn't exist and is omitted; h[3] doesn't fit.
+    raw_resp = self._retrieve_batch('default', h)
+    resp = isolated_pb2.RetrieveBatchResponse()
+    _decode(raw_resp.body, resp)
+    expected = isolated_pb2.RetrieveBatchResponse()
+    expected.items.add(digest=h[0], content='cached')
+    expected.items.add(digest=h[1], content='inline')
+    expected.items.add(digest=h[2], url='https://gs/default/' + h[2])
+    expected.items.add(digest=h[3])
+    self.assertEqual(expected, resp)
+
+  def test_retrieve_batch_bad_request(self):
+    self.mock(acl, 'isolate_readable', lambda: True)
+    raw_resp = self._retrieve_batch('default', ['invalid'], True)
+    self.assertEqual(400, raw_resp.status_int)
+    raw_resp = self._retrieve_batch('~bad', [], True)
+    self.assertEqual('Invalid namespace', raw_resp.body)
+
+  def test_retrieve_batch_denied(self):
+    self.mock(acl, 'isolate_readable', lambda: False)
+    raw_resp = self._retrieve_batch('default', [], True)
+    self.assertEqual(403, raw_resp.status_int)
+
 
 if __name__ == '__main__':
   if '-v' in sys.argv:
@@ -3,6 +3,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import datetime
 import hashlib
 import json
 import logging
@@ -30,6 +31,7 @@ import gcs
 import handlers_backend
 import handlers_frontend
 import model
+import snapshot
 
 # Access to a protected member _XXX of a client class
 # pylint: disable=W0212
@@ -121,6 +123,48 @@ class MainTest(test_case.TestCase):
         headers={'X-XSRF-Token-Request': '1'}).json
     return resp['xsrf_token'].encode('ascii')
 
+  def mock_invalidate(self):
+    invalidated = []
+    self.mock(snapshot, 'invalidate', lambda: invalidated.append(True))
+    return invalidated
+
+  def test_cleanup_old(self):
+    self.mock(gcs, 'delete_files', lambda *_args, **_kwargs: [])
+    invalidated = self.mock_invalidate()
+    now = self.mock_now(datetime.datetime(2019, 1, 2, 3, 4, 5))
+    hashes = [self.gen_content_inline(content=str(i)) for i in xrange(5)]
+    entries = ndb.get_multi(model.get_entry_key('default', h) for h in hashes)
+    # Expires all but the last one.
+    for i, entry in enumerate(entries[:-1]):
+      entry.expiration_ts = now - datetime.timedelta(days=i+1)
+    ndb.put_multi(entries)
+
+    headers = {'X-AppEngine-QueueName': 'cleanup'}
+    self.app_backend.post('/internal/taskqueue/cleanup/old', headers=headers)
+    self.assertEqual(handlers_backend.SWEEP_SHARDS, self.execute_tasks())
+    self.assertEqual(
+        [entries[-1].key], model.ContentEntry.query().fetch(keys_only=True))
+    shards = model.ExpirySweepShard.query().fetch()
+    self.assertEqual(handlers_backend.SWEEP_SHARDS, len(shards))
+    self.assertTrue(all(s.done for s in shards))
+    self.assertEqual(4, sum(s.deleted for s in shards))
+
+    # Nothing left to sweep.
+    self.app_backend.post('/internal/taskqueue/cleanup/old', headers=headers)
+    self.assertEqual(0, self.execute_tasks())
+    # Expired entries are not listed in the snapshots.
+    self.assertEqual([], invalidated)
+
+  def test_cleanup_obliterate(self):
+    self.mock(gcs, 'list_files', lambda _bucket: [])
+    invalidated = self.mock_invalidate()
+    self.gen_content_inline()
+    headers = {'X-AppEngine-QueueName': 'cleanup'}
+    self.app_backend.post(
+        '/internal/taskqueue/cleanup/obliterate', headers=headers)
+    self.assertEqual([], model.ContentEntry.query().fetch(keys_only=True))
+    self.assertEqual([True], invalidated)
+
   def test_root(self):
     # Just asserts it doesn't crash.
     self.app_frontend.get('/')
@@ -213,10 +257,15 @@ class MainTest(test_case.TestCase):
         expanded_size=len(content),
         is_verified=True).put()
 
+    self.mock(gcs, 'delete_files', lambda *_args, **_kwargs: [])
+    invalidated = self.mock_invalidate()
+
     self.set_as_reader()
     self.app_frontend.get(
         '/content?namespace=default-gzip&digest=%s' % hashhex, status=404)
     self.assertEqual(None, key.get())
+    # The snapshots may list it, so the clients would not upload it again.
+    self.assertEqual([True], invalidated)
 
   def test_config(self):
     self.set_as_admin()
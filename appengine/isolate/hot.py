@@ -0,0 +1,223 @@
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Tracks the most fetched inline entries and keeps them in memcache.
+
+Each instance counts the fetches of inline content in a count-min sketch and
+keeps the heaviest hitters as candidates. Every SAMPLE_INTERVAL, an instance
+saves its candidates in a HotSample entity and starts over.
+
+A cron job sums the samples of the last WINDOW into HotDigests, promotes the
+hottest entries into memcache for PROMOTED_DURATION and demotes the ones that
+are not hot anymore. Entries that are not .isolated files are otherwise never
+saved in memcache, so they are read from the datastore on each fetch.
+"""
+
+import datetime
+import logging
+import threading
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from components import utils
+
+import model
+
+
+# Number of counters per row of the count-min sketch.
+SKETCH_WIDTH = 2048
+
+
+# Number of rows of the count-min sketch, e.g. of hash functions.
+SKETCH_DEPTH = 4
+
+
+# Number of heavy hitters tracked per instance.
+CANDIDATES = 100
+
+
+# How often an instance saves its heavy hitters.
+SAMPLE_INTERVAL = datetime.timedelta(minutes=1)
+
+
+# Period of the samples summed by cron_update().
+WINDOW = datetime.timedelta(minutes=10)
+
+
+# Number of entries reported and considered for promotion.
+TOP_N = 100
+
+
+# Minimum number of fetches during WINDOW for an entry to be promoted.
+MIN_HITS = 100
+
+
+# How long a promoted entry stays in memcache. It must be longer than the cron
+# job period, which refreshes it.
+PROMOTED_DURATION = datetime.timedelta(hours=1)
+
+
+### Models
+
+
+class HotEntry(ndb.Model):
+  """Fetches of an entry, to be embedded in another entity."""
+  # '<namespace>/<hash>', the ContentEntry key id.
+  key_id = ndb.StringProperty(indexed=False)
+  # Estimated number of fetches and bytes served.
+  hits = ndb.IntegerProperty(indexed=False)
+  bytes = ndb.IntegerProperty(indexed=False)
+  # Set when the entry was promoted into memcache.
+  promoted = ndb.BooleanProperty(default=False, indexed=False)
+
+
+class HotSample(ndb.Model):
+  """Heavy hitters seen by one instance during SAMPLE_INTERVAL.
+
+  No key id; deleted once older than WINDOW.
+  """
+  # End of the sample.
+  ts = ndb.DateTimeProperty()
+  entries = ndb.LocalStructuredProperty(HotEntry, repeated=True)
+
+
+class HotDigests(ndb.Model):
+  """The TOP_N hottest entries of the last WINDOW, sorted by hits.
+
+  Key id: 1
+  """
+  ts = ndb.DateTimeProperty(indexed=False)
+  entries = ndb.LocalStructuredProperty(HotEntry, repeated=True)
+
+
+### Private stuff.
+
+
+class _Tracker(object):
+  """Tracks the heavy hitters of an instance with a count-min sketch."""
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._reset(utils.utcnow())
+
+  def _reset(self, now):
+    self._start = now
+    self._sketch = [[0] * SKETCH_WIDTH for _ in xrange(SKETCH_DEPTH)]
+    # {key_id: bytes served}
+    self._candidates = {}
+    # Lower bound of the estimates of the candidates.
+    self._floor = 0
+
+  def _estimate(self, key_id):
+    return min(
+        row[hash((key_id, i)) % SKETCH_WIDTH]
+        for i, row in enumerate(self._sketch))
+
+  def record(self, key_id, size):
+    """Counts a fetch and returns a sample to save if SAMPLE_INTERVAL elapsed.
+    """
+    now = utils.utcnow()
+    with self._lock:
+      for i, row in enumerate(self._sketch):
+        row[hash((key_id, i)) % SKETCH_WIDTH] += 1
+      if key_id in self._candidates or len(self._candidates) < CANDIDATES:
+        self._candidates[key_id] = self._candidates.get(key_id, 0) + size
+      else:
+        estimate = self._estimate(key_id)
+        if estimate > self._floor:
+          coldest = min(self._candidates, key=self._estimate)
+          self._floor = self._estimate(coldest)
+          if self._floor < estimate:
+            del self._candidates[coldest]
+            # The bytes of the fetches before it was a candidate are unknown,
+            # assume they were of the same size.
+            self._candidates[key_id] = estimate * size
+
+      if now - self._start < SAMPLE_INTERVAL:
+        return None
+      sample = HotSample(
+          ts=now,
+          entries=[
+            HotEntry(key_id=k, hits=self._estimate(k), bytes=b)
+            for k, b in self._candidates.iteritems()
+          ])
+      self._reset(now)
+    return sample
+
+
+_tracker = _Tracker()
+
+
+def _split(key_id):
+  """Returns the namespace and hash key of a ContentEntry key id."""
+  return key_id.rsplit('/', 1)
+
+
+### Public API.
+
+
+def record(namespace, hash_key, size):
+  """Counts a fetch of inline content."""
+  sample = _tracker.record('%s/%s' % (namespace, hash_key), size)
+  if sample:
+    sample.put()
+
+
+def cron_update():
+  """Promotes the hottest entries into memcache and demotes the others.
+
+  Returns:
+    The HotDigests entity saved.
+  """
+  now = utils.utcnow()
+  cutoff = now - WINDOW
+  totals = {}
+  for sample in HotSample.query(HotSample.ts >= cutoff):
+    for e in sample.entries:
+      hits, size = totals.get(e.key_id, (0, 0))
+      totals[e.key_id] = (hits + e.hits, size + e.bytes)
+  top = sorted(totals.iteritems(), key=lambda i: (-i[1][0], i[0]))[:TOP_N]
+
+  # The .isolated files are already in memcache and stay there.
+  hot = [k for k, (hits, _) in top if hits >= MIN_HITS]
+  to_promote = {}
+  for key_id, entry in zip(
+      hot, ndb.get_multi(model.entry_key_from_id(k) for k in hot)):
+    if entry and entry.content is not None and not entry.is_isolated:
+      namespace, hash_key = _split(key_id)
+      to_promote.setdefault(namespace, {})[hash_key] = entry.content
+  for namespace, mapping in to_promote.iteritems():
+    memcache.set_multi(
+        mapping, time=PROMOTED_DURATION.total_seconds(),
+        namespace='table_%s' % namespace)
+
+  promoted = {
+    '%s/%s' % (n, h) for n, mapping in to_promote.iteritems() for h in mapping
+  }
+  previous = HotDigests.get_by_id(1)
+  to_demote = {}
+  for e in (previous.entries if previous else []):
+    if e.promoted and e.key_id not in promoted:
+      namespace, hash_key = _split(e.key_id)
+      to_demote.setdefault(namespace, []).append(hash_key)
+  for namespace, hash_keys in to_demote.iteritems():
+    memcache.delete_multi(hash_keys, namespace='table_%s' % namespace)
+
+  digests = HotDigests(
+      id=1, ts=now,
+      entries=[
+        HotEntry(key_id=k, hits=hits, bytes=size, promoted=k in promoted)
+        for k, (hits, size) in top
+      ])
+  digests.put()
+  ndb.delete_multi(
+      HotSample.query(HotSample.ts < cutoff).fetch(
+          model.MAX_KEYS_PER_DB_OPS, keys_only=True))
+  logging.info(
+      'Promoted %d entries, demoted %d; hottest:%s', len(promoted),
+      sum(len(h) for h in to_demote.itervalues()),
+      ''.join(
+          '\n%s: %d hits, %d bytes' % (e.key_id, e.hits, e.bytes)
+          for e in digests.entries[:10]))
+  return digests
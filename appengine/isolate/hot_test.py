@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import datetime
+import hashlib
+import logging
+import sys
+import unittest
+
+# pylint: disable=wrong-import-position
+import test_env
+test_env.setup_test_env()
+
+from google.appengine.api import memcache
+
+from test_support import test_case
+
+import hot
+import model
+
+
+def put_entry(content, is_isolated=False):
+  """Stores an inline ContentEntry and returns its key id."""
+  key = model.get_entry_key('default', hashlib.sha1(content).hexdigest())
+  model.new_content_entry(
+      key, content=content, is_isolated=is_isolated, is_verified=True).put()
+  return key.string_id()
+
+
+class HotTest(test_case.TestCase):
+  APP_DIR = test_env.APP_DIR
+
+  def setUp(self):
+    super(HotTest, self).setUp()
+    self.now = datetime.datetime(2019, 1, 2, 3, 4, 5)
+    self.mock_now(self.now)
+    self.mock(hot, '_tracker', hot._Tracker())
+
+  def test_record(self):
+    for _ in xrange(3):
+      hot.record('default', 'a' * 40, 10)
+    hot.record('default', 'b' * 40, 20)
+    self.assertEqual([], hot.HotSample.query().fetch())
+
+    # The sample is saved once SAMPLE_INTERVAL elapsed.
+    self.mock_now(self.now, 60)
+    hot.record('default', 'b' * 40, 20)
+    samples = hot.HotSample.query().fetch()
+    self.assertEqual(1, len(samples))
+    self.assertEqual(self.now + datetime.timedelta(seconds=60), samples[0].ts)
+    self.assertEqual(
+        [('default/' + 'a' * 40, 3, 30), ('default/' + 'b' * 40, 2, 40)],
+        sorted((e.key_id, e.hits, e.bytes) for e in samples[0].entries))
+
+  def test_record_candidates(self):
+    self.mock(hot, 'CANDIDATES', 2)
+    tracker = hot._Tracker()
+    for key_id, count in (('a', 3), ('b', 1), ('c', 5)):
+      for _ in xrange(count):
+        self.assertIsNone(tracker.record(key_id, 1))
+    self.mock_now(self.now, 60)
+    sample = tracker.record('a', 1)
+    # 'b' was evicted by 'c'.
+    self.assertEqual(
+        [('a', 4, 4), ('c', 5, 5)],
+        sorted((e.key_id, e.hits, e.bytes) for e in sample.entries))
+
+  def test_cron_update(self):
+    self.mock(hot, 'MIN_HITS', 2)
+    hot1 = put_entry('hot1')
+    hot2 = put_entry('hot2')
+    isolated = put_entry('{}', is_isolated=True)
+    lukewarm = put_entry('lukewarm')
+    cold = put_entry('cold')
+    hot.HotSample(
+        ts=self.now - datetime.timedelta(minutes=1),
+        entries=[
+          hot.HotEntry(key_id=hot1, hits=5, bytes=20),
+          hot.HotEntry(key_id=isolated, hits=3, bytes=6),
+          hot.HotEntry(key_id=lukewarm, hits=1, bytes=8),
+        ]).put()
+    hot.HotSample(
+        ts=self.now,
+        entries=[hot.HotEntry(key_id=hot2, hits=2, bytes=8)]).put()
+    # Too old.
+    hot.HotSample(
+        ts=self.now - hot.WINDOW - datetime.timedelta(seconds=1),
+        entries=[hot.HotEntry(key_id=cold, hits=100, bytes=400)]).put()
+    # Promoted by the previous run.
+    hot.HotDigests(
+        id=1, entries=[hot.HotEntry(key_id=cold, hits=3, promoted=True)]).put()
+    memcache.set(cold.rsplit('/', 1)[1], 'cold', namespace='table_default')
+
+    digests = hot.cron_update()
+    self.assertEqual(
+        [
+          (hot1, 5, 20, True),
+          (isolated, 3, 6, False),
+          (hot2, 2, 8, True),
+          (lukewarm, 1, 8, False),
+        ],
+        [(e.key_id, e.hits, e.bytes, e.promoted) for e in digests.entries])
+    cached = memcache.get_multi(
+        [k.rsplit('/', 1)[1] for k in (hot1, hot2, isolated, lukewarm, cold)],
+        namespace='table_default')
+    self.assertEqual(['hot1', 'hot2'], sorted(cached.itervalues()))
+    # The old sample was deleted.
+    self.assertEqual(2, hot.HotSample.query().count())
+
+
+if __name__ == '__main__':
+  if '-v' in sys.argv:
+    unittest.TestCase.maxDiff = None
+    logging.basicConfig(level=logging.DEBUG)
+  else:
+    logging.basicConfig(level=logging.FATAL)
+  unittest.main()
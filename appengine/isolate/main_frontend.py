@@ -31,6 +31,7 @@ import config
 import handlers_endpoints_v1
 import handlers_frontend
 import handlers_prpc
+import stats
 
 
 def create_application():
@@ -52,7 +53,9 @@ def create_application():
   ])
 
   prpc_api = webapp2.WSGIApplication(handlers_prpc.get_routes())
-  return frontend, endpoints_api, prpc_api
+  return (
+      stats.count_requests(frontend), stats.count_requests(endpoints_api),
+      stats.count_requests(prpc_api))
 
 
 frontend_app, endpoints_app, prpc_app = create_application()
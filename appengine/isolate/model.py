@@ -33,6 +33,16 @@ MAX_MEMCACHE_ISOLATED = 500*1024
 NAMESPACE_RE = r'[a-z0-9A-Z\-._]+'
 
 
+# How long a ContentEntry is known to exist once it was seen, see
+# mark_existing(). It must be much shorter than the default expiration.
+EXISTS_MARKER_DURATION = datetime.timedelta(hours=1)
+
+
+# Upper bound of how long a ContentEntry is known to not need a tag, see
+# mark_tagged(). memcache interprets longer durations as absolute timestamps.
+TAGGED_MARKER_MAX_DURATION = datetime.timedelta(days=7)
+
+
 #### Models
 
 
@@ -92,6 +102,32 @@ class ContentEntry(ndb.Model):
     return self.key.parent().id().endswith(('-bzip2', '-deflate', '-gzip'))
 
 
+class ExpirySweepShard(ndb.Model):
+  """Progress of one shard of the sweep of expired ContentEntry.
+
+  Key id is the shard number, starting at 1. There's no parent.
+
+  A sweep splits the expiration_ts range of the expired entries in shards that
+  are processed concurrently, see handlers_backend.
+  """
+  # Range of ContentEntry.expiration_ts covered by this shard, [start, end).
+  start_ts = ndb.DateTimeProperty(indexed=False)
+  end_ts = ndb.DateTimeProperty(indexed=False)
+
+  # Query cursor to resume from, as urlsafe string.
+  cursor = ndb.StringProperty(indexed=False)
+
+  # Number of ContentEntry deleted so far.
+  deleted = ndb.IntegerProperty(default=0, indexed=False)
+
+  # Set once the whole range was swept.
+  done = ndb.BooleanProperty(default=False, indexed=False)
+
+  # Moment when the sweep started and the last checkpoint.
+  created_ts = ndb.DateTimeProperty(indexed=False)
+  modified_ts = ndb.DateTimeProperty(indexed=False, auto_now=True)
+
+
 ### Private stuff.
 
 
@@ -99,6 +135,26 @@ class ContentEntry(ndb.Model):
 _HASH_LETTERS = frozenset('0123456789abcdef')
 
 
+def _exists_namespace(namespace):
+  """Returns the memcache namespace of the markers of a namespace."""
+  return 'exists_%s' % namespace
+
+
+def _tagged_namespace(namespace):
+  """Returns the memcache namespace of the tag markers of a namespace."""
+  return 'tagged_%s' % namespace
+
+
+def _forget_existing(keys):
+  """Deletes the existence markers of ContentEntry keys."""
+  per_namespace = {}
+  for key in keys:
+    namespace, hash_key = key.string_id().rsplit('/', 1)
+    per_namespace.setdefault(namespace, []).append(hash_key)
+  for namespace, hash_keys in per_namespace.iteritems():
+    memcache.delete_multi(hash_keys, namespace=_exists_namespace(namespace))
+
+
 ### Public API.
 
 
@@ -145,6 +201,11 @@ def entry_key_from_id(key_id):
       parent=datastore_utils.shard_key(hash_key, N, 'ContentShard'))
 
 
+def expiry_sweep_shard_key(shard):
+  """Returns the ndb.Key for an ExpirySweepShard."""
+  return ndb.Key(ExpirySweepShard, shard)
+
+
 def get_content(namespace, hash_key):
   """Returns the content from either memcache or datastore, when stored inline.
 
@@ -170,6 +231,104 @@ def get_content(namespace, hash_key):
     return (entity.content, entity)
 
 
+def get_contents(namespace, hash_keys, max_size):
+  """Returns the content of many entries from either memcache or datastore.
+
+  It is the batch version of get_content(): memcache is looked up in one call,
+  then the datastore in one call for the misses. Once max_size bytes of content
+  are returned, the ContentEntry is returned instead of the content.
+
+  Returns:
+    list of tuple(content, ContentEntry) in the order of hash_keys.
+    At most only one of the two is set, none if the entry doesn't exist.
+
+  Raises ValueError if a hash_key is invalid.
+  """
+  # Raises ValueError
+  keys = [get_entry_key(namespace, h) for h in hash_keys]
+  cached = memcache.get_multi(hash_keys, namespace='table_%s' % namespace)
+  out = [None] * len(hash_keys)
+  missing = []
+  for i, hash_key in enumerate(hash_keys):
+    content = cached.get(hash_key)
+    if content is not None and len(content) <= max_size:
+      max_size -= len(content)
+      out[i] = (content, None)
+    else:
+      missing.append(i)
+  entities = ndb.get_multi([keys[i] for i in missing])
+  for i, entity in zip(missing, entities):
+    if (entity and entity.content is not None and
+        len(entity.content) <= max_size):
+      max_size -= len(entity.content)
+      out[i] = (entity.content, None)
+    else:
+      out[i] = (None, entity)
+  return out
+
+
+def get_existing(namespace, hash_keys):
+  """Returns the hash keys recently seen present, from memcache.
+
+  Returns:
+    dict {hash_key: expanded_size} of the ContentEntry known to exist. The
+    other hash keys must be looked up in the datastore.
+  """
+  return memcache.get_multi(hash_keys, namespace=_exists_namespace(namespace))
+
+
+def mark_existing(namespace, entries):
+  """Notes in memcache that ContentEntry entities exist for a while.
+
+  Only verified entries that don't expire soon are marked, so that a marker
+  doesn't outlive its ContentEntry: the cleanup cron job only deletes expired
+  entries and the verify task may delete unverified ones.
+  """
+  cutoff = utils.utcnow() + EXISTS_MARKER_DURATION
+  markers = {
+    e.key.string_id().rsplit('/', 1)[1]: e.expanded_size
+    for e in entries
+    if e.is_verified and e.expiration_ts > cutoff
+  }
+  if markers:
+    memcache.set_multi(
+        markers, time=EXISTS_MARKER_DURATION.total_seconds(),
+        namespace=_exists_namespace(namespace))
+
+
+def get_tagged(namespace, hash_keys):
+  """Returns the hash keys of ContentEntry known to not need a tag yet.
+
+  Returns:
+    set of the hash keys with a marker set by mark_tagged(). The other ones may
+    need to be tagged.
+  """
+  return set(
+      memcache.get_multi(hash_keys, namespace=_tagged_namespace(namespace)))
+
+
+def mark_tagged(namespace, entries):
+  """Notes in memcache that ContentEntry entities don't need a tag for a while.
+
+  A marker expires before the entry's next_tag_ts, so the entry is tagged again
+  on its first lookup after that. Markers are bucketed per hour of remaining
+  time to keep the number of memcache calls low.
+  """
+  now = utils.utcnow()
+  max_duration = int(TAGGED_MARKER_MAX_DURATION.total_seconds())
+  per_duration = {}
+  for e in entries:
+    remaining = int((e.next_tag_ts - now).total_seconds())
+    duration = min(remaining - remaining % 3600, max_duration)
+    if duration > 0:
+      per_duration.setdefault(duration, []).append(
+          e.key.string_id().rsplit('/', 1)[1])
+  for duration, hash_keys in per_duration.iteritems():
+    memcache.set_multi(
+        dict.fromkeys(hash_keys, 1), time=duration,
+        namespace=_tagged_namespace(namespace))
+
+
 def expiration_jitter(now, expiration):
   """Returns expiration/next_tag pair to set in a ContentEntry."""
   jittered = random.uniform(1, 1.2) * expiration
@@ -236,45 +395,29 @@ def new_content_entry(key, **kwargs):
 def delete_entry_and_gs_entry(keys_to_delete):
   """Deletes synchronously a list of ContentEntry and their GS files.
 
-  For each ContentEntry, it deletes the ContentEntry first, then the files in
-  GS. The worst case is that the GS files are left behind and will be reaped by
-  a lost GS task queue. The reverse is much worse, having a ContentEntry
-  pointing to a deleted GS entry will lead to lookup failures.
+  The ContentEntry are deleted first, then the GS files of the ones that were
+  deleted, concurrently. The worst case is that the GS files are left behind
+  and will be reaped by a lost GS task queue. The reverse is much worse, having
+  a ContentEntry pointing to a deleted GS entry will lead to lookup failures.
+
+  The existence markers are deleted last.
   """
-  futures = {}
   exc = None
-  bucket = config.settings().gs_bucket
+  deleted = []
+  futures = ndb.delete_multi_async(keys_to_delete)
+  for key, future in zip(keys_to_delete, futures):
+    try:
+      future.get_result()
+      deleted.append(key.string_id())
+    except Exception as exc:
+      continue
+
   # Note that some content entries may NOT have corresponding GS files. That
   # happens for small entries stored inline in the datastore or memcache. Since
   # this function operates only on keys, it can't distinguish "large" entries
   # stored in GS from "small" ones stored inline. So instead it tries to delete
   # all corresponding GS files, silently skipping ones that are not there.
-  for key in keys_to_delete:
-    # Always delete ContentEntry first.
-    futures[key.delete_async()] = key.string_id()
-    # Note: this is worst case O(n²) but will scale better than that. The goal
-    # is to delete files as soon as possible.
-    for f in futures.keys():
-      if f.done():
-        k = futures.pop(f)
-        try:
-          f.get_result()
-          # This is synchronous.
-          gcs.delete_file(bucket, k, ignore_missing=True)
-        except Exception as exc:
-          break
-    if exc:
-      break
-
-  while futures:
-    f = ndb.Future.wait_any(futures)
-    k = futures.pop(f)
-    try:
-      f.get_result()
-      # This is synchronous.
-      gcs.delete_file(bucket, k, ignore_missing=True)
-    except Exception as exc:
-      continue
-
+  gcs.delete_files(config.settings().gs_bucket, deleted, ignore_missing=True)
+  _forget_existing(keys_to_delete)
   if exc:
     raise exc  # pylint: disable=raising-bad-type
@@ -3,6 +3,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import datetime
 import hashlib
 import logging
 import os
@@ -73,6 +74,71 @@ class MainTest(test_case.TestCase):
           'c41be5e4254d8820772c5518a2c5a8c0c7f7eda19594a7eb539453e1ed7',
         hash_item('sha512-gzip', content))
 
+  def test_get_contents(self):
+    h = ['%040x' % i for i in xrange(4)]
+    model.save_in_memcache('n', h[0], 'cached')
+    inline = model.new_content_entry(
+        model.get_entry_key('n', h[1]), content='inline')
+    gs = model.new_content_entry(model.get_entry_key('n', h[2]))
+    inline.put()
+    gs.put()
+    self.assertEqual(
+        [('cached', None), ('inline', None), (None, gs), (None, None)],
+        model.get_contents('n', h, 12))
+    # Once the budget is spent, the ContentEntry is returned instead.
+    self.assertEqual(
+        [('cached', None), (None, inline), (None, gs), (None, None)],
+        model.get_contents('n', h, 11))
+    with self.assertRaises(ValueError):
+      model.get_contents('n', ['invalid'], 12)
+
+  def test_mark_existing(self):
+    now = datetime.datetime(2019, 1, 2, 3, 4, 5)
+    self.mock_now(now)
+    self.mock(model.gcs, 'delete_files', lambda *_args, **_kwargs: [])
+    h = ['%040x' % i for i in xrange(3)]
+    entries = [
+      model.new_content_entry(
+          model.get_entry_key('n', h[0]), expanded_size=10, is_verified=True),
+      # Not verified yet.
+      model.new_content_entry(
+          model.get_entry_key('n', h[1]), expanded_size=11),
+      # Expires soon.
+      model.new_content_entry(
+          model.get_entry_key('n', h[2]), expanded_size=12, is_verified=True),
+    ]
+    entries[2].expiration_ts = now + datetime.timedelta(minutes=30)
+    model.mark_existing('n', entries)
+    self.assertEqual({h[0]: 10}, model.get_existing('n', h))
+    self.assertEqual({}, model.get_existing('other', h))
+
+    model.delete_entry_and_gs_entry([entries[0].key])
+    self.assertEqual({}, model.get_existing('n', h))
+
+  def test_mark_tagged(self):
+    now = datetime.datetime(2019, 1, 2, 3, 4, 5)
+    self.mock_now(now)
+    h = ['%040x' % i for i in xrange(3)]
+    entries = [
+      model.new_content_entry(model.get_entry_key('n', i)) for i in h
+    ]
+    entries[0].next_tag_ts = now + datetime.timedelta(hours=3, minutes=30)
+    # Too soon.
+    entries[1].next_tag_ts = now + datetime.timedelta(minutes=30)
+    # Capped.
+    entries[2].next_tag_ts = now + datetime.timedelta(days=30)
+    calls = []
+    set_multi = model.memcache.set_multi
+    def mocked_set_multi(mapping, time, namespace):
+      calls.append((sorted(mapping), time))
+      return set_multi(mapping, time=time, namespace=namespace)
+    self.mock(model.memcache, 'set_multi', mocked_set_multi)
+    model.mark_tagged('n', entries)
+    self.assertEqual(
+        [([h[0]], 3*3600), ([h[2]], 7*24*3600)], sorted(calls))
+    self.assertEqual({h[0], h[2]}, model.get_tagged('n', h))
+    self.assertEqual(set(), model.get_tagged('other', h))
+
 
 if __name__ == '__main__':
   if '-v' in sys.argv:
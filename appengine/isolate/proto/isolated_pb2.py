@@ -21,7 +21,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   package='isolated.v1',
   syntax='proto3',
   serialized_options=None,
-  serialized_pb=_b('\n\x0eisolated.proto\x12\x0bisolated.v1\x1a\x1fgoogle/protobuf/timestamp.proto\"\x7f\n\x0cStatsRequest\x12/\n\x0blatest_time\x18\x01 \x01(\x0b\x32\x1a.google.protobuf.Timestamp\x12+\n\nresolution\x18\x02 \x01(\x0e\x32\x17.isolated.v1.Resolution\x12\x11\n\tpage_size\x18\x03 \x01(\x05\"A\n\rStatsResponse\x12\x30\n\x0cmeasurements\x18\x01 \x03(\x0b\x32\x1a.isolated.v1.StatsSnapshot\"\xec\x01\n\rStatsSnapshot\x12.\n\nstart_time\x18\x01 \x01(\x0b\x32\x1a.google.protobuf.Timestamp\x12\x0f\n\x07uploads\x18\x02 \x01(\x03\x12\x15\n\ruploads_bytes\x18\x03 \x01(\x03\x12\x11\n\tdownloads\x18\x04 \x01(\x03\x12\x17\n\x0f\x64ownloads_bytes\x18\x05 \x01(\x03\x12\x19\n\x11\x63ontains_requests\x18\x06 \x01(\x03\x12\x18\n\x10\x63ontains_lookups\x18\x07 \x01(\x03\x12\x10\n\x08requests\x18\x08 \x01(\x03\x12\x10\n\x08\x66\x61ilures\x18\t \x01(\x03*G\n\nResolution\x12\x1a\n\x16RESOLUTION_UNSPECIFIED\x10\x00\x12\n\n\x06MINUTE\x10\x01\x12\x08\n\x04HOUR\x10\x02\x12\x07\n\x03\x44\x41Y\x10\x03\x32L\n\x08Isolated\x12@\n\x05Stats\x12\x19.isolated.v1.StatsRequest\x1a\x1a.isolated.v1.StatsResponse\"\x00\x62\x06proto3')
+  serialized_pb=_b('\n\x0eisolated.proto\x12\x0bisolated.v1\x1a\x1fgoogle/protobuf/timestamp.proto\"\x7f\n\x0cStatsRequest\x12/\n\x0blatest_time\x18\x01 \x01(\x0b\x32\x1a.google.protobuf.Timestamp\x12+\n\nresolution\x18\x02 \x01(\x0e\x32\x17.isolated.v1.Resolution\x12\x11\n\tpage_size\x18\x03 \x01(\x05\"A\n\rStatsResponse\x12\x30\n\x0cmeasurements\x18\x01 \x03(\x0b\x32\x1a.isolated.v1.StatsSnapshot\"\xec\x01\n\rStatsSnapshot\x12.\n\nstart_time\x18\x01 \x01(\x0b\x32\x1a.google.protobuf.Timestamp\x12\x0f\n\x07uploads\x18\x02 \x01(\x03\x12\x15\n\ruploads_bytes\x18\x03 \x01(\x03\x12\x11\n\tdownloads\x18\x04 \x01(\x03\x12\x17\n\x0f\x64ownloads_bytes\x18\x05 \x01(\x03\x12\x19\n\x11\x63ontains_requests\x18\x06 \x01(\x03\x12\x18\n\x10\x63ontains_lookups\x18\x07 \x01(\x03\x12\x10\n\x08requests\x18\x08 \x01(\x03\x12\x10\n\x08\x66\x61ilures\x18\t \x01(\x03\":\n\x14RetrieveBatchRequest\x12\x11\n\tnamespace\x18\x01 \x01(\t\x12\x0f\n\x07\x64igests\x18\x02 \x03(\t\"=\n\rRetrievedItem\x12\x0e\n\x06\x64igest\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\x0c\x12\x0b\n\x03url\x18\x03 \x01(\t\"B\n\x15RetrieveBatchResponse\x12)\n\x05items\x18\x01 \x03(\x0b\x32\x1a.isolated.v1.RetrievedItem*G\n\nResolution\x12\x1a\n\x16RESOLUTION_UNSPECIFIED\x10\x00\x12\n\n\x06MINUTE\x10\x01\x12\x08\n\x04HOUR\x10\x02\x12\x07\n\x03\x44\x41Y\x10\x03\x32\xa6\x01\n\x08Isolated\x12@\n\x05Stats\x12\x19.isolated.v1.StatsRequest\x1a\x1a.isolated.v1.StatsResponse\"\x00\x12X\n\rRetrieveBatch\x12!.isolated.v1.RetrieveBatchRequest\x1a\".isolated.v1.RetrieveBatchResponse\"\x00\x62\x06proto3')
   ,
   dependencies=[google_dot_protobuf_dot_timestamp__pb2.DESCRIPTOR,])
 
@@ -50,8 +50,8 @@ _RESOLUTION = _descriptor.EnumDescriptor(
   ],
   containing_type=None,
   serialized_options=None,
-  serialized_start=499,
-  serialized_end=570,
+  serialized_start=690,
+  serialized_end=761,
 )
 _sym_db.RegisterEnumDescriptor(_RESOLUTION)
 
@@ -225,13 +225,131 @@ _STATSSNAPSHOT = _descriptor.Descriptor(
   serialized_end=497,
 )
 
+
+_RETRIEVEBATCHREQUEST = _descriptor.Descriptor(
+  name='RetrieveBatchRequest',
+  full_name='isolated.v1.RetrieveBatchRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='namespace', full_name='isolated.v1.RetrieveBatchRequest.namespace', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='digests', full_name='isolated.v1.RetrieveBatchRequest.digests', index=1,
+      number=2, type=9, cpp_type=9, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=499,
+  serialized_end=557,
+)
+
+
+_RETRIEVEDITEM = _descriptor.Descriptor(
+  name='RetrievedItem',
+  full_name='isolated.v1.RetrievedItem',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='digest', full_name='isolated.v1.RetrievedItem.digest', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='content', full_name='isolated.v1.RetrievedItem.content', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='url', full_name='isolated.v1.RetrievedItem.url', index=2,
+      number=3, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=559,
+  serialized_end=620,
+)
+
+
+_RETRIEVEBATCHRESPONSE = _descriptor.Descriptor(
+  name='RetrieveBatchResponse',
+  full_name='isolated.v1.RetrieveBatchResponse',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='items', full_name='isolated.v1.RetrieveBatchResponse.items', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=622,
+  serialized_end=688,
+)
+
 _STATSREQUEST.fields_by_name['latest_time'].message_type = google_dot_protobuf_dot_timestamp__pb2._TIMESTAMP
 _STATSREQUEST.fields_by_name['resolution'].enum_type = _RESOLUTION
 _STATSRESPONSE.fields_by_name['measurements'].message_type = _STATSSNAPSHOT
 _STATSSNAPSHOT.fields_by_name['start_time'].message_type = google_dot_protobuf_dot_timestamp__pb2._TIMESTAMP
+_RETRIEVEBATCHRESPONSE.fields_by_name['items'].message_type = _RETRIEVEDITEM
 DESCRIPTOR.message_types_by_name['StatsRequest'] = _STATSREQUEST
 DESCRIPTOR.message_types_by_name['StatsResponse'] = _STATSRESPONSE
 DESCRIPTOR.message_types_by_name['StatsSnapshot'] = _STATSSNAPSHOT
+DESCRIPTOR.message_types_by_name['RetrieveBatchRequest'] = _RETRIEVEBATCHREQUEST
+DESCRIPTOR.message_types_by_name['RetrievedItem'] = _RETRIEVEDITEM
+DESCRIPTOR.message_types_by_name['RetrieveBatchResponse'] = _RETRIEVEBATCHRESPONSE
 DESCRIPTOR.enum_types_by_name['Resolution'] = _RESOLUTION
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
@@ -256,6 +374,27 @@ StatsSnapshot = _reflection.GeneratedProtocolMessageType('StatsSnapshot', (_mess
   ))
 _sym_db.RegisterMessage(StatsSnapshot)
 
+RetrieveBatchRequest = _reflection.GeneratedProtocolMessageType('RetrieveBatchRequest', (_message.Message,), dict(
+  DESCRIPTOR = _RETRIEVEBATCHREQUEST,
+  __module__ = 'isolated_pb2'
+  # @@protoc_insertion_point(class_scope:isolated.v1.RetrieveBatchRequest)
+  ))
+_sym_db.RegisterMessage(RetrieveBatchRequest)
+
+RetrievedItem = _reflection.GeneratedProtocolMessageType('RetrievedItem', (_message.Message,), dict(
+  DESCRIPTOR = _RETRIEVEDITEM,
+  __module__ = 'isolated_pb2'
+  # @@protoc_insertion_point(class_scope:isolated.v1.RetrievedItem)
+  ))
+_sym_db.RegisterMessage(RetrievedItem)
+
+RetrieveBatchResponse = _reflection.GeneratedProtocolMessageType('RetrieveBatchResponse', (_message.Message,), dict(
+  DESCRIPTOR = _RETRIEVEBATCHRESPONSE,
+  __module__ = 'isolated_pb2'
+  # @@protoc_insertion_point(class_scope:isolated.v1.RetrieveBatchResponse)
+  ))
+_sym_db.RegisterMessage(RetrieveBatchResponse)
+
 
 
 _ISOLATED = _descriptor.ServiceDescriptor(
@@ -264,8 +403,8 @@ _ISOLATED = _descriptor.ServiceDescriptor(
   file=DESCRIPTOR,
   index=0,
   serialized_options=None,
-  serialized_start=572,
-  serialized_end=648,
+  serialized_start=764,
+  serialized_end=930,
   methods=[
   _descriptor.MethodDescriptor(
     name='Stats',
@@ -276,6 +415,15 @@ _ISOLATED = _descriptor.ServiceDescriptor(
     output_type=_STATSRESPONSE,
     serialized_options=None,
   ),
+  _descriptor.MethodDescriptor(
+    name='RetrieveBatch',
+    full_name='isolated.v1.Isolated.RetrieveBatch',
+    index=1,
+    containing_service=None,
+    input_type=_RETRIEVEBATCHREQUEST,
+    output_type=_RETRIEVEBATCHRESPONSE,
+    serialized_options=None,
+  ),
 ])
 _sym_db.RegisterServiceDescriptor(_ISOLATED)
 
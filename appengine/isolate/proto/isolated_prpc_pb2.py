@@ -10,90 +10,102 @@ from google.protobuf import descriptor_pb2
 # dependencies. Includes source code info.
 FILE_DESCRIPTOR_SET = descriptor_pb2.FileDescriptorSet()
 FILE_DESCRIPTOR_SET.ParseFromString(zlib.decompress(base64.b64decode(
-    'eJy9WktzG1d2NgiRhFq03IJkm4Jl6w49tAAJBPiQrBHpuAYEQaplEODgIY2kcknNxgXZY6Ab6W'
-    '6QomTHlUVmk9T8gqSmkkUWs0/2WSaVdTbZZJFFKr8gy3zn9O1Gk5Ys16QqLD1uf33ved1zz+M2'
-    'tT+/rl20fXdgBrJXGnlu4GYvxM9HK7nrB657MJBlfrU/7pcDeyj9wByOwtkLf5vS5tqBGfgt+a'
-    'djvMluaBdotR88o6nzKZHKX1jNlUI6pYhOqRPRaWnhdAKydzXNk2A/DmzXmZ/C2ourH5YSApVa'
-    '8etWYmr2I+38yDyQz3z7pZxPY910K0NAG88LTe1dJaI/ch1fZr/U5obS9MeeHEon8CFkmoVMMu'
-    'IVbccc+Ydu0Do1f+E/phTF6H32nqZBG+8nK32eZ7PO89rseDRwzZ7PCqdb0WP2U+1dNXy2fwIb'
-    'sWLp1pwCNwnLXtPO99xjJyRwjidMgOwN7b34QRGZ5jkXYzgkc0u7ZLlOYNqO/8wLt9Kfn+Gpev'
-    'RCbbGfLWgx9mzgut+MR/78LM99L8LrIZzNaZmYXIanxM/0rm/aA5jVnz8fvoueb+5o2mSrMfOD'
-    'Vq3drHc7RrPxrNto79WqxrZR29LfyWrazK7R6HZqeiqb0c7db3Zb+lR2VktvVR7r6dW6ljHUtm'
-    'Z/qU3ztmWv/nCrlXK513hB5DcL7zz453kto5/T39F39JT2D6nMHD9kV/+QElV3dOLZB4eBWF1e'
-    '+YXoHEpR71YNURkHh67nl0RlMBA8wRfQUHpHYKGJri+F2xfBoe0L3x17lhSW25MCjwfukfQc2R'
-    'Njpyc9TJGiMjItImxbEgIVxUPp+TCQWC0ta5hgBsIyHbEvRd/FImE7vKpuVGuNdk30bXijpmUy'
-    'U/qMntEvY5jOvIPRrJ7X5jIzGGtQ5yJ046dMCs8ZXdee8tMU3s/pU/rt3FeCDQM9grHnQHA82X'
-    '5gWz4Ye6EydBKEZzoHUkAsEkNtPBSanFyIo0fEwW4Ogl1IIFNA5vT5BJLG86f6svZFZhriXIK4'
-    'H+ipXElMvEUErhj7kiVpw8ywVSkSlwUAzzlaDX6X9Gn9Pe0iP5F6Waj3MbhNxxIRMp9ApoB8pF'
-    '+L16T0y5jxbjwjpZBMApkCckGfi9dM6Vcw40I8g6gQMpNAaM55XYvXpPX3MUOLZ6SxhpDpBDIF'
-    'JKOf125lzkGXq7DNAmzzsVC+zRaJDkNoEjbFOVb0KpZe0f49xY9ki49BvZj7l5QIAzR5JO3iwM'
-    'QYYdA7IUPD1fyRtOy+LWN3i8wsjL5w3GAyoahFtHqyb44H2BKQoCXW2PNAk52G130bTvyWubou'
-    'aFr0PvxPY/629MWxjUMFGYa279vOgTBZxhNhepJZn0icCHc4GpPGmpaNlMucY/Wu6h/AfBE2w9'
-    'hHCSQF5Jp+I4GkgdzUb2k3FJLSr2PNtdyHkZHPenfEEnblqR/rxZhcCiwJm0sgRPBd/cMEkgaS'
-    'g1hbCpnSf4Y1H+Rui13zhT0cD4UzHu4jQCCMnMpKsZUCV53UhDxTkIfoXIcv6zE2zdhsAkkBye'
-    'iXEkgayBX9ffaylL4ILysoLwvDJMnxWi9L8fQMlv5Nih/Jy/LgdzP3VykWXcUQP1IADuVJBEEQ'
-    'tQ4913EH7oFtmQPheoiI2PASxVnstYp6h+5A+lrkhwOQ26CRJ2/4woTTDcwTTMMxkJFDRSYih7'
-    'E8aYZ+okfiwUh5dewiZAbIBQ4JEZICclVfTCBpIHm9oK0DwSEK80WueGZ7olwp/DBKJcKoshiZ'
-    'v8gWK/ATGawEeW7lrhItL5ikDkVU7fCUEp4mF5U3TSnxS7GTTynxS3DyzxJIGkhBv6ntKSSlr2'
-    'DNldwvRSP2NNvp2Ud2b4zNUPWIyj84bQMZRNFAJYK+Zw5lQjY6DUSzhKOkx9g0Y7MJhDhnEKEn'
-    'SBpIFqnrr1MKmtLvYFEu95ephHRc6oQCHZN/+GPLkr7fHw8GJ0reN0gIhwJyZA7G5CMjytROEE'
-    'Y+Ug3PPlYy/aKw+zFIiecY4QeZp5dQlI4ZybeC2KrH2DRjswkkBYT2eYKkgczrV+NNSOt3+di/'
-    'YRPiei7UmuvLt2xCGrIRzTt6Luabhmx3T8lGieZuHAJChGShEPD7aBPO6RscBn/3o5ugZArTRi'
-    'Tw/88+nFMi3lURP8SmGZtNICkgmcSBOQddNzj8fqWQaf1LrPkkt5HQtBwf5ai4FSj6rVDGH9uC'
-    'aYhF5DZUFA6xkMVsAkkBycAZJkgayDXUKkOFzOgVyi65r0XHDeAPk5xgB3LoC6rTqZQccRUQ2h'
-    'MhR4VKi8rKIj2ZBweePDApe2nCtDzXR3BEkm3tVf2E4DMQnBh+qX8SCzUDwSunBJ+B4BUIPp9A'
-    '0kCogPpCIbP6Fta8j+h4VvDYlnAYBH1rTClF/GqvnZBjFnLQ+gqXbRE2zdhsAkkBoUp2gqSBXM'
-    'apXFJIRt9mOT5O7KvjOkury8uxJAnGGTCmBVuJQ5sB4+1TjDNgvH2KcQaMt4nx/gz3hWvaf5a1'
-    't7XZ2ffOtJILG9r5uJukFtKXcMGez60nWkj1mL2iTTum44at5XQrfNj8M+0yjsvZ9nTzYkxxj6'
-    'C91JNbB3ZwON4vYXb5ABndOZiIOApORtKfSPo/qdTfTaV39jb/MPXJTkh5L2p8H8nB4CsHB75D'
-    'ax7895J2Xv8EWfG3KbQa/zqHNuoTbqP+aU7wGssdiM1xv4/ML5ZESA0pvGcGJnw0kJ51yI0FXH'
-    'loohxM9l7Lv1ALhOFYJfGGtuswCEb+erncQ3kxcEdgFJmDdB0pIZb2QyHKiEct2UNu9uz9sMkw'
-    '0V5Rl4Ejo9o2QvZtx0RhTHIhLB3DeihV+H93DDmHbg+FsMWnq8g1BzgP7YCiIngilFN4PFT9Ut'
-    '8dDNxjKmtpM21axIUK6MhgHSLRz80zgvnkt8lGcjj2qW6m8MRUzX20lXilLKZRnYzioxgGKaqZ'
-    'iEKSo9M7Iw74WQMTG++V3iQEmCVsEQkBHXtjCBbLoU0E+T/JEdd8Pdca0yWNGW1SGfZ3qQYU8B'
-    'TUjObAn5iaNwgvNZGUPlaqIW1eSYQdBG4SKOlbjjt554eh1te4rGNS6PrBlCpOzkYUxqTTc6ma'
-    '5RDsDl3Es9Am8E6qaOGcoo8XWnQh0A+OyU2UB0WtlIVVNjmWR77jhF7EuY8z532jLdrN7c6jSq'
-    'smMN5rNR8aW7UtsfkYL2ui2tx73DJ27nfE/WZ9q9Zqi0pjC2ij0zI2u51mq62JhUobSxf4TaXx'
-    'WNR+vdeqtdui2RLG7l7dADWQb1UaHaPWLgqjUa13t4zGTlGAgmg0O5qoG7tGB/M6zSKz/eE60d'
-    'wWu7VW9T4eK5tG3eg8ZobbRqdBzLabLU1UxF6l1TGq3XqlJfa6rb1muyZIsy2jXa1XjN3aFlrG'
-    'BniK2sNaoyPa9yv1+mlFNdF81Ki1SPqkmmKzBikrm/UasWI9t4xWrdohhSajKowHAevoX/nmCS'
-    'PYowZ1Kq3HRUW0XftVF7PwUmxVdis70C7/NqtgY6rdVm2XpIYp2t3NdsfodDs1sdNsbrGx27XW'
-    'Q6Naa2+IerPNBuu2axBkq9KpMGvQgLnwHuPNbttgwxmNTq3V6u7RfVkBu/wIloGUFazdYgs3G6'
-    'Qt+Uqt2XpMZMkOvANF8eh+DXiLjMrWqpAZ2rBatZOcBoYwIlSa6CkatZ26sVNrVGv0uklkHhnt'
-    'WgEbZrRpgsGM4QNg2mWtaaMglxaOE65b5P0UxraobD00SHI1Gx7QNpS7sNmq95XN1e2W4BoOuV'
-    'ZfQF7ZIDCzqMaEforRdUavqzGhP8dok9ELakwoNbhFRlNqTOhnGJUZjcY0ukFXLoxqakxoHqOf'
-    'MfpzNf7Hj/iG5qVKgbm//wheHmffZL1ripGLjMfhjS7UUPHLEaII9a4IOKZzEuIvXQdRDCEBhR'
-    'Jem15xQgUxxaQmk0sCDqMoQ61JsoheUC6g+oCfE7cYxLzbqYrayLUOoysavg9CCelSHB3z5QsH'
-    'UuTvgRwhkosd1JEuAq4jqkomcXxog4J8gZjVC2v5yaRIcE3sm9Y3iHo9LvxOJNZBubMsTd8fD/'
-    'nKB/kdg3GguvjPl7VYpYHrHKCqLWH1QJqjiaqYt+APQVr2FhBlw5zruMlZCMHm/oAvYh0piSUV'
-    'zlx9jCidcqYQLa5DMCeM2svLyytL/KezvLzOf56QFvfws7SyurS20lldW79zD39K96KfJ0g4my'
-    'dkcOQN7AuZUonE96coJCT0pu8PUTfFFx6Q8kh6qBVcTe2qOxSitV0Va2tr96haop6LrklQuIq2'
-    'lOJpVPYcHx+XbBn0S653UPb6Fv2lRaXgRfB1/qfMKlCm+VTUXpjU7/t4UEOxso56jK/cEi7Nsu'
-    'HcGr8Wz8mD8oXnJVXBTCbFteRG+GZSBfsyeKY2L8/LG916vVB47Tz24fwyXk5kWn2bTAcyICpu'
-    'v2eeJGSD+ZCbmQFaUREcKY6npn8WHBUFC7Txx6p0VAqO6OnHNAonoZKwUJqswNNOabj2Rg0f2c'
-    '7aqni+I4P2iY9ekF5X/G17IDunN2LbqNc6SKeiHygx3rTms34QSdpFqvn8NgS2vvHFn4h8Ph8i'
-    'hX5Q6h3fR2W3BT+kVQXxxRdibbUgvhX8ru4eR68iu5XLiIOQt+ce+0ySThZUTcQlvxRPkByPVj'
-    '7/4ZGLqdHylc9v3759d+1zkInOv7oD7Dr2i4jKvbvLZ6mU/rjNzIf6wxShUcq8WfRTQDOTEOct'
-    'Hkx0yFwRncUEHXaAwikHuP1GB3hgHpniebiRJXXTTlN27QHK7IQDULhELCUUW/nmBT/i5lgXoy'
-    'VHHm+O7QEK23yBFGsrCykWoWEKIS36oTmNUHfEWdJczQxVV2qzBQqlfaLMskxscOeNNkh+YKB8'
-    'tneCgtqJFH+t+PnC2b3BcahOrIH3FAEftFFL7ZqjEeIsAMMJkbA1LXKSS9gJ/e/pLIYMH8Zo1c'
-    'Fo4mkUwX9iIFas6CrcpBRZDMmEKDFbeEVJ9LulV0N0Jof4H0Hru84rNBTed+uvkDvxL5z3u6el'
-    'V1QYkCN/9/WTBQ3pmq7twtVEyBwcmycQ/kV0/Rbm/T4IoYE6QPdDGR77oDgVBbNCtRoywzNxK3'
-    'K2YpaciV9Kz10amb1e2CMFx25ETZrWIV/xxxWLOYize1GVE5QKD1y62aJEGy3Nc9YPwZXX1zUF'
-    'CEb83VFIOeS08AQVAdp+hAa6XrXM8BJTsh9QmSXyC6iGFgobp1CNDET3RDZqihLCWHi7EzqDz4'
-    '2nDUWFD0sMepEp6QaBSqu86cfc6FZTIzEKtAEOtXpOoOqrs65EhjRPsRqZ6C9jNvuQi6sYWMG0'
-    'LBRmYh/dMPOktWFnHOng/0AOTEKJ2Me55Hy/jQpIhmetKBZWl1fuUsxcudNZXllfW15fuVNaXo'
-    'H5Qu9G6KXnOOiOTB8VJs9k/igsH5jOmO4IVu4U6av53ZI6QAhYbcuzRzg/ZPBksWMKShrC3f+N'
-    'pMTsho2ycvZEHQojUTXZE08D12g323zG8oXJmYpvfkpD9yXCjMmHSzpL3Xa551p++ZHcL08kKb'
-    'dkH6fBsWR5Z+Dum4NnTRbBL5M85QSTr/l+5tCFFxhRoCnyMVcSPafKjMvoaPA80kd9x1LKSipC'
-    'X6fh0+eIGX1emVAIQpdGYVwjVVbLA3vfg3n5jq50GAwHn/IoWov4Fl2AhHFR8aBLBnFj8fHS4n'
-    'BpsddZvL++uLu+2C4t9p/cKIm6/Y08tv3wtpjsw3uksejkzkTtgdsz2VVv+JAVlokS/XYYqnrq'
-    'Ebnn63x4Gaei3G+wkqWnwRJJVTZHNu9HhLI65VDW8g9ps54Rg6UlTRTIhu4+X4CZSkcU8RB4xE'
-    'cDLdCBdKRnhocsOmB+fHGv4isSTfyx/CV/EPn95GP59/yB7Hcp0Zr0bpHjgwH5O5sY22clCw/t'
-    '9ZWH2KULM/o9Dkpeb+gqtNe1FU8gtjWAmxzJMx+8ScSX+uXEx+xpxmYTSApI9L0t+uD9PX9v+6'
-    '9I15T+Fymsyub+LSUarrPk8NeCI3m6qTSV9vS7H68NviXRUAujgB5+7PFDn5wQ46tDP6AP/Yfm'
-    'keQ7+Zgnk1YLo1+AcccO/6oDtZBR33zWoKonK6q/2imjXU58smddv9evaJdicDoEZxMQ2ySjv5'
-    'uA0gTp+qXomv9/AZ5qy/g=')))
+    'eJy9WktzG1d2JhoACV5RlgTJEgU9fA29SBkE+JBki9KkBIIg2RIIUHhYlixLagINsm2gG4NukK'
+    'Jsx6vJJqnsk0oWyWJSNVlkM/MDsk1lncoym/yDVCXLfOc+GiBN2a5JVViU2Oc+zvuee87pZv89'
+    'wz5wfK9jBXYr2+t7gZc8EcJ7C6mPdjxvp2PnxNT2oJ0LnK7tB1a3J1en/y7CpmqBFfhV+9cDzC'
+    'QfsBO02w9e09LpCI/MnFhMZSWerMaTrWs8VSaX00DyU8b6NsgPAsdzpw3s/WDxQnaEoWw1nK6O'
+    'LE1eYpM9a8d+7Tvv7Oko9sWrCRqoAU5X2EnFot/zXN9O/gmb6tqWP+jbXdsNfDAZFUyOEhI7aq'
+    '7V83e9oHpoffo/DIVRzyfvMwZp+r9Y6EmxWsg8zSYGvY5ntXwhcLSqweQ1dlI9vt4+gI6EYNHq'
+    'lBpcobHkZTbZ8vZdiSAmFgwHkrfYqRBQSOJizQfhsETzCTvT9NzAclz/dV+a0p8eF0tP6wllYj'
+    '85y8Kx1x3P+2bQ86cnxNpTerwkh5MplgjRJcSSEKa5tuV0oFZ/elLOaThdZueqdtB37D17xQqa'
+    'u9q9IK5rQYs9qyn1PFkdDpAuW86OIGbAppNVDaZr7KTG1zIDu5s8z8blnMKiIEJBMsDOwhxTVQ'
+    '0mT7PooN8RRpis0mPaZB8eYVI52DyLOyByvGcd4qMqF95eZ2zo2tDM+WqxVik16mal/LpRrm0V'
+    'C+aaWVw9PZZkbHzTLDfqxdORZILFNiqN6mkjOcGiq/nnp6OLv42whKmoJR+xuPDT5MUf+7bSaO'
+    'oYt9dypMeSXwz1JkRMfnysLKM2SqV/aonG/Pi/PmLjyVhsbCfC/hBhkalkNDaWXPxdhBe83kHf'
+    '2dkN+OL8wme8vmvzUqNg8vwg2PX6fpbnOx0uFvgcrmL3ocos4w3f5l6bB7uOz31v0G/avOm1bA'
+    '5wx9uz+67d4gO3ZfexxOZ5+Ashdpo22Mnwz+2+D83zxew8wwIr4E3L5ds2b3vYxB1X7CqZhWK5'
+    'VuRtB8easQSLGMnoeOIsm2RGdCwZTUzMMMaM8bFkjI2djeA5Oj4WSUZZ4jT7gsXGxwwsmjLupJ'
+    '5woWjwHwz6LhgG5PiB0/RBsC+FoFDC+5a7Y3OwQ+TVyYEgw9AHNqZYnDCDztT4CQ2BsampaQ1F'
+    'AV2bZ/8YEUxg5RmjlPrbCD9knJAboqW8nlTatdwDjmes9IkVz22S9MIyI8v8rgXD6HWOFs4m7X'
+    'UcF0omvB2rD4E8l1D5vNDxBi0GZXh9RGvuOzu0vlEt+aFcEeJ2/KyGINeZczMaglxnljbYMjPi'
+    '0Pn5sUuRVJYPDxIPPD7wbaHTGhwF1s5qxQtVggpsFCfdnY+fYidYLC5sdMG4QiTiUq0XjGkNgf'
+    'yFS5fVQkxNGyfVVERACQ1h4fSJKbUQwEXjhJqibReNcQ3R3CRTCyFPymBqKhohKK4hLEwlJtks'
+    'M3BQYlfHbkVSV7g6c0JCfeyliFK0GPF/NXGO/TtMHxOypY1M6l8iXF67ZCdpFjyT7Q5IZ/B7v2'
+    'c3nbZjh76vNcbNNne9YLggwzSult22Bh1oFyiEDw36fXIO8mSx7zu58DtB1fOAs0nz8g8LfWff'
+    'gSOBh67j+467Q44CdAfc6tuC9IGN4+l1ewMSlrGTLE6SxZKxtHH1PKmLwHGS9JKGoIX05Vsagp'
+    'rTtz9h14VKMHXduJy6oHV59HhJ9BGgv26kMwpFZJx2TWmIcJy8oCGgv566xPICPcx20zifusM3'
+    'rbdOd9Dl7qC7jSiEE3MohwilDzx1ckLaBmjfNK5fVviNOKGc0BBo30yc0RBo3zz3ofCSSDJ2ey'
+    'wrvUSGXSJ6rJeQALcTH7K/Ji+JkJfMGbdTfxERLKrA5GtG4RB9xIw+8DV3+57rdbwdp2l1uNdH'
+    'eIXBshQaYCsVQne9ju0z7UcdoHtAT337FmIAnKZjHWAZPNjWDhEGG0LSty1pZ5IwQnYGcyEEO8'
+    'ydmNYQxJi7eEND0MXczCz7DLowkrGFsVIklTmidJ2vcF+Gh5FIrFRD+l2Aam5CMwZpZsn4JHWR'
+    '0PSD4YWj8CmTGcIbl4wF6RKGYHNJeaMh2Fy6fFNDYHNp9jbbFAQwdc84l3rEy6GbOG7L2XNaA2'
+    'hYpX7qhsIR6NiBPqLqymj3kQ6FfJDb3jOWPlG0InFCP6EhIpY4pSHwcS95lv1VRDACv102Uqk/'
+    'j4xwIjJISXyfDOwPmk3b99uDTudA8fYebuARGNmzOgMyco/ubTfQN02XYB87Bf4Md9rhIAXxfZ'
+    'x/RPFWKBSdh2Xj3jnFOJ2H5VAo0uAy7KUgCLU8fVEpF8BDnMX3KDdMiaWEIkX/SeVGwcdDYzml'
+    'aEXjhF7zQdH7oTqXgIg0zuXfSOXChx8h5vzlTypX0ZfxWDP3/6HfGOR6ZDw8r3iPxYlbLRfCSv'
+    'RRQjt2DHI9QqzbEGJhYcG4mnowIlUuPGE67+eoh5qSn/erNg4WCsajy4pMXGDWLMTBQiFxUUNg'
+    'oXD5CvtasICDtmZcSX3F614Amw6DrcizOZUrlAj2xI0p9YRTr2JTk5LCDEHWzk7f3rHoCmDcav'
+    'Y9H9EIt1J1q+CHTI6DyTWjcFUxMh4n2prJcTC5lpjWEJhcQ+JwXzA5kYyaxocIRkeZDHUEoyOi'
+    'NgcUqvnTrVpIcwI0TWPtisI7ESdUmuYEaJrINRUEmubZc+y2oJlIRp+A5pUR27ieO7c4Px9SDY'
+    'kkQOSJYepDlIjTXk0kASJPQiIJEHkCIguMfCFWGatHUjeOT0sOJZsqutIpqSQus1+BxyhF16fG'
+    'hdQ8L+uSTkZYW98IGW5ncb3cUpnG3M47p3dLsR0VQfepUZH2ABgndAkNgdLTyaSGwPbTD8+zFU'
+    'EXUzX47V2+Yb/lqmQ8Qlldy0KADPkP4IX5+Xl1L0Up0gJJCIF27cQZDRGB5EUNgXYNDvv7CBNH'
+    '7cWYFUn9Q4TnXZWBhYnz9sH7tcef7doud22HrtIwD3ehcJSmlGD5dpA5lMq3nJZ7CzZxgmFOJ/'
+    'MCuDiKHC3tAe8OYDsqfmzQAh8IEg5pZN9VZqMg8AJB9hbUFyOzvcSdlRpR36j2DpSBYsJAL40X'
+    'MnjEhIFeKgPFhIFeTp7SEJT0ErdRUVDA1CtQ+AzFYVhvhOgzoyEOsaynarywLxDSp9vwlfHynK'
+    'JBRnql/DomjPQqoemTkV6F9HEZvjHOEH0qWI6pV8gddIg+pPR23+uG9OniemO80vQpXr4J5Sch'
+    '30xOaQj035w6Lc5VPBlroU4W5+qYRO64c0UhspW4wp6B/TgZqG1cSz3mReXMoqrNaDcQeZtWaZ'
+    'jnb6rsezQZ87pOMEzG4iIZaxshhODbVslYXNizffGqhiBP++P09rjohi2xf8qxn2suJk8daaCl'
+    'H7DJsIdGnRrfhppbvmjhRKsaTJ5jcddyPdlQi1clsPKn7Cz85GhTbuWDEOMWDW1FXnyygzM12M'
+    '5idW4HOnZ3hiz2goOe7Q85/Z9I5O+N6PrWyu+Mq+sS85Zu9z2zO50nLpyiTnse/2GOTSTjV8f+'
+    'LBJh/zolOh5Xx5KL/zzFxY6m1+Erg3YbeTWf4xIXEuSWFViwU2D3m7uiF4CQ2rVQLI22SeY/Ux'
+    'u46Taz/D0dkt0g6PnLuVwLvtLxcEp8rQyStKeYmNuWTOQQYqp2C7lw39mW1TQFCSqn4Taqw0Ij'
+    '245rIWYQX4jP+9AdHEr89Qbgs+u1UCY2xVWaEU4EytKNKBNA7kU5zq5qcbS9TsfbJ7cjUzq0SX'
+    'ge8NjBMliin9tHGBOxerTnI+IXoqilHNza9vZoSmmMURWJZD8jsw+qSAjDKEUVDofsgF6zY8Hs'
+    '/ez7mACxEV1oJiBjawDGQj7YkJH/Ex9hRdXymgNqTFvaSDno3xPXAjwFFZnV8YeqFgbCJOOj3I'
+    'dCldWFogMoMTTqW643ElxlXuUzEe0EKg/e2xX1nEgpKSzabsujWlHkW17XQ0IjdQLvpHoRzimi'
+    'JNO9u3awT26iPEg3GprY5ZBj9cl3XOlFIoEV6e+GWeO1ylr9Wb5a5HjeqlY+N1eLq3zlOSaLvF'
+    'DZel411zfqfKNSWi1WazxfXsVouV41Vxr1SrXGeDpfw9a0mMmXn/PiF1vVYq3GK1Vubm6VTGAD'
+    '+mq+XDeLtQw3y4VSY9Usr2c4MPBypc54ydw061hXr2QE2R/v45U1vlmsFjYA5lfMkll/Lgiumf'
+    'UyEVurVBnP8618tW4WGqV8lW81qluVWpGTZKtmrVDKm5vF1SzogyYvfl4s13ltI18qHRaU8cqz'
+    'crFK3I+KyVeK4DK/UioSKSHnqlktFuok0PCpAOWBwVKGcdF9xhP0UYQ4+erzjEJaKz5tYBUm+W'
+    'p+M78O6WZ+TiswTKFRLW4S11BFrbFSq5v1Rr3I1yuVVaHsWrH6uVko1h7wUqUmFNaoFcHIar6e'
+    'F6SBA+rCPJ5XGjVTKM4s14vVamOLeuazsPIzaAZc5rF3VWi4UiZpyVeKlepzQkt6EBbI8GcbRY'
+    'xXSalCW3lSQw1aK9RHl4EglAiRhnLycnG9ZK4Xy4UiTVcIzTOzVpyFwcwaLTAFYfgAiDaE1GQo'
+    '8MXk84jrZoQ9ubnG86ufm8S5Wg0PqJnKXYTaChtK52EjmqMqwxMS/fTYA2pJJ27IRzl4bewjMf'
+    'iRfJSD18dWxOAJ+SgHb4xlxGBEPsrBm2M5Mage5eCtsbQYZPJRDs6MfSwGr8vH318SHcv4O7r5'
+    'Ur+9BOcOr9zRWtXiPQ8XnYhq1PpGZW73EDxUukdNaDH+znMRvBAJUCBh2upnhlhkAqjyABE9UV'
+    'Y2h3eEnqArgJICAY+0+4h4o17gxZ7X3NV9S9EkRZnoUfgciJxIxE9c2x27hwDO11EreoizLi8o'
+    'nvj+rgMM9luEqpasw4eLNOOMb1vNbxDsWqK8OLCxD8IdJWn5/qAr+qC41vEwCFQ2dm+ehSJ1PH'
+    'cHCV0Wuzu21RuKinVpvwvUdiuN4CqvWtcbXYXIa213xKsS17aJJNVtIuno0S0qLgheFekH1shg'
+    'jdpnYU781ufnl8XvC5LiPn7mFhbnlhbqi0vLd+/jN3tf/7zAPbNCBQ7dPLALqVKxJN50IH+gpJ'
+    '5etepOiOgigss9u48UwWPKql6X8+pagS8tLd2nJIn6JdR7RBHLa7bNv9TZzv7+ftaxg3bW6+/k'
+    '+u0m/aNN2eBt8NXML1k1SxfMNV58a1G/zQegHvnCMtIw0YcecWnBG46r+QV/Qx40M/smqxKX4a'
+    'IwgXwgZ4apL8q218p4M2J7uVEqzc4eu0748Mw8Joc8Lf4cTzt2QFi8dss6GOEN6sOVLAjsWR0e'
+    '7CmKh5bfDPYyXDD04I8VaS8b7BH0UxLJRUggmshIqMo+JOHSeyV85rhLi/zNuh3UDvzA7tJ03l'
+    '9zOnb9sCHWzFKxjluUtwPFxvv23GwHmtMGbph7d8Bw8xuf/4rPzMzIkdl2kG3tbyChW4Uf0q5Z'
+    '/vAhX1qc5d9xMVfy9vWU1lsuhzgIflE0+gIlnSyIOhKX/Gy4wBbxaOHej49ciI22L9y7c+fOp0'
+    'v3gEaff9VYb7jOW43l/qfzR7Fk/zhjzkj5oQqplJwwFv3MooYZYednPJjwkLo0nhsjeIQDzB5y'
+    'gDvvdYDH1p7F30hDZtXrJ1qy6XSQXY84AIVLxFIahSnfv+En3Bz7wtGsa++vDJwO8tmZWRKspj'
+    'SkSEjFzEpc9ENrylJ2xFmSXK2UoiuxhQZms9uEWfAy1MHd9+pg9K0b3WdbB8ijXS34sezPzB61'
+    'DY5DYagNzFMEfFxDCrVp9XqIsxgwXTkiK1LZaxrRE4rew7cYbngZo1XhwviXOoL/wkCsSNH7JY'
+    'uuyIxEI0eJWPpbukS/n/u2i4JkF38RtL6vf4s6ov/98re4O/E/nPf7L7PfUmJAjvz9Vy/SDNc1'
+    'tdzlbkJkdfatAzD/VveV5L3fBiLqcFE3DDc87KAoZbgghSRVEgNM1DLithIkxU38zu57cz2r1Z'
+    'KlUbDvaWy21dwV783CjMXqhLd7RqUTdBXueKr7eF9vnRG3vmpJHp/XzIIx0b/pScySUvoFMgJU'
+    '+wgN9BqkackXELbwA0qz+Ewa2VB69sGhUSZf7v964CCnyCKMyZaOdAZf1JsOBOU+NNFpaVVS44'
+    'BSqxnLD6lRh5MRG7NkAJcqPDdQ+dVRVyJFWodI9SyUlSGZbepiUhYDLVjNJhIzvo0iWNCkvbIg'
+    '1jL4P+IDi5AitnEuxX2/hgzIlmctw9OL8wufUsxcuFufX1heml9euJudX4D6pHcj9BIcBt2e5S'
+    'PDFCsFfSSWjy13QK2BhbsZ+q7l06w6QAhYtWbf6eH8kMJHkx2L06XBve2vbbqYPVkfK2cfyUOh'
+    'JMomW/zLwDNrlZo4YzOzwzMVNnyyXe8dwowlDpftzjVquZbX9HPP7O3ckJNc1W7jNLhNO7fe8b'
+    'atzuuKYMHPET+5ESJfibbMrgcvMHWgyYhjrjh6Q5mZSKP1wxstj3o5rIS1KQk9TsIv3yBmtMXO'
+    'EYHAdLYn4xqJspjrONt9qFc05rK7QbdzTTzpvYhvuu8h46KiQb0FfuvG87kb3bkbrfqNjeUbm8'
+    's3atkb7Re3srzkfGPvO758I0T6ETZignVyZ8L22GtZwlVv+eAVmtEX/ZoMVS0F4u75akb24FSU'
+    '+xo7Bff0MEdc5ayeI+yhR4U4Oclr7se4hZyawNwc47OkQ29b9L0sJWNAbwesnjgaKIF2bNfuW/'
+    'KQ6QPmhy/iVHxlbPjxyLvEGfnWUnw88oNxjt5aVodlm/Z54CZXF9qF5ZqjOQc7Pungm/o9A91b'
+    '7yko2HEVxQtw3OzAQ/Z0c19+APKD8e6s/sgjTtzqryRIkh9Uc19+APJD8iz7z4j6AiT2GxTQqX'
+    '+L8LLnzrnixd+efbh2tJSk9AXUsTE2y8tqo47b8n2sL11viEw0Bv2APnLZtfZs8RoupClQq436'
+    'SzRv4IpXaVQp6vL4qPJU6ZVR/9ghBX2gP2GJQ84fzulPWuJC7gkNCjUkTmowSuDpM7pj/7/rIz'
+    'wc')))
 _INDEX = {
     f.name: {
       'descriptor': f,
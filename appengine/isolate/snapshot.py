@@ -0,0 +1,290 @@
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Builds snapshots of the digests present in each namespace.
+
+A client archiving a mostly unchanged tree downloads the snapshot of its
+namespace once and skips the /preupload lookup of the digests it lists.
+
+Skipping /preupload also skips the tagging of the entries, so a snapshot only
+lists the entries that expire at least VALIDITY + MIN_REMAINING after the
+snapshot was started, and clients trust it for VALIDITY only. The skipped
+entries thus stay for at least MIN_REMAINING after being archived. Once an
+entry is not in the snapshot anymore, the clients look it up again, which tags
+it.
+
+The snapshot is exact, not a Bloom filter: a false positive would make a client
+skip the upload of a missing item.
+
+Only the verified entries are listed, as an unverified entry may still be
+purged. A purge also invalidates the current snapshot, see invalidate().
+
+A build walks the keys of the verified ContentEntry by descending expiration_ts
+in a chain of tasks. The digests of each namespace are saved in
+DigestSnapshotPart entities of about PART_SIZE bytes.
+"""
+
+import binascii
+import datetime
+import logging
+import time
+
+from google.appengine.datastore import datastore_query
+from google.appengine.ext import ndb
+
+from components import utils
+
+import model
+
+
+# How long a client may use a snapshot.
+VALIDITY = datetime.timedelta(days=1)
+
+
+# Minimum time an entry listed in a snapshot stays after the snapshot stopped
+# being valid.
+MIN_REMAINING = datetime.timedelta(days=7)
+
+
+# Size of the binary digests of a DigestSnapshotPart, it is exceeded by at most
+# one page of keys.
+PART_SIZE = 512*1024
+
+
+# Maximum number of parts per namespace. The entries that expire the soonest
+# are left out of larger namespaces.
+MAX_PARTS = 40
+
+
+# How long a build task runs before checkpointing and enqueuing its
+# continuation. It is well within the task queue request deadline.
+TASK_DURATION = 5*60
+
+
+# A build without progress for that long is restarted.
+STALE_DELAY = datetime.timedelta(hours=1)
+
+
+# Number of keys fetched per page.
+_PAGE_SIZE = 1000
+
+
+### Models
+
+
+class DigestSnapshot(ndb.Model):
+  """A snapshot of the digests present in all the namespaces.
+
+  Integer key id, allocated when the build starts. Parent of its
+  DigestSnapshotPart.
+  """
+  # Moment when the build started, the listed entries existed at that time.
+  created_ts = ndb.DateTimeProperty(indexed=False)
+  modified_ts = ndb.DateTimeProperty(indexed=False, auto_now=True)
+
+  # Query cursor to resume the build from, as urlsafe string.
+  cursor = ndb.StringProperty(indexed=False)
+
+  # Number of DigestSnapshotPart per namespace: {namespace: count}.
+  parts = ndb.JsonProperty(indexed=False)
+
+  # Set once all the entries were walked.
+  done = ndb.BooleanProperty(default=False, indexed=False)
+
+  @property
+  def valid_until(self):
+    return self.created_ts + VALIDITY
+
+
+class DigestSnapshotPart(ndb.Model):
+  """Concatenated binary digests of a namespace.
+
+  Key id: '<namespace>/<index>', index starting at 0. Parent is the
+  DigestSnapshot.
+  """
+  digests = ndb.BlobProperty()
+
+
+class DigestSnapshotRoot(ndb.Model):
+  """Points to the current snapshot and the one being built.
+
+  Key id: 1
+  """
+  current = ndb.IntegerProperty(indexed=False)
+  building = ndb.IntegerProperty(indexed=False)
+
+
+### Private stuff.
+
+
+def _root_key():
+  return ndb.Key(DigestSnapshotRoot, 1)
+
+
+def _part_key(snapshot_id, namespace, index):
+  return ndb.Key(
+      DigestSnapshot, snapshot_id, DigestSnapshotPart,
+      '%s/%d' % (namespace, index))
+
+
+def _checkpoint(snapshot, buffers):
+  """Saves the buffered digests as new parts along the build progress."""
+  parts = []
+  for namespace, digests in sorted(buffers.iteritems()):
+    if not digests:
+      continue
+    index = snapshot.parts.get(namespace, 0)
+    parts.append(DigestSnapshotPart(
+        key=_part_key(snapshot.key.integer_id(), namespace, index),
+        digests=''.join(digests)))
+    snapshot.parts[namespace] = index + 1
+  buffers.clear()
+  # The parts are in the entity group of the snapshot, so a retried task never
+  # saves the same digests twice.
+  ndb.transaction(lambda: ndb.put_multi(parts + [snapshot]))
+
+
+def _delete_snapshot(snapshot_id):
+  key = ndb.Key(DigestSnapshot, snapshot_id)
+  ndb.delete_multi(
+      DigestSnapshotPart.query(ancestor=key).fetch(keys_only=True) + [key])
+
+
+### Public API.
+
+
+def get_current():
+  """Returns the current DigestSnapshot if still valid, or None."""
+  root = _root_key().get()
+  if not root or not root.current:
+    return None
+  snapshot = ndb.Key(DigestSnapshot, root.current).get()
+  if not snapshot or snapshot.valid_until <= utils.utcnow():
+    return None
+  return snapshot
+
+
+def get_part(snapshot_id, namespace, index):
+  """Returns the concatenated binary digests of a part, or None."""
+  part = _part_key(snapshot_id, namespace, index).get()
+  return part.digests if part else None
+
+
+def cron_trigger():
+  """Starts a build unless one is in progress.
+
+  Returns:
+    The id of the snapshot to build, or None.
+  """
+  root = _root_key().get() or DigestSnapshotRoot(key=_root_key())
+  now = utils.utcnow()
+  if root.building:
+    building = ndb.Key(DigestSnapshot, root.building).get()
+    if building and now - building.modified_ts < STALE_DELAY:
+      logging.info('Snapshot %d is still building', root.building)
+      return None
+    logging.warning('Restarting stale snapshot %d', root.building)
+    _delete_snapshot(root.building)
+
+  snapshot_id = DigestSnapshot.allocate_ids(1)[0]
+  DigestSnapshot(id=snapshot_id, created_ts=now, parts={}).put()
+  root.building = snapshot_id
+  root.put()
+  return snapshot_id
+
+
+def invalidate():
+  """Stops using the current snapshot and restarts the one being built.
+
+  Called when entries are purged, as the snapshots may list them.
+  """
+  def tx():
+    root = _root_key().get()
+    if not root:
+      return []
+    previous = [i for i in (root.current, root.building) if i]
+    if previous:
+      root.current = None
+      root.building = None
+      root.put()
+    return previous
+  previous = ndb.transaction(tx)
+  for snapshot_id in previous:
+    _delete_snapshot(snapshot_id)
+  if previous:
+    logging.warning('Invalidated snapshots %s', previous)
+
+
+def build(snapshot_id):
+  """Continues the build of a snapshot for up to TASK_DURATION.
+
+  Returns:
+    True if the build must be continued by another task.
+  """
+  root = _root_key().get()
+  if not root or root.building != snapshot_id:
+    logging.warning('Snapshot %d is not being built anymore', snapshot_id)
+    return False
+  snapshot = ndb.Key(DigestSnapshot, snapshot_id).get()
+  if not snapshot or snapshot.done:
+    return False
+  cutoff = snapshot.created_ts + VALIDITY + MIN_REMAINING
+  q = model.ContentEntry.query(
+      model.ContentEntry.is_verified == True,
+      model.ContentEntry.expiration_ts >= cutoff).order(
+          -model.ContentEntry.expiration_ts)
+  cursor = None
+  if snapshot.cursor:
+    cursor = datastore_query.Cursor(urlsafe=snapshot.cursor)
+
+  start = time.time()
+  # {namespace: [binary digest]}
+  buffers = {}
+  buffered = 0
+  more = True
+  while more:
+    keys, cursor, more = q.fetch_page(
+        _PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    for key in keys:
+      namespace, hash_key = key.string_id().rsplit('/', 1)
+      if snapshot.parts.get(namespace, 0) >= MAX_PARTS:
+        continue
+      digest = binascii.unhexlify(hash_key)
+      buffers.setdefault(namespace, []).append(digest)
+      buffered += len(digest)
+    snapshot.cursor = cursor.urlsafe() if more and cursor else None
+    if any(len(d) * len(d[0]) >= PART_SIZE for d in buffers.itervalues()):
+      _checkpoint(snapshot, buffers)
+    if time.time() - start >= TASK_DURATION:
+      break
+
+  snapshot.done = not more
+  _checkpoint(snapshot, buffers)
+  logging.info(
+      'Snapshot %d: %d bytes of digests in %.1fs, %s', snapshot_id, buffered,
+      time.time() - start, 'done' if snapshot.done else 'continuing')
+  if not snapshot.done:
+    return True
+
+  def promote():
+    root = _root_key().get()
+    if root.building != snapshot_id:
+      return False, None
+    previous = root.current
+    root.current = snapshot_id
+    root.building = None
+    root.put()
+    return True, previous
+  promoted, previous = ndb.transaction(promote)
+  if not promoted:
+    # It was invalidated while being built.
+    logging.warning('Discarding snapshot %d', snapshot_id)
+    _delete_snapshot(snapshot_id)
+    return False
+  if previous:
+    _delete_snapshot(previous)
+  logging.info(
+      'Snapshot %d is current: %s', snapshot_id,
+      ', '.join('%s: %d parts' % i for i in sorted(snapshot.parts.iteritems())))
+  return False
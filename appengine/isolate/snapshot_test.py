@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import datetime
+import hashlib
+import logging
+import sys
+import unittest
+
+# pylint: disable=wrong-import-position
+import test_env
+test_env.setup_test_env()
+
+from test_support import test_case
+
+import model
+import snapshot
+
+
+def put_entry(namespace, content, expiration_ts=None, is_verified=True):
+  """Stores a ContentEntry and returns its binary digest."""
+  digest = hashlib.sha1(content).digest()
+  entry = model.new_content_entry(
+      model.get_entry_key(namespace, digest.encode('hex')), content=content,
+      is_verified=is_verified)
+  if expiration_ts:
+    entry.expiration_ts = expiration_ts
+  entry.put()
+  return digest
+
+
+def split(digests):
+  """Splits concatenated binary SHA-1 digests."""
+  return [digests[i:i+20] for i in xrange(0, len(digests), 20)]
+
+
+class SnapshotTest(test_case.TestCase):
+  APP_DIR = test_env.APP_DIR
+
+  def setUp(self):
+    super(SnapshotTest, self).setUp()
+    self.now = datetime.datetime(2019, 1, 2, 3, 4, 5)
+    self.mock_now(self.now)
+
+  def get_digests(self, snapshot_id, namespace):
+    parts = snapshot.get_current().parts[namespace]
+    return sorted(
+        d
+        for i in xrange(parts)
+        for d in split(snapshot.get_part(snapshot_id, namespace, i)))
+
+  def test_build(self):
+    # 2 digests per part.
+    self.mock(snapshot, 'PART_SIZE', 40)
+    self.mock(snapshot, '_PAGE_SIZE', 2)
+    default = sorted(put_entry('default', str(i)) for i in xrange(5))
+    gzip = [put_entry('default-gzip', 'a')]
+    # Expires too soon.
+    put_entry(
+        'default', 'soon',
+        self.now + snapshot.VALIDITY + datetime.timedelta(days=1))
+    # May still be purged.
+    put_entry('default', 'unverified', is_verified=False)
+
+    snapshot_id = snapshot.cron_trigger()
+    self.assertTrue(snapshot_id)
+    # A build is already in progress.
+    self.assertIsNone(snapshot.cron_trigger())
+    self.assertIsNone(snapshot.get_current())
+
+    self.assertFalse(snapshot.build(snapshot_id))
+    current = snapshot.get_current()
+    self.assertEqual(snapshot_id, current.key.integer_id())
+    # Parts are saved once they have 2 digests or more, or when the build ends.
+    parts = current.parts['default']
+    self.assertEqual(default, self.get_digests(snapshot_id, 'default'))
+    self.assertEqual(gzip, self.get_digests(snapshot_id, 'default-gzip'))
+    self.assertIsNone(snapshot.get_part(snapshot_id, 'default', parts))
+
+    # The next build replaces it.
+    self.mock(snapshot, 'TASK_DURATION', 0)
+    next_id = snapshot.cron_trigger()
+    self.assertTrue(snapshot.build(next_id))
+    self.assertEqual(snapshot_id, snapshot.get_current().key.integer_id())
+    while snapshot.build(next_id):
+      pass
+    self.assertEqual(next_id, snapshot.get_current().key.integer_id())
+    self.assertEqual(default, self.get_digests(next_id, 'default'))
+    self.assertIsNone(snapshot.get_part(snapshot_id, 'default', 0))
+
+    # It expires.
+    self.mock_now(self.now, snapshot.VALIDITY.total_seconds())
+    self.assertIsNone(snapshot.get_current())
+
+  def test_build_max_parts(self):
+    self.mock(snapshot, 'PART_SIZE', 20)
+    self.mock(snapshot, 'MAX_PARTS', 2)
+    self.mock(snapshot, '_PAGE_SIZE', 1)
+    digests = []
+    for i in xrange(4):
+      digests.append(put_entry(
+          'default', str(i), self.now + datetime.timedelta(days=10 + i)))
+    snapshot_id = snapshot.cron_trigger()
+    self.assertFalse(snapshot.build(snapshot_id))
+    self.assertEqual(2, snapshot.get_current().parts['default'])
+    # The entries that expire last are kept.
+    self.assertEqual(
+        sorted(digests[2:]), self.get_digests(snapshot_id, 'default'))
+
+  def test_invalidate(self):
+    self.mock(snapshot, 'TASK_DURATION', 0)
+    self.mock(snapshot, '_PAGE_SIZE', 1)
+    put_entry('default', 'a')
+    put_entry('default', 'b')
+    snapshot_id = snapshot.cron_trigger()
+    while snapshot.build(snapshot_id):
+      pass
+    self.assertEqual(snapshot_id, snapshot.get_current().key.integer_id())
+    next_id = snapshot.cron_trigger()
+    self.assertTrue(snapshot.build(next_id))
+
+    snapshot.invalidate()
+    self.assertIsNone(snapshot.get_current())
+    self.assertIsNone(snapshot.get_part(snapshot_id, 'default', 0))
+    # The build in progress is discarded.
+    self.assertFalse(snapshot.build(next_id))
+    self.assertIsNone(snapshot.get_current())
+    # The next cron job starts a new one.
+    self.assertTrue(snapshot.cron_trigger())
+
+  def test_cron_trigger_stale(self):
+    stale_id = snapshot.cron_trigger()
+    self.mock_now(self.now, snapshot.STALE_DELAY.total_seconds())
+    snapshot_id = snapshot.cron_trigger()
+    self.assertNotEqual(stale_id, snapshot_id)
+    self.assertFalse(snapshot.build(stale_id))
+    self.assertFalse(snapshot.build(snapshot_id))
+    self.assertEqual(snapshot_id, snapshot.get_current().key.integer_id())
+
+
+if __name__ == '__main__':
+  if '-v' in sys.argv:
+    unittest.TestCase.maxDiff = None
+    logging.basicConfig(level=logging.DEBUG)
+  else:
+    logging.basicConfig(level=logging.FATAL)
+  unittest.main()
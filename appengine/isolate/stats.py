@@ -2,22 +2,24 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
-"""Generates statistics out of logs. Contains the backend code.
+"""Generates statistics out of counters. Contains the backend code.
 
-The first 100mb of logs read is free. It's important to keep logs concise also
-for general performance concerns. Each http handler should strive to do only one
-log entry at info level per request.
+Each instance accumulates counters in memory and flushes them every second to
+sharded memcache counters, one set per minute. The cron job then sums the
+memcache counters of each minute into a _Snapshot. Counters lost to memcache
+eviction or to an instance shutting down before flushing are not recovered.
 """
 
 import datetime
 import logging
+import random
+import threading
 
 from google.appengine.api import app_identity
 from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 from components import stats_framework
-from components.stats_framework import stats_logs
 from components import net
 from components import utils
 
@@ -70,57 +72,85 @@ class BqStateStats(ndb.Model):
 ### Utility
 
 
-# Text to store for the corresponding actions.
+# Text to log for the corresponding actions.
 _ACTION_NAMES = ['store', 'return', 'lookup', 'dupe']
 
 
-def _parse_line(line, values):
-  """Updates a _Snapshot instance with a processed statistics line if relevant.
-  """
-  if line.count(';') < 2:
-    return False
-  action_id, measurement, _rest = line.split('; ', 2)
-  action = _ACTION_NAMES.index(action_id)
-  measurement = int(measurement)
+# _Snapshot properties accumulated as counters.
+_COUNTERS = (
+  'uploads', 'uploads_bytes', 'downloads', 'downloads_bytes',
+  'contains_requests', 'contains_lookups', 'requests', 'failures',
+)
 
-  if action == STORE:
-    values.uploads += 1
-    values.uploads_bytes += measurement
-    return True
-  elif action == RETURN:
-    values.downloads += 1
-    values.downloads_bytes += measurement
-    return True
-  elif action == LOOKUP:
-    values.contains_requests += 1
-    values.contains_lookups += measurement
-    return True
-  elif action == DUPE:
-    return True
-  else:
-    return False
+
+# Number of memcache counters per property and minute. Each flush increments
+# one of them, so concurrent flushes of many instances don't contend.
+_COUNTER_SHARDS = 16
+
+
+# Minutes are processed once the flushes of all instances are done.
+_PROCESS_DELAY = 2
+
+
+_MEMCACHE_NAMESPACE = 'stats_counters'
 
 
-def _extract_snapshot_from_logs(start_time, end_time):
-  """Returns a _Snapshot from the processed logs for the specified interval.
+def _counter_key(minute, name, shard):
+  """Returns the memcache key of a counter."""
+  return '%s/%s/%d' % (minute.strftime('%Y-%m-%dT%H:%M'), name, shard)
 
-  The data is retrieved from logservice via stats_framework.
+
+class _Counters(object):
+  """Accumulates counters per minute in memory and flushes them to memcache.
+
+  They are flushed at the end of each request by count_requests().
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    # {minute: {name: value}}
+    self._pending = {}
+
+  def add(self, **values):
+    minute = utils.utcnow().replace(second=0, microsecond=0)
+    with self._lock:
+      counters = self._pending.setdefault(minute, {})
+      for name, value in values.iteritems():
+        counters[name] = counters.get(name, 0) + value
+
+  def flush(self):
+    """Adds the accumulated counters to the memcache counters."""
+    with self._lock:
+      pending = self._pending
+      self._pending = {}
+    shard = random.randrange(_COUNTER_SHARDS)
+    mapping = {
+      _counter_key(minute, name, shard): value
+      for minute, counters in pending.iteritems()
+      for name, value in counters.iteritems() if value
+    }
+    if mapping:
+      memcache.offset_multi(
+          mapping, namespace=_MEMCACHE_NAMESPACE, initial_value=0)
+
+
+_counters = _Counters()
+
+
+def _extract_snapshot_from_counters(start_time, _end_time):
+  """Returns a _Snapshot from the memcache counters of the specified minute.
+
+  Used by stats_framework.
   """
+  minute = datetime.datetime.utcfromtimestamp(start_time)
+  keys = {
+    _counter_key(minute, name, shard): name
+    for name in _COUNTERS for shard in xrange(_COUNTER_SHARDS)
+  }
   values = _Snapshot()
-  total_lines = 0
-  parse_errors = 0
-  for entry in stats_logs.yield_entries(start_time, end_time):
-    values.requests += 1
-    if entry.request.status >= 400:
-      values.failures += 1
-    for l in entry.entries:
-      if _parse_line(l, values):
-        total_lines += 1
-      else:
-        parse_errors += 1
-  logging.debug(
-      '_extract_snapshot_from_logs(%s, %s): %d lines, %d errors',
-      start_time, end_time, total_lines, parse_errors)
+  for key, value in memcache.get_multi(
+      keys.keys(), namespace=_MEMCACHE_NAMESPACE).iteritems():
+    name = keys[key]
+    setattr(values, name, getattr(values, name) + value)
   return values
 
 
@@ -177,7 +207,7 @@ def _send_to_bq(snapshots):
 
 
 STATS_HANDLER = stats_framework.StatisticsFramework(
-    'global_stats', _Snapshot, _extract_snapshot_from_logs)
+    'global_stats', _Snapshot, _extract_snapshot_from_counters)
 
 
 # Action to log.
@@ -185,12 +215,32 @@ STORE, RETURN, LOOKUP, DUPE = range(4)
 
 
 def add_entry(action, number, where):
-  """Formatted statistics log entry so it can be processed for daily stats.
+  """Accumulates a statistics entry in the counters of the current minute."""
+  logging.debug('%s; %d; %s', _ACTION_NAMES[action], number, where)
+  if action == STORE:
+    _counters.add(uploads=1, uploads_bytes=number)
+  elif action == RETURN:
+    _counters.add(downloads=1, downloads_bytes=number)
+  elif action == LOOKUP:
+    _counters.add(contains_requests=1, contains_lookups=number)
+
+
+def count_requests(app):
+  """Wraps a WSGI application to count its requests and failures.
 
-  The format is simple enough that it doesn't require a regexp for faster
-  processing.
+  The counters accumulated while serving the request are flushed once it is
+  done, so an instance never holds any after its last request.
   """
-  stats_logs.add_entry('%s; %d; %s' % (_ACTION_NAMES[action], number, where))
+  def wrapped(environ, start_response):
+    def counting_start_response(status, headers, exc_info=None):
+      failed = int(status.split(' ', 1)[0]) >= 400
+      _counters.add(requests=1, failures=int(failed))
+      return start_response(status, headers, exc_info)
+    try:
+      return app(environ, counting_start_response)
+    finally:
+      _counters.flush()
+  return wrapped
 
 
 def snapshot_to_proto(s, out):
@@ -209,7 +259,7 @@ def snapshot_to_proto(s, out):
 
 def cron_generate_stats():
   """Returns the number of minutes processed."""
-  return STATS_HANDLER.process_next_chunk(stats_framework.TOO_RECENT)
+  return STATS_HANDLER.process_next_chunk(_PROCESS_DELAY)
 
 
 def cron_send_to_bq():
@@ -3,6 +3,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import calendar
 import datetime
 import logging
 import sys
@@ -16,7 +17,6 @@ import webapp2
 import webtest
 
 from components import stats_framework
-from components.stats_framework import stats_logs
 from test_support import stats_framework_logs_mock
 from test_support import test_case
 
@@ -68,9 +68,11 @@ class StatsTest(test_case.TestCase):
         ('/dupe', Dupe),
     ]
     self.app = webtest.TestApp(
-        webapp2.WSGIApplication(fake_routes, debug=True),
+        stats.count_requests(webapp2.WSGIApplication(fake_routes, debug=True)),
         extra_environ={'REMOTE_ADDR': 'fake-ip'})
-    stats_framework_logs_mock.configure(self)
+    # Flush the counters to memcache right away.
+    self.mock(stats, '_FLUSH_INTERVAL', 0.)
+    self.mock(stats, '_counters', stats._Counters())
     self.now = datetime.datetime(2010, 1, 2, 3, 4, 5, 6)
     self.mock_now(self.now, 0)
 
@@ -88,9 +90,8 @@ class StatsTest(test_case.TestCase):
     stats_framework_logs_mock.reset_timestamp(stats.STATS_HANDLER, self.now)
 
     self.assertEqual('Yay', self.app.get(url).body)
-    self.assertEqual(1, len(list(stats_logs.yield_entries(None, None))))
 
-    self.mock_now(self.now, 60)
+    self.mock_now(self.now, 120)
     self.assertEqual(10, stats.cron_generate_stats())
 
     actual = stats_framework.get_stats(
@@ -140,6 +141,35 @@ class StatsTest(test_case.TestCase):
     # Tested by other test cases.
     pass
 
+  def test_count_requests(self):
+    stats_framework_logs_mock.reset_timestamp(stats.STATS_HANDLER, self.now)
+    self.app.get('/unknown', status=404)
+    self.mock_now(self.now, 120)
+    self.assertEqual(10, stats.cron_generate_stats())
+    actual = stats_framework.get_stats(
+        stats.STATS_HANDLER, 'minutes', self.now, 1, True)
+    self.assertEqual(1, actual[0]['requests'])
+    self.assertEqual(1, actual[0]['failures'])
+
+  def test_counters_flush(self):
+    counters = stats._Counters()
+    minute = datetime.datetime(2010, 1, 2, 3, 4)
+    def get(moment):
+      return stats._extract_snapshot_from_counters(
+          calendar.timegm(moment.timetuple()), None).uploads
+
+    # They are buffered until flushed.
+    counters.add(uploads=1)
+    counters.add(uploads=2)
+    self.assertEqual(0, get(minute))
+    self.mock_now(self.now, 60)
+    counters.add(uploads=4)
+    counters.flush()
+    self.assertEqual(3, get(minute))
+    self.assertEqual(4, get(minute + datetime.timedelta(minutes=1)))
+    counters.flush()
+    self.assertEqual(3, get(minute))
+
   def test_snapshot_to_proto(self):
     s = stats.STATS_HANDLER.stats_minute_cls(
         key=stats.STATS_HANDLER.minute_key(self.now),
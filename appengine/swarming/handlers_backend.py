@@ -24,6 +24,7 @@ from server import lease_management
 from server import named_caches
 from server import stats_bots
 from server import stats_tasks
+from server import task_cancel
 from server import task_queues
 from server import task_request
 from server import task_result
@@ -234,13 +235,31 @@ class CancelTasksHandler(webapp2.RequestHandler):
     ndb.get_context().set_cache_policy(lambda _: False)
     payload = json.loads(self.request.body)
     logging.info('Cancelling tasks with ids: %s', payload['tasks'])
-    kill_running = payload['kill_running']
-    # TODO(maruel): Parallelize.
-    for task_id in payload['tasks']:
-      ok, was_running = task_scheduler.cancel_task_with_id(
-          task_id, kill_running, None)
-      logging.info('task %s canceled: %s was running: %s',
-                   task_id, ok, was_running)
+    canceled, skipped = task_scheduler.cancel_tasks(
+        payload['tasks'], payload['kill_running'])
+    logging.info('%d tasks canceled, %d skipped', canceled, skipped)
+
+
+class TaskCancelBatchPartition(webapp2.RequestHandler):
+  """Splits the tasks of a batch cancellation in shards."""
+
+  @decorators.require_taskqueue('cancel-tasks-batch')
+  def post(self, batch_id):
+    ndb.get_context().set_cache_policy(lambda _: False)
+    if not task_cancel.task_partition(batch_id):
+      # The task needs to be retried to resume where it stopped.
+      self.response.set_status(503)
+
+
+class TaskCancelBatchShard(webapp2.RequestHandler):
+  """Cancels the tasks of a shard of a batch cancellation."""
+
+  @decorators.require_taskqueue('cancel-tasks-batch')
+  def post(self, batch_id, index):
+    ndb.get_context().set_cache_policy(lambda _: False)
+    if not task_cancel.task_cancel_shard(batch_id, int(index)):
+      # The task needs to be retried to resume where it stopped.
+      self.response.set_status(503)
 
 
 class CancelTaskOnBotHandler(webapp2.RequestHandler):
@@ -326,6 +345,26 @@ class TaskMachineProviderManagementHandler(webapp2.RequestHandler):
     lease_management.task_manage_lease(key)
 
 
+class TaskSendToBQCatchUp(webapp2.RequestHandler):
+  """Streams a time shard of a BigQuery export backlog."""
+
+  @decorators.require_taskqueue('bq-catch-up')
+  def post(self, table_name):
+    ndb.get_context().set_cache_policy(lambda _: False)
+    fn = {
+      'bot_events': bot_management.task_send_to_bq,
+      'task_requests': task_request.task_send_to_bq,
+      'task_results': task_result.task_send_to_bq,
+    }.get(table_name)
+    if not fn:
+      logging.error('Unknown table %s', table_name)
+      return
+    params = json.loads(self.request.body)
+    if not fn(params['start'], params['end']):
+      # The task needs to be retried to resume where it stopped.
+      self.response.set_status(503)
+
+
 class TaskNamedCachesPool(webapp2.RequestHandler):
   """Update named caches cache for a pool."""
 
@@ -409,6 +448,11 @@ def get_routes():
 
     # Task queues.
     ('/internal/taskqueue/cancel-tasks', CancelTasksHandler),
+    (r'/internal/taskqueue/cancel-tasks-batch/<batch_id:[0-9]+>',
+        TaskCancelBatchPartition),
+    (r'/internal/taskqueue/cancel-tasks-batch/<batch_id:[0-9]+>/'
+        r'<index:[0-9]+>',
+        TaskCancelBatchShard),
     ('/internal/taskqueue/cancel-task-on-bot', CancelTaskOnBotHandler),
     ('/internal/taskqueue/delete-tasks', DeleteTasksHandler),
     ('/internal/taskqueue/rebuild-task-cache', TaskDimensionsHandler),
@@ -417,6 +461,8 @@ def get_routes():
     ('/internal/taskqueue/machine-provider-manage',
         TaskMachineProviderManagementHandler),
     (r'/internal/taskqueue/update_named_cache', TaskNamedCachesPool),
+    (r'/internal/taskqueue/bq-catch-up/<table_name:[a-z_]+>',
+        TaskSendToBQCatchUp),
     (r'/internal/taskqueue/tsmon/<kind:[0-9A-Za-z_]+>', TaskGlobalMetrics),
 
     # Mapreduce related urls.
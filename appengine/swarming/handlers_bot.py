@@ -7,6 +7,7 @@
 import base64
 import json
 import logging
+import zlib
 
 import webob
 import webapp2
@@ -17,6 +18,7 @@ from google.appengine import runtime
 
 from components import auth
 from components import ereporter2
+from components import rpc_accounting
 from components import utils
 from server import acl
 from server import bot_auth
@@ -886,9 +888,20 @@ class BotTaskUpdateHandler(_BotApiHandler):
   ACCEPTED_KEYS = {
     u'bot_overhead', u'cipd_pins', u'cipd_stats', u'cost_usd', u'duration',
     u'exit_code', u'hard_timeout', u'id', u'io_timeout', u'isolated_stats',
-    u'output', u'output_chunk_start', u'outputs_ref', u'task_id',
+    u'output', u'output_chunk_start', u'output_encoding', u'outputs_ref',
+    u'task_id',
   }
   REQUIRED_KEYS = {u'id', u'task_id'}
+  # When the datastore RPCs of an update take more than this many seconds,
+  # the bot is asked to space its updates by UPDATE_INTERVAL_HINT seconds.
+  SLOW_UPDATE_SECS = 1.
+  UPDATE_INTERVAL_HINT = 30
+  # Encodings of the output accepted, advertised in the response so the bot
+  # only compresses when talking to a server that supports it.
+  OUTPUT_ENCODINGS = [u'zlib']
+  # Maximum size of the decompressed output of an update. The bot sends about
+  # 100kb at a time, this protects against a compression bomb.
+  MAX_DECOMPRESSED_OUTPUT = 1024*1024
 
   @auth.public  # auth happens in bot_auth.validate_bot_id_and_fetch_config()
   def post(self, task_id=None):
@@ -924,6 +937,7 @@ class BotTaskUpdateHandler(_BotApiHandler):
     isolated_stats = request.get('isolated_stats')
     output = request.get('output')
     output_chunk_start = request.get('output_chunk_start')
+    output_encoding = request.get('output_encoding')
     outputs_ref = request.get('outputs_ref')
 
     if (isolated_stats or cipd_stats) and bot_overhead is None:
@@ -975,6 +989,23 @@ class BotTaskUpdateHandler(_BotApiHandler):
         # and returning a HTTP 500 would only force the bot to stay in a retry
         # loop.
         logging.error('Failed to decode output\n%s\n%r', e, output)
+      # Like above, the output is dropped on error instead of forcing the bot
+      # in a retry loop.
+      if output_encoding == 'zlib':
+        decompressor = zlib.decompressobj()
+        try:
+          output = decompressor.decompress(
+              output, self.MAX_DECOMPRESSED_OUTPUT)
+          if decompressor.unconsumed_tail:
+            logging.error(
+                'Decompressed output is larger than %d bytes, truncated',
+                self.MAX_DECOMPRESSED_OUTPUT)
+        except zlib.error as e:
+          logging.error('Failed to decompress output\n%s', e)
+          output = None
+      elif output_encoding:
+        logging.error('Unknown output_encoding: %s', output_encoding)
+        output = None
     if outputs_ref:
       outputs_ref = task_request.FilesRef(**outputs_ref)
 
@@ -1046,7 +1077,16 @@ class BotTaskUpdateHandler(_BotApiHandler):
     # - KILLED is when the client uses the kill API to forcibly stop a running
     #   task.
     must_stop = state in (task_result.State.BOT_DIED, task_result.State.KILLED)
-    self.send_response({'must_stop': must_stop, 'ok': True})
+    out = {
+      'must_stop': must_stop,
+      'ok': True,
+      'output_encodings': self.OUTPUT_ENCODINGS,
+    }
+    stats = rpc_accounting.get_current()
+    if stats and stats.wall > self.SLOW_UPDATE_SECS:
+      # The datastore is struggling, ask the bot to back off.
+      out['update_interval'] = self.UPDATE_INTERVAL_HINT
+    self.send_response(out)
 
 
 class BotTaskErrorHandler(_BotApiHandler):
@@ -13,6 +13,7 @@ import StringIO
 import sys
 import unittest
 import zipfile
+import zlib
 
 # Setups environment.
 import test_env_handlers
@@ -26,6 +27,7 @@ import webtest
 import handlers_bot
 from components import auth
 from components import ereporter2
+from components import rpc_accounting
 from components import utils
 from server import bot_archive
 from server import bot_auth
@@ -33,6 +35,7 @@ from server import bot_code
 from server import bot_groups_config
 from server import bot_management
 from server import service_accounts
+from server import task_pack
 from server import task_queues
 
 
@@ -709,7 +712,9 @@ class BotApiTest(test_env_handlers.AppTestBase):
       'task_id': task_id,
     }
     response = self.post_json('/swarming/api/v1/bot/task_update', params)
-    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
 
     response = self.client_get_results(task_id)
     expected = self.gen_run_result(
@@ -1029,7 +1034,13 @@ class BotApiTest(test_env_handlers.AppTestBase):
 
     def _cycle(params, expected, must_stop):
       response = self.post_json('/swarming/api/v1/bot/task_update', params)
-      self.assertEqual({u'must_stop': must_stop, u'ok': True}, response)
+      self.assertEqual(
+          {
+            u'must_stop': must_stop,
+            u'ok': True,
+            u'output_encodings': [u'zlib'],
+          },
+          response)
       self.assertEqual(expected, self.client_get_results(task_id))
 
     # 1. Initial task update with no data.
@@ -1038,7 +1049,9 @@ class BotApiTest(test_env_handlers.AppTestBase):
     task_id = response['manifest']['task_id']
     params = _params()
     response = self.post_json('/swarming/api/v1/bot/task_update', params)
-    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
     response = self.client_get_results(task_id)
     expected = self.gen_run_result(
         costs_usd=[0.1],
@@ -1071,6 +1084,60 @@ class BotApiTest(test_env_handlers.AppTestBase):
         state=u'COMPLETED')
     _cycle(params, expected, False)
 
+  def test_task_update_compressed_output(self):
+    params = self.do_handshake()
+    self.set_as_user()
+    self.client_create_task_raw()
+    self.set_as_bot()
+    task_id = self.post_json(
+        '/swarming/api/v1/bot/poll', params)['manifest']['task_id']
+    params = {
+      'cost_usd': 0.1,
+      'id': 'bot1',
+      'output': base64.b64encode(zlib.compress('Oh hi')),
+      'output_chunk_start': 0,
+      'output_encoding': 'zlib',
+      'task_id': task_id,
+    }
+    response = self.post_json('/swarming/api/v1/bot/task_update', params)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
+    run_result = task_pack.unpack_run_result_key(task_id).get()
+    self.assertEqual('Oh hi', run_result.get_output())
+
+    # Unknown encodings and corrupted data are logged and dropped.
+    self.mock(handlers_bot.logging, 'error', lambda *_: None)
+    params['output_chunk_start'] = 5
+    params['output_encoding'] = 'bz2'
+    self.post_json('/swarming/api/v1/bot/task_update', params)
+    params['output_encoding'] = 'zlib'
+    params['output'] = base64.b64encode('garbage')
+    self.post_json('/swarming/api/v1/bot/task_update', params)
+    self.assertEqual('Oh hi', run_result.key.get().get_output())
+
+    # The decompressed size is capped.
+    self.mock(handlers_bot.BotTaskUpdateHandler, 'MAX_DECOMPRESSED_OUTPUT', 2)
+    params['output'] = base64.b64encode(zlib.compress('Oh hi'))
+    self.post_json('/swarming/api/v1/bot/task_update', params)
+    self.assertEqual('Oh hiOh', run_result.key.get().get_output())
+
+    # A slow datastore asks the bot to back off.
+    stats = rpc_accounting.RequestStats(False)
+    stats.rpcs[('datastore_v3', 'Put', 'TaskOutputChunk')] = (
+        rpc_accounting.RpcStats())
+    stats.rpcs[('datastore_v3', 'Put', 'TaskOutputChunk')].wall = 2.
+    self.mock(rpc_accounting, 'get_current', lambda: stats)
+    response = self.post_json('/swarming/api/v1/bot/task_update', params)
+    self.assertEqual(
+        {
+          u'must_stop': False,
+          u'ok': True,
+          u'output_encodings': [u'zlib'],
+          u'update_interval': 30,
+        },
+        response)
+
   def test_task_update_db_failure(self):
     # The error is caught in task_scheduler.bot_update_task().
     self.set_as_bot()
@@ -1242,7 +1309,9 @@ class BotApiTest(test_env_handlers.AppTestBase):
     self.assertEqual(expected, response)
 
     response = self.bot_complete_task(task_id=task_id)
-    self.assertEqual({u'must_stop': True, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': True, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
 
     expected = self.gen_run_result(
         abandoned_ts=fmtdate(self.now),
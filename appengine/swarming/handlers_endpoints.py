@@ -15,6 +15,7 @@ from google.appengine.ext import ndb
 
 import endpoints
 import gae_ts_mon
+import webapp2
 from protorpc import messages
 from protorpc import message_types
 from protorpc import protojson
@@ -25,6 +26,7 @@ from components import datastore_utils
 from components import endpoints_webapp2
 from components import machine_provider
 from components import utils
+from components.endpoints_webapp2 import partial
 
 import message_conversion
 import swarming_rpcs
@@ -35,6 +37,7 @@ from server import config
 from server import pools_config
 from server import lease_management
 from server import service_accounts
+from server import task_cancel
 from server import task_pack
 from server import task_queues
 from server import task_request
@@ -51,6 +54,11 @@ _EDIT = object()
 _VIEW = object()
 
 
+# Maximum number of task IDs accepted by tasks/get_results, so the GET query
+# string stays within the URL length limits.
+_MAX_BATCH_RESULTS = 100
+
+
 # Add support for BooleanField in protorpc in endpoints GET requests.
 _old_decode_field = protojson.ProtoJson.decode_field
 def _decode_field(self, field, value):
@@ -61,6 +69,27 @@ def _decode_field(self, field, value):
 protojson.ProtoJson.decode_field = _decode_field
 
 
+def _get_items_fields():
+  """Returns the fields of the listed items kept by the 'fields' partial
+  response mask of the current request, or None if all of them are kept.
+
+  The mask itself is applied by endpoints_webapp2 on the encoded response; this
+  is only used to skip the conversion of the fields that are masked away.
+  """
+  try:
+    fields = webapp2.get_request().get('fields')
+  except AssertionError:
+    # Not served through webapp2.
+    return None
+  if not fields:
+    return None
+  try:
+    return partial.subfields(fields, 'items')
+  except partial.ParsingError:
+    # endpoints_webapp2 ignores an invalid mask too.
+    return None
+
+
 def _to_keys(task_id):
   """Returns request and result keys, handling failure."""
   try:
@@ -92,6 +121,30 @@ def _get_task_request_async(task_id, request_key, viewing):
   raise ndb.Return(request)
 
 
+def _trim_partial_utf8(data):
+  """Returns data without the partial UTF-8 character it may end with.
+
+  The data is returned as is if it only holds a partial character, so a caller
+  paging through it always progresses.
+  """
+  # A UTF-8 character is at most 4 bytes long, look for its leading byte.
+  for i in xrange(len(data) - 1, max(len(data) - 4, 0), -1):
+    c = ord(data[i])
+    if c & 0xC0 == 0x80:
+      # Continuation byte.
+      continue
+    if c >= 0xF0:
+      size = 4
+    elif c >= 0xE0:
+      size = 3
+    elif c >= 0xC0:
+      size = 2
+    else:
+      size = 1
+    return data[:i] if i + size > len(data) else data
+  return data
+
+
 def _get_request_and_result(task_id, viewing, trust_memcache):
   """Returns the TaskRequest and task result corresponding to a task ID.
 
@@ -311,6 +364,13 @@ TaskIdWithPerf = endpoints.ResourceContainer(
     include_performance_stats=messages.BooleanField(2, default=False))
 
 
+TaskIdWithOffset = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    task_id=messages.StringField(1, required=True),
+    offset=messages.IntegerField(2, default=0),
+    length=messages.IntegerField(3, default=0))
+
+
 TaskCancel = endpoints.ResourceContainer(
     swarming_rpcs.TaskCancelRequest,
     task_id=messages.StringField(1, required=True))
@@ -384,24 +444,40 @@ class SwarmingTaskService(remote.Service):
 
   @gae_ts_mon.instrument_endpoint()
   @auth.endpoints_method(
-      TaskId, swarming_rpcs.TaskOutput,
+      TaskIdWithOffset, swarming_rpcs.TaskOutput,
       name='stdout',
       path='{task_id}/stdout',
       http_method='GET')
   @auth.require(acl.can_access)
   def stdout(self, request):
-    """Returns the output of the task corresponding to a task ID."""
+    """Returns the output of the task corresponding to a task ID.
+
+    offset and length select a byte range of the output. Use next_offset as the
+    offset of the following call to page through large outputs or to tail a
+    running task.
+    """
     # TODO(maruel): Add streaming. Real streaming is not supported by AppEngine
-    # v1.
+    # v1. /task/<task_id>/stdout on the frontend returns the raw output.
     # TODO(maruel): Send as raw content instead of encoded. This is not
     # supported by cloud endpoints.
     logging.debug('%s', request)
+    if request.offset < 0 or request.length < 0:
+      raise endpoints.BadRequestException('offset and length must be positive')
     # The result must be fetched to know the right run_result_key to use.
     _, result = _get_request_and_result(request.task_id, _VIEW, True)
-    output = result.get_output()
-    if output:
-      output = output.decode('utf-8', 'replace')
-    return swarming_rpcs.TaskOutput(output=output)
+    length = min(
+        request.length or task_result.TaskOutput.FETCH_MAX_CONTENT,
+        task_result.TaskOutput.FETCH_MAX_CONTENT)
+    output = result.get_output(request.offset, length)
+    if not output:
+      return swarming_rpcs.TaskOutput()
+    if len(output) == length:
+      # Do not split a character at the end of the page, next_offset points to
+      # its first byte instead.
+      output = _trim_partial_utf8(output)
+    return swarming_rpcs.TaskOutput(
+        output=output.decode('utf-8', 'replace'),
+        next_offset=request.offset + len(output))
 
 
 TasksRequest = endpoints.ResourceContainer(
@@ -426,6 +502,18 @@ TaskStatesRequest = endpoints.ResourceContainer(
     task_id=messages.StringField(1, repeated=True))
 
 
+TaskResultsRequest = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    task_id=messages.StringField(1, repeated=True),
+    include_performance_stats=messages.BooleanField(2, default=False),
+    include_outputs_ref=messages.BooleanField(3, default=True))
+
+
+TasksCancelBatchId = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    batch_id=messages.StringField(1, required=True))
+
+
 TasksCountRequest = endpoints.ResourceContainer(
     message_types.VoidMessage,
     end=messages.FloatField(3),
@@ -541,8 +629,12 @@ class SwarmingTasksService(remote.Service):
     logging.debug('%s', request)
     now = utils.utcnow()
     try:
-      items, cursor = datastore_utils.fetch_page(
-          self._query_from_request(request), request.limit, request.cursor)
+      # Only scan the index, then fetch the entities by key so recently updated
+      # ones are served from memcache.
+      keys, cursor = datastore_utils.fetch_page(
+          self._query_from_request(request), request.limit, request.cursor,
+          keys_only=True)
+      items = [i for i in ndb.get_multi(keys, use_cache=False) if i]
     except ValueError as e:
       raise endpoints.BadRequestException(
           'Inappropriate filter for tasks/list: %s' % e)
@@ -556,11 +648,8 @@ class SwarmingTasksService(remote.Service):
           'This combination is unsupported, sorry.')
     return swarming_rpcs.TaskList(
         cursor=cursor,
-        items=[
-          message_conversion.task_result_to_rpc(
-              i, request.include_performance_stats)
-          for i in items
-        ],
+        items=message_conversion.task_results_to_rpc(
+            items, request.include_performance_stats, _get_items_fields()),
         now=now)
 
   @gae_ts_mon.instrument_endpoint()
@@ -597,6 +686,51 @@ class SwarmingTasksService(remote.Service):
     return swarming_rpcs.TaskStates(
         states=[swarming_rpcs.TaskState(state) for state in states])
 
+  @gae_ts_mon.instrument_endpoint()
+  @auth.endpoints_method(
+      TaskResultsRequest, swarming_rpcs.TaskResultsBatch,
+      http_method='GET')
+  @auth.require(acl.can_access)
+  def get_results(self, request):
+    """Returns the results of a specific set of tasks.
+
+    It is the batched version of task/<task_id>/result, for up to 100 task IDs.
+    Results are returned in the same order as the task IDs; the task IDs that
+    do not exist or that the caller cannot view are returned in not_found
+    instead.
+    """
+    # TODO(maruel): Expose it over pRPC once the task APIs are, swarming.proto
+    # only defines the BotAPI service for now.
+    logging.debug('%s', request)
+    if len(request.task_id) > _MAX_BATCH_RESULTS:
+      raise endpoints.BadRequestException(
+          'At most %d task IDs can be requested' % _MAX_BATCH_RESULTS)
+    now = utils.utcnow()
+    keys = [_to_keys(task_id) for task_id in request.task_id]
+    # Skip memcache for the same reason as in SwarmingTaskService.result: a
+    # stale copy could otherwise be returned indefinitely.
+    entities = ndb.get_multi(
+        [result_key for _, result_key in keys],
+        use_cache=False, use_memcache=False)
+    if not acl.can_view_all_tasks():
+      # The TaskRequest enforces the ACL. It is immutable so memcache is fine.
+      requests = ndb.get_multi([request_key for request_key, _ in keys])
+      entities = [
+        e if r and acl.can_view_task(r) else None
+        for e, r in zip(entities, requests)
+      ]
+    return swarming_rpcs.TaskResultsBatch(
+        items=[
+          message_conversion.task_result_to_rpc(
+              e, request.include_performance_stats,
+              request.include_outputs_ref)
+          for e in entities if e
+        ],
+        not_found=[
+          task_id for task_id, e in zip(request.task_id, entities) if not e
+        ],
+        now=now)
+
   @gae_ts_mon.instrument_endpoint()
   @auth.endpoints_method(
       TasksRequest, swarming_rpcs.TaskRequests,
@@ -686,6 +820,55 @@ class SwarmingTasksService(remote.Service):
         matched=len(tasks),
         now=now)
 
+  @gae_ts_mon.instrument_endpoint()
+  @auth.endpoints_method(
+      swarming_rpcs.TasksCancelBatchRequest,
+      swarming_rpcs.TasksCancelBatchResponse,
+      http_method='POST')
+  @auth.require(acl.can_edit_all_tasks)
+  def cancel_batch(self, request):
+    """Cancels all the pending tasks matching the tags.
+
+    Unlike 'cancel', the matching tasks are found and canceled in parallel by
+    the server. Use 'cancel_batch_status' to poll the progress.
+    """
+    logging.debug('%s', request)
+    if not request.tags:
+      # Prevent accidental cancellation of everything.
+      raise endpoints.BadRequestException(
+          'You must specify tags when cancelling multiple tasks.')
+    now = utils.utcnow()
+    batch_id = task_cancel.start(request.tags, request.kill_running or False)
+    if not batch_id:
+      raise endpoints.InternalServerErrorException(
+          'Could not enqueue cancel request, try again later')
+    return swarming_rpcs.TasksCancelBatchResponse(batch_id=batch_id, now=now)
+
+  @gae_ts_mon.instrument_endpoint()
+  @auth.endpoints_method(
+      TasksCancelBatchId, swarming_rpcs.TasksCancelBatchStatus,
+      http_method='GET')
+  @auth.require(acl.can_edit_all_tasks)
+  def cancel_batch_status(self, request):
+    """Returns the progress of a batch cancellation started by 'cancel_batch'.
+    """
+    logging.debug('%s', request)
+    progress = task_cancel.get_progress(request.batch_id)
+    if not progress:
+      raise endpoints.NotFoundException('%s not found.' % request.batch_id)
+    return swarming_rpcs.TasksCancelBatchStatus(
+        batch_id=request.batch_id,
+        tags=progress.batch.tags,
+        kill_running=progress.batch.kill_running,
+        created_ts=progress.batch.created_ts,
+        matched=progress.matched,
+        shards=progress.shards,
+        shards_done=progress.shards_done,
+        canceled=progress.canceled,
+        skipped=progress.skipped,
+        done=progress.done,
+        now=utils.utcnow())
+
   @gae_ts_mon.instrument_endpoint()
   @auth.endpoints_method(
       TasksCountRequest, swarming_rpcs.TasksCount,
@@ -703,7 +886,11 @@ class SwarmingTasksService(remote.Service):
       return swarming_rpcs.TasksCount(count=count, now=now)
 
     try:
-      count = self._query_from_request(request, 'created_ts').count()
+      count = task_result.get_result_summaries_count(
+          message_conversion.epoch_to_datetime(request.start),
+          message_conversion.epoch_to_datetime(request.end),
+          request.state.name.lower(),
+          request.tags)
       memcache.add(mem_key, count, 24*60*60, namespace='tasks_count')
     except ValueError as e:
       raise endpoints.BadRequestException(
@@ -1011,11 +1198,8 @@ class SwarmingBotService(remote.Service):
           'Inappropriate filter for bot.tasks: %s' % e)
     return swarming_rpcs.BotTasks(
         cursor=cursor,
-        items=[
-          message_conversion.task_result_to_rpc(
-              r, request.include_performance_stats)
-          for r in items
-        ],
+        items=message_conversion.task_results_to_rpc(
+            items, request.include_performance_stats, _get_items_fields()),
         now=now)
 
 
@@ -1077,7 +1261,7 @@ class SwarmingBotsService(remote.Service):
     return swarming_rpcs.BotList(
         cursor=cursor,
         death_timeout=config.settings().bot_death_timeout_secs,
-        items=[message_conversion.bot_info_to_rpc(bot) for bot in bots],
+        items=message_conversion.bot_infos_to_rpc(bots, _get_items_fields()),
         now=now)
 
   @gae_ts_mon.instrument_endpoint()
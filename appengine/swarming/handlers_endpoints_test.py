@@ -11,6 +11,7 @@ import logging
 import os
 import random
 import sys
+import time
 import unittest
 
 import test_env_handlers
@@ -27,6 +28,7 @@ from components import utils
 
 import handlers_bot
 import handlers_endpoints
+import message_conversion
 import swarming_rpcs
 
 from server import acl
@@ -35,6 +37,7 @@ from server import bot_management
 from server import config
 from server import large
 from server import lease_management
+from server import task_cancel
 from server import task_pack
 from server import task_queues
 from server import task_request
@@ -72,6 +75,8 @@ class BaseTest(test_env_handlers.AppTestBase, test_case.EndpointsTestCase):
     self.mock(utils, 'enqueue_task', self._enqueue_task)
     self.now = datetime.datetime(2010, 1, 2, 3, 4, 5)
     self.mock_now(self.now)
+    self.mock(
+        message_conversion, '_ROWS_CACHE', message_conversion._RowsCache())
 
   @ndb.non_transactional
   def _enqueue_task(self, url, queue_name, **kwargs):
@@ -1012,6 +1017,62 @@ class TasksApiTest(BaseTest):
     response = self.call_api('cancel', body={u'tags': [u'os:Win']})
     self.assertEqual(expected, response.json)
 
+  def test_cancel_batch(self):
+    self.mock(random, 'getrandbits', lambda _: 0x88)
+    self.set_as_bot()
+    self.do_handshake()
+    self.set_as_user()
+    first, second, _, _, now_120 = self._gen_three_pending_tasks()
+    self.set_as_admin()
+
+    calls = []
+    def enqueue_task(*args, **kwargs):
+      calls.append(args[0])
+      return True
+    self.mock(utils, 'enqueue_task', enqueue_task)
+
+    self.call_api('cancel_batch', body={}, status=400)
+    response = self.call_api(
+        'cancel_batch', body={u'tags': [u'os:Win']}).json
+    batch_id = response[u'batch_id']
+    self.assertEqual(
+        {u'batch_id': batch_id, u'now': fmtdate(now_120)}, response)
+    self.assertEqual(
+        ['/internal/taskqueue/cancel-tasks-batch/' + batch_id], calls)
+
+    expected = {
+      u'batch_id': batch_id,
+      u'canceled': u'0',
+      u'created_ts': fmtdate(now_120),
+      u'done': False,
+      u'kill_running': False,
+      u'matched': u'0',
+      u'now': fmtdate(now_120),
+      u'shards': u'0',
+      u'shards_done': u'0',
+      u'skipped': u'0',
+      u'tags': [u'os:Win'],
+    }
+    actual = self.call_api(
+        'cancel_batch_status', body={u'batch_id': batch_id}).json
+    self.assertEqual(expected, actual)
+
+    # Run the workers.
+    self.assertEqual(True, task_cancel.task_partition(batch_id))
+    self.assertEqual(True, task_cancel.task_cancel_shard(batch_id, 0))
+    expected.update(
+        canceled=u'2', done=True, matched=u'2', shards=u'1', shards_done=u'1')
+    actual = self.call_api(
+        'cancel_batch_status', body={u'batch_id': batch_id}).json
+    self.assertEqual(expected, actual)
+    for task_id in (first, second):
+      self.assertEqual(
+          task_result.State.CANCELED,
+          task_pack.unpack_result_summary_key(task_id).get().state)
+
+    self.call_api(
+        'cancel_batch_status', body={u'batch_id': u'invalid'}, status=404)
+
   def test_list_ok(self):
     """Asserts that list requests all TaskResultSummaries."""
     first, second, now_120, start, end = self._gen_two_tasks()
@@ -1105,6 +1166,58 @@ class TasksApiTest(BaseTest):
     actual = self.call_api('get_states', body=message_to_dict(request)).json
     self.assertEqual(expected, actual)
 
+  def test_get_results_ok(self):
+    first, second, now_120, _, _ = self._gen_two_tasks()
+    first_no_perf = first.copy()
+    first_no_perf.pop('performance_stats')
+    request = handlers_endpoints.TaskResultsRequest.combined_message_class(
+        task_id=[second['task_id'], '12310', first['task_id']])
+    expected = {
+      u'items': [second, first_no_perf],
+      u'not_found': [u'12310'],
+      u'now': fmtdate(now_120),
+    }
+    actual = self.call_api('get_results', body=message_to_dict(request)).json
+    self.assertEqual(expected, actual)
+
+    # Run result.
+    request = handlers_endpoints.TaskResultsRequest.combined_message_class(
+        task_id=[first['run_id']], include_outputs_ref=False)
+    actual = self.call_api('get_results', body=message_to_dict(request)).json
+    self.assertEqual([first['run_id']], [i['task_id'] for i in actual['items']])
+    self.assertNotIn('outputs_ref', actual['items'][0])
+
+    # Invalid task ID.
+    request = handlers_endpoints.TaskResultsRequest.combined_message_class(
+        task_id=['invalid'])
+    self.call_api('get_results', body=message_to_dict(request), status=400)
+
+    # Too many task IDs.
+    request = handlers_endpoints.TaskResultsRequest.combined_message_class(
+        task_id=[first['task_id']] * 101)
+    self.call_api('get_results', body=message_to_dict(request), status=400)
+
+  def test_get_results_acl(self):
+    first, second, _, _, _ = self._gen_two_tasks()
+    self.set_as_privileged_user()
+    _, third_id = self.client_create_task_raw(name='third')
+    request = handlers_endpoints.TaskResultsRequest.combined_message_class(
+        task_id=[first['task_id'], third_id, second['task_id']])
+
+    # The user only sees its own tasks.
+    self.set_as_user()
+    actual = self.call_api('get_results', body=message_to_dict(request)).json
+    self.assertEqual(
+        [first['task_id'], second['task_id']],
+        [i['task_id'] for i in actual['items']])
+    self.assertEqual([third_id], actual['not_found'])
+
+    # A privileged user sees all of them.
+    self.set_as_privileged_user()
+    actual = self.call_api('get_results', body=message_to_dict(request)).json
+    self.assertEqual(3, len(actual['items']))
+    self.assertNotIn('not_found', actual)
+
   def test_count_indexes(self):
     # Asserts that no combination crashes.
     _, _, now_120, start, end = self._gen_two_tasks()
@@ -1440,7 +1553,9 @@ class TaskApiTest(BaseTest):
     self.set_as_bot()
     params = _params(output=base64.b64encode('Oh '))
     response = self.post_json('/swarming/api/v1/bot/task_update', params)
-    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
     self.set_as_user()
     expected = self.gen_result_summary(
         costs_usd=[0.1],
@@ -1474,7 +1589,9 @@ class TaskApiTest(BaseTest):
     self.set_as_bot()
     params = _params(output=base64.b64encode('hi'), output_chunk_start=3)
     response = self.post_json('/swarming/api/v1/bot/task_update', params)
-    self.assertEqual({u'must_stop': True, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': True, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
 
     # abandoned_ts is set but state isn't changed yet.
     self.set_as_user()
@@ -1505,7 +1622,9 @@ class TaskApiTest(BaseTest):
         output=base64.b64encode(' again'), output_chunk_start=6,
         duration=0.1, exit_code=0)
     response = self.post_json('/swarming/api/v1/bot/task_update', params)
-    self.assertEqual({u'must_stop': True, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': True, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
 
     self.set_as_user()
     expected = self.gen_result_summary(
@@ -1637,11 +1756,24 @@ class TaskApiTest(BaseTest):
 
     self.set_as_privileged_user()
     run_id = task_id[:-1] + '1'
-    expected = {u'output': u'rÉsult string'}
+    expected = {u'output': u'rÉsult string', u'next_offset': u'14'}
     for i in (task_id, run_id):
       response = self.call_api('stdout', body={'task_id': i})
       self.assertEqual(expected, response.json)
 
+    # Byte range.
+    response = self.call_api(
+        'stdout', body={'task_id': task_id, 'offset': 1, 'length': 2})
+    self.assertEqual({u'output': u'É', u'next_offset': u'3'}, response.json)
+    # A partial character is left for the next page.
+    response = self.call_api(
+        'stdout', body={'task_id': task_id, 'offset': 0, 'length': 2})
+    self.assertEqual({u'output': u'r', u'next_offset': u'1'}, response.json)
+    # Nothing past the end.
+    response = self.call_api(
+        'stdout', body={'task_id': task_id, 'offset': 14})
+    self.assertEqual({}, response.json)
+
   def test_stdout_empty(self):
     """Asserts that incipient tasks produce no output."""
     _, task_id = self.client_create_task_raw()
@@ -2060,6 +2192,85 @@ class BotsApiTest(BaseTest):
         dimensions=['bad'])
     self.call_api('list', body=message_to_dict(request), status=400)
 
+  def test_list_fields(self):
+    self.set_as_privileged_user()
+    bot_management.bot_event(
+        event_type='bot_connected', bot_id='id1',
+        external_ip='8.8.4.4', authenticated_as='bot:whitelisted-ip',
+        dimensions={u'id': [u'id1'], u'pool': [u'default']}, state={'ram': 65},
+        version='123456789', quarantined=False, maintenance_msg=None,
+        task_id=None, task_name=None)
+    expected = {
+      u'items': [{u'bot_id': u'id1', u'is_dead': False}],
+      u'now': fmtdate(self.now),
+    }
+    response = self.call_api(
+        'list', body={'fields': 'items(bot_id,is_dead),now'})
+    self.assertEqual(expected, response.json)
+    # The masked away fields were not converted.
+    self.assertEqual(0, len(message_conversion._ROWS_CACHE))
+
+    # The converted state is reused until the bot is updated.
+    response = self.call_api('list', body={'fields': 'items/state'})
+    self.assertEqual({u'items': [{u'state': u'{"ram":65}'}]}, response.json)
+    self.assertEqual(1, len(message_conversion._ROWS_CACHE))
+    response = self.call_api('list', body={'fields': 'items/state'})
+    self.assertEqual({u'items': [{u'state': u'{"ram":65}'}]}, response.json)
+    self.assertEqual(1, len(message_conversion._ROWS_CACHE))
+    self.mock_now(self.now, 1)
+    bot_management.bot_event(
+        event_type='bot_connected', bot_id='id1',
+        external_ip='8.8.4.4', authenticated_as='bot:whitelisted-ip',
+        dimensions={u'id': [u'id1'], u'pool': [u'default']}, state={'ram': 66},
+        version='123456789', quarantined=False, maintenance_msg=None,
+        task_id=None, task_name=None)
+    response = self.call_api('list', body={'fields': 'items/state'})
+    self.assertEqual({u'items': [{u'state': u'{"ram":66}'}]}, response.json)
+    self.assertEqual(2, len(message_conversion._ROWS_CACHE))
+
+  def test_list_throughput(self):
+    # Measures the conversion of a page of a synthetic 20k bots fleet, the
+    # first time and once the rows are memoized.
+    num = 20000
+    bots = [
+      bot_management.BotInfo(
+          key=bot_management.get_info_key('bot%d' % i),
+          composite=[
+            bot_management.BotInfo.NOT_IN_MAINTENANCE,
+            bot_management.BotInfo.ALIVE,
+            bot_management.BotInfo.NOT_MACHINE_PROVIDER,
+            bot_management.BotInfo.HEALTHY,
+            bot_management.BotInfo.IDLE,
+          ],
+          dimensions_flat=[u'id:bot%d' % i, u'os:Linux', u'pool:default'],
+          last_seen_ts=self.now,
+          state={u'disks': {u'/': {u'free_mb': i}}, u'ram': 65},
+          version=u'123456789')
+      for i in xrange(num)
+    ]
+    self.mock(message_conversion, '_ROWS_CACHE_MAX_BYTES', 1 << 30)
+    start = time.time()
+    first = message_conversion.bot_infos_to_rpc(bots)
+    cold = time.time() - start
+    start = time.time()
+    second = message_conversion.bot_infos_to_rpc(bots)
+    warm = time.time() - start
+    logging.info(
+        'Converted %d bots: %.1f bots/s; memoized: %.1f bots/s', num,
+        num / cold, num / max(warm, 1e-6))
+    self.assertEqual(num, len(message_conversion._ROWS_CACHE))
+    self.assertTrue(
+        all(a.dimensions is b.dimensions for a, b in zip(first, second)))
+    self.assertEqual(first, second)
+
+    # The memoized conversions are bounded by their size.
+    self.mock(message_conversion, '_ROWS_CACHE_MAX_BYTES', 100*1024)
+    cache = message_conversion._RowsCache()
+    self.mock(message_conversion, '_ROWS_CACHE', cache)
+    message_conversion.bot_infos_to_rpc(bots)
+    self.assertTrue(0 < cache._size <= 100*1024)
+    self.assertTrue(len(cache) < num)
+
   def test_count_ok(self):
     """Asserts that BotsCount is returned for the appropriate set of bots."""
     self.set_as_privileged_user()
@@ -2389,7 +2600,9 @@ class BotApiTest(BaseTest):
     self.set_as_bot()
     res = self.bot_poll()
     response = self.bot_complete_task(task_id=res['manifest']['task_id'])
-    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
 
     now_1 = self.mock_now(self.now, 1)
     self.mock(random, 'getrandbits', lambda _: 0x55)
@@ -2399,7 +2612,9 @@ class BotApiTest(BaseTest):
     res = self.bot_poll()
     response = self.bot_complete_task(
         exit_code=1, task_id=res['manifest']['task_id'])
-    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
 
     start = utils.datetime_to_timestamp(
         self.now + datetime.timedelta(seconds=0.5)) / 1000000.
@@ -2455,7 +2670,9 @@ class BotApiTest(BaseTest):
     res = self.bot_poll(params=params)
     now_60 = self.mock_now(self.now, 60)
     response = self.bot_complete_task(task_id=res['manifest']['task_id'])
-    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
 
     params['event'] = 'bot_rebooting'
     params['message'] = 'for the best'
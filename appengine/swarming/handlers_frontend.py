@@ -18,12 +18,16 @@ import handlers_endpoints
 import mapreduce_jobs
 import template
 
+from google.appengine.ext import ndb
+
 from components import auth
 from components import utils
 from server import acl
 from server import bot_code
 from server import bot_groups_config
 from server import config
+from server import task_pack
+from server import task_result
 
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -130,6 +134,38 @@ class TaskHandler(auth.AuthenticatingHandler):
 ### Public pages.
 
 
+class TaskOutputHandler(auth.AuthenticatingHandler):
+  """Returns the raw output of a task.
+
+  The optional offset and length query parameters select a byte range. At most
+  TaskOutput.FETCH_MAX_CONTENT bytes are returned, well within the response
+  size limit. The X-Swarming-Next-Offset response header is the offset of the
+  next page, or to use to tail the output of a running task.
+  """
+  @auth.require(acl.can_access)
+  def get(self, task_id):
+    try:
+      request_key, result_key = task_pack.get_request_and_result_keys(task_id)
+      offset = int(self.request.get('offset') or 0)
+      length = int(self.request.get('length') or 0) or None
+    except ValueError:
+      self.abort(400, 'Invalid task id or range.')
+    if offset < 0 or (length is not None and length < 0):
+      self.abort(400, 'Invalid range.')
+    request, result = ndb.get_multi((request_key, result_key))
+    if not request or not result:
+      self.abort(404, '%s not found.' % task_id)
+    if not acl.can_view_task(request):
+      self.abort(403, '%s is not accessible.' % task_id)
+    max_length = task_result.TaskOutput.FETCH_MAX_CONTENT
+    length = min(length or max_length, max_length)
+    # The response is buffered, so join the output.
+    data = ''.join(result.iter_output(offset, length))
+    self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    self.response.headers['X-Swarming-Next-Offset'] = str(offset + len(data))
+    self.response.write(data)
+
+
 class UIHandler(auth.AuthenticatingHandler):
   """Serves the landing page for the old Polymer UI of the requested page.
 
@@ -253,6 +289,8 @@ def get_routes():
       # Send bot-list and index to NewUIHandler (i.e. WebComponents)
       ('/<page:(botlist|tasklist|)>', NewUIHandler),
       ('/oldui/<page:(botlist|tasklist)>', UIHandler),
+      # Raw task output.
+      ('/task/<task_id:[0-9a-f]+>/stdout', TaskOutputHandler),
 
       # Redirects to Polymer UI
       ('/user/tasks', TasksHandler),
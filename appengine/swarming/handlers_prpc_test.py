@@ -173,7 +173,9 @@ class PRPCTest(test_env_handlers.AppTestBase):
     res = self.bot_poll(params=params)
     now_180 = self.mock_now(self.now, 180)
     response = self.bot_complete_task(task_id=res['manifest']['task_id'])
-    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    self.assertEqual(
+        {u'must_stop': False, u'ok': True, u'output_encodings': [u'zlib']},
+        response)
     self.mock_now(self.now, 240)
     params['event'] = 'bot_rebooting'
     params['message'] = 'for the best'
@@ -156,6 +156,44 @@ class FrontendTest(AppTestBase):
     self.app.get('/restricted/bots', status=302)
     self.app.get('/restricted/bot/bot321', status=302)
 
+  def test_task_output(self):
+    self.mock_default_pool_acl([])
+    self.set_as_bot()
+    self.bot_poll()
+    self.set_as_user()
+    self.client_create_task_raw()
+    self.set_as_bot()
+    task_id = self.bot_run_task()
+
+    self.set_as_privileged_user()
+    expected = u'rÉsult string'.encode('utf-8')
+    run_id = task_id[:-1] + '1'
+    for i in (task_id, run_id):
+      response = self.app.get('/task/%s/stdout' % i)
+      self.assertEqual(expected, response.body)
+      self.assertEqual('14', response.headers['X-Swarming-Next-Offset'])
+
+    # Byte range.
+    response = self.app.get('/task/%s/stdout?offset=1&length=2' % task_id)
+    self.assertEqual(u'É'.encode('utf-8'), response.body)
+    self.assertEqual('3', response.headers['X-Swarming-Next-Offset'])
+    # Tail from the end.
+    response = self.app.get('/task/%s/stdout?offset=14' % task_id)
+    self.assertEqual('', response.body)
+    self.assertEqual('14', response.headers['X-Swarming-Next-Offset'])
+
+    # Pages.
+    self.mock(task_result.TaskOutput, 'FETCH_MAX_CONTENT', 4)
+    response = self.app.get('/task/%s/stdout' % task_id)
+    self.assertEqual('r\xc3\x89s', response.body)
+    self.assertEqual('4', response.headers['X-Swarming-Next-Offset'])
+    response = self.app.get('/task/%s/stdout?offset=4&length=10' % task_id)
+    self.assertEqual('ult ', response.body)
+    self.assertEqual('8', response.headers['X-Swarming-Next-Offset'])
+
+    self.app.get('/task/%s/stdout?offset=-1' % task_id, status=400)
+    self.app.get('/task/1d69b9f088008810/stdout', status=404)
+
 
 class FrontendAdminTest(AppTestBase):
   @staticmethod
@@ -308,8 +346,11 @@ class BackendTest(AppTestBase):
     )
     # Format: (<queue-name>, <base-url>, <argument>).
     task_queues = [
+      ('bq-catch-up', '/internal/taskqueue/bq-catch-up/', 'task_results'),
       ('cancel-task-on-bot', '/internal/taskqueue/cancel-task-on-bot', ''),
       ('cancel-tasks', '/internal/taskqueue/cancel-tasks', ''),
+      ('cancel-tasks-batch', '/internal/taskqueue/cancel-tasks-batch/', '1'),
+      ('cancel-tasks-batch', '/internal/taskqueue/cancel-tasks-batch/', '1/0'),
       ('delete-tasks', '/internal/taskqueue/delete-tasks', ''),
       ('es-notify-tasks', '/internal/taskqueue/es-notify-tasks', ''),
       ('machine-provider-manage',
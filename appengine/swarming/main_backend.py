@@ -16,6 +16,7 @@ APP_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, os.path.join(APP_DIR, 'components', 'third_party'))
 
 from components import ereporter2
+from components import rpc_accounting
 from components import utils
 
 import gae_ts_mon
@@ -52,6 +53,7 @@ def create_application():
   event_mon_metrics.initialize()
   ts_mon_metrics.initialize()
   utils.report_memory(backend_app)
+  rpc_accounting.instrument(backend_app, header=utils.is_local_dev_server())
   return backend_app, main.APP
 
 
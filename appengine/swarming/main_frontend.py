@@ -19,6 +19,7 @@ sys.path.insert(0, os.path.join(APP_DIR, 'components', 'third_party'))
 
 from components import endpoints_webapp2
 from components import ereporter2
+from components import rpc_accounting
 from components import utils
 
 import gae_ts_mon
@@ -78,6 +79,9 @@ def create_application():
   utils.report_memory(frontend_app)
   utils.report_memory(endpoints_api)
   utils.report_memory(prpc_api)
+  rpc_accounting.instrument(frontend_app, header=utils.is_local_dev_server())
+  rpc_accounting.instrument(endpoints_api, header=utils.is_local_dev_server())
+  rpc_accounting.instrument(prpc_api, header=utils.is_local_dev_server())
   return frontend_app, endpoints_api, prpc_api, main.APP
 
 
@@ -13,6 +13,7 @@ ProtoRPC.
 
 import datetime
 import json
+import threading
 
 import swarming_rpcs
 
@@ -25,6 +26,50 @@ from server import task_result
 ### Private API.
 
 
+# Maximum approximate size in bytes of the conversions memoized by
+# bot_infos_to_rpc() and task_results_to_rpc().
+_ROWS_CACHE_MAX_BYTES = 16*1024*1024
+
+# Approximate size in bytes of a StringListPair message, excluding its strings.
+_PAIR_OVERHEAD = 200
+
+
+class _RowsCache(object):
+  """Memoizes the expensive parts of the conversion of entity versions.
+
+  Only the pieces that are costly to compute and don't depend on the fields
+  mask are kept, bounded by their approximate size.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    # {(key, version): tuple(size, value)}
+    self._entries = {}
+    self._size = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, cache_key, compute):
+    """Returns the memoized value, compute() returns tuple(size, value)."""
+    entry = self._entries.get(cache_key)
+    if entry is None:
+      entry = compute()
+      with self._lock:
+        if cache_key not in self._entries:
+          while self._entries and (
+              self._size + entry[0] > _ROWS_CACHE_MAX_BYTES):
+            # Evict an arbitrary entry. Listing pages in key order would defeat
+            # a LRU anyway.
+            self._size -= self._entries.popitem()[1][0]
+          if entry[0] <= _ROWS_CACHE_MAX_BYTES:
+            self._entries[cache_key] = entry
+            self._size += entry[0]
+    return entry[1]
+
+
+_ROWS_CACHE = _RowsCache()
+
+
 def _string_pairs_from_dict(dictionary):
   # For key: value items like env.
   return [
@@ -51,11 +96,23 @@ def _string_list_pairs_from_dict(dictionary):
   ]
 
 
-def _ndb_to_rpc(cls, entity, **overrides):
-  members = (f.name for f in cls.all_fields())
+def _ndb_to_rpc(cls, entity, fields=None, **overrides):
+  # If fields is set, only these message fields are filled in.
+  members = (
+      f.name for f in cls.all_fields() if fields is None or f.name in fields)
   kwargs = {m: getattr(entity, m) for m in members if not m in overrides}
   kwargs.update(overrides)
-  return cls(**{k: v for k, v in kwargs.iteritems() if v is not None})
+  return cls(**{
+    k: v for k, v in kwargs.iteritems()
+    if v is not None and (fields is None or k in fields)
+  })
+
+
+def _string_list_pairs_size(dictionary):
+  """Returns the approximate size of _string_list_pairs_from_dict()."""
+  return sum(
+      _PAIR_OVERHEAD + len(k) + sum(len(v) for v in values)
+      for k, values in (dictionary or {}).iteritems())
 
 
 def _rpc_to_ndb(cls, entity, **overrides):
@@ -175,17 +232,50 @@ def epoch_to_datetime(value):
     raise ValueError(e)
 
 
-def bot_info_to_rpc(entity, deleted=False):
-  """"Returns a swarming_rpcs.BotInfo from a bot.BotInfo."""
-  return _ndb_to_rpc(
-      swarming_rpcs.BotInfo,
-      entity,
-      bot_id=entity.id,
-      deleted=deleted,
-      dimensions=_string_list_pairs_from_dict(entity.dimensions),
-      is_dead=entity.is_dead,
-      machine_type=entity.machine_type,
-      state=json.dumps(entity.state, sort_keys=True, separators=(',', ':')))
+def _bot_info_pieces(entity):
+  """Returns tuple(size, tuple(dimensions, state)) for bot_info_to_rpc()."""
+  dimensions = _string_list_pairs_from_dict(entity.dimensions)
+  state = json.dumps(entity.state, sort_keys=True, separators=(',', ':'))
+  size = _string_list_pairs_size(entity.dimensions) + len(state)
+  return size, (dimensions, state)
+
+
+def _bot_info_to_rpc(entity, deleted, fields, get_pieces):
+  overrides = {
+    'bot_id': entity.id,
+    'deleted': deleted,
+    'is_dead': entity.is_dead,
+    'machine_type': entity.machine_type,
+  }
+  if fields is None or 'dimensions' in fields or 'state' in fields:
+    overrides['dimensions'], overrides['state'] = get_pieces()
+  return _ndb_to_rpc(swarming_rpcs.BotInfo, entity, fields, **overrides)
+
+
+def bot_info_to_rpc(entity, deleted=False, fields=None):
+  """"Returns a swarming_rpcs.BotInfo from a bot.BotInfo.
+
+  If fields is set, only these swarming_rpcs.BotInfo fields are filled in.
+  """
+  return _bot_info_to_rpc(
+      entity, deleted, fields, lambda: _bot_info_pieces(entity)[1])
+
+
+def bot_infos_to_rpc(entities, fields=None):
+  """Returns a list of swarming_rpcs.BotInfo from bot.BotInfo entities.
+
+  The dimensions and state conversions are memoized per bot version, as the
+  bots are listed over and over again while most of them didn't change. They
+  are shared by the returned messages and must not be modified.
+  """
+  fields = frozenset(fields) if fields is not None else None
+  return [
+    _bot_info_to_rpc(
+        e, False, fields,
+        lambda e=e: _ROWS_CACHE.get(
+            (e.key, e.last_seen_ts), lambda: _bot_info_pieces(e)))
+    for e in entities
+  ]
 
 
 def bot_event_to_rpc(entity):
@@ -283,15 +373,16 @@ def new_task_request_from_rpc(msg, now):
   return req, secret_bytes, template_apply
 
 
-def task_result_to_rpc(entity, send_stats):
-  """"Returns a swarming_rpcs.TaskResult from a task_result.TaskResultSummary or
-  task_result.TaskRunResult.
-  """
+def _task_result_to_rpc(
+    entity, send_stats, send_outputs, fields, get_bot_dimensions):
+  def want(name):
+    return fields is None or name in fields
+
   outputs_ref = (
       _ndb_to_rpc(swarming_rpcs.FilesRef, entity.outputs_ref)
-      if entity.outputs_ref else None)
+      if send_outputs and want('outputs_ref') and entity.outputs_ref else None)
   cipd_pins = None
-  if entity.cipd_pins:
+  if want('cipd_pins') and entity.cipd_pins:
     cipd_pins = swarming_rpcs.CipdPins(
       client_package=(
         _ndb_to_rpc(swarming_rpcs.CipdPackage,
@@ -304,7 +395,8 @@ def task_result_to_rpc(entity, send_stats):
       ] if entity.cipd_pins.packages else None
     )
   performance_stats = None
-  if send_stats and entity.performance_stats.is_valid:
+  if (send_stats and want('performance_stats') and
+      entity.performance_stats.is_valid):
       def op(entity):
         if entity:
           return _ndb_to_rpc(swarming_rpcs.OperationStats, entity)
@@ -315,7 +407,9 @@ def task_result_to_rpc(entity, send_stats):
           isolated_download=op(entity.performance_stats.isolated_download),
           isolated_upload=op(entity.performance_stats.isolated_upload))
   kwargs = {
-    'bot_dimensions': _string_list_pairs_from_dict(entity.bot_dimensions or {}),
+    'bot_dimensions': (
+        get_bot_dimensions()
+        if want('bot_dimensions') and entity.bot_dimensions else None),
     'cipd_pins': cipd_pins,
     'outputs_ref': outputs_ref,
     'performance_stats': performance_stats,
@@ -333,7 +427,39 @@ def task_result_to_rpc(entity, send_stats):
     # This returns the right value for deduped tasks too.
     k = entity.run_result_key
     kwargs['run_id'] = task_pack.pack_run_result_key(k) if k else None
-  return _ndb_to_rpc(
-      swarming_rpcs.TaskResult,
-      entity,
-      **kwargs)
+  return _ndb_to_rpc(swarming_rpcs.TaskResult, entity, fields, **kwargs)
+
+
+def task_result_to_rpc(entity, send_stats, send_outputs=True, fields=None):
+  """"Returns a swarming_rpcs.TaskResult from a task_result.TaskResultSummary or
+  task_result.TaskRunResult.
+
+  performance_stats is only included when send_stats is True, outputs_ref only
+  when send_outputs is True. If fields is set, only these
+  swarming_rpcs.TaskResult fields are filled in.
+  """
+  return _task_result_to_rpc(
+      entity, send_stats, send_outputs, fields,
+      lambda: _string_list_pairs_from_dict(entity.bot_dimensions))
+
+
+def task_results_to_rpc(entities, send_stats, fields=None):
+  """Returns a list of swarming_rpcs.TaskResult from
+  task_result.TaskResultSummary or task_result.TaskRunResult entities.
+
+  The bot dimensions conversions are memoized per entity version, i.e.
+  modified_ts. They are shared by the returned messages and must not be
+  modified.
+  """
+  def bot_dimensions(e):
+    return (
+        _string_list_pairs_size(e.bot_dimensions),
+        _string_list_pairs_from_dict(e.bot_dimensions))
+  fields = frozenset(fields) if fields is not None else None
+  return [
+    _task_result_to_rpc(
+        e, send_stats, True, fields,
+        lambda e=e: _ROWS_CACHE.get(
+            (e.key, e.modified_ts), lambda: bot_dimensions(e)))
+    for e in entities
+  ]
@@ -51,7 +51,8 @@
 - BotInfo is a 'dump-only' entity used for UI, it permits quickly show the
   state of every bots in an single query. It is basically a cache of the last
   BotEvent and additionally updated on poll. It doesn't need to be updated in a
-  transaction.
+  transaction. Polls that do not change anything but last_seen_ts and state are
+  coalesced, see _BOT_INFO_FLUSH_INTERVAL.
 - BotSettings contains bot-specific settings. It must be updated in a
   transaction and contains admin-provided settings, contrary to the other
   entities which are generated from data provided by the bot itself.
@@ -78,6 +79,38 @@ from server import task_queues
 # BotEvent entities are deleted when they are older than the cutoff.
 _OLD_BOT_EVENTS_CUT_OFF = datetime.timedelta(days=366)
 
+# Maximum delay before BotInfo is stored for a bot that keeps on polling
+# without changing anything but its state. In the meantime, the exact
+# last_seen_ts is kept in memcache.
+#
+# The consistency model is:
+# - BotInfo.last_seen_ts in the datastore is at most this much older than the
+#   last poll of an alive bot. Any other change to BotInfo is stored right away.
+# - As long as this value plus the bots' poll interval is below
+#   SettingsCfg.bot_death_timeout_secs, cron_update_bot_info() and thus
+#   BotInfo.is_dead are not affected. cron_update_bot_info() still confirms
+#   with the memcache value before declaring a bot dead.
+# - BotInfo.state may lag by this much.
+_BOT_INFO_FLUSH_INTERVAL = datetime.timedelta(seconds=60)
+
+# BotInfo properties that are stored right away when they change, as opposed to
+# last_seen_ts and state that are flushed periodically.
+_BOT_INFO_EAGER_PROPERTIES = (
+  'authenticated_as',
+  'dimensions_flat',
+  'external_ip',
+  'lease_expiration_ts',
+  'lease_id',
+  'leased_indefinitely',
+  'machine_lease',
+  'machine_type',
+  'maintenance_msg',
+  'quarantined',
+  'task_id',
+  'task_name',
+  'version',
+)
+
 
 ### Models.
 
@@ -436,6 +469,94 @@ class DimensionAggregation(ndb.Model):
   KEY = ndb.Key('DimensionAggregation', 'current')
 
 
+### Private APIs.
+
+
+def _get_eager_values(bot_info):
+  """Returns the values of the BotInfo properties that must not be coalesced."""
+  out = []
+  for name in _BOT_INFO_EAGER_PROPERTIES:
+    v = getattr(bot_info, name)
+    out.append(list(v) if isinstance(v, list) else v)
+  return out
+
+
+def _set_last_seen(bot_id, now):
+  """Stores the exact last_seen_ts of a bot whose BotInfo put was coalesced."""
+  memcache.set(
+      bot_id, now, time=config.settings().bot_death_timeout_secs,
+      namespace='BotInfo.last_seen')
+
+
+@ndb.tasklet
+def _get_last_seen_async(bot_id):
+  """Returns the last_seen_ts of a bot as kept in memcache, if any."""
+  v = yield ndb.get_context().memcache_get(
+      bot_id, namespace='BotInfo.last_seen')
+  raise ndb.Return(v)
+
+
+def _get_bq_callbacks():
+  """Returns the callbacks for bq_state to export BotEvent.
+
+  Returns:
+    tuple(get_oldest_key, get_rows, fetch_rows, key_to_ts, ts_to_key).
+  """
+  fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
+  def _convert(e):
+    """Returns a tuple(db_key, bq_key, row)."""
+    out = swarming_pb2.BotEvent()
+    e.to_proto(out)
+    # This is fine because bot_id cannot contain ':'. See
+    # config.DIMENSION_KEY_RE.
+    bq_key = e.id + ':' + e.ts.strftime(fmt)
+    return (e.key.urlsafe(), bq_key, out)
+
+  def get_oldest_key():
+    """Returns a tuple(db_key, bq_key)."""
+    # BigQuery requires partitioned table to not insert items older than 365
+    # days old. The problem with going back all the way to 364 days is that
+    # churning through the backlog can take a *long* time, so only go back 7
+    # days.
+    cutoff = (utils.utcnow() - datetime.timedelta(days=7))
+    cutoff = datetime.datetime(cutoff.year, cutoff.month, cutoff.day)
+    oldest = BotEvent.query(BotEvent.ts >= cutoff).order(BotEvent.ts).get()
+    if not oldest:
+      return None, None
+    # Since the query is an inequality > (and not >=), go back in time 1 second
+    # to not discard the very first entity.
+    ts = oldest.ts - datetime.timedelta(seconds=1)
+    bq_key = oldest.id + ':' + ts.strftime(fmt)
+    return (oldest.key.urlsafe(), bq_key)
+
+  def get_rows(_db_key, bq_key, size):
+    """Returns a list of tuple(db_key, bq_key, row)."""
+    start = datetime.datetime.strptime(bq_key.split(':', 1)[1], fmt)
+    return [
+      _convert(e) for e in
+      BotEvent.query(BotEvent.ts > start).order(BotEvent.ts).fetch(limit=size)
+      if e
+    ]
+
+  def fetch_rows(db_keys, _bq_key):
+    """Returns a list of tuple(db_key, bq_key, row)."""
+    return [
+      _convert(e) for e in ndb.get_multi(ndb.Key(urlsafe=k) for k in db_keys)
+      if e
+    ]
+
+  def key_to_ts(_db_key, bq_key):
+    """Returns the timestamp of a row."""
+    return datetime.datetime.strptime(bq_key.split(':', 1)[1], fmt)
+
+  def ts_to_key(ts):
+    """Returns a tuple(db_key, bq_key) usable as get_rows() start position."""
+    # get_rows() only uses the timestamp part of bq_key.
+    return u'', u':' + ts.strftime(fmt)
+
+  return get_oldest_key, get_rows, fetch_rows, key_to_ts, ts_to_key
+
+
 ### Public APIs.
 
 
@@ -568,7 +689,10 @@ def bot_event(
   # Retrieve the previous BotInfo and update it.
   info_key = get_info_key(bot_id)
   bot_info = info_key.get()
-  if not bot_info:
+  previous = None
+  if bot_info:
+    previous = (bot_info.last_seen_ts, _get_eager_values(bot_info))
+  else:
     bot_info = BotInfo(key=info_key)
   now = utils.utcnow()
   bot_info.last_seen_ts = now
@@ -611,6 +735,13 @@ def bot_event(
       # GET is to keep first_seen_ts. It's not necessary to use a transaction
       # here since no BotEvent is being added, only last_seen_ts is really
       # updated.
+      if (previous and not bot_info.is_dead and
+          now - previous[0] < _BOT_INFO_FLUSH_INTERVAL and
+          previous[1] == _get_eager_values(bot_info)):
+        # Nothing relevant changed and BotInfo was stored recently. Only note
+        # the bot liveness in memcache.
+        _set_last_seen(bot_id, now)
+        return
       bot_info.put()
       return
 
@@ -710,6 +841,14 @@ def cron_update_bot_info():
   @ndb.tasklet
   def run(bot_key):
     bot = yield bot_key.get_async()
+    if bot and bot.last_seen_ts <= cutoff:
+      # The BotInfo put may have been coalesced, look at the exact value.
+      last_seen_ts = yield _get_last_seen_async(bot.id)
+      if last_seen_ts and last_seen_ts > cutoff:
+        # The bot is alive, flush it.
+        bot.last_seen_ts = last_seen_ts
+        yield bot.put_async()
+        raise ndb.Return(0)
     if (bot and bot.last_seen_ts <= cutoff and
         (BotInfo.ALIVE in bot.composite or BotInfo.DEAD not in bot.composite)):
       # Updating it recomputes composite.
@@ -732,8 +871,10 @@ def cron_update_bot_info():
       if BotInfo.ALIVE in b.composite or BotInfo.DEAD not in b.composite:
         # Make sure the variable is not aliased.
         k = b.key
-        # Unregister the bot from task queues since it can't reap anything.
-        task_queues.cleanup_after_bot(k.parent())
+        last_seen_ts = _get_last_seen_async(b.id).get_result()
+        if not last_seen_ts or last_seen_ts <= cutoff:
+          # Unregister the bot from task queues since it can't reap anything.
+          task_queues.cleanup_after_bot(k.parent())
         # Retry more often than the default 1. We do not want to throw too much
         # in the logs and there should be plenty of time to do the retries.
         f = datastore_utils.transaction_async(lambda: run(k), retries=5)
@@ -885,48 +1026,15 @@ def cron_send_to_bq():
   Returns:
     total number of bot events sent to BQ.
   """
-  fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
-  def _convert(e):
-    """Returns a tuple(db_key, bq_key, row)."""
-    out = swarming_pb2.BotEvent()
-    e.to_proto(out)
-    # This is fine because bot_id cannot contain ':'. See
-    # config.DIMENSION_KEY_RE.
-    bq_key = e.id + ':' + e.ts.strftime(fmt)
-    return (e.key.urlsafe(), bq_key, out)
-
-  def get_oldest_key():
-    """Returns a tuple(db_key, bq_key)."""
-    # BigQuery requires partitioned table to not insert items older than 365
-    # days old. The problem with going back all the way to 364 days is that
-    # churning through the backlog can take a *long* time, so only go back 7
-    # days.
-    cutoff = (utils.utcnow() - datetime.timedelta(days=7))
-    cutoff = datetime.datetime(cutoff.year, cutoff.month, cutoff.day)
-    oldest = BotEvent.query(BotEvent.ts >= cutoff).order(BotEvent.ts).get()
-    if not oldest:
-      return None, None
-    # Since the query is an inequality > (and not >=), go back in time 1 second
-    # to not discard the very first entity.
-    ts = oldest.ts - datetime.timedelta(seconds=1)
-    bq_key = oldest.id + ':' + ts.strftime(fmt)
-    return (oldest.key.urlsafe(), bq_key)
+  return bq_state.cron_send_to_bq('bot_events', *_get_bq_callbacks())
 
-  def get_rows(_db_key, bq_key, size):
-    """Returns a list of tuple(db_key, bq_key, row)."""
-    start = datetime.datetime.strptime(bq_key.split(':', 1)[1], fmt)
-    return [
-      _convert(e) for e in
-      BotEvent.query(BotEvent.ts > start).order(BotEvent.ts).fetch(limit=size)
-      if e
-    ]
 
-  def fetch_rows(db_keys, _bq_key):
-    """Returns a list of tuple(db_key, bq_key, row)."""
-    return [
-      _convert(e) for e in ndb.get_multi(ndb.Key(urlsafe=k) for k in db_keys)
-      if e
-    ]
+def task_send_to_bq(start, end):
+  """Sends the BotEvent that happened in a time range to BigQuery.
 
-  return bq_state.cron_send_to_bq(
-      'bot_events', get_oldest_key, get_rows, fetch_rows)
+  Returns:
+    True if all the bot events in the range were sent.
+  """
+  _, get_rows, fetch_rows, key_to_ts, ts_to_key = _get_bq_callbacks()
+  return bq_state.send_shard_to_bq(
+      'bot_events', start, end, get_rows, fetch_rows, key_to_ts, ts_to_key)
@@ -291,6 +291,37 @@ class BotManagementTest(test_case.TestCase):
     # No BotEvent is registered for 'poll'.
     self.assertEqual([], bot_management.get_events_query('id1', True).fetch())
 
+  def test_bot_event_poll_sleep_coalesced(self):
+    _bot_event(event_type='bot_connected')
+    info_key = bot_management.get_info_key('id1')
+
+    # A poll shortly after only updates memcache.
+    then = self.mock_now(self.now, 10)
+    _bot_event(event_type='request_sleep')
+    self.assertEqual(self.now, info_key.get().last_seen_ts)
+    self.assertEqual(
+        then, memcache.get('id1', namespace='BotInfo.last_seen'))
+
+    # A change in a significant property is stored right away.
+    then = self.mock_now(self.now, 20)
+    _bot_event(event_type='request_sleep', quarantined=True)
+    self.assertEqual(then, info_key.get().last_seen_ts)
+    self.assertEqual(True, info_key.get().quarantined)
+
+    # BotInfo is flushed once the interval elapsed.
+    self.mock_now(then, 30)
+    _bot_event(event_type='request_sleep', quarantined=True)
+    self.assertEqual(then, info_key.get().last_seen_ts)
+    then = self.mock_now(
+        then, bot_management._BOT_INFO_FLUSH_INTERVAL.total_seconds())
+    _bot_event(event_type='request_sleep', quarantined=True)
+    self.assertEqual(then, info_key.get().last_seen_ts)
+
+    # No BotEvent is registered for 'poll'.
+    self.assertEqual(
+        ['bot_connected'],
+        [e.event_type for e in bot_management.get_events_query('id1', True)])
+
   def test_bot_event_busy(self):
     _bot_event(event_type='bot_connected')
     _bot_event(event_type='request_task', task_id='12311', task_name='yo')
@@ -426,6 +457,26 @@ class BotManagementTest(test_case.TestCase):
     # The cron job ran, so it's now correct.
     check([bot1_dead], [bot2_alive])
 
+  def test_cron_update_bot_info_coalesced(self):
+    # A bot whose BotInfo put was coalesced is not declared dead.
+    timeout = bot_management.config.settings().bot_death_timeout_secs
+    _bot_event(event_type='bot_connected')
+    then = self.mock_now(self.now, 30)
+    _bot_event(event_type='request_sleep')
+    info_key = bot_management.get_info_key('id1')
+    self.assertEqual(self.now, info_key.get().last_seen_ts)
+
+    self.mock_now(self.now, timeout)
+    self.assertEqual(0, bot_management.cron_update_bot_info())
+    bot_info = info_key.get()
+    self.assertEqual(then, bot_info.last_seen_ts)
+    self.assertFalse(bot_info.is_dead)
+
+    # Without further poll, it is eventually declared dead.
+    self.mock_now(then, timeout)
+    self.assertEqual(1, bot_management.cron_update_bot_info())
+    self.assertTrue(info_key.get().is_dead)
+
   def test_cron_delete_old_bot_events(self):
     # Create an old BotEvent right at the cron job cut off, and another one one
     # second later (that will be kept).
@@ -481,7 +532,9 @@ class BotManagementTest(test_case.TestCase):
       self.assertEqual(bot_management.bq_state.bqh.INSERT_ROWS_SCOPE, scopes)
       self.assertEqual(600, deadline)
       return {'insertErrors': []}
-    self.mock(bot_management.bq_state.net, 'json_request', json_request)
+    self.mock(
+        bot_management.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
 
     # Generate a few events.
     self.mock_now(self.now, 10)
@@ -549,7 +602,9 @@ class BotManagementTest(test_case.TestCase):
           ],
         }
       return {'insertErrors': []}
-    self.mock(bot_management.bq_state.net, 'json_request', json_request)
+    self.mock(
+        bot_management.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
 
     # Generate two events.
     self.mock_now(self.now, 10)
@@ -594,6 +649,35 @@ class BotManagementTest(test_case.TestCase):
     # Next cron skips everything that was processed.
     self.assertEqual(0, bot_management.cron_send_to_bq())
 
+  def test_task_send_to_bq(self):
+    payloads = []
+    def json_request(url, method, payload, scopes, deadline):
+      # pylint: disable=unused-argument
+      payloads.append(payload)
+      return {'insertErrors': []}
+    self.mock(
+        bot_management.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
+
+    self.mock_now(self.now, 10)
+    _bot_event(bot_id=u'id1', event_type='bot_connected')
+    self.mock_now(self.now, 20)
+    _bot_event(event_type='request_task', task_id='12311', task_name='yo')
+    self.mock_now(self.now, 30)
+
+    # Only the first one is in the time shard.
+    fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
+    start = self.now.strftime(fmt)
+    end = (self.now + datetime.timedelta(seconds=15)).strftime(fmt)
+    self.assertEqual(True, bot_management.task_send_to_bq(start, end))
+    self.assertEqual(1, len(payloads))
+    self.assertEqual(
+        [u'id1:2010-01-02T03:04:15.000006Z'],
+        [r['insertId'] for r in payloads[0]['rows']])
+    # The shard state is cleaned up once done.
+    self.assertEqual(
+        None, bot_management.bq_state.BqState.get_by_id('bot_events:' + start))
+
 
 if __name__ == '__main__':
   logging.basicConfig(
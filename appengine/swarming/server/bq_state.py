@@ -17,13 +17,49 @@ from components import utils
 import bqh
 
 
+# Maximum number of rows sent in a single insertAll request.
+_MAX_BATCH = 500
+
+# Maximum number of insertAll requests in flight at once. The next pages are
+# fetched from the DB while the previous ones are being inserted.
+_MAX_INFLIGHT = 4
+
+# Maximum duration of a cron job or task queue worker, after which the export
+# stops and resumes on the next run.
+_MAX_DURATION = datetime.timedelta(seconds=300)
+
+# When the export lags by more than this, the backlog is split in time shards
+# exported in parallel by task queue workers, see send_shard_to_bq().
+_CATCH_UP_THRESHOLD = datetime.timedelta(hours=1)
+
+# Duration of the backlog exported by each catch-up worker.
+_CATCH_UP_SHARD = datetime.timedelta(minutes=30)
+
+# Maximum number of catch-up workers triggered per cron job run.
+_CATCH_UP_MAX_SHARDS = 48
+
+# The most recent rows are always left to the cron job.
+_CATCH_UP_MARGIN = datetime.timedelta(minutes=5)
+
+# Format of the time shard boundaries in the task queue payload.
+_TS_FMT = u'%Y-%m-%dT%H:%M:%S.%fZ'
+
+# How long the BqState of a completed catch-up time shard is kept. It prevents
+# a retried cron job from exporting the shard again.
+_CATCH_UP_KEEP = datetime.timedelta(days=1)
+
+# Functions called with (table_name, lag in seconds) when the export lag is
+# known.
+_lag_callbacks = []
+
+
 ### Models
 
 
 class BqState(ndb.Model):
   """Stores the last BigQuery successful writes.
 
-  Key id: table_name.
+  Key id: table_name, or '<table_name>:<start>' for a catch-up time shard.
 
   By storing the successful writes, this enables not having to read from BQ. Not
   having to sync state *from* BQ means one less RPC that could fail randomly.
@@ -45,11 +81,28 @@ class BqState(ndb.Model):
   failed_db_keys = ndb.StringProperty(repeated=True, indexed=False)
   failed_bq_keys = ndb.StringProperty(repeated=True, indexed=False)
 
+  # Set once a catch-up time shard was entirely sent.
+  done = ndb.BooleanProperty(default=False, indexed=False)
+
 
 ### Private APIs.
 
 
-def _send_to_bq(table_name, rows):
+class _InFlight(object):
+  """An insertAll request in flight."""
+  def __init__(self, future, count, last, retried):
+    # ndb.Future returning tuple(failed_db_keys, failed_bq_keys).
+    self.future = future
+    # Number of rows sent.
+    self.count = count
+    # tuple(db_key, bq_key) of the last new row sent, or None.
+    self.last = last
+    # list of tuple(db_key, bq_key) of the previously failed rows sent again.
+    self.retried = retried
+
+
+@ndb.tasklet
+def _send_to_bq_async(table_name, rows):
   """Sends the rows to BigQuery.
 
   Arguments:
@@ -77,7 +130,7 @@ def _send_to_bq(table_name, rows):
       for _db_key, bq_key, row in rows
     ],
   }
-  res = net.json_request(
+  res = yield net.json_request_async(
       url=url, method='POST', payload=payload, scopes=bqh.INSERT_ROWS_SCOPE,
       deadline=600)
 
@@ -107,13 +160,218 @@ def _send_to_bq(table_name, rows):
     failed_bq_keys.append(bq_key)
   if dropped:
     logging.warning('%d old rows silently dropped', dropped)
-  return failed_db_keys, failed_bq_keys
+  raise ndb.Return((failed_db_keys, failed_bq_keys))
+
+
+def _send_loop(
+    table_name, state, namespace, get_rows, fetch_rows, end_ts, key_to_ts):
+  """Streams rows to BigQuery until there is nothing left or time is up.
+
+  Up to _MAX_INFLIGHT insertAll requests are kept in flight while the next pages
+  are fetched. The requests complete in order and state is only saved once the
+  rows it points to were sent, so a crash never skips a row.
+
+  Arguments:
+    end_ts: if set, rows past this timestamp are ignored.
+
+  Returns:
+    tuple(number of rows sent, True if there is nothing left to send).
+  """
+  total = 0
+  inflight = []
+  # Previously failed rows to send again, as tuple(db_key, bq_key).
+  failed = zip(state.failed_db_keys, state.failed_bq_keys)
+  # Position of the next page to fetch.
+  next_key = (state.last_db_key, state.last_bq_key)
+  exhausted = False
+  should_stop = utils.utcnow() + _MAX_DURATION
+
+  def save():
+    # Rows being sent again are still recorded as failed until they succeed.
+    keys = failed + [k for f in inflight for k in f.retried]
+    state.failed_db_keys = [k[0] for k in keys]
+    state.failed_bq_keys = [k[1] for k in keys]
+    state.ts = utils.utcnow()
+    state.put()
+
+  def complete():
+    f = inflight.pop(0)
+    failed_db_keys, failed_bq_keys = f.future.get_result()
+    if failed_db_keys:
+      logging.error('Failed to insert %s rows', len(failed_db_keys))
+    failed.extend(zip(failed_db_keys, failed_bq_keys))
+    if f.last:
+      state.last_db_key, state.last_bq_key = f.last
+    save()
+    return f.count - len(failed_db_keys)
+
+  while True:
+    if len(inflight) >= _MAX_INFLIGHT or (
+        inflight and exhausted and not failed):
+      total += complete()
+      continue
+    if exhausted and not failed:
+      # We're done!
+      return total, True
+    if (utils.utcnow() >= should_stop or
+        not memcache.get('running', namespace=namespace)):
+      logging.info('Time is up or memcache was cleared')
+      while inflight:
+        total += complete()
+      return total, False
+
+    # There cannot be more than _MAX_BATCH rows per request.
+    retried = failed[:_MAX_BATCH]
+    del failed[:len(retried)]
+    size = _MAX_BATCH - len(retried)
+    rows = []
+    last = None
+    if size:
+      rows = get_rows(next_key[0], next_key[1], size)
+      exhausted = not rows
+      if end_ts:
+        # get_rows() may return a short page when it skips rows, so the shard
+        # only ends once a row past end_ts is seen.
+        in_shard = [r for r in rows if key_to_ts(r[0], r[1]) <= end_ts]
+        exhausted = exhausted or len(in_shard) < len(rows)
+        rows = in_shard
+      if rows:
+        # Save the last row key from tuple(db_key, bq_key, row).
+        last = tuple(rows[-1][:2])
+        logging.info(
+            'get_rows(%s, %s, %s) returned %d rows; last is now %s, %s',
+            next_key[0], next_key[1], size, len(rows), last[0], last[1])
+        next_key = last
+      else:
+        logging.info(
+            'get_rows(%s, %s, %s) returned 0 rows',
+            next_key[0], next_key[1], size)
+
+    if retried:
+      # If some rows were removed, they are silently skipped.
+      backlog = fetch_rows([k[0] for k in retried], [k[1] for k in retried])
+      logging.info(
+          'fetch_rows(%d rows) returned %d rows', len(retried), len(backlog))
+      rows.extend(backlog)
+      if not backlog:
+        retried = []
+        save()
+
+    if rows:
+      logging.info('Sending %d rows', len(rows))
+      inflight.append(_InFlight(
+          _send_to_bq_async(table_name, rows), len(rows), last, retried))
+
+
+def _get_lag(state, key_to_ts):
+  """Returns the age of the last row sent as a datetime.timedelta."""
+  return utils.utcnow() - key_to_ts(state.last_db_key, state.last_bq_key)
+
+
+def _shard_key(table_name, start):
+  """Returns the BqState ndb.Key of a catch-up time shard."""
+  return ndb.Key(BqState, '%s:%s' % (table_name, start))
+
+
+def _get_export_lag(table_name, state, key_to_ts):
+  """Returns the age of the oldest row not sent yet as a datetime.timedelta.
+
+  state points past the catch-up time shards as soon as they are triggered, so
+  the shards that are not done yet are accounted for. The shards done for more
+  than _CATCH_UP_KEEP are deleted along the way.
+  """
+  lag = _get_lag(state, key_to_ts)
+  # All the shards of the table, as their key id starts with '<table_name>:'.
+  q = BqState.query(
+      BqState.key >= _shard_key(table_name, ''),
+      BqState.key < ndb.Key(BqState, table_name + ';'))
+  old = []
+  now = utils.utcnow()
+  for shard in q:
+    if not shard.done:
+      lag = max(lag, _get_lag(shard, key_to_ts))
+    elif now - shard.ts > _CATCH_UP_KEEP:
+      old.append(shard.key)
+  if old:
+    ndb.delete_multi(old)
+  return lag
+
+
+def _report_lag(table_name, lag):
+  for callback in _lag_callbacks:
+    try:
+      callback(table_name, lag.total_seconds())
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('bq_state lag callback failed')
+
+
+def _trigger_catch_up(table_name, state, key_to_ts, ts_to_key):
+  """Splits the backlog in time shards exported by task queue workers.
+
+  The cron job then resumes right after the last shard.
+
+  Returns:
+    True if the workers were triggered.
+  """
+  start = key_to_ts(state.last_db_key, state.last_bq_key)
+  end = min(
+      start + _CATCH_UP_SHARD * _CATCH_UP_MAX_SHARDS,
+      utils.utcnow() - _CATCH_UP_MARGIN)
+  shards = []
+  while start < end:
+    shards.append((start, min(start + _CATCH_UP_SHARD, end)))
+    start = shards[-1][1]
+  logging.info(
+      'Triggering %d catch-up shards from %s to %s', len(shards),
+      shards[0][0], end)
+  # Save the shards before enqueuing them, so the export lag accounts for them
+  # until they are done. A shard already saved, e.g. by a previous run that
+  # failed to enqueue all of them, is kept as is.
+  keys = [_shard_key(table_name, s.strftime(_TS_FMT)) for s, _ in shards]
+  to_put = []
+  for key, (shard_start, _), existing in zip(
+      keys, shards, ndb.get_multi(keys)):
+    if not existing:
+      db_key, bq_key = ts_to_key(shard_start)
+      to_put.append(BqState(
+          key=key, ts=utils.utcnow(), last_db_key=db_key, last_bq_key=bq_key))
+  ndb.put_multi(to_put)
+  for shard_start, shard_end in shards:
+    # Named tasks so a retry of the cron job doesn't export a shard twice.
+    name = '%s-%s-%s' % (
+        table_name.replace('_', '-'), shard_start.strftime('%Y%m%d%H%M%S%f'),
+        shard_end.strftime('%Y%m%d%H%M%S%f'))
+    payload = utils.encode_to_json({
+      'start': shard_start.strftime(_TS_FMT),
+      'end': shard_end.strftime(_TS_FMT),
+    })
+    if not utils.enqueue_task(
+        '/internal/taskqueue/bq-catch-up/' + table_name, 'bq-catch-up',
+        payload=payload, name=name):
+      logging.warning('Failed to trigger catch-up shard %s', name)
+      return False
+  state.last_db_key, state.last_bq_key = ts_to_key(end)
+  state.ts = utils.utcnow()
+  state.put()
+  return True
 
 
 ### Public API.
 
 
-def cron_send_to_bq(table_name, get_oldest_key, get_rows, fetch_rows):
+def register_lag_callback(callback):
+  """Registers a function called with (table_name, lag in seconds) after each
+  export.
+
+  The lag is the age of the last row sent.
+  """
+  if callback not in _lag_callbacks:
+    _lag_callbacks.append(callback)
+
+
+def cron_send_to_bq(
+    table_name, get_oldest_key, get_rows, fetch_rows, key_to_ts=None,
+    ts_to_key=None):
   """Sends the bot events to BigQuery.
 
   To ensure no items are missing, we query the last item in the table, then look
@@ -122,6 +380,9 @@ def cron_send_to_bq(table_name, get_oldest_key, get_rows, fetch_rows):
   Logs insert errors and returns a list of timestamps of row that could
   not be inserted.
 
+  When key_to_ts and ts_to_key are provided, the export lag is reported and a
+  large backlog is exported in parallel via send_shard_to_bq().
+
   Arguments:
     table_name: BigQuery table name. Also used as the key id to use for the
         BqState entity.
@@ -132,11 +393,14 @@ def cron_send_to_bq(table_name, get_oldest_key, get_rows, fetch_rows):
         into table table_name. Accepts (db_key, bq_key, size).
     fetch_rows: returns a list of tuple(db_key, bq_key, row) data for individual
         rows that had to be retried. Accepts a list of db_key.
+    key_to_ts: returns the timestamp of a row as a datetime.datetime. Accepts
+        (db_key, bq_key).
+    ts_to_key: returns tuple(db_key, bq_key) so that get_rows() returns the
+        rows after this timestamp. Accepts a datetime.datetime.
 
   Returns:
     total number of bot events sent to BQ.
   """
-  total = 0
   start = utils.utcnow()
   state = BqState.get_by_id(table_name)
   if not state:
@@ -144,7 +408,7 @@ def cron_send_to_bq(table_name, get_oldest_key, get_rows, fetch_rows):
     db_key, bq_key = get_oldest_key()
     logging.info('get_oldest_key() = %s, %s', db_key, bq_key)
     if not db_key or not bq_key:
-      return total
+      return 0
     state = BqState(
         id=table_name, ts=start, last_db_key=db_key, last_bq_key=bq_key)
     state.put()
@@ -155,67 +419,60 @@ def cron_send_to_bq(table_name, get_oldest_key, get_rows, fetch_rows):
   namespace = 'bq_state.' + table_name
   if not memcache.add('running', 'yep', time=400, namespace=namespace):
     logging.debug('Other cron already running')
-    return total
+    return 0
 
   try:
-    should_stop = start + datetime.timedelta(seconds=300)
-    while utils.utcnow() < should_stop:
-      if not memcache.get('running', namespace=namespace):
-        logging.info('memcache was cleared')
-        return total
-
-      # Send at most 500 items at a time to reduce the risks of failure.
-      max_batch = 500
-      # There cannot be more than 500 failed pending send.
-      size = max_batch - len(state.failed_db_keys)
-
-      if size:
-        rows = get_rows(state.last_db_key, state.last_bq_key, size)
-        if not rows:
-          logging.info(
-              'get_rows(%s, %s, %s) returned 0 rows',
-              state.last_db_key, state.last_bq_key, size)
-          if not state.failed_db_keys:
-            # We're done!
-            return total
-        else:
-          # Save the last row bq_key from tuple(db_key, bq_key, row).
-          db_key, bq_key, _row = rows[-1]
-          logging.info(
-              'get_rows(%s, %s, %s) returned %d rows; last is now %s, %s',
-              state.last_db_key, state.last_bq_key, size, len(rows),
-              db_key, bq_key)
-          state.last_db_key = db_key
-          state.last_bq_key = bq_key
-      else:
-        # Failed is full. Retry again.
-        rows = []
+    if key_to_ts and ts_to_key:
+      if _get_lag(state, key_to_ts) > _CATCH_UP_THRESHOLD:
+        _trigger_catch_up(table_name, state, key_to_ts, ts_to_key)
+    total, _ = _send_loop(
+        table_name, state, namespace, get_rows, fetch_rows, None, key_to_ts)
+    return total
+  finally:
+    memcache.delete('running', namespace=namespace)
+    if key_to_ts:
+      _report_lag(table_name, _get_export_lag(table_name, state, key_to_ts))
 
-      # If some rows were removed, remove them from the failed_db_keys field.
-      if state.failed_db_keys:
-        backlog = fetch_rows(state.failed_db_keys, state.failed_bq_keys)
-        logging.info(
-            'fetch_rows(%d rows) returned %d rows',
-            len(state.failed_db_keys), len(backlog))
-        rows.extend(backlog)
-      elif not rows:
-        # We've hit the end.
-        return total
 
-      # We continue if state.failed_db_keys was set, so BqState.failed_db_keys
-      # can be zapped below.
+def send_shard_to_bq(
+    table_name, start, end, get_rows, fetch_rows, key_to_ts, ts_to_key):
+  """Sends the rows in a time shard of the backlog to BigQuery.
 
-      if rows:
-        logging.info('Sending %d rows', len(rows))
-        state.failed_db_keys, state.failed_bq_keys = _send_to_bq(
-            table_name, rows)
-        if state.failed_db_keys:
-          logging.error('Failed to insert %s rows', len(state.failed_db_keys))
-        total += len(rows) - len(state.failed_db_keys)
-
-      # The next cron job round will retry the ones that failed, and last_bq_key
-      # is updated.
+  Called by the task queue workers triggered by cron_send_to_bq(). The progress
+  is saved in its own BqState so a retry resumes where the previous one
+  stopped. It is marked as done once the whole shard was sent.
+
+  Arguments:
+    table_name: BigQuery table name.
+    start: the rows strictly after this timestamp are sent, as a string.
+    end: the rows up to this timestamp are sent, as a string.
+    get_rows, fetch_rows, key_to_ts, ts_to_key: see cron_send_to_bq().
+
+  Returns:
+    True if the whole shard was sent.
+  """
+  key = _shard_key(table_name, start)
+  state = key.get()
+  if not state:
+    db_key, bq_key = ts_to_key(datetime.datetime.strptime(start, _TS_FMT))
+    state = BqState(
+        key=key, ts=utils.utcnow(), last_db_key=db_key, last_bq_key=bq_key)
+  elif state.done:
+    return True
+  namespace = 'bq_state.' + key.string_id()
+  if not memcache.add('running', 'yep', time=400, namespace=namespace):
+    logging.info('Other worker already running')
+    # The other worker may have been killed, have this task retried.
+    return False
+  try:
+    total, done = _send_loop(
+        table_name, state, namespace, get_rows, fetch_rows,
+        datetime.datetime.strptime(end, _TS_FMT), key_to_ts)
+    logging.info('Sent %d rows from %s to %s', total, start, end)
+    if done:
+      state.done = True
       state.ts = utils.utcnow()
       state.put()
+    return done
   finally:
     memcache.delete('running', namespace=namespace)
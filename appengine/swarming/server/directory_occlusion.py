@@ -58,6 +58,17 @@ class Checker(object):
       node = node._subdirs.setdefault(subdir, Checker('/'.join(tokens[:i+1])))
     node._owner_notes[owner].add(note)
 
+  def copy(self):
+    """Returns a deep copy of this Checker.
+
+    Useful to add paths to a Checker prepared once without modifying it.
+    """
+    ret = Checker(self._full_path)
+    for owner, notes in self._owner_notes.iteritems():
+      ret._owner_notes[owner] = set(notes)
+    ret._subdirs = {k: v.copy() for k, v in self._subdirs.iteritems()}
+    return ret
+
   def conflicts(self, ctx):
     """Populates `ctx` with all violations found in this Checker.
 
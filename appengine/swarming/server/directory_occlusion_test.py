@@ -29,6 +29,20 @@ class TestDirectoryOcclusionChecker(unittest.TestCase):
     self.assertFalse(self.doc.conflicts(self.ctx))
     self.assertEqual(self.ctx.result().messages, [])
 
+  def test_copy(self):
+    self.doc.add('some/path', 'bobbie', 'for justice')
+    doc = self.doc.copy()
+    doc.add('some/path', 'charlie', 'for peace')
+
+    self.assertFalse(self.doc.conflicts(self.ctx))
+    self.assertTrue(doc.conflicts(self.ctx))
+    self.assertEqual(
+        [x.text for x in self.ctx.result().messages],
+        [
+          ('\'some/path\': directory has conflicting owners: '
+           'bobbie[\'for justice\'] and charlie[\'for peace\']'),
+        ])
+
   def test_conflicting_directory(self):
     self.doc.add('some/path', 'bobbie', 'for justice')
     self.doc.add('some/path', 'charlie', 'for peace')
@@ -350,6 +350,26 @@ CipdPackage = collections.namedtuple('CipdPackage', ['path', 'pkg', 'version'])
 Env = collections.namedtuple('Env', ['var', 'value', 'prefix', 'soft'])
 
 
+# Ready to apply form of a TaskTemplate, see compile_task_template().
+CompiledTaskTemplate = collections.namedtuple('CompiledTaskTemplate', [
+  # Sorted tuple of the env vars that the task must not set.
+  'hard_env',
+  # Tuple of (var, value) of the env vars with a value.
+  'env',
+  # Tuple of (var, prefixes) of the env vars with prefixes.
+  'env_prefixes',
+  # frozenset of the cache names reserved by the template.
+  'cache_names',
+  # sequence of CacheEntry.
+  'cache',
+  # sequence of CipdPackage.
+  'cipd_package',
+  # directory_occlusion.Checker with the template paths. It must be copied
+  # before adding the task paths to it.
+  'checker',
+])
+
+
 def get_pool_config(pool_name):
   """Returns PoolConfig for the given pool or None if not defined."""
   if pool_name is None:
@@ -367,6 +387,27 @@ def known():
   return sorted(_fetch_pools_config().pools)
 
 
+def compile_task_template(task_template, rev=None):
+  """Returns the CompiledTaskTemplate for a TaskTemplate.
+
+  The compiled templates of the pools.cfg revision rev are memoized, so a
+  template is compiled once per revision instead of once per task.
+  """
+  global _COMPILED_TASK_TEMPLATES
+  if rev is None:
+    return _compile_task_template(task_template)
+  compiled_rev, compiled = _COMPILED_TASK_TEMPLATES
+  if compiled_rev != rev:
+    # Drop the templates of the previous revision.
+    compiled = {}
+    _COMPILED_TASK_TEMPLATES = (rev, compiled)
+  ret = compiled.get(task_template)
+  if not ret:
+    ret = _compile_task_template(task_template)
+    compiled[task_template] = ret
+  return ret
+
+
 ### Private stuff.
 
 
@@ -375,6 +416,11 @@ def known():
 _LOCAL_FAKE_CONFIG = None
 
 
+# (pools.cfg revision, {TaskTemplate: CompiledTaskTemplate}), see
+# compile_task_template().
+_COMPILED_TASK_TEMPLATES = (None, {})
+
+
 # Parsed representation of pools.cfg ready for queries.
 _PoolsCfg = collections.namedtuple('_PoolsCfg', [
   'pools',  # dict {pool name => PoolConfig tuple}
@@ -383,6 +429,24 @@ _PoolsCfg = collections.namedtuple('_PoolsCfg', [
 ])
 
 
+def _compile_task_template(task_template):
+  """Returns the CompiledTaskTemplate for a TaskTemplate."""
+  checker = directory_occlusion.Checker()
+  for cache in task_template.cache:
+    checker.add(cache.path, 'task template cache %r' % cache.name, '')
+  for cp in task_template.cipd_package:
+    checker.add(cp.path, 'task template cipd', '%s:%s' % (cp.pkg, cp.version))
+  return CompiledTaskTemplate(
+      hard_env=tuple(e.var for e in task_template.env if not e.soft),
+      env=tuple((e.var, e.value) for e in task_template.env if e.value),
+      env_prefixes=tuple(
+          (e.var, tuple(e.prefix)) for e in task_template.env if e.prefix),
+      cache_names=frozenset(c.name for c in task_template.cache),
+      cache=tuple(task_template.cache),
+      cipd_package=tuple(task_template.cipd_package),
+      checker=checker)
+
+
 def _resolve_task_template_inclusions(ctx, task_templates):
   """Resolves all task template inclusions in the provided
   pools_pb2.TaskTemplate list.
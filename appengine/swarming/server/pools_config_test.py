@@ -648,6 +648,28 @@ class TestTaskTemplates(TaskTemplateBaseTest):
             inclusions=frozenset({'base'}),
           ))
 
+  def test_compile_task_template(self):
+    tt = pools_config.TaskTemplate.from_pb(self.ctx, self.parse("""
+    cache: { name: "hi"  path: "cache/hi" }
+    cipd_package: { path: "bin" pkg: "foo/bar" version: "latest" }
+    env: {var: "VAR" value: "1"}
+    env: {var: "PATH" prefix: "1" prefix: "2" soft: true}
+    """))
+
+    compiled = pools_config.compile_task_template(tt)
+    self.assertEqual(('VAR',), compiled.hard_env)
+    self.assertEqual((('VAR', '1'),), compiled.env)
+    self.assertEqual((('PATH', ('1', '2')),), compiled.env_prefixes)
+    self.assertEqual(frozenset(['hi']), compiled.cache_names)
+    self.assertEqual(tt.cache, compiled.cache)
+    self.assertEqual(tt.cipd_package, compiled.cipd_package)
+    self.assertFalse(compiled.checker.conflicts(self.ctx))
+
+    # Compiled once per pools.cfg revision.
+    compiled = pools_config.compile_task_template(tt, 'rev1')
+    self.assertIs(compiled, pools_config.compile_task_template(tt, 'rev1'))
+    self.assertIsNot(compiled, pools_config.compile_task_template(tt, 'rev2'))
+
 
 class TestPoolCfgTaskTemplate(TaskTemplateBaseTest):
   @staticmethod
@@ -0,0 +1,254 @@
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Cancels a large number of pending tasks in parallel.
+
+A batch cancellation is started with start(). A first task queue worker pages
+through the pending tasks matching the tags in key order, and splits them in
+key ranges of _SHARD_SIZE tasks. Each key range is canceled by its own task
+queue worker, which cancels the tasks in grouped transactions with
+task_scheduler.cancel_tasks().
+
+Each shard saves its progress in its own root entity, so the workers don't
+contend with each other and a retried worker resumes where the previous one
+stopped. get_progress() sums them up.
+"""
+
+import collections
+import datetime
+import logging
+
+from google.appengine.ext import ndb
+
+from components import datastore_utils
+from components import utils
+
+from server import task_pack
+from server import task_result
+from server import task_scheduler
+
+
+# Maximum number of tasks in a shard, canceled by a single task queue worker.
+_SHARD_SIZE = 1000
+
+# Number of tasks canceled between two saves of the shard progress.
+_CHUNK_SIZE = 100
+
+# Maximum duration of a shard worker, after which it stops and is retried to
+# resume where it stopped.
+_MAX_DURATION = datetime.timedelta(seconds=300)
+
+
+# Summary of a batch cancellation returned by get_progress().
+Progress = collections.namedtuple(
+    'Progress',
+    [
+      # TaskCancelBatch entity.
+      'batch',
+      # Number of pending tasks matched so far.
+      'matched',
+      # Number of shards triggered so far and number of shards completed.
+      'shards',
+      'shards_done',
+      # Number of tasks canceled and not canceled, e.g. because they started
+      # running in the meantime.
+      'canceled',
+      'skipped',
+      # True when all the matched tasks were processed.
+      'done',
+    ])
+
+
+### Models
+
+
+class TaskCancelBatch(ndb.Model):
+  """A batch cancellation of the pending tasks matching tags.
+
+  Key id: auto-generated integer, the batch ID.
+
+  Only written by the partitioning worker.
+  """
+  _use_memcache = False
+
+  created_ts = ndb.DateTimeProperty(indexed=False)
+  modified_ts = ndb.DateTimeProperty(indexed=False)
+  tags = ndb.StringProperty(repeated=True, indexed=False)
+  kill_running = ndb.BooleanProperty(indexed=False, default=False)
+
+  # Partitioning progress: query cursor to resume from and number of tasks and
+  # shards so far.
+  cursor = ndb.StringProperty(indexed=False)
+  matched = ndb.IntegerProperty(indexed=False, default=0)
+  shards = ndb.IntegerProperty(indexed=False, default=0)
+  # Set once all the matching tasks were assigned to a shard.
+  partitioned = ndb.BooleanProperty(indexed=False, default=False)
+
+
+class TaskCancelShard(ndb.Model):
+  """A key range of the tasks of a TaskCancelBatch.
+
+  Key id: '<batch id>:<shard index>'. It is a root entity so the shards are
+  updated concurrently.
+
+  Only written by its worker once created.
+  """
+  _use_memcache = False
+
+  modified_ts = ndb.DateTimeProperty(indexed=False)
+  # Tasks to cancel, in key order.
+  task_ids = ndb.StringProperty(repeated=True, indexed=False)
+  # Index in task_ids of the next task to cancel.
+  next_index = ndb.IntegerProperty(indexed=False, default=0)
+  canceled = ndb.IntegerProperty(indexed=False, default=0)
+  skipped = ndb.IntegerProperty(indexed=False, default=0)
+  # Query cursor right after task_ids, so a retried partitioning worker
+  # resumes from it.
+  cursor = ndb.StringProperty(indexed=False)
+
+  @property
+  def done(self):
+    return self.next_index >= len(self.task_ids)
+
+
+### Private stuff.
+
+
+def _shard_key(batch_id, index):
+  return ndb.Key(TaskCancelShard, '%s:%d' % (batch_id, index))
+
+
+def _enqueue_shard(batch_id, index):
+  # Named tasks so a retry of the partitioning worker doesn't trigger a shard
+  # twice.
+  return utils.enqueue_task(
+      '/internal/taskqueue/cancel-tasks-batch/%s/%d' % (batch_id, index),
+      'cancel-tasks-batch', name='cancel-tasks-batch-%s-%d' % (batch_id, index))
+
+
+### Public API.
+
+
+def start(tags, kill_running):
+  """Starts a batch cancellation of the pending tasks matching all the tags.
+
+  Warning: ACL check must have been done before.
+
+  Returns:
+    The batch ID as a string, or None if it couldn't be triggered.
+  """
+  assert tags, 'Refusing to cancel all the tasks'
+  now = utils.utcnow()
+  batch = TaskCancelBatch(
+      created_ts=now, modified_ts=now, tags=tags, kill_running=kill_running)
+  batch.put()
+  batch_id = str(batch.key.integer_id())
+  if not utils.enqueue_task(
+      '/internal/taskqueue/cancel-tasks-batch/' + batch_id,
+      'cancel-tasks-batch'):
+    batch.key.delete()
+    return None
+  logging.info('Started batch cancellation %s for %s', batch_id, tags)
+  return batch_id
+
+
+def get_progress(batch_id):
+  """Returns the Progress of a batch cancellation or None if not found."""
+  try:
+    batch = TaskCancelBatch.get_by_id(int(batch_id))
+  except ValueError:
+    return None
+  if not batch:
+    return None
+  shards = [
+    s for s in ndb.get_multi(
+        _shard_key(batch_id, i) for i in xrange(batch.shards))
+    if s
+  ]
+  shards_done = sum(1 for s in shards if s.done)
+  return Progress(
+      batch=batch,
+      matched=batch.matched,
+      shards=batch.shards,
+      shards_done=shards_done,
+      canceled=sum(s.canceled for s in shards),
+      skipped=sum(s.skipped for s in shards),
+      done=batch.partitioned and shards_done == batch.shards)
+
+
+def task_partition(batch_id):
+  """Splits the tasks of a batch cancellation in shards and triggers them.
+
+  Returns:
+    True if all the matching tasks were assigned to a shard.
+  """
+  batch = TaskCancelBatch.get_by_id(int(batch_id))
+  if not batch:
+    logging.error('Batch cancellation %s not found', batch_id)
+    return True
+  q = task_result.TaskResultSummary.query(
+      task_result.TaskResultSummary.state == task_result.State.PENDING,
+      default_options=ndb.QueryOptions(use_cache=False))
+  for tag in batch.tags:
+    q = q.filter(task_result.TaskResultSummary.tags == tag)
+
+  while not batch.partitioned:
+    key = _shard_key(batch_id, batch.shards)
+    # The shard may already exist if the previous attempt failed right after
+    # creating it. The query may return a different page by now, so resume
+    # after the tasks of the shard instead.
+    shard = key.get()
+    if shard:
+      matched, cursor = len(shard.task_ids), shard.cursor
+    else:
+      keys, cursor = datastore_utils.fetch_page(
+          q, _SHARD_SIZE, batch.cursor, keys_only=True)
+      matched = len(keys)
+      if keys:
+        TaskCancelShard(
+            key=key, modified_ts=utils.utcnow(),
+            task_ids=[task_pack.pack_result_summary_key(k) for k in keys],
+            cursor=cursor).put()
+    if matched:
+      if not _enqueue_shard(batch_id, batch.shards):
+        return False
+      batch.shards += 1
+      batch.matched += matched
+    batch.cursor = cursor
+    batch.partitioned = not cursor
+    batch.modified_ts = utils.utcnow()
+    batch.put()
+  logging.info(
+      'Batch cancellation %s: %d tasks in %d shards', batch_id, batch.matched,
+      batch.shards)
+  return True
+
+
+def task_cancel_shard(batch_id, index):
+  """Cancels the tasks of a shard of a batch cancellation.
+
+  Returns:
+    True if all the tasks of the shard were processed.
+  """
+  batch = TaskCancelBatch.get_by_id(int(batch_id))
+  shard = _shard_key(batch_id, index).get()
+  if not batch or not shard:
+    logging.error('Batch cancellation shard %s:%s not found', batch_id, index)
+    return True
+  start_ts = utils.utcnow()
+  while not shard.done:
+    chunk = shard.task_ids[shard.next_index:shard.next_index+_CHUNK_SIZE]
+    canceled, skipped = task_scheduler.cancel_tasks(chunk, batch.kill_running)
+    shard.canceled += canceled
+    shard.skipped += skipped
+    shard.next_index += len(chunk)
+    shard.modified_ts = utils.utcnow()
+    shard.put()
+    if not shard.done and shard.modified_ts - start_ts > _MAX_DURATION:
+      logging.info('Batch cancellation shard %s:%s paused', batch_id, index)
+      return False
+  logging.info(
+      'Batch cancellation shard %s:%s: %d canceled, %d skipped', batch_id,
+      index, shard.canceled, shard.skipped)
+  return True
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import datetime
+import logging
+import os
+import random
+import sys
+import time
+import unittest
+
+# Setups environment.
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+import test_env_handlers
+
+from google.appengine.ext import ndb
+
+import webtest
+
+import handlers_backend
+
+from components import auth_testing
+from components import rpc_accounting
+from components import utils
+
+from server import task_cancel
+from server import task_pack
+from server import task_request
+from server import task_result
+from server import task_scheduler
+from server import task_to_run
+from server.task_result import State
+
+
+# pylint: disable=W0212
+
+
+def _gen_pending(tags):
+  """Creates a pending task and returns its task ID."""
+  request = task_request.TaskRequest(
+      created_ts=utils.utcnow(),
+      manual_tags=tags,
+      name=u'yay',
+      priority=50,
+      task_slices=[
+        task_request.TaskSlice(
+            expiration_secs=60,
+            properties=task_request.TaskProperties(
+                command=[u'command1'],
+                dimensions_data={u'pool': [u'default']},
+                execution_timeout_secs=24*60*60)),
+      ],
+      user=u'Jesus')
+  task_request.init_new_request(request, True, task_request.TEMPLATE_AUTO)
+  request.key = task_request.new_request_key()
+  request.put()
+  result_summary = task_result.new_result_summary(request)
+  result_summary.modified_ts = utils.utcnow()
+  ndb.put_multi([result_summary, task_to_run.new_task_to_run(request, 1, 0)])
+  return result_summary.task_id
+
+
+class TaskCancelTest(test_env_handlers.AppTestBase):
+  def setUp(self):
+    super(TaskCancelTest, self).setUp()
+    self.now = datetime.datetime(2014, 1, 2, 3, 4, 5, 6)
+    self.mock_now(self.now)
+    auth_testing.mock_get_current_identity(self)
+    # Setup the backend to handle task queues.
+    self.app = webtest.TestApp(
+        handlers_backend.create_application(True),
+        extra_environ={
+          'REMOTE_ADDR': self.source_ip,
+          'SERVER_SOFTWARE': os.environ['SERVER_SOFTWARE'],
+        })
+    enqueue_orig = utils.enqueue_task
+    self.mock(
+        utils, 'enqueue_task',
+        lambda *args, **kwargs: enqueue_orig(
+            *args, use_dedicated_module=False, **kwargs))
+    self._random = 0
+    def getrandbits(_bits):
+      self._random += 1
+      return self._random
+    self.mock(random, 'getrandbits', getrandbits)
+
+  def assertProgress(self, expected, batch_id):
+    progress = task_cancel.get_progress(batch_id)._asdict()
+    progress.pop('batch')
+    self.assertEqual(expected, progress)
+
+  def test_start(self):
+    task_ids = [_gen_pending([u'a:b', u'c:d']) for _ in xrange(5)]
+    other = _gen_pending([u'a:b'])
+    self.mock(task_cancel, '_SHARD_SIZE', 2)
+    batch_id = task_cancel.start([u'a:b', u'c:d'], False)
+    self.assertProgress(
+        {
+          'canceled': 0, 'done': False, 'matched': 0, 'shards': 0,
+          'shards_done': 0, 'skipped': 0,
+        },
+        batch_id)
+    # The partitioning worker plus a worker per shard.
+    self.assertEqual(4, self.execute_tasks())
+    self.assertProgress(
+        {
+          'canceled': 5, 'done': True, 'matched': 5, 'shards': 3,
+          'shards_done': 3, 'skipped': 0,
+        },
+        batch_id)
+    for task_id in task_ids:
+      self.assertEqual(State.CANCELED, self._get_state(task_id))
+    self.assertEqual(State.PENDING, self._get_state(other))
+
+  def test_get_progress(self):
+    self.assertIsNone(task_cancel.get_progress('invalid'))
+    self.assertIsNone(task_cancel.get_progress('1234'))
+    batch_id = task_cancel.start([u'a:b'], False)
+    progress = task_cancel.get_progress(batch_id)
+    self.assertEqual([u'a:b'], progress.batch.tags)
+    self.assertEqual(self.now, progress.batch.created_ts)
+
+  def test_task_partition(self):
+    task_ids = [_gen_pending([u'a:b']) for _ in xrange(5)]
+    self.mock(task_cancel, '_SHARD_SIZE', 2)
+    batch_id = task_cancel.start([u'a:b'], False)
+    self.assertEqual(True, task_cancel.task_partition(batch_id))
+    # Shards are key ranges.
+    shards = [
+      task_cancel._shard_key(batch_id, i).get().task_ids for i in xrange(3)
+    ]
+    self.assertEqual(sorted(task_ids), sorted(sum(shards, [])))
+    self.assertEqual([2, 2, 1], [len(s) for s in shards])
+    # Running it again is a no-op.
+    self.assertEqual(True, task_cancel.task_partition(batch_id))
+    self.assertEqual(3, task_cancel.get_progress(batch_id).shards)
+    self.assertEqual(True, task_cancel.task_partition('1234'))
+
+  def test_task_partition_retry(self):
+    # The first attempt fails right after creating the first shard.
+    task_ids = [_gen_pending([u'a:b']) for _ in xrange(5)]
+    self.mock(task_cancel, '_SHARD_SIZE', 2)
+    batch_id = task_cancel.start([u'a:b'], False)
+    enqueue_orig = task_cancel._enqueue_shard
+    self.mock(task_cancel, '_enqueue_shard', lambda *_: False)
+    self.assertEqual(False, task_cancel.task_partition(batch_id))
+    self.assertEqual(0, task_cancel.get_progress(batch_id).shards)
+
+    # A newer task now sorts first in the query.
+    self.mock_now(self.now, 60)
+    _gen_pending([u'a:b'])
+    self.mock(task_cancel, '_enqueue_shard', enqueue_orig)
+    self.assertEqual(True, task_cancel.task_partition(batch_id))
+    # The retry resumed after the existing shard, each task is in exactly one
+    # shard.
+    shards = [
+      task_cancel._shard_key(batch_id, i).get().task_ids for i in xrange(3)
+    ]
+    self.assertEqual(sorted(task_ids), sorted(sum(shards, [])))
+    self.assertEqual(5, task_cancel.get_progress(batch_id).matched)
+
+  def test_task_cancel_shard(self):
+    task_ids = [_gen_pending([u'a:b']) for _ in xrange(5)]
+    self.mock(task_cancel, '_CHUNK_SIZE', 2)
+    batch_id = task_cancel.start([u'a:b'], False)
+    self.assertEqual(True, task_cancel.task_partition(batch_id))
+    # A task started running in the meantime.
+    result_summary = task_result.TaskResultSummary.query(
+        task_result.TaskResultSummary.tags == u'a:b').get()
+    result_summary.state = State.RUNNING
+    result_summary.put()
+
+    # The worker runs out of time after the first chunk and is retried.
+    self.mock(task_cancel, '_MAX_DURATION', datetime.timedelta(seconds=-1))
+    self.assertEqual(False, task_cancel.task_cancel_shard(batch_id, 0))
+    shard = task_cancel._shard_key(batch_id, 0).get()
+    self.assertEqual(2, shard.next_index)
+    self.mock(task_cancel, '_MAX_DURATION', datetime.timedelta(seconds=300))
+    self.assertEqual(True, task_cancel.task_cancel_shard(batch_id, 0))
+    self.assertProgress(
+        {
+          'canceled': 4, 'done': True, 'matched': 5, 'shards': 1,
+          'shards_done': 1, 'skipped': 1,
+        },
+        batch_id)
+    self.assertEqual(
+        [State.CANCELED] * 4,
+        [
+          self._get_state(t) for t in task_ids
+          if t != result_summary.task_id
+        ])
+    self.assertEqual(True, task_cancel.task_cancel_shard(batch_id, 1))
+
+  def test_throughput(self):
+    # Measures the cancellation throughput on the ndb testbed, with the tasks
+    # canceled in grouped transactions and one at a time.
+    num = 200
+    grouped_ids = [_gen_pending([u'a:b']) for _ in xrange(num)]
+    single_ids = [_gen_pending([u'a:b']) for _ in xrange(num)]
+
+    stats = rpc_accounting.start_request()
+    start = time.time()
+    try:
+      self.assertEqual(
+          (num, 0), task_scheduler.cancel_tasks(grouped_ids, False))
+    finally:
+      rpc_accounting.end_request()
+    grouped = time.time() - start
+    grouped_commits = stats.rpcs[('datastore_v3', 'Commit', '')].count
+
+    stats = rpc_accounting.start_request()
+    start = time.time()
+    try:
+      for task_id in single_ids:
+        self.assertEqual(
+            (True, False),
+            task_scheduler.cancel_task_with_id(task_id, False, None))
+    finally:
+      rpc_accounting.end_request()
+    single = time.time() - start
+    single_commits = stats.rpcs[('datastore_v3', 'Commit', '')].count
+
+    logging.info(
+        'Grouped: %.1f tasks/s, %d commits; one at a time: %.1f tasks/s, %d '
+        'commits', num / grouped, grouped_commits, num / single,
+        single_commits)
+    self.assertEqual(num / task_scheduler._CANCEL_GROUP_SIZE, grouped_commits)
+    self.assertEqual(num, single_commits)
+
+  def _get_state(self, task_id):
+    return task_pack.unpack_result_summary_key(task_id).get().state
+
+
+if __name__ == '__main__':
+  if '-v' in sys.argv:
+    unittest.TestCase.maxDiff = None
+  logging.basicConfig(
+      level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL)
+  unittest.main()
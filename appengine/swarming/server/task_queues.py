@@ -36,6 +36,14 @@ Used to optimize scheduling.
     |TaskDimensionsRoot     |  (not stored)
     |id=<pool:foo or id:foo>|
     +-----------------------+
+        |
+        +------------------------------------+
+        |                                    |
+        |                                    v
+        |                            +-------------------+
+        |                            |TaskDimensionsIndex|
+        |                            |id=1               |
+        |                            +-------------------+
         |
         +---------------- ... -------+
         |                            |
@@ -56,6 +64,7 @@ import logging
 import random
 import struct
 import time
+import zlib
 
 from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
@@ -77,6 +86,15 @@ from server import task_pack
 _ADVANCE = datetime.timedelta(hours=1, minutes=10)
 
 
+# Maximum size of the compressed TaskDimensionsIndex properties. Entities are
+# limited to 1MiB, leave some room for the rest of the entity.
+_MAX_INDEX_SIZE = 900*1024
+
+# An overflowed TaskDimensionsIndex is rebuilt at most this often, in case the
+# root shrank enough for the index to fit again.
+_INDEX_OVERFLOW_RETRY = datetime.timedelta(hours=1)
+
+
 class Error(Exception):
   pass
 
@@ -276,6 +294,153 @@ class TaskDimensions(ndb.Model):
           '%s.sets must all be unique' % self.__class__.__name__)
 
 
+class TaskDimensionsIndex(ndb.Model):
+  """Inverted index of all the TaskDimensionsSet under a TaskDimensionsRoot.
+
+  Parent is TaskDimensionsRoot.
+  Key id is 1.
+
+  Maps each 'key:value' to the ordinals of the TaskDimensionsSet that require
+  it. This enables _rebuild_bot_cache_async() to find the TaskDimensions a bot
+  can run by counting hits in the posting lists of the bot's dimensions, instead
+  of doing a linear scan of all the TaskDimensions in the root.
+
+  It is in the same entity group as the TaskDimensions it indexes so it is
+  updated in the same transaction. It can still list sets that expired but were
+  not tidied yet, so the candidates must be confirmed with
+  TaskDimensions.match_bot().
+
+  If the entity doesn't exist, the TaskDimensions in the root are scanned.
+
+  A root with too many TaskDimensions for the index to fit in an entity is
+  marked as overflow; its TaskDimensions are then scanned until a rebuild of the
+  index fits again, attempted every _INDEX_OVERFLOW_RETRY.
+  """
+  # List of [dimensions_hash, len(dimensions_flat)], one per TaskDimensionsSet.
+  # The index in this list is the set ordinal.
+  sets = ndb.JsonProperty(compressed=True)
+  # Mapping of 'key:value' to the sorted list of set ordinals requiring it.
+  postings = ndb.JsonProperty(compressed=True)
+  # Set once the index grew past _MAX_INDEX_SIZE. sets and postings are then
+  # cleared and not maintained anymore until the index is rebuilt.
+  overflow = ndb.BooleanProperty(default=False, indexed=False)
+  overflow_ts = ndb.DateTimeProperty(indexed=False)
+  # Upper bound of the size of sets and postings serialized as JSON, maintained
+  # incrementally so the compressed size is only computed when it could exceed
+  # _MAX_INDEX_SIZE. None on entities written before it was added.
+  raw_size = ndb.IntegerProperty(indexed=False)
+  # raw_size under which the compressed size is known to fit, as the compressed
+  # size can't grow by more than the raw size.
+  checked_size = ndb.IntegerProperty(indexed=False)
+
+  def update(self, task_dimensions):
+    """Replaces the indexed sets for this TaskDimensions."""
+    if self.overflow:
+      return
+    self.remove(task_dimensions.key.integer_id())
+    self._add(task_dimensions)
+
+  def remove(self, dimensions_hash):
+    """Removes all the indexed sets for this dimensions_hash.
+
+    The ordinals are renumbered so the lists stay dense.
+    """
+    if self.overflow:
+      return
+    sets = self.sets or []
+    remap = {}
+    new_sets = []
+    for i, s in enumerate(sets):
+      if s[0] != dimensions_hash:
+        remap[i] = len(new_sets)
+        new_sets.append(s)
+    if len(new_sets) == len(sets):
+      return
+    raw_size = sum(_get_set_raw_size(s) for s in new_sets)
+    postings = {}
+    for d, ordinals in (self.postings or {}).iteritems():
+      l = [remap[o] for o in ordinals if o in remap]
+      if l:
+        postings[d] = l
+        raw_size += _get_posting_raw_size(d, l)
+    self.sets = new_sets
+    self.postings = postings
+    self.raw_size = raw_size
+
+  def match_bot(self, bot_dimensions_flat):
+    """Returns the sorted dimensions_hash of the TaskDimensions having at least
+    one set that this bot can run.
+
+    Arguments:
+      bot_dimensions_flat: list of 'key:value' as returned by
+          dimensions_to_flat().
+    """
+    postings = self.postings or {}
+    hits = {}
+    for d in bot_dimensions_flat:
+      for o in postings.get(d, ()):
+        hits[o] = hits.get(o, 0) + 1
+    sets = self.sets
+    return sorted(
+        set(sets[o][0] for o, count in hits.iteritems() if count == sets[o][1]))
+
+  def _add(self, task_dimensions):
+    if self.sets is None:
+      self.sets = []
+    if self.postings is None:
+      self.postings = {}
+    if self.raw_size is None:
+      self.raw_size = self._get_raw_size()
+    dimensions_hash = task_dimensions.key.integer_id()
+    for s in task_dimensions.sets:
+      ordinal = len(self.sets)
+      self.sets.append([dimensions_hash, len(s.dimensions_flat)])
+      self.raw_size += _get_set_raw_size(self.sets[-1])
+      for d in s.dimensions_flat:
+        if d not in self.postings:
+          self.raw_size += _get_posting_raw_size(d, [])
+        self.postings.setdefault(d, []).append(ordinal)
+        self.raw_size += len(str(ordinal)) + 2
+
+  def _get_raw_size(self):
+    """Returns the upper bound of the JSON size of sets and postings."""
+    return (
+        sum(_get_set_raw_size(s) for s in self.sets or []) +
+        sum(
+            _get_posting_raw_size(d, l)
+            for d, l in (self.postings or {}).iteritems()))
+
+  def _get_size(self):
+    """Returns the size of the compressed sets and postings."""
+    return sum(
+        len(zlib.compress(json.dumps(v))) for v in (self.sets, self.postings))
+
+  def _pre_put_hook(self):
+    super(TaskDimensionsIndex, self)._pre_put_hook()
+    if self.key.integer_id() != 1:
+      raise datastore_errors.BadValueError(
+          '%s.key.id must be 1' % self.__class__.__name__)
+    if self.overflow:
+      return
+    if self.raw_size is None:
+      self.raw_size = self._get_raw_size()
+    if self.raw_size <= max(_MAX_INDEX_SIZE, self.checked_size or 0):
+      return
+    size = self._get_size()
+    if size <= _MAX_INDEX_SIZE:
+      self.checked_size = self.raw_size + _MAX_INDEX_SIZE - size
+      return
+    logging.warning(
+        'TaskDimensionsIndex for %s is too large with %d sets; disabling it',
+        self.key.parent().string_id(), len(self.sets or []))
+    self.overflow = True
+    self.overflow_ts = utils.utcnow()
+    self.sets = []
+    self.postings = {}
+    self.raw_size = None
+    self.checked_size = None
+
+
 ### Private APIs.
 
 
@@ -292,18 +457,48 @@ def _validate_dimensions_flat(obj):
         '%s.dimensions_flat must be sorted' % obj.__class__.__name__)
 
 
-def _get_task_queries_for_bot(bot_dimensions):
-  """Returns all the ndb.Query for TaskDimensions relevant for this bot.
+def _get_task_roots_for_bot(bot_dimensions):
+  """Returns all the TaskDimensionsRoot ndb.Key relevant for this bot.
 
-  In practice it returns one query for the bot id and one per pool.
+  In practice it returns one key for the bot id and one per pool.
   """
   ancestors = [ndb.Key(TaskDimensionsRoot, u'id:' + bot_dimensions[u'id'][0])]
   for pool in bot_dimensions['pool']:
     ancestors.append(ndb.Key(TaskDimensionsRoot, u'pool:' + pool))
-  # These are consistent queries because they use an ancestor. The old entries
-  # are removed by cron job /internal/cron/task_queues_tidy triggered every N
-  # minutes (see cron.yaml).
-  return [TaskDimensions.query(ancestor=a) for a in ancestors]
+  return ancestors
+
+
+def _get_set_raw_size(s):
+  """Returns the upper bound of the JSON size of a TaskDimensionsIndex.sets
+  item.
+  """
+  # '[<hash>, <len>], '
+  return len(str(s[0])) + len(str(s[1])) + 6
+
+
+def _get_posting_raw_size(d, ordinals):
+  """Returns the upper bound of the JSON size of a TaskDimensionsIndex.postings
+  item.
+  """
+  # '"<d>": [<ordinal>, ...], '
+  return len(json.dumps(d)) + 6 + sum(len(str(o)) + 2 for o in ordinals)
+
+
+def _get_index_key(root_key):
+  """Returns the TaskDimensionsIndex ndb.Key for this TaskDimensionsRoot."""
+  return ndb.Key(TaskDimensionsIndex, 1, parent=root_key)
+
+
+def _build_TaskDimensionsIndex(root_key):
+  """Returns a new TaskDimensionsIndex for all the TaskDimensions in this root.
+
+  This is a linear scan, only done when the index is first created or retried
+  after it overflowed.
+  """
+  index = TaskDimensionsIndex(key=_get_index_key(root_key))
+  for task_dimensions in TaskDimensions.query(ancestor=root_key):
+    index._add(task_dimensions)
+  return index
 
 
 def _cap_futures(futures):
@@ -344,55 +539,94 @@ def _delete_stale_BotTaskDimensions(bot_dimensions, bot_root_key, cleaned):
       cleaned[0] += 1
 
 
+@ndb.tasklet
+def _match_TaskDimensions_async(
+    bot_dimensions, bot_root_key, now, matches, task_dimensions):
+  """Stores a BotTaskDimensions if this TaskDimensions can run on this bot."""
+  # match_bot() returns a TaskDimensionsSet if there's a match.
+  s = task_dimensions.match_bot(bot_dimensions)
+  if s and s.valid_until_ts >= now:
+    # Valid TaskDimensionsSet.
+    dimensions_hash = task_dimensions.key.integer_id()
+    # Reuse TaskDimensionsSet.valid_until_ts.
+    obj = BotTaskDimensions(
+        id=dimensions_hash, parent=bot_root_key,
+        valid_until_ts=s.valid_until_ts,
+        dimensions_flat=s.dimensions_flat)
+    yield obj.put_async()
+    matches.append(dimensions_hash)
+
+
 @ndb.tasklet
 def _update_BotTaskDimensions_slice(
-    bot_dimensions, bot_root_key, now, matches, q):
-  """Updates BotTaskDimensions for task queues with the TaskDimensions query for
-  this bot.
+    bot_dimensions, bot_root_key, now, matches, root_key):
+  """Updates BotTaskDimensions for task queues with a linear scan of the
+  TaskDimensions under this root for this bot.
 
-  The TaskDimension ndb.Query is either rooted on the bot id or one of its pool.
+  The TaskDimensionsRoot is either the bot id or one of its pool.
 
   The expected total number of TaskDimensions is in the tens or few hundreds, as
   it depends on all the kinds of different task dimensions that this bot could
   run that are ACTIVE queues, e.g. TaskDimensions.valid_until_ts is in the
   future.
   """
+  # This is a consistent query because it uses an ancestor. The old entries are
+  # removed by cron job /internal/cron/task_queues_tidy triggered every N
+  # minutes (see cron.yaml).
+  q = TaskDimensions.query(ancestor=root_key)
   qit = q.iter(batch_size=100, deadline=15)
   while (yield qit.has_next_async()):
-    task_dimensions = qit.next()
-    # match_bot() returns a TaskDimensionsSet if there's a match.
-    s = task_dimensions.match_bot(bot_dimensions)
-    if s and s.valid_until_ts >= now:
-      # Valid TaskDimensionsSet.
-      dimensions_hash = task_dimensions.key.integer_id()
-      # Reuse TaskDimensionsSet.valid_until_ts.
-      obj = BotTaskDimensions(
-          id=dimensions_hash, parent=bot_root_key,
-          valid_until_ts=s.valid_until_ts,
-          dimensions_flat=s.dimensions_flat)
-      yield obj.put_async()
-      matches.append(dimensions_hash)
+    yield _match_TaskDimensions_async(
+        bot_dimensions, bot_root_key, now, matches, qit.next())
+
+
+@ndb.tasklet
+def _update_BotTaskDimensions_indexed(
+    bot_dimensions, bot_root_key, now, matches, index):
+  """Updates BotTaskDimensions for task queues with the TaskDimensionsIndex of
+  a root for this bot.
+
+  Only the TaskDimensions listed by the index as candidates are fetched, with a
+  single get_multi.
+  """
+  root_key = index.key.parent()
+  candidates = index.match_bot(dimensions_to_flat(bot_dimensions))
+  entities = yield ndb.get_multi_async(
+      ndb.Key(TaskDimensions, h, parent=root_key) for h in candidates)
+  yield [
+    _match_TaskDimensions_async(
+        bot_dimensions, bot_root_key, now, matches, task_dimensions)
+    for task_dimensions in entities if task_dimensions
+  ]
 
 
 @ndb.tasklet
 def _update_BotTaskDimensions(bot_dimensions, bot_root_key, now, matches):
   """Updates all task queues known for this bot."""
   # There's one per pool plus one for the bot id.
-  yield [
-    _update_BotTaskDimensions_slice(
-        bot_dimensions, bot_root_key, now, matches, q)
-    for q in _get_task_queries_for_bot(bot_dimensions)
-  ]
+  roots = _get_task_roots_for_bot(bot_dimensions)
+  indexes = yield ndb.get_multi_async(_get_index_key(r) for r in roots)
+  futures = []
+  for root_key, index in zip(roots, indexes):
+    if index and not index.overflow:
+      futures.append(_update_BotTaskDimensions_indexed(
+          bot_dimensions, bot_root_key, now, matches, index))
+    else:
+      futures.append(_update_BotTaskDimensions_slice(
+          bot_dimensions, bot_root_key, now, matches, root_key))
+  yield futures
 
 
 @ndb.tasklet
 def _rebuild_bot_cache_async(bot_dimensions, bot_root_key):
   """Rebuilds the BotTaskDimensions cache for a single bot.
 
-  This is done by a linear scan for all the TaskDimensions under the
-  TaskDimensionsRoot entities with key id 'id:<bot_id>' and 'pool:<pool>', for
-  each pool exposed by the bot. Only the TaskDimensions with TaskDimensionsRoot
-  id with bot's id or the bot's pool are queried, not *all* TaskDimensions.
+  This is done by a lookup in the TaskDimensionsIndex of the TaskDimensionsRoot
+  entities with key id 'id:<bot_id>' and 'pool:<pool>', for each pool exposed by
+  the bot. When a root has no index yet, it falls back to a linear scan of all
+  the TaskDimensions under this root. Only the TaskDimensions with
+  TaskDimensionsRoot id with bot's id or the bot's pool are queried, not *all*
+  TaskDimensions.
 
   Normally bots are in one or an handful of pools so the number of queries
   should be relatively low. This is all ancestor queries, so they are
@@ -471,6 +705,12 @@ def _remove_old_entity_async(key, now):
     obj = yield key.get_async()
     if obj and obj.valid_until_ts < now:
       yield key.delete_async()
+      if key.kind() == TaskDimensions._get_kind():
+        # Keep the index in sync, it is in the same entity group.
+        index = yield _get_index_key(key.parent()).get_async()
+        if index:
+          index.remove(key.integer_id())
+          yield index.put_async()
       raise ndb.Return(key)
 
   res = yield datastore_utils.transaction_async(
@@ -903,14 +1143,28 @@ def rebuild_task_cache(payload):
     updated += sum(1 for i in _flush_futures(pending) if i)
 
     # Done updating, now store the entity. Must use a transaction as there could
-    # be other dimensions set in the entity.
+    # be other dimensions set in the entity. The TaskDimensionsIndex is in the
+    # same entity group so it is updated in the same transaction.
     task_dims_key = _get_task_dims_key(dimensions_hash, dimensions)
+    index_key = _get_index_key(task_dims_key.parent())
     def run():
-      obj = task_dims_key.get()
+      obj, index = ndb.get_multi([task_dims_key, index_key])
+      to_put = []
+      if not index or (
+          index.overflow and
+          (index.overflow_ts or utils.EPOCH) <= now - _INDEX_OVERFLOW_RETRY):
+        # First time this root is indexed, or the root may have shrunk since the
+        # index overflowed. Index all the existing entities. The overflow is
+        # cleared if it fits now.
+        index = _build_TaskDimensionsIndex(task_dims_key.parent())
+        to_put.append(index)
       if not obj:
         obj = TaskDimensions(key=task_dims_key)
       if obj.assert_request(now, valid_until_ts, dimensions_flat):
-        obj.put()
+        index.update(obj)
+        to_put = [obj, index]
+      if to_put:
+        ndb.put_multi(to_put)
       return obj
 
     try:
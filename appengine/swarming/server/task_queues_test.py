@@ -6,6 +6,7 @@
 
 import datetime
 import hashlib
+import json
 import logging
 import os
 import sys
@@ -167,6 +168,43 @@ class TaskQueuesApiTest(test_env_handlers.AppTestBase):
         ]).put()
     cls(sets=[setcls(valid_until_ts=now, dimensions_flat=['a:b'])]).put()
 
+  def test_TaskDimensionsIndex(self):
+    now = datetime.datetime(2010, 1, 2, 3, 4, 5)
+    root_key = ndb.Key(task_queues.TaskDimensionsRoot, u'pool:default')
+    def gen(dimensions_hash, *sets):
+      return task_queues.TaskDimensions(
+          id=dimensions_hash, parent=root_key,
+          sets=[
+            task_queues.TaskDimensionsSet(
+                valid_until_ts=now, dimensions_flat=list(s))
+            for s in sets
+          ])
+
+    index = task_queues.TaskDimensionsIndex(id=1, parent=root_key)
+    index.update(gen(1, [u'os:Linux', u'pool:default']))
+    index.update(
+        gen(2, [u'pool:default'], [u'gpu:none', u'os:Mac', u'pool:default']))
+    index.put()
+    index = index.key.get()
+    self.assertEqual([1, 2], index.match_bot([u'os:Linux', u'pool:default']))
+    self.assertEqual([2], index.match_bot([u'os:Mac', u'pool:default']))
+    self.assertEqual([], index.match_bot([u'os:Linux']))
+
+    # Updating replaces the sets.
+    index.update(gen(2, [u'gpu:none', u'os:Mac', u'pool:default']))
+    self.assertEqual([1], index.match_bot([u'os:Linux', u'pool:default']))
+    self.assertEqual(
+        [2], index.match_bot([u'gpu:none', u'os:Mac', u'pool:default']))
+
+    index.remove(1)
+    self.assertEqual([[2, 3]], index.sets)
+    self.assertEqual([], index.match_bot([u'os:Linux', u'pool:default']))
+    self.assertEqual(
+        [2], index.match_bot([u'gpu:none', u'os:Mac', u'pool:default']))
+
+    with self.assertRaises(datastore_errors.BadValueError):
+      task_queues.TaskDimensionsIndex(id=2, parent=root_key).put()
+
   def assert_count(self, count, entity):
     actual = entity.query().count()
     if actual != count:
@@ -370,6 +408,104 @@ class TaskQueuesApiTest(test_env_handlers.AppTestBase):
     bot_root_key = bot_management.get_root_key(u'bot1')
     self.assertEqual([2980491642], task_queues.get_queues(bot_root_key))
 
+  def test_assert_task_index(self):
+    self._assert_task()
+    self.assert_count(1, task_queues.TaskDimensionsIndex)
+    index = task_queues.TaskDimensionsIndex.query().get()
+    self.assertEqual(u'pool:default', index.key.parent().string_id())
+    self.assertEqual([[2980491642, 3]], index.sets)
+    self.assertEqual(
+        [2980491642],
+        index.match_bot(
+            [u'cpu:x86-64', u'id:bot1', u'os:Ubuntu-16.04', u'pool:default']))
+
+  def test_assert_task_then_bot_without_index(self):
+    # Roots created before the index existed are still scanned.
+    self._assert_task()
+    task_queues.TaskDimensionsIndex.query().get().key.delete()
+    self.assertEqual(1, _assert_bot())
+    bot_root_key = bot_management.get_root_key(u'bot1')
+    self.assertEqual([2980491642], task_queues.get_queues(bot_root_key))
+
+  def test_assert_task_then_bot_index_stale(self):
+    # A TaskDimensions listed in the index but deleted is ignored.
+    self._assert_task()
+    task_queues.TaskDimensions.query().get().key.delete()
+    self.assertEqual(0, _assert_bot())
+    self.assert_count(0, task_queues.BotTaskDimensions)
+
+  def test_assert_task_then_bot_index_overflow(self):
+    # An index too large to be stored is disabled, the root is scanned instead.
+    self.mock(task_queues, '_MAX_INDEX_SIZE', 10)
+    self._assert_task()
+    index = task_queues.TaskDimensionsIndex.query().get()
+    self.assertTrue(index.overflow)
+    self.assertEqual([], index.sets)
+    self.assertEqual(1, _assert_bot())
+    bot_root_key = bot_management.get_root_key(u'bot1')
+    self.assertEqual([2980491642], task_queues.get_queues(bot_root_key))
+
+  def test_assert_task_index_overflow_cleared(self):
+    # An overflowed index is rebuilt once _INDEX_OVERFLOW_RETRY passed, and is
+    # enabled again if it fits.
+    now = utils.utcnow()
+    self.mock(task_queues, '_MAX_INDEX_SIZE', 10)
+    self._assert_task()
+    self.assertTrue(task_queues.TaskDimensionsIndex.query().get().overflow)
+    self.mock(task_queues, '_MAX_INDEX_SIZE', 900*1024)
+
+    def assert_task(os_dim):
+      request = _gen_request(
+          properties=_gen_properties(
+              dimensions={u'os': [os_dim], u'pool': [u'default']}))
+      task_queues.assert_task(request)
+      self.assertEqual(1, self.execute_tasks())
+      return task_queues.TaskDimensionsIndex.query().get()
+
+    # Too early.
+    self.mock_now(now, 60)
+    index = assert_task(u'Ubuntu-18.04')
+    self.assertTrue(index.overflow)
+    self.assertEqual([], index.sets)
+
+    self.mock_now(now, 60*60)
+    index = assert_task(u'Ubuntu-20.04')
+    self.assertFalse(index.overflow)
+    self.assertEqual(3, len(index.sets))
+    self.assertEqual(
+        [2980491642],
+        index.match_bot(
+            [u'cpu:x86-64', u'id:bot1', u'os:Ubuntu-16.04', u'pool:default']))
+
+  def test_assert_task_index_raw_size(self):
+    # The compressed size is only computed when the index could be too large.
+    calls = []
+    get_size = task_queues.TaskDimensionsIndex._get_size
+    def _get_size(index):
+      calls.append(index)
+      return get_size(index)
+    self.mock(task_queues.TaskDimensionsIndex, '_get_size', _get_size)
+    self._assert_task()
+    self.assertEqual([], calls)
+    index = task_queues.TaskDimensionsIndex.query().get()
+    self.assertEqual(index._get_raw_size(), index.raw_size)
+    self.assertLessEqual(
+        len(json.dumps(index.sets)) + len(json.dumps(index.postings)),
+        index.raw_size)
+
+    # Once over _MAX_INDEX_SIZE, the compressed size is checked once, then only
+    # when the raw size grew by the remaining room.
+    index._add(task_queues.TaskDimensions.query().get())
+    size = get_size(index)
+    self.assertLess(size, index.raw_size - 1)
+    self.mock(task_queues, '_MAX_INDEX_SIZE', index.raw_size - 1)
+    index.put()
+    self.assertEqual(1, len(calls))
+    self.assertFalse(index.overflow)
+    self.assertEqual(2*index.raw_size - 1 - size, index.checked_size)
+    index.put()
+    self.assertEqual(1, len(calls))
+
   def test_assert_bot_then_task_with_id(self):
     # Assert a task that includes an 'id' dimension. No task queue is triggered
     # in this case, rebuild_task_cache() is called inlined.
@@ -460,6 +596,8 @@ class TaskQueuesApiTest(test_env_handlers.AppTestBase):
     self.assert_count(0, task_queues.BotTaskDimensions)
     self.assert_count(0, task_queues.TaskDimensions)
     self.assertEqual([], task_queues.get_queues(bot_root_key))
+    # The index is kept but is now empty.
+    self.assertEqual([], task_queues.TaskDimensionsIndex.query().get().sets)
 
 
 if __name__ == '__main__':
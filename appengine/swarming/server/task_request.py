@@ -69,7 +69,6 @@ from components.config import validation
 from proto.api import swarming_pb2
 from server import bq_state
 from server import config
-from server import directory_occlusion
 from server import pools_config
 from server import service_accounts
 from server import task_pack
@@ -1233,6 +1232,63 @@ def _get_automatic_tags(request):
   return tags
 
 
+def _get_bq_callbacks():
+  """Returns the callbacks for bq_state to export TaskRequest.
+
+  Returns:
+    tuple(get_oldest_key, get_rows, fetch_rows, key_to_ts, ts_to_key).
+  """
+  fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
+  def _convert(e):
+    """Returns a tuple(db_key, bq_key, row)."""
+    out = swarming_pb2.TaskRequest()
+    e.to_proto(out)
+    return (e.created_ts.strftime(fmt), e.task_id, out)
+
+  def get_oldest_key():
+    """Returns a tuple(db_key, bq_key)."""
+    # BigQuery requires partitioned table to not insert items older than 365
+    # days old. The problem with going back all the way to 364 days is that
+    # churning through the backlog can take a *long* time, so only go back 7
+    # days.
+    cutoff = (utils.utcnow() - datetime.timedelta(days=7))
+    cutoff = datetime.datetime(cutoff.year, cutoff.month, cutoff.day)
+    oldest = TaskRequest.query(TaskRequest.created_ts >= cutoff).order(
+        TaskRequest.created_ts).get()
+    if not oldest:
+      return None, None
+    # Since the query is an inequality > (and not >=), go back in time.
+    return (
+      (oldest.created_ts - datetime.timedelta(seconds=1)).strftime(fmt),
+      oldest.task_id,
+    )
+
+  def get_rows(db_key, _bq_key, size):
+    """Returns a list of tuple(db_key, bq_key, row)."""
+    earliest = datetime.datetime.strptime(db_key, fmt)
+    return [
+        _convert(e) for e in
+        TaskRequest.query(TaskRequest.created_ts > earliest).order(
+            TaskRequest.created_ts).fetch(limit=size)
+        if e
+    ]
+
+  def fetch_rows(_db_keys, bq_keys):
+    """Returns a list of tuple(db_key, bq_key, row)."""
+    keys = (task_pack.unpack_request_key(k[:-1]) for k in bq_keys)
+    return [_convert(e) for e in ndb.get_multi(keys) if e]
+
+  def key_to_ts(db_key, _bq_key):
+    """Returns the timestamp of a row."""
+    return datetime.datetime.strptime(db_key, fmt)
+
+  def ts_to_key(ts):
+    """Returns a tuple(db_key, bq_key) usable as get_rows() start position."""
+    return ts.strftime(fmt), u''
+
+  return get_oldest_key, get_rows, fetch_rows, key_to_ts, ts_to_key
+
+
 ### Public API.
 
 
@@ -1391,7 +1447,7 @@ def _select_task_template(pool, template_apply):
       enum controlling application of the deployment.
 
   Returns:
-    (TaskTemplate, extra_tags) if there's a template to apply or else
+    (CompiledTaskTemplate, extra_tags) if there's a template to apply or else
     (None, extra_tags).
   """
   if not pool:
@@ -1424,7 +1480,9 @@ def _select_task_template(pool, template_apply):
   to_apply = deployment.canary if canary else deployment.prod
 
   tags += ('swarming.pool.template:%s' % ('canary' if canary else 'prod'),)
-  return to_apply, tags
+  if not to_apply:
+    return None, tags
+  return pools_config.compile_task_template(to_apply, pool_cfg.rev), tags
 
 
 def _apply_task_template(task_template, props):
@@ -1433,61 +1491,58 @@ def _apply_task_template(task_template, props):
   Modifies `props` in-place.
 
   Args:
-    task_template (pools_config.TaskTemplate|None) - The template to apply. If
-      None, then this function returns without modifying props.
+    task_template (pools_config.CompiledTaskTemplate|None) - The template to
+      apply. If None, then this function returns without modifying props.
     props (TaskProperties) - The task properties to modify.
   """
   if task_template is None:
     return
 
-  assert isinstance(task_template, pools_config.TaskTemplate)
+  assert isinstance(task_template, pools_config.CompiledTaskTemplate)
   assert isinstance(props, TaskProperties)
 
-  for envvar in task_template.env:
-    var_name = envvar.var
-
-    if not envvar.soft:
-      if var_name in (props.env or {}):
-        raise ValueError(
-            'request.env[%r] conflicts with pool\'s template' % var_name)
-      if var_name in (props.env_prefixes or {}):
-        raise ValueError(
-            'request.env_prefixes[%r] conflicts with pool\'s template'
-            % var_name)
+  for var_name in task_template.hard_env:
+    if var_name in (props.env or {}):
+      raise ValueError(
+          'request.env[%r] conflicts with pool\'s template' % var_name)
+    if var_name in (props.env_prefixes or {}):
+      raise ValueError(
+          'request.env_prefixes[%r] conflicts with pool\'s template'
+          % var_name)
 
-    if envvar.value:
-      props.env = props.env or {}
-      props.env[var_name] = props.env.get(var_name, '') or envvar.value
+  if task_template.env:
+    props.env = props.env or {}
+    for var_name, value in task_template.env:
+      props.env[var_name] = props.env.get(var_name, '') or value
 
-    if envvar.prefix:
-      props.env_prefixes = props.env_prefixes or {}
+  if task_template.env_prefixes:
+    props.env_prefixes = props.env_prefixes or {}
+    for var_name, prefix in task_template.env_prefixes:
       props.env_prefixes[var_name] = (
-          list(envvar.prefix) + props.env_prefixes.get(var_name, []))
-
-  reserved_cache_names = set()
-  occlude_checker = directory_occlusion.Checker()
-  # Add all task template paths.
-  for cache in task_template.cache:
-    reserved_cache_names.add(cache.name)
-    occlude_checker.add(cache.path, 'task template cache %r' % cache.name, '')
-  for cp in task_template.cipd_package:
-    occlude_checker.add(
-        cp.path, 'task template cipd', '%s:%s' % (cp.pkg, cp.version))
-
-  # Add all task paths, avoiding spurious initializations in the underlying
-  # TaskProperties (repeated fields auto-initialize to [] when looped over).
-  for cache in (props.caches or ()):
-    if cache.name in reserved_cache_names:
+          list(prefix) + props.env_prefixes.get(var_name, []))
+
+  # Avoid spurious initializations in the underlying TaskProperties (repeated
+  # fields auto-initialize to [] when looped over).
+  caches = props.caches or ()
+  packages = props.cipd_input.packages or () if props.cipd_input else ()
+  for cache in caches:
+    if cache.name in task_template.cache_names:
       raise ValueError(
           'request.cache[%r] conflicts with pool\'s template' % cache.name)
-    occlude_checker.add(cache.path, 'task cache %r' % cache.name, '')
-  for cp in (props.cipd_input.packages or () if props.cipd_input else ()):
-    occlude_checker.add(
-        cp.path, 'task cipd', '%s:%s' % (cp.package_name, cp.version))
 
-  ctx = validation.Context()
-  if occlude_checker.conflicts(ctx):
-    raise ValueError('\n'.join(m.text for m in ctx.result().messages))
+  if caches or packages:
+    # The template paths were validated with pools.cfg, so only check the
+    # task paths against them.
+    occlude_checker = task_template.checker.copy()
+    for cache in caches:
+      occlude_checker.add(cache.path, 'task cache %r' % cache.name, '')
+    for cp in packages:
+      occlude_checker.add(
+          cp.path, 'task cipd', '%s:%s' % (cp.package_name, cp.version))
+
+    ctx = validation.Context()
+    if occlude_checker.conflicts(ctx):
+      raise ValueError('\n'.join(m.text for m in ctx.result().messages))
 
   for cache in task_template.cache:
     props.caches.append(CacheEntry(name=cache.name, path=cache.path))
@@ -1690,45 +1745,15 @@ def cron_send_to_bq():
   Returns:
     total number of task requests sent to BQ.
   """
-  fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
-  def _convert(e):
-    """Returns a tuple(db_key, bq_key, row)."""
-    out = swarming_pb2.TaskRequest()
-    e.to_proto(out)
-    return (e.created_ts.strftime(fmt), e.task_id, out)
-
-  def get_oldest_key():
-    """Returns a tuple(db_key, bq_key)."""
-    # BigQuery requires partitioned table to not insert items older than 365
-    # days old. The problem with going back all the way to 364 days is that
-    # churning through the backlog can take a *long* time, so only go back 7
-    # days.
-    cutoff = (utils.utcnow() - datetime.timedelta(days=7))
-    cutoff = datetime.datetime(cutoff.year, cutoff.month, cutoff.day)
-    oldest = TaskRequest.query(TaskRequest.created_ts >= cutoff).order(
-        TaskRequest.created_ts).get()
-    if not oldest:
-      return None, None
-    # Since the query is an inequality > (and not >=), go back in time.
-    return (
-      (oldest.created_ts - datetime.timedelta(seconds=1)).strftime(fmt),
-      oldest.task_id,
-    )
+  return bq_state.cron_send_to_bq('task_requests', *_get_bq_callbacks())
 
-  def get_rows(db_key, _bq_key, size):
-    """Returns a list of tuple(db_key, bq_key, row)."""
-    earliest = datetime.datetime.strptime(db_key, fmt)
-    return [
-        _convert(e) for e in
-        TaskRequest.query(TaskRequest.created_ts > earliest).order(
-            TaskRequest.created_ts).fetch(limit=size)
-        if e
-    ]
 
-  def fetch_rows(_db_keys, bq_keys):
-    """Returns a list of tuple(db_key, bq_key, row)."""
-    keys = (task_pack.unpack_request_key(k[:-1]) for k in bq_keys)
-    return [_convert(e) for e in ndb.get_multi(keys) if e]
+def task_send_to_bq(start, end):
+  """Sends the TaskRequest created in a time range to BigQuery.
 
-  return bq_state.cron_send_to_bq(
-      'task_requests', get_oldest_key, get_rows, fetch_rows)
+  Returns:
+    True if all the task requests in the range were sent.
+  """
+  _, get_rows, fetch_rows, key_to_ts, ts_to_key = _get_bq_callbacks()
+  return bq_state.send_shard_to_bq(
+      'task_requests', start, end, get_rows, fetch_rows, key_to_ts, ts_to_key)
@@ -4,6 +4,7 @@
 # that can be found in the LICENSE file.
 
 import datetime
+import json
 import logging
 import random
 import string
@@ -147,18 +148,18 @@ def _gen_task_template(cache=None, cipd_package=None, env=None):
     return pools_config.Env(var, value, tuple(map(unicode, prefix)), soft)
 
   return pools_config.TaskTemplate(
-    cache=sorted(
+    cache=tuple(sorted(
       pools_config.CacheEntry(unicode(name), unicode(path))
       for name, path in (cache or {}).iteritems()
-    ),
-    cipd_package=sorted(
+    )),
+    cipd_package=tuple(sorted(
       pools_config.CipdPackage(unicode(path), unicode(pkg), unicode(version))
       for (path, pkg), version in (cipd_package or {}).iteritems()
-    ),
-    env=sorted(
+    )),
+    env=tuple(sorted(
       env_value(unicode(var), value)
       for var, value in (env or {}).iteritems()
-    ),
+    )),
     inclusions=(),
   )
 
@@ -189,7 +190,8 @@ class TaskRequestPrivateTest(TestCase):
       env={'ENV': ('1', ['a'])},
     )
     p = task_request.TaskProperties()
-    task_request._apply_task_template(tt, p)
+    task_request._apply_task_template(
+        pools_config.compile_task_template(tt), p)
     self.assertEqual(p, task_request.TaskProperties(
       env={u'ENV': u'1'},
       env_prefixes={u'ENV': [u'a']},
@@ -203,7 +205,8 @@ class TaskRequestPrivateTest(TestCase):
     tt = _gen_task_template(env={'ENV': ('1', ['a'])})
     p = task_request.TaskProperties(env={u'ENV': u'10'})
     with self.assertRaises(ValueError) as ex:
-      task_request._apply_task_template(tt, p)
+      task_request._apply_task_template(
+          pools_config.compile_task_template(tt), p)
     self.assertEqual(
         ex.exception.message,
         "request.env[u'ENV'] conflicts with pool's template")
@@ -212,7 +215,8 @@ class TaskRequestPrivateTest(TestCase):
     tt = _gen_task_template(env={'ENV': ('1', ['a'])})
     p = task_request.TaskProperties(env_prefixes={u'ENV': [u'b']})
     with self.assertRaises(ValueError) as ex:
-      task_request._apply_task_template(tt, p)
+      task_request._apply_task_template(
+          pools_config.compile_task_template(tt), p)
     self.assertEqual(
         ex.exception.message,
         "request.env_prefixes[u'ENV'] conflicts with pool's template")
@@ -220,7 +224,8 @@ class TaskRequestPrivateTest(TestCase):
   def test_apply_template_env_override_soft(self):
     tt = _gen_task_template(env={'ENV': ('1', ['a'], True)})
     p = task_request.TaskProperties(env={u'ENV': u'2'})
-    task_request._apply_task_template(tt, p)
+    task_request._apply_task_template(
+        pools_config.compile_task_template(tt), p)
     self.assertEqual(p, task_request.TaskProperties(
         env={u'ENV': u'2'},
         env_prefixes={u'ENV': [u'a']},
@@ -229,7 +234,8 @@ class TaskRequestPrivateTest(TestCase):
   def test_apply_template_env_prefixes_append_soft(self):
     tt = _gen_task_template(env={'ENV': ('1', ['a'], True)})
     p = task_request.TaskProperties(env_prefixes={u'ENV': [u'b']})
-    task_request._apply_task_template(tt, p)
+    task_request._apply_task_template(
+        pools_config.compile_task_template(tt), p)
     self.assertEqual(p, task_request.TaskProperties(
       env={u'ENV': u'1'},
       env_prefixes={u'ENV': [u'a', u'b']},
@@ -240,7 +246,8 @@ class TaskRequestPrivateTest(TestCase):
     p = task_request.TaskProperties(
       caches=[task_request.CacheEntry(name='c', path='B')])
     with self.assertRaises(ValueError) as ex:
-      task_request._apply_task_template(tt, p)
+      task_request._apply_task_template(
+          pools_config.compile_task_template(tt), p)
     self.assertEqual(
         ex.exception.message,
         "request.cache['c'] conflicts with pool's template")
@@ -250,7 +257,8 @@ class TaskRequestPrivateTest(TestCase):
     p = task_request.TaskProperties(
       caches=[task_request.CacheEntry(name='other', path='C')])
     with self.assertRaises(ValueError) as ex:
-      task_request._apply_task_template(tt, p)
+      task_request._apply_task_template(
+          pools_config.compile_task_template(tt), p)
     self.assertEqual(
         ex.exception.message,
         "u'C': directory has conflicting owners: task cache 'other' "
@@ -264,7 +272,8 @@ class TaskRequestPrivateTest(TestCase):
               task_request.CipdPackage(
                 path='C', package_name='pkg', version='latest')]))
     with self.assertRaises(ValueError) as ex:
-      task_request._apply_task_template(tt, p)
+      task_request._apply_task_template(
+          pools_config.compile_task_template(tt), p)
     self.assertEqual(
         ex.exception.message,
         "u'C': directory has conflicting owners: task cipd['pkg:latest'] "
@@ -278,7 +287,8 @@ class TaskRequestPrivateTest(TestCase):
               task_request.CipdPackage(
                 path='C', package_name='other', version='latest')]))
     with self.assertRaises(ValueError) as ex:
-      task_request._apply_task_template(tt, p)
+      task_request._apply_task_template(
+          pools_config.compile_task_template(tt), p)
     self.assertEqual(
         ex.exception.message,
         "u'C': directory has conflicting owners: task cipd['other:latest'] "
@@ -289,7 +299,8 @@ class TaskRequestPrivateTest(TestCase):
     p = task_request.TaskProperties(
       caches=[task_request.CacheEntry(name='other', path='C')])
     with self.assertRaises(ValueError) as ex:
-      task_request._apply_task_template(tt, p)
+      task_request._apply_task_template(
+          pools_config.compile_task_template(tt), p)
     self.assertEqual(
         ex.exception.message,
         "u'C': directory has conflicting owners: task cache 'other' "
@@ -1668,7 +1679,9 @@ class TaskRequestApiTest(TestCase):
       self.assertEqual(task_request.bq_state.bqh.INSERT_ROWS_SCOPE, scopes)
       self.assertEqual(600, deadline)
       return {'insertErrors': []}
-    self.mock(task_request.bq_state.net, 'json_request', json_request)
+    self.mock(
+        task_request.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
 
     # Generate two tasks requests.
     now = datetime.datetime(2014, 1, 2, 3, 4, 5, 6)
@@ -1714,6 +1727,97 @@ class TaskRequestApiTest(TestCase):
     # Next cron skips everything that was processed.
     self.assertEqual(0, task_request.cron_send_to_bq())
 
+  def test_cron_send_to_bq_catch_up(self):
+    # A backlog older than bq_state._CATCH_UP_THRESHOLD is split in time shards
+    # sent by task queue workers.
+    enqueued = []
+    def enqueue_task(url, queue_name, payload, name):
+      enqueued.append((url, queue_name, json.loads(payload), name))
+      return True
+    self.mock(task_request.bq_state.utils, 'enqueue_task', enqueue_task)
+    lags = []
+    self.mock(
+        task_request.bq_state, '_lag_callbacks',
+        [lambda table_name, lag: lags.append(lag)])
+    self.mock(
+        task_request.bq_state.net, 'json_request_async',
+        ndb.tasklet(lambda **_kwargs: {'insertErrors': []}))
+
+    now = datetime.datetime(2014, 1, 2, 3, 4, 5, 6)
+    self.mock_now(now, 10)
+    request_1 = _gen_request()
+    request_1.key = task_request.new_request_key()
+    request_1.put()
+    self.mock_now(now, 10 + 2*60*60)
+
+    # Nothing is left for the cron job itself.
+    self.assertEqual(0, task_request.cron_send_to_bq())
+    url = '/internal/taskqueue/bq-catch-up/task_requests'
+    expected = [
+      (url, 'bq-catch-up',
+       {u'start': u'2014-01-02T03:04:14.000006Z',
+        u'end': u'2014-01-02T03:34:14.000006Z'},
+       'task-requests-20140102030414000006-20140102033414000006'),
+      (url, 'bq-catch-up',
+       {u'start': u'2014-01-02T03:34:14.000006Z',
+        u'end': u'2014-01-02T04:04:14.000006Z'},
+       'task-requests-20140102033414000006-20140102040414000006'),
+      (url, 'bq-catch-up',
+       {u'start': u'2014-01-02T04:04:14.000006Z',
+        u'end': u'2014-01-02T04:34:14.000006Z'},
+       'task-requests-20140102040414000006-20140102043414000006'),
+      (url, 'bq-catch-up',
+       {u'start': u'2014-01-02T04:34:14.000006Z',
+        u'end': u'2014-01-02T04:59:15.000006Z'},
+       'task-requests-20140102043414000006-20140102045915000006'),
+    ]
+    self.assertEqual(expected, enqueued)
+    state = task_request.bq_state.BqState.get_by_id('task_requests')
+    self.assertEqual(u'2014-01-02T04:59:15.000006Z', state.last_db_key)
+    # The lag accounts for the shards still pending.
+    self.assertEqual([2*60*60 + 1.], lags)
+
+    # Once the shards are sent, only the cron job's own lag is left.
+    for _, _, payload, _ in enqueued:
+      self.assertEqual(
+          True, task_request.task_send_to_bq(payload['start'], payload['end']))
+    self.assertEqual(0, task_request.cron_send_to_bq())
+    self.assertEqual([2*60*60 + 1., 5*60.], lags)
+
+  def test_task_send_to_bq(self):
+    payloads = []
+    def json_request(url, method, payload, scopes, deadline):
+      # pylint: disable=unused-argument
+      payloads.append(payload)
+      return {'insertErrors': []}
+    self.mock(
+        task_request.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
+
+    now = datetime.datetime(2014, 1, 2, 3, 4, 5, 6)
+    self.mock_now(now, 10)
+    request_1 = _gen_request()
+    request_1.key = task_request.new_request_key()
+    request_1.put()
+    self.mock_now(now, 20)
+    request_2 = _gen_request()
+    request_2.key = task_request.new_request_key()
+    request_2.put()
+    self.mock_now(now, 30)
+
+    # Only the first one is in the time shard.
+    start = u'2014-01-02T03:04:05.000006Z'
+    self.assertEqual(
+        True,
+        task_request.task_send_to_bq(start, u'2014-01-02T03:04:15.000006Z'))
+    self.assertEqual(1, len(payloads))
+    self.assertEqual(
+        [request_1.task_id], [r['insertId'] for r in payloads[0]['rows']])
+    # The shard state is kept once done.
+    self.assertEqual(
+        True,
+        task_request.bq_state.BqState.get_by_id('task_requests:' + start).done)
+
   def test_cron_send_to_bq_fail(self):
     # Test the failure code path.
     def getrandbits(i):
@@ -1747,7 +1851,9 @@ class TaskRequestApiTest(TestCase):
           ],
         }
       return {'insertErrors': []}
-    self.mock(task_request.bq_state.net, 'json_request', json_request)
+    self.mock(
+        task_request.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
 
     # Generate two tasks requests.
     now = datetime.datetime(2014, 1, 2, 3, 4, 5, 6)
@@ -13,6 +13,8 @@ store tasks results.
   be multiple tries for one job, for example if a bot dies.
 - The stdout of the task is saved under TaskOutput, chunked in TaskOutputChunk
   entities to fit the entity size limit.
+- TaskDedupIndex maps the properties hash of an idempotent task to its latest
+  successful TaskResultSummary, so deduplication is a keyed lookup.
 
 Graph of schema:
 
@@ -69,9 +71,11 @@ import datetime
 import logging
 import random
 import re
+import zlib
 
 from google.appengine import runtime
 from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
 from google.appengine.datastore import datastore_query
 from google.appengine.ext import ndb
 
@@ -97,6 +101,32 @@ import cipd
 # bot processes run at higher priority.
 BOT_PING_TOLERANCE = datetime.timedelta(seconds=6*60)
 
+# TaskResultSummary counters, kept in memcache, see
+# get_result_summaries_count(). Tasks are counted per tag, state and hour of
+# creation.
+_COUNTERS_NAMESPACE = 'TaskResultSummary.counters'
+_COUNTERS_BUCKET = datetime.timedelta(hours=1)
+# Number of shards of each counter, to spread the updates of hot counters. A
+# task always updates the same shard.
+_COUNTERS_SHARDS = 4
+# Each shard is stored with this bias added, since memcache values can't go
+# below 0 and a shard may be decremented by more than its own increments.
+_COUNTERS_BIAS = 1 << 40
+# The counters are recounted from the DB at least this often, which bounds the
+# drift caused by an update racing with a recount between its put and its
+# offset of the counters.
+_COUNTERS_EXPIRATION = 24*60*60
+# Only the tasks created less than this long ago are counted from the counters.
+# This is far below _OLD_TASK_REQUEST_CUT_OFF in task_request.py, so deleted
+# tasks never need to be decremented.
+_COUNTERS_MAX_AGE = datetime.timedelta(days=30)
+# Maximum duration of the recount of a counter from the DB, while its lock is
+# held.
+_COUNTERS_LOCK_EXPIRATION = 60
+# When more buckets than this have to be counted from the DB, count the whole
+# range at once instead.
+_COUNTERS_MAX_MISSING = 24
+
 
 class State(object):
   """Represents the current task state.
@@ -200,7 +230,7 @@ class TaskOutput(ndb.Model):
   This entity doesn't actually exist in the DB. It only exists to make
   categories.
   """
-  # The maximum size for each TaskOutputChunk.chunk. The rationale is that
+  # The maximum size for each TaskOutputChunk. The rationale is that
   # appending data to an entity requires reading it first, so it must not be too
   # big. On the other hand, having thousands of small entities is pure overhead.
   # TODO(maruel): This value was selected from guts feeling. Do proper load
@@ -218,46 +248,106 @@ class TaskOutput(ndb.Model):
   PUT_MAX_CHUNKS = PUT_MAX_CONTENT / CHUNK_SIZE
 
   # Hard limit on the amount of data returned by get_output_async() at once.
-  # Eventually, we'll want to add support for chunked fetch, if desired. Because
-  # CHUNK_SIZE is hardcoded, it's not exactly 16Mb.
+  # Use iter_output() to read more. Because CHUNK_SIZE is hardcoded, it's not
+  # exactly 16Mb.
   FETCH_MAX_CONTENT = 16*1000*1024
 
   # Maximum number of chunks to fetch at once.
   FETCH_MAX_CHUNKS = FETCH_MAX_CONTENT / CHUNK_SIZE
 
+  # Number of chunks fetched per batch by iter_output().
+  ITER_CHUNKS = 8
+
   # It is easier if there is no remainder for efficiency.
   assert (PUT_MAX_CONTENT % CHUNK_SIZE) == 0
   assert (FETCH_MAX_CONTENT % CHUNK_SIZE) == 0
 
   @classmethod
   @ndb.tasklet
-  def get_output_async(cls, output_key, number_chunks):
-    """Returns the stdout for the task as a ndb.Future."""
+  def get_output_async(cls, output_key, number_chunks, offset=0, length=None):
+    """Returns the stdout for the task as a ndb.Future.
+
+    Only the TaskOutputChunk overlapping the requested range are fetched.
+
+    Arguments:
+      output_key: ndb.Key to TaskOutput.
+      number_chunks: number of TaskOutputChunk for this output.
+      offset: byte offset to start reading from.
+      length: maximum number of bytes to return, capped at FETCH_MAX_CONTENT.
+    """
     # TODO(maruel): Save number_chunks locally in this entity.
     if not number_chunks:
       raise ndb.Return(None)
+    if length is None or length > cls.FETCH_MAX_CONTENT:
+      length = cls.FETCH_MAX_CONTENT
+    out = yield cls._get_range_async(output_key, number_chunks, offset, length)
+    raise ndb.Return(out)
+
+  @classmethod
+  def iter_output(cls, output_key, number_chunks, offset=0, length=None):
+    """Yields the stdout for the task as str, a few chunks at a time.
+
+    There is no size limit. The next batch of TaskOutputChunk is fetched while
+    the current one is being consumed.
+    """
+    end = number_chunks * cls.CHUNK_SIZE
+    if length is not None:
+      end = min(end, offset + length)
+    window = cls.ITER_CHUNKS * cls.CHUNK_SIZE
+
+    def fetch(start):
+      # Align the batches on the chunks.
+      stop = min(end, (start / window + 1) * window)
+      return stop, cls._get_range_async(
+          output_key, number_chunks, start, stop - start)
+
+    if offset >= end:
+      return
+    stop, future = fetch(offset)
+    while future:
+      data = future.get_result()
+      expected = stop - offset
+      offset = stop
+      future = None
+      if len(data) == expected and offset < end:
+        stop, future = fetch(offset)
+      if data:
+        yield data
 
-    number_chunks = min(number_chunks, cls.FETCH_MAX_CHUNKS)
+  @classmethod
+  @ndb.tasklet
+  def _get_range_async(cls, output_key, number_chunks, offset, length):
+    """Returns up to length bytes of the stdout starting at offset."""
+    first = offset / cls.CHUNK_SIZE
+    last = min(number_chunks, (offset + length + cls.CHUNK_SIZE - 1) /
+               cls.CHUNK_SIZE)
+    if first >= last:
+      raise ndb.Return('')
 
     # TODO(maruel): Always get one more than necessary, in case number_chunks
     # is invalid. If there's an unexpected TaskOutputChunk entity present,
     # continue fetching for more incrementally.
-    parts = []
+    chunks = []
     for f in ndb.get_multi_async(
         _output_key_to_output_chunk_key(output_key, i)
-        for i in xrange(number_chunks)):
+        for i in xrange(first, last)):
       chunk = yield f
-      parts.append(chunk.chunk if chunk else None)
+      chunks.append(chunk if chunk and chunk.data_size else None)
 
-    # Trim ending empty chunks.
-    while parts and not parts[-1]:
-      parts.pop()
+    if last == number_chunks:
+      # Trim ending empty chunks.
+      while chunks and not chunks[-1]:
+        chunks.pop()
 
-    # parts is now guaranteed to not end with an empty chunk.
-    # Replace any missing chunk.
-    for i in xrange(len(parts)):
-      if not parts[i]:
-        parts[i] = '\x00' * cls.CHUNK_SIZE
+    # chunks is now guaranteed to not end with an empty chunk.
+    # Replace any missing chunk. Only decompress the requested range.
+    parts = []
+    for i, chunk in enumerate(chunks):
+      base = (first + i) * cls.CHUNK_SIZE
+      start = max(offset - base, 0)
+      end = min(offset + length - base, cls.CHUNK_SIZE)
+      parts.append(
+          chunk.get_data(start, end) if chunk else '\x00' * (end - start))
     raise ndb.Return(''.join(parts))
 
 
@@ -268,18 +358,103 @@ class TaskOutputChunk(ndb.Model):
   since 0 is not a valid id.
 
   Each entity except the last one must have exactly
-  len(self.chunk) == self.CHUNK_SIZE.
+  data_size == TaskOutput.CHUNK_SIZE.
+
+  The data is stored as a series of independently compressed frames, so
+  appending to the chunk doesn't require recompressing the previous data and
+  reading a range only decompresses the frames overlapping it. Entities written
+  before frames were introduced store the data in chunk instead.
+
+  Deploy constraint: versions predating frames only read and write chunk. As
+  long as WRITE_LEGACY_CHUNK is True, chunk is written along frames and is the
+  authoritative copy when set, since an old version appending to it leaves
+  frames stale. Only set WRITE_LEGACY_CHUNK to False once no serving version
+  predates frames, otherwise they would read the new chunks as empty.
   """
+  # Legacy storage, compressed as a whole. When set, it takes precedence over
+  # frames.
   chunk = ndb.BlobProperty(default='', compressed=True)
   # gaps is a series of 2 integer pairs, which specifies the part that are
   # invalid. Normally it should be empty. All values are relative to the start
   # of this chunk offset.
   gaps = ndb.IntegerProperty(repeated=True, indexed=False)
+  # Concatenation of the zlib compressed frames.
+  frames = ndb.BlobProperty(default='')
+  # frame_index is a series of 2 integer pairs, one per frame: the offset of
+  # the frame in the uncompressed data and its offset in frames.
+  frame_index = ndb.IntegerProperty(repeated=True, indexed=False)
+  # Size of the uncompressed data stored in frames.
+  size = ndb.IntegerProperty(default=0, indexed=False)
+
+  # Once there are more frames than this, they are merged into one to keep the
+  # compression ratio and the index size in check.
+  MAX_FRAMES = 32
+
+  # TODO(maruel): Set to False once all the versions of the server read frames,
+  # so appends stop recompressing the whole chunk.
+  WRITE_LEGACY_CHUNK = True
 
   @property
   def chunk_number(self):
     return self.key.integer_id() - 1
 
+  @property
+  def data_size(self):
+    """Size of the uncompressed data."""
+    return len(self.chunk) if self.chunk else self.size
+
+  def get_data(self, start=0, end=None):
+    """Returns the uncompressed data in [start, end)."""
+    if self.chunk or not self.frame_index:
+      return self.chunk[start:end]
+    if end is None or end > self.size:
+      end = self.size
+    if start >= end:
+      return ''
+    parts = []
+    first_offset = None
+    nb_frames = len(self.frame_index) / 2
+    for i in xrange(nb_frames):
+      raw_start = self.frame_index[2*i]
+      raw_end = (
+          self.frame_index[2*i+2] if i + 1 < nb_frames else self.size)
+      if raw_end <= start:
+        continue
+      if raw_start >= end:
+        break
+      if first_offset is None:
+        first_offset = raw_start
+      comp_end = (
+          self.frame_index[2*i+3] if i + 1 < nb_frames else len(self.frames))
+      parts.append(
+          zlib.decompress(self.frames[self.frame_index[2*i+1]:comp_end]))
+    return ''.join(parts)[start-first_offset:end-first_offset]
+
+  def append_data(self, data):
+    """Appends data at the end as a new frame."""
+    if self.chunk or len(self.frame_index) / 2 >= self.MAX_FRAMES:
+      # Convert the legacy storage, discarding frames that may be stale.
+      self.set_data(self.get_data() + data)
+    else:
+      self._add_frame(data)
+      if self.WRITE_LEGACY_CHUNK:
+        self.chunk = self.get_data()
+
+  def set_data(self, data):
+    """Replaces the whole data, stored as a single frame."""
+    self.chunk = data if self.WRITE_LEGACY_CHUNK else ''
+    self.frames = ''
+    self.frame_index = []
+    self.size = 0
+    self._add_frame(data)
+
+  def _add_frame(self, data):
+    if not data:
+      return
+    self.frame_index.extend((self.size, len(self.frames)))
+    self.frames += zlib.compress(data)
+    self.size += len(data)
+
 
 class OperationStats(ndb.Model):
   """Statistics for an operation.
@@ -779,25 +954,37 @@ class _TaskResultCommon(ndb.Model):
     if not self.server_versions or self.server_versions[-1] != server_version:
       self.server_versions.append(server_version)
 
-  def get_output(self):
+  def get_output(self, offset=0, length=None):
     """Returns the output, either as str or None if no output is present."""
-    return self.get_output_async().get_result()
+    return self.get_output_async(offset, length).get_result()
 
   @ndb.tasklet
-  def get_output_async(self):
+  def get_output_async(self, offset=0, length=None):
     """Returns the stdout as a ndb.Future.
 
     Use out.get_result() to get the data as a str or None if no output is
-    present.
+    present. At most TaskOutput.FETCH_MAX_CONTENT bytes are returned.
     """
     if not self.run_result_key or not self.stdout_chunks:
       # The task was not reaped or no output was streamed for this index yet.
       raise ndb.Return(None)
 
     output_key = _run_result_key_to_output_key(self.run_result_key)
-    out = yield TaskOutput.get_output_async(output_key, self.stdout_chunks)
+    out = yield TaskOutput.get_output_async(
+        output_key, self.stdout_chunks, offset, length)
     raise ndb.Return(out)
 
+  def iter_output(self, offset=0, length=None):
+    """Yields the stdout as str, a few chunks at a time.
+
+    Contrary to get_output(), there is no size limit.
+    """
+    if not self.run_result_key or not self.stdout_chunks:
+      return iter(())
+    output_key = _run_result_key_to_output_key(self.run_result_key)
+    return TaskOutput.iter_output(
+        output_key, self.stdout_chunks, offset, length)
+
   def _pre_put_hook(self):
     """Use extra validation that cannot be validated throught 'validator'."""
     super(_TaskResultCommon, self)._pre_put_hook()
@@ -1126,6 +1313,72 @@ class TaskResultSummary(_TaskResultCommon):
   def to_dict(self):
     return super(TaskResultSummary, self).to_dict(exclude=['properties_hash'])
 
+  @classmethod
+  def _from_pb(cls, pb, set_key=True, ent=None, key=None):
+    ent = super(TaskResultSummary, cls)._from_pb(pb, set_key, ent, key)
+    if not ent._projection:
+      # Remember what is counted for this task, to update the counters on the
+      # next put.
+      ent._counted = (ent.state, tuple(ent.tags))
+      # Remember if the dedup index already points to this task.
+      ent._indexed_hash = ent.properties_hash
+    return ent
+
+  def _pre_put_hook(self):
+    super(TaskResultSummary, self)._pre_put_hook()
+    # The context of the put, to know in _post_put_hook() if it is part of a
+    # transaction.
+    self._put_context = ndb.get_context()
+    properties_hash = self.properties_hash
+    if (properties_hash and self.key and
+        properties_hash != getattr(self, '_indexed_hash', None)):
+      # The task just completed successfully. Only point the dedup index to it
+      # once the transaction, if any, succeeded.
+      self._indexed_hash = properties_hash
+      key = self.key
+      created_ts = self.created_ts
+      ndb.get_context().call_on_commit(
+          lambda: put_dedup_index(properties_hash, key, created_ts))
+
+  def _post_put_hook(self, future):
+    super(TaskResultSummary, self)._post_put_hook(future)
+    if future.get_exception():
+      return
+    counted = (self.state, tuple(self.tags))
+    deltas = _get_counters_deltas(getattr(self, '_counted', None), counted)
+    if not deltas:
+      return
+    key = future.get_result()
+    created_ts = self.created_ts
+    def update():
+      _offset_counters(key, created_ts, deltas)
+      # Only remembered once counted, so a retried transaction counts again.
+      self._counted = counted
+    # Only update the counters once the transaction, if any, succeeded.
+    context = getattr(self, '_put_context', None) or ndb.get_context()
+    if context.in_transaction():
+      context.call_on_commit(update)
+    else:
+      update()
+
+
+class TaskDedupIndex(ndb.Model):
+  """Points to the latest successful result of an idempotent task.
+
+  Key id: hex encoded TaskProperties.properties_hash(). It is a root entity so
+  it can be fetched by key, from memcache most of the time, when a new task is
+  scheduled.
+
+  It is overwritten each time a task with the same properties completes
+  successfully. The TaskResultSummary must still be checked as this entity may
+  be stale.
+  """
+  result_summary_key = ndb.KeyProperty(kind='TaskResultSummary', indexed=False)
+  # TaskResultSummary.created_ts of the result. The result expires
+  # config.settings().reusable_task_age_secs after it. The setting is evaluated
+  # upon lookup, as it may change.
+  created_ts = ndb.DateTimeProperty(indexed=False)
+
 
 class TagValues(ndb.Model):
   tag = ndb.StringProperty()
@@ -1145,6 +1398,28 @@ class TagAggregation(ndb.Model):
 ### Private stuff.
 
 
+# Name of the state filter of each state, as accepted by _filter_query().
+_STATE_FILTERS = {
+  State.RUNNING: 'running',
+  State.PENDING: 'pending',
+  State.EXPIRED: 'expired',
+  State.TIMED_OUT: 'timed_out',
+  State.BOT_DIED: 'bot_died',
+  State.CANCELED: 'canceled',
+  State.COMPLETED: 'completed',
+  State.KILLED: 'killed',
+  State.NO_RESOURCE: 'no_resource',
+}
+
+
+# Counters to sum for each state filter supported by the counters.
+_COUNTED_STATES = {
+  'all': ('all',),
+  'pending_running': ('pending', 'running'),
+}
+_COUNTED_STATES.update((v, (v,)) for v in _STATE_FILTERS.itervalues())
+
+
 def _run_result_key_to_output_key(run_result_key):
   """Returns a ndb.key to a TaskOutput."""
   assert run_result_key.kind() == 'TaskRunResult', run_result_key
@@ -1229,10 +1504,15 @@ def _output_append(output_key, number_chunks, output, output_chunk_start):
     chunk = entities[i]
     # Magically combine everything.
     end = start + len(output)
-    if len(chunk.chunk) < start:
-      # Insert blank data automatically.
-      chunk.gaps.extend((len(chunk.chunk), start))
-      chunk.chunk = chunk.chunk + '\x00' * (start-len(chunk.chunk))
+    size = chunk.data_size
+    if size <= start:
+      # Append, the common case. Only a new frame is compressed.
+      if size < start:
+        # Insert blank data automatically.
+        chunk.gaps.extend((size, start))
+        output = '\x00' * (start-size) + output
+      chunk.append_data(output)
+      continue
 
     # Strip gaps that are being written to.
     new_gaps = []
@@ -1266,7 +1546,8 @@ def _output_append(output_key, number_chunks, output, output_chunk_start):
         new_gaps.extend((gap_start, gap_end))
 
     chunk.gaps = new_gaps
-    chunk.chunk = chunk.chunk[:start] + output + chunk.chunk[end:]
+    data = chunk.get_data()
+    chunk.set_data(data[:start] + output + data[end:])
   return entities, number_chunks
 
 
@@ -1364,6 +1645,211 @@ def _filter_query(cls, q, start, end, sort, state):
   raise ValueError('Invalid state')
 
 
+def _get_counters_deltas(previous, current):
+  """Returns the counters to update when a TaskResultSummary changes.
+
+  Arguments:
+    previous: tuple(state, tags) counted for this task or None if it is new.
+    current: tuple(state, tags) to count for this task.
+
+  Returns:
+    dict((tag, state filter): delta). tag is '' for the total.
+  """
+  deltas = collections.defaultdict(int)
+  if previous:
+    for tag in ('',) + previous[1]:
+      deltas[(tag, _STATE_FILTERS[previous[0]])] -= 1
+  else:
+    for tag in ('',) + current[1]:
+      deltas[(tag, 'all')] += 1
+  for tag in ('',) + current[1]:
+    deltas[(tag, _STATE_FILTERS[current[0]])] += 1
+  return {k: v for k, v in deltas.iteritems() if v}
+
+
+def _get_counters_bucket(ts):
+  """Returns the start of the counters bucket containing ts."""
+  return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _get_counter_keys(tag, state, bucket):
+  """Returns the memcache keys of the shards of a counter."""
+  return [
+    '%s|%s|%s|%d' % (tag, state, bucket.strftime('%Y-%m-%dT%H'), i)
+    for i in xrange(_COUNTERS_SHARDS)
+  ]
+
+
+def _get_counter_generation_key(keys):
+  """Returns the memcache key incremented on every update of a counter."""
+  return '%s|gen' % keys[0].rsplit('|', 1)[0]
+
+
+def _offset_counters(key, created_ts, deltas):
+  """Updates the counters of a task in memcache.
+
+  Offsetting an evicted shard is a no-op. The counter is then recounted from
+  the DB on the next read, see _count_from_counters().
+  """
+  shard = key.parent().integer_id() % _COUNTERS_SHARDS
+  bucket = _get_counters_bucket(created_ts)
+  offsets = {}
+  for (tag, state), delta in deltas.iteritems():
+    keys = _get_counter_keys(tag, state, bucket)
+    offsets[keys[shard]] = delta
+    # Tells a concurrent recount that it may have counted this update.
+    offsets[_get_counter_generation_key(keys)] = 1
+  try:
+    memcache.offset_multi(offsets, namespace=_COUNTERS_NAMESPACE)
+  except Exception as e:  # pylint: disable=broad-except
+    # Never fail a put because of the counters.
+    logging.warning('Failed to update the counters: %s', e)
+
+
+def _recount_counter(keys, lock, q):
+  """Counts from the DB a counter that has a missing shard and saves it back.
+
+  A task updated while counting may or may not be seen by the query, while its
+  offset is applied to the shards either way. So the generation of the counter
+  is snapshotted before the shards are reset, and the counter is discarded if
+  it changed by the time the count is saved. The next read recounts it.
+  Readers ignore the counter while its lock is held.
+  """
+  if not memcache.add(
+      lock, 1, time=_COUNTERS_LOCK_EXPIRATION, namespace=_COUNTERS_NAMESPACE):
+    # Another request is recounting it.
+    return q.count()
+  try:
+    gen_key = _get_counter_generation_key(keys)
+    memcache.add(
+        gen_key, 0, time=_COUNTERS_EXPIRATION, namespace=_COUNTERS_NAMESPACE)
+    gen = memcache.get(gen_key, namespace=_COUNTERS_NAMESPACE)
+    memcache.set_multi(
+        {k: _COUNTERS_BIAS for k in keys},
+        time=_COUNTERS_EXPIRATION, namespace=_COUNTERS_NAMESPACE)
+    value = q.count()
+    memcache.offset_multi({keys[0]: value}, namespace=_COUNTERS_NAMESPACE)
+    if (gen is None or
+        memcache.get(gen_key, namespace=_COUNTERS_NAMESPACE) != gen):
+      memcache.delete_multi(keys, namespace=_COUNTERS_NAMESPACE)
+    return value
+  finally:
+    memcache.delete(lock, namespace=_COUNTERS_NAMESPACE)
+
+
+def _count_from_counters(start, end, state, tag):
+  """Returns the number of tasks created in [start, end) from the counters.
+
+  start and end must be aligned on _COUNTERS_BUCKET. A counter with a missing
+  shard is recounted from the DB.
+
+  Returns:
+    The count or None if too many counters are missing.
+  """
+  buckets = []
+  bucket = start
+  while bucket < end:
+    buckets.append(bucket)
+    bucket += _COUNTERS_BUCKET
+  counters = []
+  for b in buckets:
+    for s in _COUNTED_STATES[state]:
+      keys = _get_counter_keys(tag, s, b)
+      counters.append((s, b, keys, '%s|lock' % keys[0].rsplit('|', 1)[0]))
+  values = memcache.get_multi(
+      [k for _, _, keys, lock in counters for k in keys + [lock]],
+      namespace=_COUNTERS_NAMESPACE)
+  missing = [
+    c for c in counters
+    if c[3] in values or not all(k in values for k in c[2])
+  ]
+  if len(missing) > _COUNTERS_MAX_MISSING:
+    return None
+
+  count = sum(
+      values[k] - _COUNTERS_BIAS
+      for c in counters if c not in missing for k in c[2])
+  for s, b, keys, lock in missing:
+    q = get_result_summaries_query(
+        b, b + _COUNTERS_BUCKET, 'created_ts', s, [tag] if tag else [])
+    count += _recount_counter(keys, lock, q)
+  return count
+
+
+def _get_bq_callbacks():
+  """Returns the callbacks for bq_state to export TaskRunResult.
+
+  Returns:
+    tuple(get_oldest_key, get_rows, fetch_rows, key_to_ts, ts_to_key).
+  """
+  fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
+  def _convert(e):
+    """Converts a TaskRunResult to a tuple(db_key, bq_key, row)."""
+    out = swarming_pb2.TaskResult()
+    e.to_proto(out)
+    if not e.ended_ts:
+      # Inconsistent query. This is extremely rare, a TaskRunResult was returned
+      # from the _yield_done_tasks() query but e.ended_ts isn't set after all
+      # due to an inconsistency in the database.
+      return None, None, None
+    return (e.ended_ts.strftime(fmt), e.task_id, out)
+
+  def get_oldest_key():
+    """Returns a tuple(db_key, bq_key)."""
+    # BigQuery requires partitioned table to not insert items older than 365
+    # days old. The problem with going back all the way to 364 days is that
+    # churning through the backlog can take a *long* time, so only go back 7
+    # days.
+    cutoff = (utils.utcnow() - datetime.timedelta(days=7))
+    cutoff = datetime.datetime(cutoff.year, cutoff.month, cutoff.day)
+    oldest = TaskRunResult.query(TaskRunResult.completed_ts >= cutoff).order(
+        TaskRunResult.completed_ts).get()
+    if not oldest:
+      return None, None
+    # Since the query is an inequality > (and not >=), go back in time 1 second
+    # to not discard the very first entity.
+    return (
+      (oldest.completed_ts - datetime.timedelta(seconds=1)).strftime(fmt),
+      oldest.task_id,
+    )
+
+  def _convert_all(entities):
+    """Converts TaskRunResult in batch, returns a list of tuple(db_key, bq_key,
+    row).
+    """
+    entities = [e for e in entities if e]
+    # Fetch all the TaskRequest at once instead of one at a time in to_proto().
+    requests = ndb.get_multi(e.request_key for e in entities)
+    for e, r in zip(entities, requests):
+      # pylint: disable=protected-access
+      e._request_cache = r
+    # Ignore _convert() failure.
+    return [r for r in (_convert(e) for e in entities) if r[0]]
+
+  def get_rows(db_key, _bq_key, size):
+    """Returns a list of tuple(db_key, bq_key, row)."""
+    # bq_key is not usable here, see get_oldest_key() to see why.
+    earliest = datetime.datetime.strptime(db_key, fmt)
+    return _convert_all(
+        TaskRunResult.query(TaskRunResult.completed_ts > earliest).order(
+            TaskRunResult.completed_ts).fetch(limit=size))
+
+  def fetch_rows(_db_keys, bq_keys):
+    """Returns a list of tuple(db_key, bq_key, row)."""
+    return _convert_all(ndb.get_multi(
+        task_pack.unpack_run_result_key(k) for k in bq_keys))
+
+  def key_to_ts(db_key, _bq_key):
+    """Returns the timestamp of a row."""
+    return datetime.datetime.strptime(db_key, fmt)
+
+  def ts_to_key(ts):
+    """Returns a tuple(db_key, bq_key) usable as get_rows() start position."""
+    return ts.strftime(fmt), u''
+
+  return get_oldest_key, get_rows, fetch_rows, key_to_ts, ts_to_key
+
+
 ### Public API.
 
 
@@ -1412,6 +1898,18 @@ def new_run_result(request, to_run, bot_id, bot_version, bot_dimensions):
       server_versions=[utils.get_app_version()])
 
 
+def put_dedup_index(properties_hash, result_summary_key, created_ts):
+  """Points the TaskDedupIndex of properties_hash to a successful result."""
+  try:
+    TaskDedupIndex(
+        id=properties_hash.encode('hex'),
+        result_summary_key=result_summary_key,
+        created_ts=created_ts).put()
+  except datastore_errors.Error as e:
+    # Never fail a put because of the index; the task won't be reused.
+    logging.warning('Failed to update the dedup index: %s', e)
+
+
 def yield_run_result_keys_with_dead_bot():
   """Yields all the TaskRunResult ndb.Key where the bot died recently.
 
@@ -1476,6 +1974,44 @@ def get_result_summaries_query(start, end, sort, state, tags):
   return _filter_query(TaskResultSummary, q, start, end, sort, state)
 
 
+def get_result_summaries_count(start, end, state, tags):
+  """Returns the number of TaskResultSummary matching these filters.
+
+  Whole hours of the last _COUNTERS_MAX_AGE are summed from counters maintained
+  by TaskResultSummary._post_put_hook(). The partial hours at both ends, older
+  tasks, filters not supported by the counters and counters evicted from
+  memcache are counted from the DB.
+
+  Arguments:
+    start: Earliest creation date of counted tasks.
+    end: Most recent creation date of counted tasks, or None for now.
+    state: One of State enum value as str. Use 'all' to count all tasks.
+    tags: List of search for one or multiple task tags.
+  """
+  def exact(s, e):
+    return get_result_summaries_query(s, e, 'created_ts', state, tags).count()
+
+  now = utils.utcnow()
+  end = end or now
+  if len(tags) > 1 or state not in _COUNTED_STATES:
+    return exact(start, end)
+  earliest = max(start, now - _COUNTERS_MAX_AGE)
+  first = _get_counters_bucket(earliest)
+  if first < earliest:
+    first += _COUNTERS_BUCKET
+  last = _get_counters_bucket(end)
+  if last <= first:
+    return exact(start, end)
+  count = _count_from_counters(first, last, state, tags[0] if tags else '')
+  if count is None:
+    return exact(start, end)
+  if start < first:
+    count += exact(start, first)
+  if last < end:
+    count += exact(last, end)
+  return count
+
+
 def cron_update_tags():
   """Populates TagAggregation entities."""
   seen = {}
@@ -1515,57 +2051,15 @@ def cron_send_to_bq():
   Returns:
     total number of task results sent to BQ.
   """
-  fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
-  def _convert(e):
-    """Converts a TaskRunResult to a tuple(db_key, bq_key, row)."""
-    out = swarming_pb2.TaskResult()
-    e.to_proto(out)
-    if not e.ended_ts:
-      # Inconsistent query. This is extremely rare, a TaskRunResult was returned
-      # from the _yield_done_tasks() query but e.ended_ts isn't set after all
-      # due to an inconsistency in the database.
-      return None, None, None
-    return (e.ended_ts.strftime(fmt), e.task_id, out)
+  return bq_state.cron_send_to_bq('task_results', *_get_bq_callbacks())
 
-  def get_oldest_key():
-    """Returns a tuple(db_key, bq_key)."""
-    # BigQuery requires partitioned table to not insert items older than 365
-    # days old. The problem with going back all the way to 364 days is that
-    # churning through the backlog can take a *long* time, so only go back 7
-    # days.
-    cutoff = (utils.utcnow() - datetime.timedelta(days=7))
-    cutoff = datetime.datetime(cutoff.year, cutoff.month, cutoff.day)
-    oldest = TaskRunResult.query(TaskRunResult.completed_ts >= cutoff).order(
-        TaskRunResult.completed_ts).get()
-    if not oldest:
-      return None, None
-    # Since the query is an inequality > (and not >=), go back in time 1 second
-    # to not discard the very first entity.
-    return (
-      (oldest.completed_ts - datetime.timedelta(seconds=1)).strftime(fmt),
-      oldest.task_id,
-    )
 
-  def get_rows(db_key, _bq_key, size):
-    """Returns a list of tuple(db_key, bq_key, row)."""
-    # bq_key is not usable here, see get_oldest_key() to see why.
-    earliest = datetime.datetime.strptime(db_key, fmt)
-    return [
-        _convert(e) for e in
-        TaskRunResult.query(TaskRunResult.completed_ts > earliest).order(
-            TaskRunResult.completed_ts).fetch(limit=size)
-        if e
-    ]
+def task_send_to_bq(start, end):
+  """Sends the TaskRunResult completed in a time range to BigQuery.
 
-  def fetch_rows(_db_keys, bq_keys):
-    """Returns a list of tuple(db_key, bq_key, row)."""
-    items = (
-      _convert(e)
-      for e in ndb.get_multi(
-          task_pack.unpack_run_result_key(k) for k in bq_keys)
-      if e)
-    # Ignore _convert() failure.
-    return [e for e in items if e[0]]
-
-  return bq_state.cron_send_to_bq(
-      'task_results', get_oldest_key, get_rows, fetch_rows)
+  Returns:
+    True if all the task results in the range were sent.
+  """
+  _, get_rows, fetch_rows, key_to_ts, ts_to_key = _get_bq_callbacks()
+  return bq_state.send_shard_to_bq(
+      'task_results', start, end, get_rows, fetch_rows, key_to_ts, ts_to_key)
@@ -9,6 +9,7 @@ import os
 import random
 import sys
 import unittest
+import zlib
 
 import test_env
 test_env.setup_test_env()
@@ -16,6 +17,7 @@ test_env.setup_test_env()
 from google.protobuf import duration_pb2
 
 from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 import webtest
@@ -821,7 +823,9 @@ class TaskResultApiTest(TestCase):
       self.assertEqual(task_result.bq_state.bqh.INSERT_ROWS_SCOPE, scopes)
       self.assertEqual(600, deadline)
       return {'insertErrors': []}
-    self.mock(task_result.bq_state.net, 'json_request', json_request)
+    self.mock(
+        task_result.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
 
     # Generate two tasks results.
     self.mock_now(self.now, 10)
@@ -897,7 +901,9 @@ class TaskResultApiTest(TestCase):
           ],
         }
       return {'insertErrors': []}
-    self.mock(task_result.bq_state.net, 'json_request', json_request)
+    self.mock(
+        task_result.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
 
     # Generate two tasks results.
     self.mock_now(self.now, 10)
@@ -948,6 +954,219 @@ class TaskResultApiTest(TestCase):
     # Next cron skips everything that was processed.
     self.assertEqual(0, task_result.cron_send_to_bq())
 
+  def test_task_send_to_bq(self):
+    payloads = []
+    def json_request(url, method, payload, scopes, deadline):
+      # pylint: disable=unused-argument
+      payloads.append(payload)
+      return {'insertErrors': []}
+    self.mock(
+        task_result.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
+
+    self.mock_now(self.now, 10)
+    run_result_1 = _gen_result()
+    run_result_1.completed_ts = utils.utcnow()
+    run_result_1.modified_ts = utils.utcnow()
+    run_result_1.put()
+    self.mock_now(self.now, 20)
+    run_result_2 = _gen_result()
+    run_result_2.completed_ts = utils.utcnow()
+    run_result_2.modified_ts = utils.utcnow()
+    run_result_2.put()
+    self.mock_now(self.now, 30)
+
+    # Only the first one is in the time shard.
+    fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
+    start = self.now.strftime(fmt)
+    end = (self.now + datetime.timedelta(seconds=15)).strftime(fmt)
+    self.assertEqual(True, task_result.task_send_to_bq(start, end))
+    self.assertEqual(1, len(payloads))
+    self.assertEqual(
+        [run_result_1.task_id], [r['insertId'] for r in payloads[0]['rows']])
+    # The shard state is kept once done, so the shard isn't sent again.
+    self.assertEqual(
+        True,
+        task_result.bq_state.BqState.get_by_id('task_results:' + start).done)
+    self.assertEqual(True, task_result.task_send_to_bq(start, end))
+    self.assertEqual(1, len(payloads))
+
+  def test_task_send_to_bq_short_page(self):
+    # A page shortened by a skipped row doesn't end the time shard.
+    self.mock(task_result.bq_state, '_MAX_BATCH', 2)
+    payloads = []
+    def json_request(url, method, payload, scopes, deadline):
+      # pylint: disable=unused-argument
+      payloads.append(payload)
+      return {'insertErrors': []}
+    self.mock(
+        task_result.bq_state.net, 'json_request_async',
+        ndb.tasklet(json_request))
+
+    run_results = []
+    for i in xrange(3):
+      self.mock_now(self.now, 10 + i)
+      run_result = _gen_result()
+      run_result.completed_ts = utils.utcnow()
+      run_result.modified_ts = utils.utcnow()
+      run_result.put()
+      run_results.append(run_result)
+    self.mock_now(self.now, 30)
+    # The first one looks inconsistent and is skipped by get_rows().
+    skipped = run_results[0].key
+    self.mock(
+        task_result.TaskRunResult, 'ended_ts',
+        property(lambda e: None if e.key == skipped else e.completed_ts))
+
+    fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
+    start = self.now.strftime(fmt)
+    end = (self.now + datetime.timedelta(seconds=20)).strftime(fmt)
+    self.assertEqual(True, task_result.task_send_to_bq(start, end))
+    self.assertEqual(
+        [r.task_id for r in run_results[1:]],
+        [r['insertId'] for p in payloads for r in p['rows']])
+
+  def test_task_send_to_bq_running(self):
+    # The task is retried while another worker holds the time shard.
+    fmt = u'%Y-%m-%dT%H:%M:%S.%fZ'
+    start = self.now.strftime(fmt)
+    end = (self.now + datetime.timedelta(seconds=15)).strftime(fmt)
+    self.assertTrue(
+        memcache.add(
+            'running', 'yep', namespace='bq_state.task_results:' + start))
+    self.assertEqual(False, task_result.task_send_to_bq(start, end))
+
+  def test_get_result_summaries_count(self):
+    # One task every 30 minutes for 3 hours.
+    keys = []
+    for i in xrange(6):
+      self.mock_now(self.now, i*30*60)
+      result_summary = task_result.new_result_summary(_gen_request())
+      result_summary.modified_ts = utils.utcnow()
+      result_summary.put()
+      keys.append(result_summary.key)
+    now = self.mock_now(self.now, 3*60*60)
+
+    def expire(key):
+      result_summary = key.get()
+      result_summary.state = task_result.State.EXPIRED
+      result_summary.abandoned_ts = now
+      result_summary.completed_ts = now
+      result_summary.modified_ts = now
+      ndb.transaction(result_summary.put)
+    expire(keys[0])
+
+    queries = []
+    old_count = ndb.Query.count
+    def count(q, *args, **kwargs):
+      queries.append(q)
+      return old_count(q, *args, **kwargs)
+    self.mock(ndb.Query, 'count', count)
+    def get(state, tags):
+      del queries[:]
+      return task_result.get_result_summaries_count(
+          self.now, None, state, tags)
+
+    # The counters of the whole hours 04:00 and 05:00 are seeded from the DB.
+    self.assertEqual(6, get('all', []))
+    self.assertEqual(4, len(queries))
+    # Then only the partial hours at both ends are counted from the DB.
+    self.assertEqual(6, get('all', []))
+    self.assertEqual(2, len(queries))
+    self.assertEqual(5, get('pending', []))
+    self.assertEqual(1, get('expired', [u'tag:1']))
+    self.assertEqual(5, get('pending_running', [u'tag:1']))
+
+    # The counters follow the state changes.
+    expire(keys[2])
+    self.assertEqual(4, get('pending', []))
+    self.assertEqual(2, len(queries))
+    self.assertEqual(2, get('expired', [u'tag:1']))
+    self.assertEqual(2, len(queries))
+    self.assertEqual(6, get('all', []))
+
+    # Unsupported filters are counted from the DB.
+    self.assertEqual(0, get('completed_success', []))
+    self.assertEqual(1, len(queries))
+    self.assertEqual(2, get('expired', [u'tag:1', u'pool:default']))
+    self.assertEqual(1, len(queries))
+
+    # Evicted counters are recounted.
+    memcache.flush_all()
+    self.assertEqual(4, get('pending', []))
+    self.assertEqual(4, len(queries))
+
+    # A rolled back update isn't counted, its retry is.
+    result_summary = keys[3].get()
+    result_summary.state = task_result.State.EXPIRED
+    result_summary.abandoned_ts = now
+    result_summary.completed_ts = now
+    result_summary.modified_ts = now
+    def rolled_back():
+      result_summary.put()
+      raise ndb.Rollback()
+    ndb.transaction(rolled_back)
+    self.assertEqual(4, get('pending', []))
+    ndb.transaction(result_summary.put)
+    self.assertEqual(3, get('pending', []))
+    self.assertEqual(2, len(queries))
+
+    # A counter being recounted by another request is ignored.
+    self.assertTrue(memcache.add(
+        '|pending|2014-01-02T04|lock', 1,
+        namespace='TaskResultSummary.counters'))
+    self.assertEqual(3, get('pending', []))
+    self.assertEqual(3, len(queries))
+
+    # Older tasks are counted from the DB.
+    self.mock(task_result, '_COUNTERS_MAX_AGE', datetime.timedelta(hours=2))
+    self.assertEqual(6, get('all', []))
+    self.assertEqual(3, len(queries))
+
+  def test_get_result_summaries_count_recount_race(self):
+    # A task updated while its counter is recounted may be counted by both the
+    # query and the counters offset, so the recount is not saved.
+    self.mock_now(self.now, 60*60)
+    keys = []
+    for _ in xrange(2):
+      result_summary = task_result.new_result_summary(_gen_request())
+      result_summary.modified_ts = utils.utcnow()
+      result_summary.put()
+      keys.append(result_summary.key)
+    now = self.mock_now(self.now, 2*60*60)
+
+    queries = []
+    raced = []
+    old_count = ndb.Query.count
+    def count(q, *args, **kwargs):
+      queries.append(q)
+      if not raced:
+        raced.append(q)
+        # The put is seen by the query and offsets the counters, which were
+        # just reset.
+        result_summary = keys[0].get()
+        result_summary.state = task_result.State.EXPIRED
+        result_summary.abandoned_ts = now
+        result_summary.completed_ts = now
+        result_summary.modified_ts = now
+        ndb.transaction(result_summary.put)
+      return old_count(q, *args, **kwargs)
+    self.mock(ndb.Query, 'count', count)
+    def get(state):
+      del queries[:]
+      return task_result.get_result_summaries_count(
+          self.now, None, state, [])
+
+    # 04:00 is the only whole hour, it is recounted first.
+    self.assertEqual(1, get('pending'))
+    self.assertEqual(3, len(queries))
+    # The racing recount was discarded, it is recounted.
+    self.assertEqual(1, get('pending'))
+    self.assertEqual(3, len(queries))
+    # It is now stored.
+    self.assertEqual(1, get('pending'))
+    self.assertEqual(2, len(queries))
+
   def test_get_result_summaries_query(self):
     # Indirectly tested by API.
     pass
@@ -961,7 +1180,9 @@ class TestOutput(TestCase):
   def assertTaskOutputChunk(self, expected):
     q = task_result.TaskOutputChunk.query().order(
         task_result.TaskOutputChunk.key)
-    self.assertEqual(expected, [t.to_dict() for t in q.fetch()])
+    self.assertEqual(
+        expected,
+        [{'chunk': t.get_data(), 'gaps': t.gaps} for t in q.fetch()])
 
   def test_append_output(self):
     run_result = _gen_result()
@@ -1103,6 +1324,136 @@ class TestOutput(TestCase):
     self.assertTaskOutputChunk(
         [{'chunk': 'Baz\x00Bar\x00FooWow', 'gaps': [3, 4, 7, 8]}])
 
+  def test_append_output_frames(self):
+    self.mock(task_result.TaskOutputChunk, 'WRITE_LEGACY_CHUNK', False)
+    run_result = _gen_result()
+    for i in xrange(3):
+      ndb.put_multi(run_result.append_output('Part%d\n' % i, 6 * i))
+    chunk = task_result.TaskOutputChunk.query().get()
+    # Each append is compressed independently.
+    self.assertEqual('', chunk.chunk)
+    self.assertEqual([0, 0, 6, 14, 12, 28], chunk.frame_index)
+    self.assertEqual(18, chunk.data_size)
+    self.assertEqual('Part0\nPart1\nPart2\n', chunk.get_data())
+    # Only the overlapping frames are decompressed.
+    self.assertEqual('1\nPa', chunk.get_data(10, 14))
+    self.assertEqual('', chunk.get_data(18))
+
+    # An overwrite rewrites a single frame.
+    ndb.put_multi(run_result.append_output('P', 4))
+    chunk = task_result.TaskOutputChunk.query().get()
+    self.assertEqual([0, 0], chunk.frame_index)
+    self.assertEqual('PartP\nPart1\nPart2\n', chunk.get_data())
+
+  def test_append_output_frames_merged(self):
+    run_result = _gen_result()
+    self.mock(task_result.TaskOutputChunk, 'MAX_FRAMES', 2)
+    self.mock(task_result.TaskOutputChunk, 'WRITE_LEGACY_CHUNK', False)
+    for i in xrange(3):
+      ndb.put_multi(run_result.append_output('%d' % i, i))
+    chunk = task_result.TaskOutputChunk.query().get()
+    self.assertEqual([0, 0], chunk.frame_index)
+    self.assertEqual('012', run_result.get_output())
+
+  def test_append_output_dual_write(self):
+    # Until all the versions read frames, chunk is written too so they can
+    # read the output.
+    run_result = _gen_result()
+    for i in xrange(3):
+      ndb.put_multi(run_result.append_output('Part%d\n' % i, 6 * i))
+    chunk = task_result.TaskOutputChunk.query().get()
+    self.assertEqual('Part0\nPart1\nPart2\n', chunk.chunk)
+    self.assertEqual([0, 0], chunk.frame_index)
+    self.assertEqual('Part0\nPart1\nPart2\n', zlib.decompress(chunk.frames))
+
+  def test_get_output_chunk_and_frames(self):
+    # An old version appended to chunk after a new version wrote both, frames
+    # are stale and chunk wins.
+    run_result = _gen_result()
+    ndb.put_multi(run_result.append_output('Part1\n', 0))
+    chunk = task_result.TaskOutputChunk.query().get()
+    self.assertEqual('Part1\n', chunk.chunk)
+    chunk.chunk = 'Part1\nOld\n'
+    chunk.put()
+    self.assertEqual('Part1\nOld\n', run_result.get_output())
+    self.assertEqual('Old', run_result.get_output(6, 3))
+
+    # The next append starts over from chunk.
+    ndb.put_multi(run_result.append_output('New\n', 10))
+    self.assertEqual('Part1\nOld\nNew\n', run_result.get_output())
+    chunk = task_result.TaskOutputChunk.query().get()
+    self.assertEqual([0, 0], chunk.frame_index)
+    self.assertEqual('Part1\nOld\nNew\n', zlib.decompress(chunk.frames))
+
+  def test_append_output_legacy(self):
+    # Entities saved before the frames were introduced are still readable and
+    # are converted on the next append.
+    self.mock(task_result.TaskOutputChunk, 'WRITE_LEGACY_CHUNK', False)
+    run_result = _gen_result()
+    ndb.put_multi(run_result.append_output('Part1\n', 0))
+    key = task_result.TaskOutputChunk.query().get(keys_only=True)
+    task_result.TaskOutputChunk(key=key, chunk='Legacy\n').put()
+    self.assertEqual('Legacy\n', run_result.get_output())
+    self.assertEqual('gacy', run_result.get_output(2, 4))
+
+    ndb.put_multi(run_result.append_output('Part2\n', 7))
+    chunk = key.get()
+    self.assertEqual('', chunk.chunk)
+    self.assertEqual(1, len(chunk.frame_index) / 2)
+    self.assertEqual('Legacy\nPart2\n', run_result.get_output())
+    self.assertTaskOutputChunk([{'chunk': 'Legacy\nPart2\n', 'gaps': []}])
+
+  def test_get_output_range(self):
+    run_result = _gen_result()
+    chunk_size = task_result.TaskOutput.CHUNK_SIZE
+    data = ''.join(chr(ord('a') + i) * chunk_size for i in xrange(3)) + 'end'
+    ndb.put_multi(run_result.append_output(data, 0))
+    self.assertEqual(data, run_result.get_output())
+    self.assertEqual('abbb', run_result.get_output(chunk_size - 1, 4))
+    self.assertEqual('cend', run_result.get_output(3 * chunk_size - 1))
+    self.assertEqual('', run_result.get_output(len(data)))
+
+    # Only the chunks in the range are fetched.
+    keys = []
+    old_get_multi_async = ndb.get_multi_async
+    def get_multi_async(k):
+      k = list(k)
+      keys.extend(k)
+      return old_get_multi_async(k)
+    self.mock(ndb, 'get_multi_async', get_multi_async)
+    self.assertEqual('cen', run_result.get_output(3 * chunk_size - 1, 3))
+    self.assertEqual([3, 4], [k.integer_id() for k in keys])
+
+  def test_get_output_range_large(self):
+    run_result = _gen_result()
+    self.mock(logging, 'error', lambda *_: None)
+    one_mb = '<3Google' * (1024*1024/8)
+    for i in xrange(17):
+      ndb.put_multi(run_result.append_output(one_mb, i*len(one_mb)))
+
+    # Past FETCH_MAX_CONTENT is readable with an offset.
+    max_content = task_result.TaskOutput.FETCH_MAX_CONTENT
+    self.assertEqual(max_content, len(run_result.get_output()))
+    self.assertEqual(
+        17*len(one_mb) - max_content, len(run_result.get_output(max_content)))
+
+  def test_iter_output(self):
+    run_result = _gen_result()
+    self.assertEqual([], list(run_result.iter_output()))
+
+    self.mock(task_result.TaskOutput, 'ITER_CHUNKS', 2)
+    chunk_size = task_result.TaskOutput.CHUNK_SIZE
+    data = ''.join(chr(ord('a') + i) * chunk_size for i in xrange(5)) + 'end'
+    ndb.put_multi(run_result.append_output(data, 0))
+    actual = list(run_result.iter_output())
+    self.assertEqual(data, ''.join(actual))
+    # Batches are aligned on ITER_CHUNKS chunks.
+    self.assertEqual(
+        [2*chunk_size, 2*chunk_size, chunk_size + 3], map(len, actual))
+    actual = list(run_result.iter_output(chunk_size + 1, 2*chunk_size))
+    self.assertEqual(data[chunk_size+1:3*chunk_size+1], ''.join(actual))
+    self.assertEqual([chunk_size - 1, chunk_size + 1], map(len, actual))
+
 
 if __name__ == '__main__':
   logging.basicConfig(
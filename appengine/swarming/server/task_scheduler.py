@@ -42,6 +42,25 @@ from server import task_to_run
 
 _PROBABILITY_OF_QUICK_COMEBACK = 0.05
 
+# Updates carrying only output are appended to the TaskOutputChunk entities
+# without rewriting TaskRunResult and TaskResultSummary, as long as the last
+# checkpoint of these is more recent than this. It must stay well below
+# task_result.BOT_PING_TOLERANCE since cron_handle_bot_died() looks at
+# TaskRunResult.modified_ts.
+_OUTPUT_CHECKPOINT_INTERVAL = datetime.timedelta(seconds=30)
+
+# Number of pending tasks canceled per transaction by cancel_tasks(). Each task
+# is its own entity group and a cross-group transaction is limited to 25 entity
+# groups.
+_CANCEL_GROUP_SIZE = 25
+
+# When task_result.TaskDedupIndex was deployed. Until reusable_task_age_secs
+# after it, a reusable task may have completed before it was indexed, so an
+# index miss falls back to the properties_hash query. Afterward, a miss means
+# there is no task to reuse.
+# TODO(maruel): Remove _query_dupe_task() once this is past for good.
+_DEDUP_INDEX_ROLLOUT_TS = datetime.datetime(2026, 10, 19)
+
 
 def _secs_to_ms(value):
   """Converts a seconds value in float to the number of ms as an integer."""
@@ -484,8 +503,8 @@ def _pubsub_notify(task_id, topic, auth_token, userdata):
     logging.exception('Fatal error when sending PubSub notification')
 
 
-def _find_dupe_task(now, h):
-  """Finds a previously run task that is also idempotent and completed.
+def _query_dupe_task(oldest, h):
+  """Queries for a previously run task that is also idempotent and completed.
 
   Fetch items that can be used to dedupe the task. See the comment for this
   property for more details.
@@ -495,8 +514,6 @@ def _find_dupe_task(now, h):
   is equivalent to decreasing TaskRequest.created_ts, ordering by key works as
   well and doesn't require a composite index.
   """
-  # TODO(maruel): Make a reverse map on successful task completion so this
-  # becomes a simple ndb.get().
   cls = task_result.TaskResultSummary
   q = cls.query(cls.properties_hash==h).order(cls.key)
   for i, dupe_summary in enumerate(q.iter(batch_size=1)):
@@ -507,19 +524,47 @@ def _find_dupe_task(now, h):
         # Indexes are very inconsistent, give up.
         return None
       continue
-
-    # Refuse tasks older than X days. This is due to the isolate server
-    # dropping files.
-    # TODO(maruel): The value should be calculated from the isolate server
-    # setting and be unbounded when no isolated input was used.
-    oldest = now - datetime.timedelta(
-        seconds=config.settings().reusable_task_age_secs)
     if dupe_summary.created_ts <= oldest:
       return None
     return dupe_summary
   return None
 
 
+def _find_dupe_task(now, h):
+  """Finds a previously run task that is also idempotent and completed.
+
+  The TaskDedupIndex is fetched by key, so it is served from memcache most of
+  the time. On an index miss shortly after the index was deployed, a task that
+  completed before may still be reused, so it falls back to querying by
+  properties_hash and backfills the index. See _DEDUP_INDEX_ROLLOUT_TS.
+  """
+  # Refuse tasks older than X days. This is due to the isolate server
+  # dropping files.
+  # TODO(maruel): The value should be calculated from the isolate server
+  # setting and be unbounded when no isolated input was used.
+  oldest = now - datetime.timedelta(
+      seconds=config.settings().reusable_task_age_secs)
+  index = task_result.TaskDedupIndex.get_by_id(h.encode('hex'))
+  if index:
+    if index.created_ts <= oldest:
+      return None
+    dupe_summary = index.result_summary_key.get()
+    # The index may be stale, e.g. the task was deleted.
+    if (dupe_summary and
+        dupe_summary.state == task_result.State.COMPLETED and
+        not dupe_summary.failure):
+      return dupe_summary
+
+  if _DEDUP_INDEX_ROLLOUT_TS <= oldest:
+    # Any reusable task completed after the index was deployed.
+    return None
+  dupe_summary = _query_dupe_task(oldest, h)
+  if dupe_summary:
+    task_result.put_dedup_index(
+        h, dupe_summary.key, dupe_summary.created_ts)
+  return dupe_summary
+
+
 def _dedupe_result_summary(dupe_summary, result_summary, task_slice_index):
   """Copies the results from dupe_summary into result_summary."""
   # PerformanceStats is not copied over, since it's not relevant, nothing
@@ -722,6 +767,55 @@ def _bot_update_tx(
   return result_summary, run_result, None
 
 
+def _can_update_output_only(run_result, bot_id, now):
+  """Returns True if output can be appended without a full update."""
+  return bool(
+      run_result and
+      run_result.bot_id == bot_id and
+      run_result.state == task_result.State.RUNNING and
+      not run_result.killing and
+      run_result.stdout_chunks and
+      run_result.modified_ts and
+      now - run_result.modified_ts < _OUTPUT_CHECKPOINT_INTERVAL)
+
+
+def _bot_update_output_only(run_result_key, bot_id, output, output_chunk_start):
+  """Appends output to a running task without touching the result entities.
+
+  Only the TaskOutputChunk entities are written, so chatty tasks write less
+  data per update. The chunks are in the same entity group as TaskRunResult and
+  TaskResultSummary, so the transaction still contends with the other updates
+  of the task. modified_ts and cost_usd are updated at the next checkpoint.
+
+  Returns:
+    TaskRunResult.state or None if a full update is needed instead.
+  """
+  # 1 GET, usually from memcache, to skip the transaction when a full update is
+  # needed anyway. Then 2 GETs and 1 PUT in the transaction.
+  now = utils.utcnow()
+  if not _can_update_output_only(run_result_key.get(), bot_id, now):
+    return None
+
+  def run():
+    # The first GET may be stale, e.g. the task may have been canceled since.
+    run_result = run_result_key.get()
+    if not _can_update_output_only(run_result, bot_id, now):
+      return None
+    number_chunks = run_result.stdout_chunks
+    entities = run_result.append_output(output, output_chunk_start)
+    if run_result.stdout_chunks != number_chunks:
+      # A new TaskOutputChunk is needed, it has to be recorded in the results.
+      return None
+    ndb.put_multi(entities)
+    return run_result.state
+
+  try:
+    return datastore_utils.transaction(run)
+  except datastore_utils.CommitError as e:
+    logging.info('Got commit error on output append: %s', e)
+    return None
+
+
 def _get_task_from_external_scheduler(es_cfg, bot_dimensions):
   """Gets a task to run from external scheduler.
 
@@ -815,6 +909,53 @@ def _ensure_active_slice(request, try_number, task_slice_index):
   return datastore_utils.transaction(run)
 
 
+def _cancel_pending_tx(requests, now):
+  """Cancels a group of pending tasks in a single cross-group transaction.
+
+  The requests must not need a notification, see cancel_tasks().
+
+  Returns:
+    tuple(number of tasks canceled, list of the TaskRequest that are running).
+  """
+  def run():
+    """1 DB GET for the results, 1 for the TaskToRun, 1 PUT."""
+    summaries = ndb.get_multi(
+        task_pack.request_key_to_result_summary_key(r.key) for r in requests)
+    entities = []
+    to_run_keys = []
+    running = []
+    for request, result_summary in zip(requests, summaries):
+      if not result_summary:
+        continue
+      if result_summary.state == task_result.State.RUNNING:
+        running.append(request)
+        continue
+      if not result_summary.can_be_canceled:
+        continue
+      result_summary.state = task_result.State.CANCELED
+      result_summary.abandoned_ts = now
+      result_summary.completed_ts = now
+      result_summary.modified_ts = now
+      entities.append(result_summary)
+      to_run_keys.append(
+          task_to_run.request_to_task_to_run_key(
+              request,
+              result_summary.try_number or 1,
+              result_summary.current_task_slice or 0))
+    for to_run in ndb.get_multi(to_run_keys):
+      if to_run:
+        to_run.queue_number = None
+        entities.append(to_run)
+    ndb.put_multi(entities)
+    return to_run_keys, running
+
+  to_run_keys, running = datastore_utils.transaction(run, xg=True)
+  # Add them to the negative cache.
+  for to_run_key in to_run_keys:
+    task_to_run.set_lookup_cache(to_run_key, False)
+  return len(to_run_keys), running
+
+
 ### Public API.
 
 
@@ -1121,6 +1262,9 @@ def bot_update_task(
     performance_stats):
   """Updates a TaskRunResult and TaskResultSummary, along TaskOutputChunk.
 
+  Updates only carrying output skip the TaskRunResult and TaskResultSummary
+  writes in between checkpoints; see _OUTPUT_CHECKPOINT_INTERVAL.
+
   Arguments:
   - run_result_key: ndb.Key to TaskRunResult.
   - bot_id: Self advertised bot id to ensure it's the one expected.
@@ -1165,6 +1309,13 @@ def bot_update_task(
       exit_code, duration, hard_timeout, io_timeout, cost_usd, outputs_ref,
       cipd_pins, performance_stats)
 
+  if (output and exit_code is None and not hard_timeout and not io_timeout and
+      not outputs_ref and not cipd_pins):
+    state = _bot_update_output_only(
+        run_result_key, bot_id, output, output_chunk_start or 0)
+    if state:
+      return state
+
   result_summary_key = task_pack.run_result_key_to_result_summary_key(
       run_result_key)
   request_key = task_pack.result_summary_key_to_request_key(result_summary_key)
@@ -1375,6 +1526,72 @@ def cancel_task(request, result_key, kill_running, bot_id):
   return datastore_utils.transaction(run)
 
 
+def cancel_tasks(task_ids, kill_running):
+  """Cancels many tasks, grouping the pending ones in a few transactions.
+
+  Pending tasks are canceled _CANCEL_GROUP_SIZE at a time in cross-group
+  transactions. Running tasks, tasks sending a notification upon completion and
+  the tasks of a group whose transaction failed are canceled one at a time with
+  cancel_task().
+
+  Warning: ACL check must have been done before.
+
+  Arguments:
+    task_ids: list of packed task IDs.
+    kill_running: if true, also cancel the tasks in RUNNING state.
+
+  Returns:
+    tuple(number of tasks canceled, number of tasks not canceled).
+  """
+  now = utils.utcnow()
+  request_keys = [
+    task_pack.get_request_and_result_keys(task_id)[0] for task_id in task_ids
+  ]
+  grouped = []
+  single = []
+  skipped = 0
+  for task_id, request in zip(task_ids, ndb.get_multi(request_keys)):
+    if not request:
+      logging.error('Request for %s was not found.', task_id)
+      skipped += 1
+    elif request.pubsub_topic or external_scheduler.config_for_task(request):
+      single.append(request)
+    else:
+      grouped.append(request)
+
+  canceled = 0
+  for i in xrange(0, len(grouped), _CANCEL_GROUP_SIZE):
+    group = grouped[i:i+_CANCEL_GROUP_SIZE]
+    try:
+      count, running = _cancel_pending_tx(group, now)
+    except datastore_utils.CommitError:
+      logging.warning(
+          'Failed to cancel %d tasks at once, retrying one at a time',
+          len(group))
+      single.extend(group)
+      continue
+    canceled += count
+    skipped += len(group) - count - len(running)
+    if kill_running:
+      single.extend(running)
+    else:
+      skipped += len(running)
+
+  for request in single:
+    try:
+      ok, _ = cancel_task(
+          request, task_pack.request_key_to_result_summary_key(request.key),
+          kill_running, None)
+    except datastore_utils.CommitError:
+      logging.warning('Failed to cancel %s', request.task_id)
+      ok = False
+    if ok:
+      canceled += 1
+    else:
+      skipped += 1
+  return canceled, skipped
+
+
 ### Cron job.
 
 
@@ -871,6 +871,57 @@ class TaskSchedulerApiTest(test_env_handlers.AppTestBase):
     self.assertEqual(1, result_summary.current_task_slice)
     self.assertEqual(0, result_summary.try_number)
 
+  def test_task_idempotent_index(self):
+    # The dedup index points to the task once it completed successfully.
+    task_id = self._task_ran_successfully(1, 0)
+    result_summary_key = task_pack.unpack_result_summary_key(task_id)
+    h = result_summary_key.get().properties_hash
+    index = task_result.TaskDedupIndex.get_by_id(h.encode('hex'))
+    self.assertEqual(result_summary_key, index.result_summary_key)
+    self.assertEqual(self.now, index.created_ts)
+
+    # A stale index is ignored, the task is enqueued for execution.
+    result_summary_key.delete()
+    self.mock_now(self.now, 1)
+    result_summary = self._quick_schedule(
+        0,
+        task_slices=[
+          task_request.TaskSlice(
+              expiration_secs=60,
+              properties=_gen_properties(idempotent=True),
+              wait_for_capacity=False),
+        ])
+    self.assertIsNone(result_summary.deduped_from)
+    to_run_key = task_to_run.request_to_task_to_run_key(
+        result_summary.request_key.get(), 1, 0)
+    self.assertTrue(to_run_key.get().queue_number)
+
+  def test_task_idempotent_index_miss(self):
+    # A task that completed without being indexed is found by query.
+    task_id = self._task_ran_successfully(1, 0)
+    result_summary_key = task_pack.unpack_result_summary_key(task_id)
+    h = result_summary_key.get().properties_hash
+    task_result.TaskDedupIndex.get_by_id(h.encode('hex')).key.delete()
+
+    new_ts = self.mock_now(self.now, config.settings().reusable_task_age_secs-1)
+    self._task_deduped(1, new_ts, task_id, '1d8dc670a0008a10')
+    # The index was backfilled.
+    index = task_result.TaskDedupIndex.get_by_id(h.encode('hex'))
+    self.assertEqual(result_summary_key, index.result_summary_key)
+
+  def test_task_idempotent_index_miss_after_rollout(self):
+    # Once the index was deployed for long enough, a miss doesn't query.
+    self.mock(task_scheduler, '_DEDUP_INDEX_ROLLOUT_TS', self.now)
+    task_id = self._task_ran_successfully(1, 0)
+    h = task_pack.unpack_result_summary_key(task_id).get().properties_hash
+    task_result.TaskDedupIndex.get_by_id(h.encode('hex')).key.delete()
+    self.mock(
+        task_scheduler, '_query_dupe_task',
+        lambda *_: self.fail('Unexpected query'))
+
+    self.mock_now(self.now, config.settings().reusable_task_age_secs)
+    self.assertIsNone(task_scheduler._find_dupe_task(utils.utcnow(), h))
+
   def test_task_parent_children(self):
     # Parent task creates a child task.
     parent_id = self._task_ran_successfully(1, 0)
@@ -1178,6 +1229,88 @@ class TaskSchedulerApiTest(test_env_handlers.AppTestBase):
             performance_stats=None))
     self.assertEqual('hhey', run_result.key.get().get_output())
 
+  def test_bot_update_task_output_only(self):
+    run_result = self._quick_reap(1, 0)
+    def update(output, output_chunk_start, cost_usd):
+      return task_scheduler.bot_update_task(
+          run_result_key=run_result.key,
+          bot_id='localhost',
+          cipd_pins=None,
+          output=output,
+          output_chunk_start=output_chunk_start,
+          exit_code=None,
+          duration=None,
+          hard_timeout=False,
+          io_timeout=False,
+          cost_usd=cost_usd,
+          outputs_ref=None,
+          performance_stats=None)
+
+    # The first output creates the TaskOutputChunk so it is a full update.
+    self.assertEqual(State.RUNNING, update('hi', 0, 0.1))
+    puts = []
+    old_put_multi = ndb.put_multi
+    def put_multi(entities, **kwargs):
+      puts.extend(e.key.kind() for e in entities)
+      return old_put_multi(entities, **kwargs)
+    self.mock(ndb, 'put_multi', put_multi)
+
+    # Only the output is written until the next checkpoint.
+    self.mock_now(self.now, 10)
+    self.assertEqual(State.RUNNING, update('hey', 2, 0.2))
+    self.assertEqual(State.RUNNING, update('ho', 5, 0.3))
+    self.assertEqual(['TaskOutputChunk', 'TaskOutputChunk'], puts)
+    self.assertEqual(0.1, run_result.key.get().cost_usd)
+    self.assertEqual(self.now, run_result.key.get().modified_ts)
+    self.assertEqual('hiheyho', run_result.key.get().get_output())
+
+    # Checkpoint.
+    now_1 = self.mock_now(
+        self.now, task_scheduler._OUTPUT_CHECKPOINT_INTERVAL.total_seconds())
+    del puts[:]
+    self.assertEqual(State.RUNNING, update('!', 7, 0.4))
+    self.assertEqual(
+        ['TaskRunResult', 'TaskOutputChunk', 'TaskResultSummary'], puts)
+    self.assertEqual(0.4, run_result.key.get().cost_usd)
+    self.assertEqual(now_1, run_result.key.get().modified_ts)
+    self.assertEqual('hiheyho!', run_result.key.get().get_output())
+
+  def test_bot_update_task_output_only_stale(self):
+    run_result = self._quick_reap(1, 0)
+    def update(output, output_chunk_start):
+      return task_scheduler.bot_update_task(
+          run_result_key=run_result.key,
+          bot_id='localhost',
+          cipd_pins=None,
+          output=output,
+          output_chunk_start=output_chunk_start,
+          exit_code=None,
+          duration=None,
+          hard_timeout=False,
+          io_timeout=False,
+          cost_usd=0.1,
+          outputs_ref=None,
+          performance_stats=None)
+
+    self.assertEqual(State.RUNNING, update('hi', 0))
+    # The task is canceled but the bot update first sees a stale copy.
+    stale = run_result.key.get()
+    self.assertEqual((True, True), task_scheduler.cancel_task(
+        run_result.request_key.get(), run_result.result_summary_key, True,
+        None))
+    old_get = ndb.Key.get
+    def get(key, **kwargs):
+      if key == run_result.key and not ndb.in_transaction():
+        return stale
+      return old_get(key, **kwargs)
+    self.mock(ndb.Key, 'get', get)
+
+    # The transaction sees the cancelation and does a full update, so the bot
+    # is told to stop.
+    self.mock_now(self.now, 10)
+    self.assertEqual(State.KILLED, update('hey', 2))
+    self.assertEqual('hihey', old_get(run_result.key).get_output())
+
   def test_bot_update_exception(self):
     run_result = self._quick_reap(1, 0)
     def r(*_):
@@ -1537,6 +1670,51 @@ class TaskSchedulerApiTest(test_env_handlers.AppTestBase):
     self.assertEqual(State.COMPLETED, run_result.state)
     self.assertEqual(2, len(pub_sub_calls)) # No other message.
 
+  def test_cancel_tasks(self):
+    pub_sub_calls = self.mock_pub_sub()
+    run_result = self._quick_reap(1, 0)
+    pending = [self._quick_schedule(0) for _ in xrange(3)]
+    pending.append(
+        self._quick_schedule(0, pubsub_topic='projects/abc/topics/def'))
+    # Cancel the pending tasks 2 at a time.
+    self.mock(task_scheduler, '_CANCEL_GROUP_SIZE', 2)
+    task_ids = [r.task_id for r in pending] + [run_result.task_id]
+
+    # Denied for the running task if kill_running == False.
+    self.assertEqual((4, 1), task_scheduler.cancel_tasks(task_ids, False))
+    self.assertEqual(1, self.execute_tasks())
+    self.assertEqual(1, len(pub_sub_calls)) # CANCELED
+    for result_summary in pending:
+      self.assertEqual(State.CANCELED, result_summary.key.get().state)
+      # Make sure the TaskToRun is added to the negative cache.
+      to_run_key = task_to_run.request_to_task_to_run_key(
+          result_summary.request_key.get(), 1, 0)
+      self.assertIsNone(to_run_key.get().queue_number)
+      actual = task_to_run._lookup_cache_is_taken_async(
+          to_run_key).get_result()
+      self.assertEqual(True, actual)
+    self.assertEqual(State.RUNNING, run_result.key.get().state)
+
+    # The pending tasks are already canceled, kill the running one.
+    self.assertEqual((1, 4), task_scheduler.cancel_tasks(task_ids, True))
+    self.assertEqual(0, self.execute_tasks())
+    run_result = run_result.key.get()
+    self.assertEqual(State.RUNNING, run_result.state)
+    self.assertEqual(True, run_result.killing)
+
+  def test_cancel_tasks_commit_error(self):
+    self._register_bot(0, self.bot_dimensions)
+    pending = [self._quick_schedule(1)]
+    pending.extend(self._quick_schedule(0) for _ in xrange(2))
+    # The grouped transaction fails, the tasks are canceled one at a time.
+    def _cancel_pending_tx(requests, now):
+      raise datastore_utils.CommitError('Sorry!')
+    self.mock(task_scheduler, '_cancel_pending_tx', _cancel_pending_tx)
+    task_ids = [r.task_id for r in pending]
+    self.assertEqual((3, 0), task_scheduler.cancel_tasks(task_ids, False))
+    for result_summary in pending:
+      self.assertEqual(State.CANCELED, result_summary.key.get().state)
+
   def test_cron_abort_expired_task_to_run(self):
     pub_sub_calls = self.mock_pub_sub()
     self._register_bot(0, self.bot_dimensions)
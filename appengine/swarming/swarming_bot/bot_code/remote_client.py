@@ -12,6 +12,7 @@ import threading
 import time
 import traceback
 import urllib
+import zlib
 
 from utils import net
 
@@ -45,6 +46,11 @@ AUTH_HEADERS_EXPIRATION_SEC = 4*60+30
 NET_CONNECTION_TIMEOUT_SEC = 3*60
 
 
+# Task output at least this large is sent zlib compressed, once the server
+# advertised that it supports it in a task update response.
+OUTPUT_COMPRESS_MIN_SIZE = 1024
+
+
 def createRemoteClient(server, auth, hostname, work_dir, grpc_proxy):
   grpc_proxy = os.environ.get('SWARMING_GRPC_PROXY', grpc_proxy)
   if grpc_proxy:
@@ -113,11 +119,22 @@ class RemoteClientNative(object):
     self._disabled = not auth_headers_callback
     self._bot_hostname = hostname
     self._bot_work_dir = work_dir
+    self._update_interval_hint = None
+    # Encodings of the task output supported by the server, as advertised in
+    # its last task update response.
+    self._output_encodings = frozenset()
 
   @property
   def server(self):
     return self._server
 
+  @property
+  def update_interval_hint(self):
+    """Minimum interval in seconds between task updates requested by the server
+    in its last task update response, or None.
+    """
+    return self._update_interval_hint
+
   @property
   def is_grpc(self):
     return False
@@ -269,7 +286,14 @@ class RemoteClientNative(object):
     data.update(params)
     # Preserving prior behaviour: empty stdout is not transmitted
     if stdout_and_chunk and stdout_and_chunk[0]:
-      data['output'] = base64.b64encode(stdout_and_chunk[0])
+      output = stdout_and_chunk[0]
+      if ('zlib' in self._output_encodings and
+          len(output) >= OUTPUT_COMPRESS_MIN_SIZE):
+        compressed = zlib.compress(output)
+        if len(compressed) < len(output):
+          output = compressed
+          data['output_encoding'] = 'zlib'
+      data['output'] = base64.b64encode(output)
       data['output_chunk_start'] = stdout_and_chunk[1]
     if exit_code != None:
       data['exit_code'] = exit_code
@@ -280,6 +304,8 @@ class RemoteClientNative(object):
     if not resp or resp.get('error'):
       raise InternalError(
           resp.get('error') if resp else 'Failed to contact server')
+    self._update_interval_hint = resp.get('update_interval')
+    self._output_encodings = frozenset(resp.get('output_encodings') or [])
     return not resp.get('must_stop', False)
 
   def post_task_error(self, task_id, bot_id, message):
@@ -72,6 +72,10 @@ class RemoteClientGrpc(object):
   def is_grpc(self):
     return True
 
+  @property
+  def update_interval_hint(self):
+    return None
+
   def initialize(self, quit_bit=None):
     pass
 
@@ -3,12 +3,14 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import base64
 import datetime
 import logging
 import sys
 import threading
 import time
 import unittest
+import zlib
 
 import test_env_bot_code
 test_env_bot_code.setup_test_env()
@@ -142,6 +144,62 @@ class TestRemoteClient(auto_stub.TestCase):
       c.mint_oauth_token('task_id', 'bot_id', 'account_id', ['a', 'b'])
 
 
+  def test_post_task_update(self):
+    c = remote_client.RemoteClientNative('http://localhost:1', None,
+                                         'localhost', '/')
+    calls = []
+    def mocked_call(url_path, data):
+      calls.append((url_path, data))
+      return {
+        'must_stop': False,
+        'ok': True,
+        'output_encodings': encodings,
+        'update_interval': 30,
+      }
+    self.mock(c, '_url_read_json', mocked_call)
+
+    self.assertEqual(None, c.update_interval_hint)
+    # The server didn't advertise compression support yet.
+    big = 'hi\n' * 1000
+    encodings = ['zlib']
+    self.assertTrue(c.post_task_update('23', 'bot', {}, (big, 0)))
+    self.assertEqual(30, c.update_interval_hint)
+    encodings = None
+    self.assertTrue(c.post_task_update('23', 'bot', {}, (big, 1)))
+    # An old server doesn't support it.
+    self.assertTrue(c.post_task_update('23', 'bot', {}, (big, 2)))
+    expected = [
+      (
+        '/swarming/api/v1/bot/task_update/23',
+        {
+          'id': 'bot',
+          'output': base64.b64encode(big),
+          'output_chunk_start': 0,
+          'task_id': '23',
+        },
+      ),
+      (
+        '/swarming/api/v1/bot/task_update/23',
+        {
+          'id': 'bot',
+          'output': base64.b64encode(zlib.compress(big)),
+          'output_chunk_start': 1,
+          'output_encoding': 'zlib',
+          'task_id': '23',
+        },
+      ),
+      (
+        '/swarming/api/v1/bot/task_update/23',
+        {
+          'id': 'bot',
+          'output': base64.b64encode(big),
+          'output_chunk_start': 2,
+          'task_id': '23',
+        },
+      ),
+    ]
+    self.assertEqual(expected, calls)
+
 if __name__ == '__main__':
   logging.basicConfig(
       level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL)
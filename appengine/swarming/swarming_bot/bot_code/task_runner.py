@@ -435,17 +435,30 @@ class _OutputBuffer(object):
 
   This data is buffered and must be sent to the Swarming server when
   self.should_post_update() is True.
+
+  The interval between task_update packets adapts to the task: output of quiet
+  tasks is sent promptly while output of verbose tasks is batched. The interval
+  is stretched when the server is slow to respond or asks the bot to back off,
+  and the packets rate is capped.
   """
   # To be mocked in tests.
   _MIN_PACKET_INTERVAL = 10
   _MAX_PACKET_INTERVAL = 30
+  # Wait between task_update packets when the task barely outputs anything.
+  _QUIET_PACKET_INTERVAL = 1.
+  # Output rate in bytes/s at which _MIN_PACKET_INTERVAL is used.
+  _VERBOSE_RATE = 10*1024.
+  # Maximum number of task_update packets per second, except for full buffers.
+  _MAX_PACKET_QPS = 1.
+  # Packets are spaced by at least this multiple of the server round trip time.
+  _RTT_FACTOR = 4.
 
   def __init__(self, task_details, start):
     self._task_details = task_details
     self._start = start
     # Sends a maximum of 100kb of stdout per task_update packet.
     self._max_chunk_size = 102400
-    # Minimum wait between task_update packet when there's output.
+    # Wait between task_update packet when there's output for verbose tasks.
     self._min_packet_interval = self._MIN_PACKET_INTERVAL
     # Maximum wait between task_update packet when there's no output.
     self._max_packet_interval = self._MAX_PACKET_INTERVAL
@@ -461,6 +474,12 @@ class _OutputBuffer(object):
     self._last_io = self._last_loop
     # Last time data was poped and (we assume) sent to the server.
     self._last_pop = self._last_loop
+    # Moving average of the output rate in bytes/s.
+    self._rate = 0.
+    # Moving average of the task_update round trip time in seconds.
+    self._rtt = 0.
+    # Minimum interval between packets requested by the server, if any.
+    self._server_interval = None
 
   @property
   def last_loop(self):
@@ -486,11 +505,22 @@ class _OutputBuffer(object):
     """Pops the buffered data to send it to the server."""
     o = self._output_chunk_start
     s = self._stdout
+    now = monotonic_time()
+    elapsed = now - self._last_pop
+    if elapsed > 0:
+      self._rate = (self._rate + len(s) / elapsed) / 2.
     self._output_chunk_start += len(self._stdout)
     self._stdout = ''
-    self._last_pop = monotonic_time()
+    self._last_pop = now
     return (s, o)
 
+  def on_update_sent(self, duration, server_interval):
+    """Records the round trip time of a task_update packet and the interval
+    hinted by the server in its reply, if any.
+    """
+    self._rtt = (self._rtt + duration) / 2. if self._rtt else duration
+    self._server_interval = server_interval
+
   def maxsize(self):
     """Returns the maximum number of bytes proc.yield_any() can return."""
     return self._max_chunk_size - len(self._stdout)
@@ -499,17 +529,20 @@ class _OutputBuffer(object):
     """Returns True if it's time to send a task_update packet via post_update().
 
     Sends a packet when one of this condition is met:
-    - more than self._max_chunk_size of stdout is buffered.
-    - self._last_pop was more than "self._min_packet_interval seconds ago"
-      and there was stdout.
-    - self._last_pop was more than "self._max_packet_interval seconds ago".
+    - more than self._max_chunk_size of stdout is buffered. This is done right
+      away so the child process never blocks on its pipe.
+    - there is stdout and the hard or I/O timeout will fire before the next
+      packet, so the output is not held back while the task gets killed.
+    - self._last_pop was more than self._packet_interval() seconds ago.
     """
-    packet_interval = (
-        self._min_packet_interval if self._stdout
-        else self._max_packet_interval)
-    return (
-        len(self._stdout) >= self._max_chunk_size or
-        (self._last_loop - self._last_pop) > packet_interval)
+    if len(self._stdout) >= self._max_chunk_size:
+      return True
+    since_pop = self._last_loop - self._last_pop
+    if since_pop < self._min_spacing():
+      return False
+    if self._stdout and self._until_timeout() < self._packet_interval():
+      return True
+    return since_pop > self._packet_interval()
 
   def calc_yield_wait(self, timed_out):
     """Calculates the maximum number of seconds to wait in yield_any().
@@ -517,7 +550,6 @@ class _OutputBuffer(object):
     This is necessary as task_runner must send keep-alive to the server to tell
     it that it is not hung, even if the subprocess doesn't output any data.
     """
-    # TODO(maruel): Use exponential backoff. https://crbug.com/825500
     if timed_out:
       # Give a |grace_period| seconds delay.
       if self._task_details.grace_period:
@@ -525,16 +557,42 @@ class _OutputBuffer(object):
             self._last_loop - timed_out - self._task_details.grace_period, 0.)
       return 0.
 
-    out = (
-        self._min_packet_interval if self._stdout
-        else self._max_packet_interval)
     now = monotonic_time()
+    out = self._packet_interval() - (now - self._last_pop)
+    out = min(out, self._until_timeout(now))
+    out = max(out, 0)
+    logging.debug('calc_yield_wait() = %d', out)
+    return out
+
+  def _min_spacing(self):
+    """Returns the minimum number of seconds between two packets."""
+    out = max(1. / self._MAX_PACKET_QPS, self._RTT_FACTOR * self._rtt)
+    if self._server_interval:
+      out = max(out, self._server_interval)
+    # Never delay keep-alive packets.
+    return min(out, self._max_packet_interval)
+
+  def _packet_interval(self):
+    """Returns the number of seconds to wait after the last packet before
+    sending the next one.
+    """
+    if not self._stdout:
+      return self._max_packet_interval
+    # Scale from quiet to verbose tasks according to the output rate.
+    ratio = min(self._rate / self._VERBOSE_RATE, 1.)
+    out = (
+        self._QUIET_PACKET_INTERVAL +
+        (self._min_packet_interval - self._QUIET_PACKET_INTERVAL) * ratio)
+    return min(max(out, self._min_spacing()), self._max_packet_interval)
+
+  def _until_timeout(self, now=None):
+    """Returns the number of seconds until the hard or I/O timeout fires."""
+    now = now or monotonic_time()
+    out = self._max_packet_interval
     if self._task_details.hard_timeout:
       out = min(out, self._start + self._task_details.hard_timeout - now)
     if self._task_details.io_timeout:
-      out = min(out, self._last_loop + self._task_details.io_timeout - now)
-    out = max(out, 0)
-    logging.debug('calc_yield_wait() = %d', out)
+      out = min(out, self._last_io + self._task_details.io_timeout - now)
     return out
 
 
@@ -607,8 +665,12 @@ def run_command(remote, task_details, work_dir, cost_usd_hour,
         if buf.should_post_update():
           params['cost_usd'] = (
               cost_usd_hour * (monotonic_time() - task_start) / 60. / 60.)
-          if not remote.post_task_update(
-              task_details.task_id, task_details.bot_id, params, buf.pop()):
+          update_start = monotonic_time()
+          must_continue = remote.post_task_update(
+              task_details.task_id, task_details.bot_id, params, buf.pop())
+          buf.on_update_sent(
+              monotonic_time() - update_start, remote.update_interval_hint)
+          if not must_continue:
             # Server is telling us to stop. Normally task cancellation.
             if not kill_sent and not term_sent:
               logging.warning('Server induced stop; sending SIGTERM')
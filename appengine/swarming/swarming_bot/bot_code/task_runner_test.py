@@ -1279,6 +1279,83 @@ class TaskRunnerNoServer(auto_stub.TestCase):
     self.assertEqual(expected, actual)
 
 
+class TestOutputBuffer(auto_stub.TestCase):
+  def setUp(self):
+    super(TestOutputBuffer, self).setUp()
+    self.now = 100.
+    self.mock(task_runner, 'monotonic_time', lambda: self.now)
+
+  def _buf(self, **kwargs):
+    kwargs.setdefault('hard_timeout', 3600.)
+    kwargs.setdefault('io_timeout', 1200.)
+    return task_runner._OutputBuffer(
+        get_task_details('print(\'hi\')', **kwargs), self.now)
+
+  def _add(self, buf, data, seconds):
+    self.now += seconds
+    buf.add('stdout', data)
+
+  def test_quiet(self):
+    buf = self._buf()
+    self._add(buf, 'hi\n', 0.5)
+    # Packets rate is capped.
+    self.assertFalse(buf.should_post_update())
+    self._add(buf, '', 0.6)
+    self.assertTrue(buf.should_post_update())
+    self.assertEqual(('hi\n', 0), buf.pop())
+    # Keep-alive.
+    self._add(buf, '', 29.)
+    self.assertFalse(buf.should_post_update())
+    self.assertEqual(1., buf.calc_yield_wait(None))
+    self._add(buf, '', 1.1)
+    self.assertTrue(buf.should_post_update())
+
+  def test_verbose(self):
+    buf = self._buf()
+    self._add(buf, 'a' * 50000, 2.)
+    self.assertTrue(buf.should_post_update())
+    buf.pop()
+    # The output rate is now high so output is batched for longer.
+    self._add(buf, 'a' * 1000, 2.)
+    self.assertFalse(buf.should_post_update())
+    self.assertEqual(8., buf.calc_yield_wait(None))
+    self._add(buf, 'a' * 1000, 8.1)
+    self.assertTrue(buf.should_post_update())
+
+  def test_full(self):
+    buf = self._buf()
+    self._add(buf, 'a' * buf.maxsize(), 0.1)
+    self.assertEqual(0, buf.maxsize())
+    self.assertTrue(buf.should_post_update())
+
+  def test_backpressure(self):
+    buf = self._buf()
+    # Slow server.
+    buf.on_update_sent(2., None)
+    self._add(buf, 'hi\n', 7.)
+    self.assertFalse(buf.should_post_update())
+    self._add(buf, '', 1.1)
+    self.assertTrue(buf.should_post_update())
+    buf.pop()
+    # The server asks to back off.
+    buf.on_update_sent(0.1, 20)
+    self._add(buf, 'hi\n', 19.)
+    self.assertFalse(buf.should_post_update())
+    self._add(buf, '', 1.1)
+    self.assertTrue(buf.should_post_update())
+
+  def test_timeout(self):
+    buf = self._buf(io_timeout=5.)
+    self._add(buf, 'a' * 50000, 2.)
+    buf.pop()
+    self._add(buf, 'hi\n', 0.5)
+    self.assertFalse(buf.should_post_update())
+    # The I/O timeout would fire before the next packet.
+    self.assertEqual(5., buf.calc_yield_wait(None))
+    self._add(buf, '', 4.)
+    self.assertTrue(buf.should_post_update())
+
+
 if __name__ == '__main__':
   fix_encoding.fix_encoding()
   if '-v' in sys.argv:
@@ -2,10 +2,12 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import base64
 import json
 import os
 import sys
 import threading
+import zlib
 
 BOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -78,8 +80,12 @@ class Handler(httpserver.Handler):
 
     if self.path.startswith('/swarming/api/v1/bot/task_update/'):
       task_id = self.path[len('/swarming/api/v1/bot/task_update/'):]
+      if data.pop('output_encoding', None) == 'zlib':
+        data['output'] = base64.b64encode(
+            zlib.decompress(base64.b64decode(data['output'])))
       must_stop = self.server.parent._on_task_update(task_id, data)
-      return self.send_json({'ok': True, 'must_stop': must_stop})
+      return self.send_json(
+          {'ok': True, 'must_stop': must_stop, 'output_encodings': ['zlib']})
 
     if self.path.startswith('/swarming/api/v1/bot/task_error'):
       task_id = self.path[len('/swarming/api/v1/bot/task_error/'):]
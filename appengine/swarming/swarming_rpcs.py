@@ -521,6 +521,12 @@ class TasksCancelRequest(messages.Message):
   kill_running = messages.BooleanField(4)
 
 
+class TasksCancelBatchRequest(messages.Message):
+  """Request to cancel all the pending tasks matching the tags."""
+  tags = messages.StringField(1, repeated=True)
+  kill_running = messages.BooleanField(2)
+
+
 ### Task-Related Responses
 
 
@@ -561,9 +567,39 @@ class TasksCancelResponse(messages.Message):
   matched = messages.IntegerField(3)
 
 
+class TasksCancelBatchResponse(messages.Message):
+  """Result of starting a batch cancellation."""
+  # Use it with the 'cancel_batch_status' RPC to poll the progress.
+  batch_id = messages.StringField(1)
+  now = message_types.DateTimeField(2)
+
+
+class TasksCancelBatchStatus(messages.Message):
+  """Progress of a batch cancellation."""
+  batch_id = messages.StringField(1)
+  tags = messages.StringField(2, repeated=True)
+  kill_running = messages.BooleanField(3)
+  created_ts = message_types.DateTimeField(4)
+  # Number of pending tasks matched so far.
+  matched = messages.IntegerField(5)
+  # Number of shards triggered so far and number of shards completed.
+  shards = messages.IntegerField(6)
+  shards_done = messages.IntegerField(7)
+  # Number of tasks canceled and not canceled, e.g. because they started
+  # running in the meantime.
+  canceled = messages.IntegerField(8)
+  skipped = messages.IntegerField(9)
+  # True when all the matched tasks were processed.
+  done = messages.BooleanField(10)
+  now = message_types.DateTimeField(11)
+
+
 class TaskOutput(messages.Message):
   """A task's output as a string."""
   output = messages.StringField(1)
+  # Byte offset right after the returned output, to use as the offset of the
+  # next request.
+  next_offset = messages.IntegerField(2)
 
 
 class TaskResult(messages.Message):
@@ -652,6 +688,14 @@ class TaskStates(messages.Message):
   states = messages.EnumField(TaskState, 1, repeated=True)
 
 
+class TaskResultsBatch(messages.Message):
+  """Wraps a list of TaskResult. Used in the 'get_results' RPC."""
+  items = messages.MessageField(TaskResult, 1, repeated=True)
+  # Requested task IDs that do not exist.
+  not_found = messages.StringField(2, repeated=True)
+  now = message_types.DateTimeField(3)
+
+
 class TaskList(messages.Message):
   """Wraps a list of TaskResult."""
   # TODO(maruel): Rename to TaskResults.
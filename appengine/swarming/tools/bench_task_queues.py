@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Compares TaskDimensionsIndex lookups with the TaskDimensions linear scan.
+
+Runs against the ndb testbed, so the absolute numbers are not representative of
+production but the ratio between the two is.
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import test_env
+test_env.setup_test_env()
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from components import utils
+from server import task_queues
+
+
+def _gen_task_dimensions(root_key, num_sets, valid_until_ts):
+  """Yields TaskDimensions with random but plausible dimensions."""
+  pool = root_key.string_id().split(':', 1)[1]
+  for i in xrange(num_sets):
+    dimensions = {
+      u'os': [random.choice([u'Linux', u'Mac', u'Windows'])],
+      u'pool': [pool],
+      u'cpu': [random.choice([u'x86', u'x86-64', u'arm64'])],
+      # Unique per set so each one is a different queue. The bot only has some
+      # of them, see main().
+      u'builder': [u'b%d' % i],
+    }
+    if random.random() < 0.3:
+      dimensions[u'gpu'] = [random.choice([u'none', u'8086', u'10de'])]
+    dimensions_hash = task_queues.hash_dimensions(dimensions)
+    yield task_queues.TaskDimensions(
+        id=dimensions_hash, parent=root_key,
+        sets=[
+          task_queues.TaskDimensionsSet(
+              valid_until_ts=valid_until_ts,
+              dimensions_flat=task_queues.dimensions_to_flat(dimensions)),
+        ])
+
+
+def _populate(root_key, num_sets, valid_until_ts):
+  entities = list(_gen_task_dimensions(root_key, num_sets, valid_until_ts))
+  for i in xrange(0, len(entities), 500):
+    ndb.put_multi(entities[i:i+500])
+  index = task_queues._build_TaskDimensionsIndex(root_key)
+  index.put()
+  return index
+
+
+def _bench(name, runs, fn):
+  durations = []
+  matches = None
+  for _ in xrange(runs):
+    start = time.time()
+    matches = fn()
+    durations.append(time.time() - start)
+  durations.sort()
+  print('%-6s: %d matches; median %.1fms; best %.1fms' % (
+      name, len(matches), durations[len(durations)/2] * 1000.,
+      durations[0] * 1000.))
+  return matches
+
+
+def main():
+  parser = argparse.ArgumentParser(description=sys.modules[__name__].__doc__)
+  parser.add_argument(
+      '--sets', type=int, default=10000,
+      help='Number of TaskDimensions in the pool; default: %(default)s')
+  parser.add_argument(
+      '--runs', type=int, default=5,
+      help='Number of lookups to time; default: %(default)s')
+  parser.add_argument(
+      '--builders', type=float, default=0.1,
+      help='Fraction of the builders the bot has, in ]0, 1], so a part of the '
+           'TaskDimensions match it; default: %(default)s')
+  parser.add_argument('-v', '--verbose', action='store_true')
+  args = parser.parse_args()
+  logging.basicConfig(
+      level=logging.DEBUG if args.verbose else logging.ERROR)
+
+  tb = testbed.Testbed()
+  tb.activate()
+  try:
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    ndb.get_context().set_cache_policy(False)
+
+    now = utils.utcnow()
+    valid_until_ts = now + datetime.timedelta(hours=1)
+    root_key = ndb.Key(task_queues.TaskDimensionsRoot, u'pool:default')
+    print('Populating %d TaskDimensions' % args.sets)
+    index = _populate(root_key, args.sets, valid_until_ts)
+    step = max(int(round(1. / args.builders)), 1)
+    bot_dimensions = {
+      u'builder': [u'b%d' % i for i in xrange(0, args.sets, step)],
+      u'cpu': [u'x86', u'x86-64'],
+      u'gpu': [u'none'],
+      u'id': [u'bot1'],
+      u'os': [u'Linux'],
+      u'pool': [u'default'],
+    }
+    bot_root_key = ndb.Key('BotRoot', u'bot1')
+
+    def scan():
+      matches = []
+      task_queues._update_BotTaskDimensions_slice(
+          bot_dimensions, bot_root_key, now, matches, root_key).get_result()
+      return matches
+
+    def lookup():
+      matches = []
+      task_queues._update_BotTaskDimensions_indexed(
+          bot_dimensions, bot_root_key, now, matches, index).get_result()
+      return matches
+
+    def lookup_in_memory():
+      return index.match_bot(task_queues.dimensions_to_flat(bot_dimensions))
+
+    expected = _bench('scan', args.runs, scan)
+    actual = _bench('index', args.runs, lookup)
+    _bench('memory', args.runs, lookup_in_memory)
+    assert sorted(expected) == sorted(actual), (expected, actual)
+  finally:
+    tb.deactivate()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
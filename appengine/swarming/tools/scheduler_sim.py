@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Deterministic offline simulator for the Swarming scheduler.
+
+Replays a trace of task triggers and bot polls through the real task_scheduler,
+task_queues and task_to_run code running on the ndb testbed, with a fake clock.
+Nothing is sent over the network, so it doesn't need a running server unlike
+local_smoke_test.py or swarming_load_test_*.py.
+
+The trace is a file with one JSON object per line, sorted by 'ts', the number
+of simulated seconds since the start of the simulation:
+
+  {"ts": 0, "type": "trigger", "dimensions": {"pool": ["default"]},
+   "priority": 50, "expiration_secs": 3600, "duration": 120}
+  {"ts": 1.5, "type": "poll", "bot_id": "bot1",
+   "dimensions": {"id": ["bot1"], "pool": ["default"]}}
+
+'duration' is how long the task runs once reaped. When --poll-interval is
+specified, bots keep on polling by themselves after their first poll, otherwise
+only the polls in the trace are done. Use --synthetic to generate a trace
+instead of reading one; --save-trace saves it for later replays.
+
+The testbed runs one request at a time so transactions never collide by
+themselves. --contention makes this fraction of the datastore commits fail as
+if a concurrent transaction had won, so ndb retries them like in production.
+
+The report contains the reap latency (simulated time between a trigger and the
+reap of its task), the wall time and datastore RPC counts per operation, the
+number of transactions, their retries after a commit collision and the ones
+that failed with CommitError after exhausting their retries, and the queue wait
+distribution.
+"""
+
+import argparse
+import datetime
+import heapq
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import test_env
+test_env.setup_test_env()
+
+from google.appengine.api import api_base_pb
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore_errors
+from google.appengine.datastore import datastore_pb
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.runtime import apiproxy_errors
+
+import event_mon_metrics
+import gae_ts_mon
+from components import auth
+from components import utils
+from components.auth import api as auth_api
+from server import bot_management
+from server import task_pack
+from server import task_queues
+from server import task_request
+from server import task_scheduler
+
+
+# Simulated time at which the simulation starts.
+_EPOCH = datetime.datetime(2019, 1, 1)
+
+# Upper bounds in seconds of the queue wait distribution buckets.
+_WAIT_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _percentile(values, p):
+  """Returns the p-th percentile of a sorted list, or None if empty."""
+  if not values:
+    return None
+  return values[min(len(values) - 1, int(len(values) * p / 100.))]
+
+
+class _OpStats(object):
+  """Accumulates the statistics for one kind of operation."""
+
+  def __init__(self):
+    self.count = 0
+    self.wall = []
+    self.rpcs = {}
+    self.transactions = 0
+    # Callback runs beyond the first one, i.e. retries after a commit collision.
+    self.transaction_retries = 0
+    # Transactions that ran out of retries; datastore_utils raises CommitError.
+    self.commit_errors = 0
+
+  def to_dict(self):
+    wall = sorted(self.wall)
+    return {
+      'count': self.count,
+      'wall_p50_ms': _percentile(wall, 50) * 1000. if wall else None,
+      'wall_p99_ms': _percentile(wall, 99) * 1000. if wall else None,
+      'rpcs': dict(self.rpcs),
+      'transactions': self.transactions,
+      'transaction_retries': self.transaction_retries,
+      'commit_errors': self.commit_errors,
+      'rpcs_per_op': {
+        k: float(v) / self.count for k, v in sorted(self.rpcs.iteritems())
+      },
+    }
+
+
+class Simulator(object):
+  """Runs the events of a trace through the scheduler with a fake clock."""
+
+  def __init__(self, poll_interval, max_secs, contention=0.):
+    self._poll_interval = poll_interval
+    self._contention = contention
+    self._rnd = random.Random(0)
+    self._transaction_async = None
+    self._now = _EPOCH
+    self._deadline = _EPOCH + datetime.timedelta(seconds=max_secs)
+    # heap of (simulated time, sequence, event type, event).
+    self._events = []
+    self._seq = 0
+    # Number of events in self._events that are not bot polls.
+    self._not_polls = 0
+    self._op = None
+    self._ops = {}
+    # Bots currently running a task.
+    self._busy = set()
+    # Bots that poll by themselves.
+    self._looping = set()
+    # task_id -> simulated trigger time.
+    self._pending = {}
+    self.reap_latencies = []
+    self.skipped_polls = 0
+    self.enqueued = {}
+
+  ## Setup.
+
+  def install(self, mock=setattr):
+    """Mocks the clock and the task queue, and hooks the datastore RPCs and
+    transactions.
+
+    mock(obj, name, value) is used to replace the attributes, e.g.
+    TestCase.mock so they are restored after a test.
+    """
+    mock(utils, 'utcnow', lambda: self._now)
+    mock(ndb.DateTimeProperty, '_now', lambda _: self._now)
+    mock(ndb.DateProperty, '_now', lambda _: self._now.date())
+    mock(utils, 'enqueue_task', self._enqueue_task)
+    ident = auth.Identity(auth.IDENTITY_USER, 'sim@example.com')
+    mock(auth_api, '_get_current_identity', lambda: ident)
+    # datastore_utils.transaction*() all end up in ndb.transaction_async().
+    self._transaction_async = ndb.transaction_async
+    mock(ndb, 'transaction_async', self._counted_transaction_async)
+    stub = apiproxy_stub_map.apiproxy.GetStub('datastore_v3')
+    make_sync_call = stub.MakeSyncCall
+    def contended_make_sync_call(service, call, request, response, *args):
+      if (call == 'Commit' and self._contention and
+          self._rnd.random() < self._contention):
+        # What the datastore does when another transaction committed first.
+        make_sync_call(service, 'Rollback', request, api_base_pb.VoidProto())
+        raise apiproxy_errors.ApplicationError(
+            datastore_pb.Error.CONCURRENT_TRANSACTION, 'simulated contention')
+      return make_sync_call(service, call, request, response, *args)
+    mock(stub, 'MakeSyncCall', contended_make_sync_call)
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'scheduler_sim', self._rpc_hook, 'datastore_v3')
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'scheduler_sim', self._rpc_hook, 'memcache')
+
+  def _rpc_hook(self, service, call, _request, _response):
+    if self._op:
+      name = '%s.%s' % (service, call)
+      self._op.rpcs[name] = self._op.rpcs.get(name, 0) + 1
+
+  @ndb.tasklet
+  def _counted_transaction_async(self, callback, **ctx_options):
+    """Wraps ndb.transaction_async() to count the callback retries."""
+    op = self._op
+    attempts = [0]
+    def run():
+      attempts[0] += 1
+      return callback()
+    try:
+      res = yield self._transaction_async(run, **ctx_options)
+    except (
+        datastore_errors.InternalError,
+        datastore_errors.Timeout,
+        datastore_errors.TransactionFailedError):
+      # The exceptions datastore_utils.transaction() converts to CommitError.
+      if op:
+        op.commit_errors += 1
+      raise
+    finally:
+      if op:
+        op.transactions += 1
+        op.transaction_retries += max(0, attempts[0] - 1)
+    raise ndb.Return(res)
+
+  def _enqueue_task(self, url, queue_name, payload=None, **_kwargs):
+    self.enqueued[queue_name] = self.enqueued.get(queue_name, 0) + 1
+    if queue_name == 'rebuild-task-cache':
+      # Run it one second later, like a fairly idle task queue would.
+      self._push(1., 'taskqueue', {'payload': payload})
+    return True
+
+  ## Events.
+
+  def _push(self, delay, event_type, event):
+    self._seq += 1
+    if event_type != 'poll':
+      self._not_polls += 1
+    ts = self._now + datetime.timedelta(seconds=delay)
+    heapq.heappush(self._events, (ts, self._seq, event_type, event))
+
+  def load(self, trace):
+    """Loads the events of a trace."""
+    for event in trace:
+      self._push(event['ts'], event['type'], event)
+
+  def run(self):
+    """Processes all the events until none are left or the deadline is hit."""
+    handlers = {
+      'complete': self._on_complete,
+      'poll': self._on_poll,
+      'taskqueue': self._on_taskqueue,
+      'trigger': self._on_trigger,
+    }
+    while self._events:
+      ts, _, event_type, event = heapq.heappop(self._events)
+      if ts > self._deadline:
+        break
+      if event_type != 'poll':
+        self._not_polls -= 1
+      self._now = ts
+      handlers[event_type](event)
+      if not self._pending and not self._not_polls:
+        # Only bots polling for nothing left, stop the simulation.
+        break
+
+  def _timed(self, name, fn, *args):
+    """Runs fn as the operation 'name' and accounts its RPCs and wall time."""
+    self._op = self._ops.setdefault(name, _OpStats())
+    self._op.count += 1
+    # Do not let the ndb in-context cache skew the RPC counts between requests.
+    ndb.get_context().clear_cache()
+    start = time.time()
+    try:
+      return fn(*args)
+    finally:
+      self._op.wall.append(time.time() - start)
+      self._op = None
+
+  def _on_trigger(self, event):
+    request = task_request.TaskRequest(
+        created_ts=self._now,
+        manual_tags=[u'sim:1'],
+        name=u'sim',
+        priority=event.get('priority', 50),
+        task_slices=[
+          task_request.TaskSlice(
+              expiration_secs=event.get('expiration_secs', 3600),
+              properties=task_request.TaskProperties(
+                  command=[u'sim'],
+                  dimensions_data=event['dimensions'],
+                  execution_timeout_secs=24*60*60,
+                  # Stored in the environment so _on_poll() knows how long the
+                  # task runs.
+                  env={u'SIM_DURATION': unicode(event.get('duration', 60))}),
+              wait_for_capacity=True),
+        ],
+        user=u'sim')
+    task_request.init_new_request(request, True, task_request.TEMPLATE_AUTO)
+    summary = self._timed(
+        'schedule_request', task_scheduler.schedule_request, request, None)
+    self._pending[summary.task_id] = self._now
+
+  def _on_poll(self, event):
+    bot_id = event['bot_id']
+    dimensions = event['dimensions']
+    if bot_id in self._busy:
+      self.skipped_polls += 1
+      return
+    if self._poll_interval:
+      self._looping.add(bot_id)
+    request, run_result = self._timed(
+        'bot_poll', self._poll, bot_id, dimensions)
+    if not request:
+      if bot_id in self._looping:
+        self._push(self._poll_interval, 'poll', event)
+      return
+    created = self._pending.pop(
+        task_pack.pack_result_summary_key(run_result.result_summary_key))
+    self.reap_latencies.append((self._now - created).total_seconds())
+    self._busy.add(bot_id)
+    duration = float(request.task_slice(0).properties.env[u'SIM_DURATION'])
+    self._push(duration, 'complete', {
+      'bot_id': bot_id,
+      'dimensions': dimensions,
+      'duration': duration,
+      'run_result_key': run_result.key,
+    })
+
+  def _poll(self, bot_id, dimensions):
+    """Does what BotPollHandler does."""
+    bot_root_key = bot_management.get_root_key(bot_id)
+    task_queues.assert_bot_async(bot_root_key, dimensions).get_result()
+    request, _, run_result = task_scheduler.bot_reap_task(
+        dimensions, 'sim', None)
+    if request:
+      self._bot_event(
+          'request_task', bot_id, dimensions, run_result.task_id, request.name)
+    else:
+      self._bot_event('request_sleep', bot_id, dimensions, None, None)
+    return request, run_result
+
+  def _on_complete(self, event):
+    bot_id = event['bot_id']
+    self._timed('bot_update_task', self._complete, event)
+    self._busy.discard(bot_id)
+    if bot_id in self._looping:
+      # Bots poll right after completing a task.
+      self._push(
+          0, 'poll', {'bot_id': bot_id, 'dimensions': event['dimensions']})
+
+  def _complete(self, event):
+    """Does what BotTaskUpdateHandler does on task completion."""
+    task_scheduler.bot_update_task(
+        event['run_result_key'], event['bot_id'], None, None, 0,
+        event['duration'], False, False, 0., None, None, None)
+    self._bot_event(
+        'task_completed', event['bot_id'], event['dimensions'], None, None)
+
+  def _bot_event(self, event_type, bot_id, dimensions, task_id, task_name):
+    bot_management.bot_event(
+        event_type=event_type, bot_id=bot_id, external_ip='127.0.0.1',
+        authenticated_as='bot:sim', dimensions=dimensions, state={},
+        version='sim', quarantined=False, maintenance_msg=None,
+        task_id=task_id, task_name=task_name)
+
+  def _on_taskqueue(self, event):
+    self._timed(
+        'rebuild_task_cache', task_queues.rebuild_task_cache, event['payload'])
+
+  ## Report.
+
+  def report(self):
+    latencies = sorted(self.reap_latencies)
+    buckets = [0] * (len(_WAIT_BUCKETS) + 1)
+    for l in latencies:
+      i = 0
+      while i < len(_WAIT_BUCKETS) and l > _WAIT_BUCKETS[i]:
+        i += 1
+      buckets[i] += 1
+    return {
+      'simulated_secs': (self._now - _EPOCH).total_seconds(),
+      'reaped': len(latencies),
+      'never_reaped': len(self._pending),
+      'skipped_polls': self.skipped_polls,
+      'reap_latency_p50_secs': _percentile(latencies, 50),
+      'reap_latency_p99_secs': _percentile(latencies, 99),
+      'queue_wait_buckets': [
+        ['<=%ds' % b if i < len(_WAIT_BUCKETS) else '>%ds' % _WAIT_BUCKETS[-1],
+         buckets[i]]
+        for i, b in enumerate(_WAIT_BUCKETS + (_WAIT_BUCKETS[-1],))
+      ],
+      'transaction_retries': sum(
+          op.transaction_retries for op in self._ops.itervalues()),
+      'commit_errors': sum(op.commit_errors for op in self._ops.itervalues()),
+      'enqueued': self.enqueued,
+      'ops': {k: v.to_dict() for k, v in self._ops.iteritems()},
+    }
+
+
+def gen_synthetic_trace(bots, tasks, kinds, period, duration):
+  """Returns a trace of 'tasks' triggers over 'period' seconds with 'bots'
+  polling once.
+
+  Each task requests one of 'kinds' different dimensions sets, each bot
+  provides all of them.
+  """
+  rnd = random.Random(0)
+  trace = []
+  for i in xrange(bots):
+    bot_id = u'bot%d' % i
+    trace.append({
+      'ts': rnd.uniform(0, 10),
+      'type': 'poll',
+      'bot_id': bot_id,
+      'dimensions': {
+        u'id': [bot_id],
+        u'kind': [u'k%d' % k for k in xrange(kinds)],
+        u'os': [u'Linux'],
+        u'pool': [u'default'],
+      },
+    })
+  for _ in xrange(tasks):
+    trace.append({
+      'ts': rnd.uniform(0, period),
+      'type': 'trigger',
+      'dimensions': {
+        u'kind': [u'k%d' % rnd.randrange(kinds)],
+        u'os': [u'Linux'],
+        u'pool': [u'default'],
+      },
+      'priority': rnd.choice([20, 50, 100]),
+      'expiration_secs': 3600,
+      'duration': rnd.expovariate(1. / duration),
+    })
+  trace.sort(key=lambda e: e['ts'])
+  return trace
+
+
+def _print_report(report):
+  print('Simulated %.0fs' % report['simulated_secs'])
+  print('Reaped %d tasks; %d never reaped; %d polls skipped while busy' % (
+      report['reaped'], report['never_reaped'], report['skipped_polls']))
+  if report['reaped']:
+    print('Reap latency: p50 %.1fs; p99 %.1fs' % (
+        report['reap_latency_p50_secs'], report['reap_latency_p99_secs']))
+  print('Queue wait distribution:')
+  for name, count in report['queue_wait_buckets']:
+    print('  %-8s %d' % (name, count))
+  for name, op in sorted(report['ops'].iteritems()):
+    print('%s: %d calls; wall p50 %.1fms; p99 %.1fms' % (
+        name, op['count'], op['wall_p50_ms'], op['wall_p99_ms']))
+    print('  %d transactions; %d retries; %d CommitError' % (
+        op['transactions'], op['transaction_retries'], op['commit_errors']))
+    for rpc, count in sorted(op['rpcs_per_op'].iteritems()):
+      print('  %-36s %.2f/op' % (rpc, count))
+  print('Task queues enqueued: %s' % (
+      ', '.join('%s=%d' % i for i in sorted(report['enqueued'].iteritems())) or
+      'none'))
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=sys.modules[__name__].__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--trace', help='JSON lines trace to replay')
+  parser.add_argument(
+      '--synthetic', action='store_true', help='Generate a synthetic trace')
+  parser.add_argument('--bots', type=int, default=50)
+  parser.add_argument('--tasks', type=int, default=500)
+  parser.add_argument(
+      '--kinds', type=int, default=5,
+      help='Number of different task dimensions sets in the synthetic trace')
+  parser.add_argument(
+      '--period', type=float, default=600.,
+      help='Synthetic trace triggers are spread over this many seconds')
+  parser.add_argument(
+      '--task-duration', type=float, default=30.,
+      help='Mean synthetic task duration in seconds')
+  parser.add_argument(
+      '--poll-interval', type=float,
+      help='Idle bots poll again after this many seconds; default to 10 for '
+           'synthetic traces')
+  parser.add_argument(
+      '--max-secs', type=float, default=6*60*60.,
+      help='Stops the simulation after this many simulated seconds; '
+           'default: %(default)s')
+  parser.add_argument(
+      '--contention', type=float, default=0.,
+      help='Fraction of the datastore commits failing with a simulated '
+           'concurrent transaction; default: %(default)s')
+  parser.add_argument('--save-trace', help='Saves the trace used')
+  parser.add_argument('--json', help='Writes the report as JSON to this file')
+  parser.add_argument('-v', '--verbose', action='store_true')
+  args = parser.parse_args()
+  if bool(args.trace) == args.synthetic:
+    parser.error('Use exactly one of --trace or --synthetic')
+  logging.basicConfig(
+      level=logging.DEBUG if args.verbose else logging.CRITICAL)
+
+  if args.synthetic:
+    trace = gen_synthetic_trace(
+        args.bots, args.tasks, args.kinds, args.period, args.task_duration)
+    if args.poll_interval is None:
+      args.poll_interval = 10.
+  else:
+    with open(args.trace) as f:
+      trace = [json.loads(l) for l in f if l.strip()]
+  if args.save_trace:
+    with open(args.save_trace, 'w') as f:
+      for event in trace:
+        f.write(json.dumps(event, sort_keys=True) + '\n')
+
+  tb = testbed.Testbed()
+  tb.activate()
+  try:
+    tb.init_app_identity_stub()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub()
+    tb.init_user_stub()
+    gae_ts_mon.reset_for_unittest(disable=True)
+    event_mon_metrics.initialize()
+
+    sim = Simulator(args.poll_interval, args.max_secs, args.contention)
+    sim.install()
+    sim.load(trace)
+    sim.run()
+    report = sim.report()
+  finally:
+    tb.deactivate()
+
+  _print_report(report)
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import logging
+import os
+import sys
+import unittest
+
+# Setups environment.
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+import test_env
+test_env.setup_test_env()
+
+import event_mon_metrics
+import gae_ts_mon
+from test_support import test_case
+
+from tools import scheduler_sim
+
+
+class SchedulerSimTest(test_case.TestCase):
+  APP_DIR = APP_DIR
+
+  def setUp(self):
+    super(SchedulerSimTest, self).setUp()
+    gae_ts_mon.reset_for_unittest(disable=True)
+    event_mon_metrics.initialize()
+
+  def _run(self, contention):
+    trace = scheduler_sim.gen_synthetic_trace(2, 4, 2, 20., 5.)
+    sim = scheduler_sim.Simulator(10., 3600., contention)
+    sim.install(self.mock)
+    sim.load(trace)
+    sim.run()
+    return sim.report()
+
+  def test_smoke(self):
+    report = self._run(0.)
+    expected = [
+      'commit_errors',
+      'enqueued',
+      'never_reaped',
+      'ops',
+      'queue_wait_buckets',
+      'reap_latency_p50_secs',
+      'reap_latency_p99_secs',
+      'reaped',
+      'simulated_secs',
+      'skipped_polls',
+      'transaction_retries',
+    ]
+    self.assertEqual(expected, sorted(report))
+    self.assertEqual(4, report['reaped'])
+    self.assertEqual(0, report['never_reaped'])
+    # The testbed runs one request at a time, nothing collides.
+    self.assertEqual(0, report['transaction_retries'])
+    self.assertEqual(0, report['commit_errors'])
+    expected = [
+      'commit_errors',
+      'count',
+      'rpcs',
+      'rpcs_per_op',
+      'transaction_retries',
+      'transactions',
+      'wall_p50_ms',
+      'wall_p99_ms',
+    ]
+    for op in report['ops'].itervalues():
+      self.assertEqual(expected, sorted(op))
+    self.assertTrue(report['ops']['schedule_request']['transactions'])
+
+  def test_contention(self):
+    report = self._run(0.5)
+    self.assertTrue(report['transaction_retries'])
+    self.assertEqual(
+        report['transaction_retries'],
+        sum(op['transaction_retries'] for op in report['ops'].itervalues()))
+    self.assertEqual(
+        report['commit_errors'],
+        sum(op['commit_errors'] for op in report['ops'].itervalues()))
+
+
+if __name__ == '__main__':
+  logging.basicConfig(
+      level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL)
+  unittest.main()
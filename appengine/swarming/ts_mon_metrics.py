@@ -11,10 +11,12 @@ import logging
 
 from google.appengine.datastore.datastore_query import Cursor
 
+from components import rpc_accounting
 from components import utils
 import gae_ts_mon
 
 from server import bot_management
+from server import bq_state
 from server import task_result
 
 # - android_devices is a side effect of the health of each Android devices
@@ -259,6 +261,54 @@ _bot_auth_successes = gae_ts_mon.CounterMetric(
     ])
 
 
+# Instance metrics. Metric fields:
+# - handler: route template of the request handler, e.g.
+#   '/swarming/api/v1/bot/poll'.
+# - rpc: '<service>.<call>', e.g. 'datastore_v3.Put'.
+# - kind: datastore entity kinds involved in the RPC, if any.
+_handler_rpcs = gae_ts_mon.CounterMetric(
+    'swarming/handlers/rpcs',
+    'Number of datastore and memcache RPCs done by request handlers.',
+    [
+        gae_ts_mon.StringField('handler'),
+        gae_ts_mon.StringField('rpc'),
+        gae_ts_mon.StringField('kind'),
+    ])
+
+
+_handler_rpc_bytes = gae_ts_mon.CounterMetric(
+    'swarming/handlers/rpc_bytes',
+    'Bytes sent and received by datastore and memcache RPCs done by request '
+    'handlers.',
+    [
+        gae_ts_mon.StringField('handler'),
+        gae_ts_mon.StringField('rpc'),
+        gae_ts_mon.StringField('kind'),
+    ])
+
+
+# Instance metric. Metric fields:
+# - handler: route template of the request handler.
+_handler_rpc_durations = gae_ts_mon.CumulativeDistributionMetric(
+    'swarming/handlers/rpc_durations',
+    'Wall time spent waiting for datastore and memcache RPCs per request, in '
+    'milliseconds.',
+    [
+        gae_ts_mon.StringField('handler'),
+    ],
+    bucketer=_bucketer)
+
+
+# Instance metric. Metric fields:
+# - table: BigQuery table name, e.g. 'task_results'.
+_bq_export_lag = gae_ts_mon.FloatMetric(
+    'swarming/bq/export_lag',
+    'Age of the last row exported to BigQuery, in seconds.',
+    [
+        gae_ts_mon.StringField('table'),
+    ])
+
+
 ### Private stuff.
 
 
@@ -519,6 +569,31 @@ def on_bot_auth_success(auth_method, condition):
   })
 
 
+def on_request_rpc_stats(handler, stats):
+  """Called by rpc_accounting at the end of each request.
+
+  Arguments:
+    handler: route template of the request handler.
+    stats: rpc_accounting.RequestStats.
+  """
+  for (service, call, kind), s in stats.rpcs.iteritems():
+    fields = {
+      'handler': handler,
+      'rpc': '%s.%s' % (service, call),
+      'kind': kind,
+    }
+    _handler_rpcs.increment_by(s.count, fields=fields)
+    _handler_rpc_bytes.increment_by(
+        s.bytes_sent + s.bytes_received, fields=fields)
+  _handler_rpc_durations.add(
+      stats.wall * 1000., fields={'handler': handler})
+
+
+def on_bq_export_lag(table_name, seconds):
+  """Called by bq_state after each export."""
+  _bq_export_lag.set(seconds, fields={'table': table_name})
+
+
 def set_global_metrics(kind, payload=None):
   if kind == 'jobs':
     _set_jobs_metrics(payload)
@@ -543,3 +618,5 @@ def initialize():
       _machine_types_target_size,
   ])
   gae_ts_mon.register_global_metrics_callback('callback', _set_global_metrics)
+  rpc_accounting.register_callback(on_request_rpc_stats)
+  bq_state.register_lag_callback(on_bq_export_lag)
@@ -14,6 +14,7 @@ test_env.setup_test_env()
 from google.appengine.ext import ndb
 
 import gae_ts_mon
+from components import rpc_accounting
 from test_support import test_case
 
 import ts_mon_metrics
@@ -181,6 +182,33 @@ class TestMetrics(test_case.TestCase):
     ts_mon_metrics.on_task_requested(summary, deduped=False)
     self.assertEqual(1, ts_mon_metrics._jobs_requested.get(fields=fields))
 
+  def test_on_request_rpc_stats(self):
+    stats = rpc_accounting.RequestStats(False)
+    s = rpc_accounting.RpcStats()
+    s.count = 2
+    s.bytes_sent = 10
+    s.bytes_received = 30
+    s.wall = 0.005
+    stats.rpcs[('datastore_v3', 'Get', 'BotInfo')] = s
+    ts_mon_metrics.on_request_rpc_stats('/bot/poll', stats)
+    fields = {
+      'handler': '/bot/poll',
+      'rpc': 'datastore_v3.Get',
+      'kind': 'BotInfo',
+    }
+    self.assertEqual(2, ts_mon_metrics._handler_rpcs.get(fields=fields))
+    self.assertEqual(40, ts_mon_metrics._handler_rpc_bytes.get(fields=fields))
+    dist = ts_mon_metrics._handler_rpc_durations.get(
+        fields={'handler': '/bot/poll'})
+    self.assertEqual(1, dist.count)
+    self.assertEqual(5., dist.sum)
+
+  def test_on_bq_export_lag(self):
+    ts_mon_metrics.on_bq_export_lag('task_results', 12.5)
+    self.assertEqual(
+        12.5,
+        ts_mon_metrics._bq_export_lag.get(fields={'table': 'task_results'}))
+
   def test_initialize(self):
     # Smoke test for syntax errors.
     ts_mon_metrics.initialize()
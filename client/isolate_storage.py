@@ -6,6 +6,8 @@
 """A low-level blob storage/retrieval interface to the Isolate server"""
 
 import base64
+import binascii
+import bisect
 import collections
 import hashlib
 import logging
@@ -43,6 +45,22 @@ NET_IO_FILE_CHUNK = 16 * 1024
 DOWNLOAD_READ_TIMEOUT = 60
 
 
+# Size of the chunks of a resumable upload to Google Storage. It must be a
+# multiple of 256kiB.
+RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+# Number of consecutive failed attempts of a resumable upload to Google Storage
+# without progress before giving up.
+RESUMABLE_MAX_ATTEMPTS = 5
+
+
+# Directory where the snapshots of the digests present on the servers are
+# cached, see IsolateServer.fetch_snapshot(). Disabled when None.
+SNAPSHOT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.isolated_snapshots')
+
+
 # Stores the gRPC proxy address. Must be set if the storage API class is
 # IsolateServerGrpc (call 'set_grpc_proxy').
 _grpc_proxy = None
@@ -136,6 +154,7 @@ class Item(object):
 
   @property
   def compression_level(self):
+    """zlib compression level, or None to choose it from the content."""
     return self._compression_level
 
   def content(self):
@@ -143,6 +162,34 @@ class Item(object):
     raise NotImplementedError()
 
 
+class SortedDigests(object):
+  """Read-only set of hex digests backed by sorted concatenated binary digests.
+
+  A large snapshot takes a fraction of the memory of a set of str this way.
+  """
+  def __init__(self, data, digest_size):
+    self._data = data
+    self._digest_size = digest_size
+
+  def __len__(self):
+    return len(self._data) / self._digest_size
+
+  def __getitem__(self, index):
+    """Returns the binary digest at |index|, for bisect."""
+    if not 0 <= index < len(self):
+      raise IndexError(index)
+    offset = index * self._digest_size
+    return self._data[offset:offset+self._digest_size]
+
+  def __contains__(self, digest):
+    try:
+      key = binascii.unhexlify(digest)
+    except TypeError:
+      return False
+    index = bisect.bisect_left(self, key)
+    return index < len(self) and self[index] == key
+
+
 class StorageApi(object):
   """Interface for classes that implement low-level storage operations.
 
@@ -180,6 +227,28 @@ class StorageApi(object):
     """
     raise NotImplementedError()
 
+  def fetch_batch(self, digests):
+    """Fetches many small objects at once.
+
+    Arguments:
+      digests: hash digests of the items to download.
+
+    Returns:
+      A dict digest -> content (str) of the items returned in one round trip.
+      The other items must be fetched with 'fetch'.
+    """
+    return {}
+
+  def fetch_snapshot(self):
+    """Fetches the digests the server guarantees to keep for a few days.
+
+    Items with these digests don't need to go through 'contains'.
+
+    Returns:
+      A SortedDigests, or None if the server has no snapshot.
+    """
+    return None
+
   def push(self, item, push_state, content=None):
     """Uploads an |item| with content generated by |content| generator.
 
@@ -238,6 +307,13 @@ class _IsolateServerPushState(object):
     self.uploaded = False
     self.finalized = False
     self.size = size
+    # Resumable upload to Google Storage, for large items.
+    self.resumable_upload_url = (
+        preupload_status.get('gs_resumable_upload_url') or None)
+    # URL of the resumable upload session, once started.
+    self.session_url = None
+    # Number of bytes acknowledged by Google Storage in the session.
+    self.offset = 0
 
 
 def guard_memory_use(server, content, size):
@@ -290,6 +366,20 @@ def guard_memory_use(server, content, size):
       logging.info('Unblocked: %d %d', memory_use, size)
 
 
+def _save_snapshot(path, prefix, data):
+  """Saves a snapshot in SNAPSHOT_CACHE_DIR, replacing the previous ones."""
+  if not os.path.isdir(SNAPSHOT_CACHE_DIR):
+    os.makedirs(SNAPSHOT_CACHE_DIR)
+  for name in os.listdir(SNAPSHOT_CACHE_DIR):
+    if name.startswith(prefix + '-'):
+      os.remove(os.path.join(SNAPSHOT_CACHE_DIR, name))
+  # Do not leave a truncated snapshot behind.
+  tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+  with open(tmp, 'wb') as f:
+    f.write(data)
+  os.rename(tmp, path)
+
+
 class IsolateServer(StorageApi):
   """StorageApi implementation that downloads and uploads to Isolate Server.
 
@@ -310,6 +400,8 @@ class IsolateServer(StorageApi):
     self._lock = threading.Lock()
     self._server_caps = None
     self._memory_use = 0
+    # Set when retrieve_batch failed, e.g. the server doesn't support it.
+    self._batch_failed = False
 
   @property
   def _server_capabilities(self):
@@ -395,6 +487,85 @@ class IsolateServer(StorageApi):
     for data in connection.iter_content(NET_IO_FILE_CHUNK):
       yield data
 
+  def fetch_batch(self, digests):
+    if self._batch_failed:
+      return {}
+    source_url = '%s/_ah/api/isolateservice/v1/retrieve_batch' % (
+        self.server_ref.url)
+    logging.debug('download_batch(%s, %d)', source_url, len(digests))
+    response = net.url_read_json(
+        url=source_url,
+        data={
+          'digests': [d.encode('utf-8') for d in digests],
+          'namespace': self._namespace_dict,
+        },
+        read_timeout=DOWNLOAD_READ_TIMEOUT)
+    if response is None:
+      # Fall back to one fetch() per item from now on.
+      logging.warning('Failed to fetch a batch of %d items', len(digests))
+      self._batch_failed = True
+      return {}
+    # Items with an URL or without content are left to fetch().
+    return {
+      i['digest']: base64.b64decode(i['content'])
+      for i in response.get('items', []) if i.get('content') is not None
+    }
+
+  def fetch_snapshot(self):
+    url = '%s/_ah/api/isolateservice/v1/snapshot' % self.server_ref.url
+    response = net.url_read_json(url=url, data=self._namespace_dict)
+    if not response or not int(response.get('parts', 0)):
+      return None
+    snapshot_id = response['snapshot_id']
+    parts = int(response['parts'])
+
+    # The cached snapshots are per server and namespace.
+    prefix = hashlib.sha1(
+        '%s/%s' % (self.server_ref.url, self.server_ref.namespace)).hexdigest()
+    path = None
+    if SNAPSHOT_CACHE_DIR:
+      path = os.path.join(SNAPSHOT_CACHE_DIR, '%s-%s' % (prefix, snapshot_id))
+    size = self.server_ref.hash_algo().digest_size
+    data = None
+    if path and os.path.isfile(path):
+      with open(path, 'rb') as f:
+        data = f.read()
+      if len(data) % size:
+        logging.warning('Invalid cached snapshot of %d bytes', len(data))
+        return None
+    else:
+      url = '%s/_ah/api/isolateservice/v1/snapshot_part' % self.server_ref.url
+      chunks = []
+      for index in xrange(parts):
+        response = net.url_read_json(
+            url=url,
+            data={
+              'index': index,
+              'namespace': self._namespace_dict,
+              'snapshot_id': snapshot_id,
+            },
+            read_timeout=DOWNLOAD_READ_TIMEOUT)
+        if not response:
+          logging.warning('Failed to fetch part %d of the snapshot', index)
+          return None
+        chunks.append(base64.b64decode(response.get('digests', '')))
+      data = ''.join(chunks)
+      if len(data) % size:
+        logging.warning('Invalid snapshot of %d bytes', len(data))
+        return None
+      # The digests are sorted once and cached sorted.
+      data = ''.join(
+          sorted(data[i:i+size] for i in xrange(0, len(data), size)))
+      if path:
+        try:
+          _save_snapshot(path, prefix, data)
+        except (IOError, OSError) as e:
+          logging.warning('Failed to cache the snapshot: %s', e)
+
+    digests = SortedDigests(data, size)
+    logging.info('Snapshot %s lists %d digests', snapshot_id, len(digests))
+    return digests
+
   def push(self, item, push_state, content=None):
     assert isinstance(item, Item)
     assert item.digest is not None
@@ -541,6 +712,11 @@ class IsolateServer(StorageApi):
       return response is not None and response['ok']
 
     # upload to GS
+    if push_state.resumable_upload_url:
+      success = self._do_resumable_push(push_state, content)
+      if success is not None:
+        return success
+      logging.warning('Failed to start a resumable upload, uploading at once')
     url = push_state.upload_url
     response = net.url_read(
         content_type='application/octet-stream',
@@ -550,6 +726,90 @@ class IsolateServer(StorageApi):
         url=url)
     return response is not None
 
+  def _do_resumable_push(self, push_state, content):
+    """Uploads isolated file to GS with the resumable upload protocol.
+
+    The content is sent in RESUMABLE_CHUNK_SIZE chunks. push_state keeps the
+    upload session and the number of bytes acknowledged by GS, so that after a
+    failure, the upload continues from the last acknowledged offset, even in a
+    later push() of the same item. A session that GS refuses, e.g. because it
+    expired, is forgotten so the next push() starts a new one.
+
+    Args:
+      push_state: an _IsolateServicePushState instance
+      content: a 'str' with the whole content.
+
+    Returns:
+      True on success, False on failure, None if the upload session couldn't be
+      started.
+    """
+    size = len(content)
+    if not push_state.session_url:
+      response = net.url_open(
+          push_state.resumable_upload_url,
+          data='',
+          content_type='application/octet-stream',
+          method='POST',
+          headers={'x-goog-resumable': 'start'},
+          follow_redirects=False)
+      session_url = response.get_header('Location') if response else None
+      if not session_url:
+        return None
+      push_state.session_url = session_url
+      push_state.offset = 0
+
+    attempts = 0
+    query = False
+    while attempts < RESUMABLE_MAX_ATTEMPTS:
+      if query:
+        # Asks GS how many bytes it received.
+        data = ''
+        content_range = 'bytes */%d' % size
+      else:
+        end = min(push_state.offset + RESUMABLE_CHUNK_SIZE, size)
+        data = content[push_state.offset:end]
+        content_range = 'bytes %d-%d/%d' % (push_state.offset, end - 1, size)
+      # Do not let net retry, the chunk may have been partially received.
+      response = net.url_open(
+          push_state.session_url,
+          data=data,
+          content_type='application/octet-stream',
+          method='PUT',
+          headers={'Content-Range': content_range},
+          max_attempts=1,
+          follow_redirects=False,
+          return_http_errors=True)
+      if response and response.code in (200, 201):
+        push_state.offset = size
+        return True
+      if response and response.code == 308:
+        # Range is missing when no byte was received yet.
+        received = response.get_header('Range')
+        offset = int(received.rsplit('-', 1)[1]) + 1 if received else 0
+        if offset > push_state.offset:
+          attempts = 0
+        push_state.offset = offset
+        # GS has all the bytes yet didn't complete the upload; ask again.
+        query = offset >= size
+        if query:
+          attempts += 1
+        continue
+      if response and 400 <= response.code < 500:
+        # The session is gone, e.g. 404 or 410, resuming it is pointless.
+        logging.warning(
+            'Resumable upload session of %d bytes failed with HTTP %d',
+            size, response.code)
+        push_state.session_url = None
+        push_state.offset = 0
+        return False
+      attempts += 1
+      logging.warning(
+          'Resumable upload of %d bytes failed after offset %d, attempt %d',
+          size, push_state.offset, attempts)
+      net.sleep_before_retry(attempts, None)
+      query = True
+    return False
+
 
 class _IsolateServerGrpcPushState(object):
   """Empty class, just to present same interface as IsolateServer  """
@@ -10,6 +10,7 @@ __version__ = '0.9.0'
 import collections
 import errno
 import functools
+import itertools
 import logging
 import optparse
 import os
@@ -67,14 +68,35 @@ DEADLOCK_TIMEOUT = 5 * 60
 ITEMS_PER_CONTAINS_QUERIES = (20, 20, 50, 50, 50, 100)
 
 
+# Number of distinct items an upload must have for the snapshot of the digests
+# present on the server to be fetched, see Storage.upload_items(). The snapshot
+# can be megabytes large, smaller uploads just look up all their items.
+MIN_ITEMS_FOR_SNAPSHOT = 2000
+
+
 # A list of already compressed extension types that should not receive any
 # compression before being uploaded.
 ALREADY_COMPRESSED_TYPES = [
-    '7z', 'avi', 'cur', 'gif', 'h264', 'jar', 'jpeg', 'jpg', 'mp4', 'pdf',
-    'png', 'wav', 'zip',
+    '7z', 'aab', 'apk', 'avi', 'bz2', 'cur', 'gif', 'gz', 'h264', 'jar',
+    'jpeg', 'jpg', 'mkv', 'mov', 'mp3', 'mp4', 'ogg', 'pdf', 'png', 'tgz',
+    'wav', 'webm', 'webp', 'whl', 'woff2', 'xz', 'zip', 'zst',
 ]
 
 
+# zlib compression level used for the content that compresses well. Content
+# that doesn't is stored, see _probe_compression_level().
+COMPRESSION_LEVEL = 7
+
+
+# Number of bytes at the start of an item used to guess how well it compresses.
+PROBE_SIZE = 64 * 1024
+
+
+# Items for which the probe compresses to more than this ratio of its size are
+# stored instead of compressed.
+INCOMPRESSIBLE_RATIO = 0.9
+
+
 # The delay (in seconds) to wait between logging statements when retrieving
 # the required files. This is intended to let the user (or buildbot) know that
 # the program is still running.
@@ -235,8 +257,22 @@ def putfile(srcfileobj, dstpath, file_mode=None, size=-1, use_symlink=False):
     fs.chmod(dstpath, file_mode)
 
 
-def zip_compress(content_generator, level=7):
-  """Reads chunks from |content_generator| and yields zip compressed chunks."""
+def zip_compress(content_generator, level=COMPRESSION_LEVEL):
+  """Reads chunks from |content_generator| and yields zip compressed chunks.
+
+  If |level| is None, it is chosen from the first PROBE_SIZE bytes of content.
+  """
+  if level is None:
+    content_generator = iter(content_generator)
+    head = []
+    head_size = 0
+    for chunk in content_generator:
+      head.append(chunk)
+      head_size += len(chunk)
+      if head_size >= PROBE_SIZE:
+        break
+    level = _probe_compression_level(''.join(head)[:PROBE_SIZE])
+    content_generator = itertools.chain(head, content_generator)
   compressor = zlib.compressobj(level)
   for chunk in content_generator:
     compressed = compressor.compress(chunk)
@@ -280,10 +316,25 @@ def zip_decompress(
 
 
 def _get_zip_compression_level(filename):
-  """Given a filename calculates the ideal zip compression level to use."""
-  file_ext = os.path.splitext(filename)[1].lower()
-  # TODO(csharp): Profile to find what compression level works best.
-  return 0 if file_ext in ALREADY_COMPRESSED_TYPES else 7
+  """Given a filename calculates the ideal zip compression level to use.
+
+  Returns None when it has to be guessed from the content, see zip_compress().
+  """
+  file_ext = os.path.splitext(filename)[1].lower().lstrip('.')
+  return 0 if file_ext in ALREADY_COMPRESSED_TYPES else None
+
+
+def _probe_compression_level(data):
+  """Returns the zip compression level to use for content starting with |data|.
+
+  Compressing at the fastest level is a cheap estimate of the entropy of the
+  content. Content that barely compresses, like archives or media files with an
+  unknown extension, is stored to save the CPU time of compressing it again.
+  """
+  if not data:
+    return COMPRESSION_LEVEL
+  ratio = float(len(zlib.compress(data, 1))) / len(data)
+  return 0 if ratio > INCOMPRESSIBLE_RATIO else COMPRESSION_LEVEL
 
 
 def create_directories(base_directory, files):
@@ -521,6 +572,8 @@ class Storage(object):
     self._net_thread_pool = None
     self._aborted = False
     self._prev_sig_handlers = {}
+    # Digests that are known to be on the server, see upload_items().
+    self._known_digests = None
 
   @property
   def server_ref(self):
@@ -753,7 +806,16 @@ class Storage(object):
         # This must be done in the primary thread since items can be a
         # generator.
         for item in items:
-          if seen.setdefault(item.digest, item) is item:
+          if seen.setdefault(item.digest, item) is not item:
+            continue
+          # The items listed in the snapshot of the server are not looked up.
+          # It is only worth fetching for large uploads.
+          if (self._known_digests is None and
+              len(seen) >= MIN_ITEMS_FOR_SNAPSHOT):
+            self._known_digests = (
+                self._storage_api.fetch_snapshot() or frozenset())
+          if (self._known_digests is None or
+              item.digest not in self._known_digests):
             incoming.put(item)
       finally:
         incoming.put(None)
@@ -872,6 +934,42 @@ class Storage(object):
     # really fast and most probably IO bound anyway.
     self.net_thread_pool.add_task_with_channel(channel, priority, fetch)
 
+  def async_fetch_batch(self, channel, priority, items):
+    """Starts asynchronous fetch of many small items in a parallel thread.
+
+    The items returned inline by the server are fetched in one round trip. The
+    others are fetched one by one with async_fetch().
+
+    Arguments:
+      channel: TaskChannel that receives back each digest when its download
+          ends.
+      priority: thread pool task priority for the fetch.
+      items: list of (digest, size, sink) tuples, see async_fetch().
+    """
+    def fetch_batch():
+      contents = {}
+      try:
+        contents = self._storage_api.fetch_batch([i[0] for i in items])
+      except Exception as err:
+        logging.warning('Failed to fetch a batch of %d items: %s',
+            len(items), err)
+      for digest, size, sink in items:
+        if digest in contents:
+          try:
+            stream = [contents[digest]]
+            if self.server_ref.is_with_compression:
+              stream = zip_decompress(stream, isolated_format.DISK_FILE_CHUNK)
+            verifier = FetchStreamVerifier(
+                stream, self.server_ref.hash_algo, digest, size)
+            sink(verifier.run())
+            channel.send_result(digest)
+            continue
+          except Exception as err:
+            logging.warning('Failed to fetch %s in a batch: %s', digest, err)
+        self.async_fetch(channel, priority, digest, size, sink)
+
+    self.net_thread_pool.add_task_with_channel(None, priority, fetch_batch)
+
 
 class FetchQueue(object):
   """Fetches items from Storage and places them into ContentAddressedCache.
@@ -881,6 +979,13 @@ class FetchQueue(object):
   don't depend on each other at all.
   """
 
+  # Items of at most this size are fetched in batches, see
+  # Storage.async_fetch_batch(). Larger ones are usually in Cloud Storage.
+  _BATCH_MAX_ITEM_SIZE = 2048
+
+  # Maximum number of items in a batch.
+  _BATCH_SIZE = 100
+
   def __init__(self, storage, cache):
     self.storage = storage
     self.cache = cache
@@ -893,6 +998,8 @@ class FetchQueue(object):
     # Already fetched digests the caller waits for which are not yet returned by
     # wait().
     self._waiting_on_ready = set()
+    # Small items not yet fetched, per priority, see _flush_batches().
+    self._batches = {}
 
   def add(
       self,
@@ -926,9 +1033,14 @@ class FetchQueue(object):
 
     # Start fetching.
     self._pending.add(digest)
-    self.storage.async_fetch(
-        self._channel, priority, digest, size,
-        functools.partial(self.cache.write, digest))
+    sink = functools.partial(self.cache.write, digest)
+    if size is not None and size <= self._BATCH_MAX_ITEM_SIZE:
+      batch = self._batches.setdefault(priority, [])
+      batch.append((digest, size, sink))
+      if len(batch) == self._BATCH_SIZE:
+        self._flush_batches()
+      return
+    self.storage.async_fetch(self._channel, priority, digest, size, sink)
 
   def wait_on(self, digest):
     """Updates digests to be waited on by 'wait'."""
@@ -954,6 +1066,7 @@ class FetchQueue(object):
       return self._waiting_on_ready.pop()
 
     assert self._waiting_on, 'Needs items to wait on'
+    self._flush_batches()
 
     # Wait for one waited-on item to be fetched.
     while self._pending:
@@ -991,6 +1104,15 @@ class FetchQueue(object):
     # Not thread safe, but called after all work is done.
     return self._accessed.issubset(self.cache)
 
+  def _flush_batches(self):
+    """Starts fetching the small items added so far."""
+    for priority, batch in self._batches.iteritems():
+      if len(batch) == 1:
+        self.storage.async_fetch(self._channel, priority, *batch[0])
+      else:
+        self.storage.async_fetch_batch(self._channel, priority, batch)
+    self._batches = {}
+
 
 class FetchStreamVerifier(object):
   """Verifies that fetched file is valid before passing it to the
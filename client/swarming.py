@@ -286,6 +286,13 @@ def trigger_task_shards(swarming, task_request, shards):
 # How often to print status updates to stdout in 'collect'.
 STATUS_UPDATE_INTERVAL = 5 * 60.
 
+# Minimum number of shards for which 'collect' polls the results of all the
+# shards at once with tasks/get_results instead of one task at a time.
+BATCH_MIN_SHARDS = 4
+
+# Maximum number of task IDs per tasks/get_results call.
+BATCH_MAX_TASKS = 100
+
 
 class TaskState(object):
   """Represents the current task state.
@@ -477,6 +484,30 @@ def parse_time(value):
   raise ValueError('Failed to parse %s' % value)
 
 
+def _fetch_output(output_url):
+  """Returns the whole output of a task.
+
+  The server returns large outputs in pages. Servers that support paging
+  return next_offset, the offset to use to fetch the following page. The
+  output ends once a page is empty or next_offset stops advancing.
+  """
+  out = net.url_read_json(output_url)
+  if not out:
+    return ''
+  parts = [out.get('output', '')]
+  offset = 0
+  while out.get('output') and out.get('next_offset'):
+    next_offset = int(out['next_offset'])
+    if next_offset <= offset:
+      break
+    offset = next_offset
+    out = net.url_read_json('%s?offset=%d' % (output_url, offset))
+    if not out:
+      break
+    parts.append(out.get('output', ''))
+  return ''.join(parts)
+
+
 def retrieve_results(
     base_url, shard_index, task_id, timeout, should_stop, output_collector,
     include_perf, fetch_stdout):
@@ -490,7 +521,6 @@ def retrieve_results(
   result_url = '%s/_ah/api/swarming/v1/task/%s/result' % (base_url, task_id)
   if include_perf:
     result_url += '?include_performance_stats=true'
-  output_url = '%s/_ah/api/swarming/v1/task/%s/stdout' % (base_url, task_id)
   started = now()
   deadline = started + timeout if timeout > 0 else None
   attempt = 0
@@ -546,18 +576,109 @@ def retrieve_results(
     # When timeout == -1, always return on first attempt. 500s are already
     # retried in this case.
     if result['state'] not in TaskState.STATES_RUNNING or timeout == -1:
-      if fetch_stdout:
-        out = net.url_read_json(output_url)
-        result['output'] = out.get('output', '') if out else ''
-      # Record the result, try to fetch attached output files (if any).
-      if output_collector:
-        # TODO(vadimsh): Respect |should_stop| and |deadline| when fetching.
-        output_collector.process_shard_result(shard_index, result)
-      if result.get('internal_failure'):
-        logging.error('Internal error!')
-      elif result['state'] == 'BOT_DIED':
-        logging.error('Bot died!')
-      return result
+      return process_result(
+          base_url, shard_index, task_id, result, output_collector,
+          fetch_stdout)
+
+
+def process_result(
+    base_url, shard_index, task_id, result, output_collector, fetch_stdout):
+  """Completes the result of a task that is not running anymore.
+
+  Fetches the task output if requested and passes the result to the output
+  collector.
+
+  Returns:
+    <result dict>.
+  """
+  if fetch_stdout:
+    result['output'] = _fetch_output(
+        '%s/_ah/api/swarming/v1/task/%s/stdout' % (base_url, task_id))
+  # Record the result, try to fetch attached output files (if any).
+  if output_collector:
+    # TODO(vadimsh): Respect |should_stop| and |deadline| when fetching.
+    output_collector.process_shard_result(shard_index, result)
+  if result.get('internal_failure'):
+    logging.error('Internal error!')
+  elif result['state'] == 'BOT_DIED':
+    logging.error('Bot died!')
+  return result
+
+
+def poll_results_batch(
+    base_url, task_ids, timeout, should_stop, include_perf, on_result):
+  """Polls the results of many tasks at once with tasks/get_results.
+
+  Calls on_result(shard_index, result) once per task, as soon as the task is
+  not running anymore, or with None as the result when it timed out.
+
+  Returns:
+    List of the shard indexes that must be retrieved one at a time with
+    retrieve_results(), which happens when the server doesn't support
+    tasks/get_results.
+  """
+  assert timeout is None or isinstance(timeout, float), timeout
+  remaining = list(enumerate(task_ids))
+  started = now()
+  deadline = started + timeout if timeout > 0 else None
+  attempt = 0
+  supported = False
+
+  while remaining and not should_stop.is_set():
+    attempt += 1
+
+    # Same backoff as in retrieve_results().
+    current_time = now()
+    if deadline and current_time >= deadline:
+      logging.error('poll_results_batch(%s) timed out on attempt %d',
+          base_url, attempt)
+      break
+    if attempt > 1:
+      max_delay = min(15, 1 + (current_time - started) / 30.0)
+      delay = min(max_delay, deadline - current_time) if deadline else max_delay
+      if delay > 0:
+        logging.debug('Waiting %.1f sec before retrying', delay)
+        should_stop.wait(delay)
+        if should_stop.is_set():
+          break
+
+    still_running = []
+    for i in xrange(0, len(remaining), BATCH_MAX_TASKS):
+      chunk = remaining[i:i+BATCH_MAX_TASKS]
+      args = [('task_id', task_id) for _, task_id in chunk]
+      if include_perf:
+        args.append(('include_performance_stats', 'true'))
+      result = net.url_read_json(
+          '%s/_ah/api/swarming/v1/tasks/get_results?%s' % (
+              base_url, urllib.urlencode(args)),
+          retry_50x=bool(timeout == -1))
+      if not result or result.get('error'):
+        if not supported:
+          logging.warning(
+              'tasks/get_results failed, retrieving results one at a time')
+          return [index for index, _ in remaining]
+        if timeout == -1:
+          for index, _ in chunk:
+            on_result(index, None)
+        else:
+          still_running.extend(chunk)
+        continue
+
+      supported = True
+      results = dict((r['task_id'], r) for r in result.get('items', []))
+      for index, task_id in chunk:
+        r = results.get(task_id)
+        if r and (r['state'] not in TaskState.STATES_RUNNING or timeout == -1):
+          on_result(index, r)
+        elif not r and timeout == -1:
+          on_result(index, None)
+        else:
+          still_running.append((index, task_id))
+    remaining = still_running
+
+  for index, _ in remaining:
+    on_result(index, None)
+  return []
 
 
 def yield_results(
@@ -573,6 +694,10 @@ def yield_results(
   done. Since in general the number of task_keys is in the range <=10, it's not
   worth normally to limit the number threads. Mostly used for testing purposes.
 
+  When there are at least BATCH_MIN_SHARDS task IDs, the states of all the
+  tasks are polled at once with poll_results_batch() and the thread pool is
+  only used to fetch the outputs of the completed tasks.
+
   output_collector is an optional instance of TaskOutputCollector that will be
   used to fetch files produced by a task from isolate server to the local disk.
 
@@ -597,9 +722,46 @@ def yield_results(
             task_id, timeout, should_stop, output_collector, include_perf,
             fetch_stdout)
 
-      # Enqueue 'retrieve_results' calls for each shard key to run in parallel.
-      for shard_index, task_id in enumerate(task_ids):
-        enqueue_retrieve_results(shard_index, task_id)
+      if len(task_ids) >= BATCH_MIN_SHARDS:
+        # Adds a task to the thread pool to call 'process_result' on a task
+        # that completed, or directly returns None when it timed out.
+        reported = set()
+        def on_result(shard_index, result):
+          reported.add(shard_index)
+          if not result:
+            results_channel.send_result((shard_index, None))
+            return
+          # pylint: disable=no-value-for-parameter
+          task_fn = lambda *args: (shard_index, process_result(*args))
+          pool.add_task(
+              0, results_channel.wrap_task(task_fn), swarm_base_url,
+              shard_index, task_ids[shard_index], result, output_collector,
+              fetch_stdout)
+
+        def poll():
+          try:
+            indexes = poll_results_batch(
+                swarm_base_url, task_ids, timeout, should_stop, include_perf,
+                on_result)
+          except Exception:
+            logging.exception('Unexpected exception in poll_results_batch')
+            for shard_index in xrange(len(task_ids)):
+              if shard_index not in reported:
+                results_channel.send_result((shard_index, None))
+            return
+          if should_stop.is_set():
+            return
+          for shard_index in indexes:
+            enqueue_retrieve_results(shard_index, task_ids[shard_index])
+
+        poller = threading.Thread(target=poll, name='poll_results_batch')
+        poller.daemon = True
+        poller.start()
+      else:
+        # Enqueue 'retrieve_results' calls for each shard key to run in
+        # parallel.
+        for shard_index, task_id in enumerate(task_ids):
+          enqueue_retrieve_results(shard_index, task_id)
 
       # Wait for all of them to finish.
       shards_remaining = range(len(task_ids))
@@ -72,7 +72,7 @@ class FakeIsolateServerHandler(httpserver.Handler):
       if not finalize_gs:
         self.server.contents.setdefault(namespace, {})[d] = hash_content(
             content)
-    else:
+    elif not finalize_gs:
       self.server.contents.setdefault(namespace, {})[d] = content
     self.send_json({'ok': True})
 
@@ -108,6 +108,11 @@ class FakeIsolateServerHandler(httpserver.Handler):
           }
           if self._should_push_to_gs(entry['i'], entry['s']):
             status['gs_upload_url'] = self._generate_signed_url(entry['d'])
+            min_size = self.server.resumable_min_size
+            if min_size is not None and entry['s'] >= min_size:
+              status['gs_resumable_upload_url'] = (
+                  '%s/FAKE_GCS_RESUMABLE/%s/%s' % (
+                      self.server.url, entry['n'], entry['d']))
           li.append(status)
         # Don't use finalize url for the fake.
 
@@ -126,6 +131,17 @@ class FakeIsolateServerHandler(httpserver.Handler):
       self._storage_helper(body, False)
     elif self.path.startswith('/_ah/api/isolateservice/v1/finalize_gs_upload'):
       self._storage_helper(body, True)
+    elif self.path.startswith('/_ah/api/isolateservice/v1/retrieve_batch'):
+      request = json.loads(body)
+      namespace = request['namespace']['namespace']
+      contents = self.server.contents.get(namespace, {})
+      # Missing entries are omitted.
+      self.send_json({
+        'items': [
+          {'digest': d, 'content': contents[d]}
+          for d in request['digests'] if d in contents
+        ],
+      })
     elif self.path.startswith('/_ah/api/isolateservice/v1/retrieve'):
       request = json.loads(body)
       namespace = request['namespace']['namespace']
@@ -134,8 +150,37 @@ class FakeIsolateServerHandler(httpserver.Handler):
         logging.error(
             'Failed to retrieve %s / %s', namespace, request['digest'])
       self.send_json({'content': data})
+    elif self.path.startswith('/_ah/api/isolateservice/v1/snapshot_part'):
+      request = json.loads(body)
+      namespace = request['namespace']['namespace']
+      snapshot_id, parts = self.server.snapshots.get(namespace, (None, []))
+      index = int(request['index'])
+      if str(snapshot_id) != str(request['snapshot_id']) or index >= len(parts):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+      self.send_json({'digests': base64.b64encode(parts[index])})
+    elif self.path.startswith('/_ah/api/isolateservice/v1/snapshot'):
+      request = json.loads(body)
+      snapshot_id, parts = self.server.snapshots.get(
+          request['namespace'], (None, []))
+      if not parts:
+        self.send_json({})
+      else:
+        self.send_json(
+            {'snapshot_id': str(snapshot_id), 'parts': str(len(parts))})
     elif self.path.startswith('/_ah/api/isolateservice/v1/server_details'):
       self.send_json({'server_version': 'such a good version'})
+    elif self.path.startswith('/FAKE_GCS_RESUMABLE/'):
+      assert self.headers['x-goog-resumable'] == 'start', self.headers
+      path = self.path[len('/FAKE_GCS_RESUMABLE/'):]
+      self.server.sessions[path] = ''
+      self.send_response(201)
+      self.send_header(
+          'Location', '%s/FAKE_GCS_SESSION/%s' % (self.server.url, path))
+      self.send_header('Content-Length', '0')
+      self.end_headers()
     else:
       raise NotImplementedError(self.path)
 
@@ -151,9 +196,58 @@ class FakeIsolateServerHandler(httpserver.Handler):
       else:
         self.server.contents.setdefault(namespace, {})[h] = self.read_body()
       self.send_octet_stream('')
+    elif self.path.startswith('/FAKE_GCS_SESSION/'):
+      self._resumable_put(self.path[len('/FAKE_GCS_SESSION/'):])
     else:
       raise NotImplementedError(self.path)
 
+  def _resumable_put(self, path):
+    """Implements a chunk upload or a status query of a GCS resumable upload.
+    """
+    namespace, h = path.split('/', 1)
+    received = self.server.sessions[path]
+    data = self.read_body()
+    content_range = self.headers['Content-Range']
+    m = re.match(r'^bytes (\d+)-(\d+)/(\d+)$', content_range)
+    if m:
+      start, end, total = map(int, m.groups())
+      assert start == len(received), (start, len(received))
+      assert end - start + 1 == len(data), (start, end, len(data))
+      self.server.chunks.append((start, end))
+      if self.server.resumable_expirations:
+        # Forgets the session.
+        self.server.resumable_expirations -= 1
+        del self.server.sessions[path]
+        self.send_response(410)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+      if self.server.resumable_failures:
+        # Keeps half of the chunk and fails.
+        self.server.resumable_failures -= 1
+        self.server.sessions[path] = received + data[:len(data) / 2]
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+      received += data
+      self.server.sessions[path] = received
+    else:
+      m = re.match(r'^bytes \*/(\d+)$', content_range)
+      assert m, content_range
+      total = int(m.group(1))
+    if len(received) == total:
+      if self.server.store_hash_instead:
+        received = hash_content(received)
+      self.server.contents.setdefault(namespace, {})[h] = received
+      self.send_octet_stream('')
+      return
+    self.send_response(308)
+    if received:
+      self.send_header('Range', 'bytes=0-%d' % (len(received) - 1))
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
 
 class FakeIsolateServer(httpserver.Server):
   _HANDLER_CLS = FakeIsolateServerHandler
@@ -162,11 +256,38 @@ class FakeIsolateServer(httpserver.Server):
     super(FakeIsolateServer, self).__init__()
     self._server.contents = {}
     self._server.store_hash_instead = False
+    # Minimum size of the items uploaded with the resumable upload protocol, if
+    # any.
+    self._server.resumable_min_size = None
+    # Number of chunks of resumable uploads to partially save and then fail.
+    self._server.resumable_failures = 0
+    # Number of chunks of resumable uploads to fail by expiring their session.
+    self._server.resumable_expirations = 0
+    # Ongoing resumable uploads and the ranges of the chunks received.
+    self._server.sessions = {}
+    self._server.chunks = []
+    # Snapshots of the digests present: {namespace: (id, [binary digests])}.
+    self._server.snapshots = {}
 
   def store_hash_instead(self):
     """Stops saving content in memory. Used to test large files."""
     self._server.store_hash_instead = True
 
+  def enable_resumable(self, min_size, failures=0, expirations=0):
+    """Enables the resumable uploads of the items of min_size bytes or more."""
+    self._server.resumable_min_size = min_size
+    self._server.resumable_failures = failures
+    self._server.resumable_expirations = expirations
+
+  def add_snapshot(self, namespace, snapshot_id, parts):
+    """Sets the snapshot of a namespace, as lists of hex digests per part."""
+    self._server.snapshots[namespace] = (
+        snapshot_id, [''.join(d.decode('hex') for d in p) for p in parts])
+
+  @property
+  def chunks(self):
+    return self._server.chunks
+
   @property
   def contents(self):
     return self._server.contents
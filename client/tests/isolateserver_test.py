@@ -29,6 +29,7 @@ import isolateserver
 import isolate_storage
 import local_caching
 import test_utils
+from depot_tools import auto_stub
 from depot_tools import fix_encoding
 from utils import file_path
 from utils import fs
@@ -111,6 +112,23 @@ class TestZipCompression(TestCase):
     with self.assertRaises(IOError):
       ''.join(isolateserver.zip_decompress(['Im not a zip file']))
 
+  def test_compress_probe(self):
+    """Verify the level is chosen from the content when not specified."""
+    self.mock(isolateserver, 'PROBE_SIZE', 1000)
+    # The second byte of the zlib header is the compression level: \x01 for 0
+    # or 1 and \xda for 7 to 9.
+    for data, header in ((os.urandom(3000), '\x01'), ('a' * 3000, '\xda')):
+      chunks = [data[i:i+300] for i in xrange(0, len(data), 300)]
+      compressed = ''.join(isolateserver.zip_compress(chunks, None))
+      self.assertEqual('\x78' + header, compressed[:2])
+      self.assertEqual(
+          data, ''.join(isolateserver.zip_decompress([compressed])))
+
+  def test_get_zip_compression_level(self):
+    self.assertEqual(0, isolateserver._get_zip_compression_level('a/b.APK'))
+    self.assertEqual(None, isolateserver._get_zip_compression_level('a/b.txt'))
+    self.assertEqual(None, isolateserver._get_zip_compression_level('a/zip'))
+
 
 class FakeItem(isolate_storage.Item):
   def __init__(self, data, high_priority=False):
@@ -621,6 +639,60 @@ class IsolateServerStorageApiTest(TestCase):
     fetched = ''.join(storage.fetch(item, 0, 0))
     self.assertEqual(data, fetched)
 
+  def test_fetch_batch(self):
+    server_ref = isolate_storage.ServerRef('http://example.com', 'default')
+    items = [isolateserver_fake.hash_content(str(i)) for i in xrange(4)]
+    self.expected_requests([
+      (
+        '%s/_ah/api/isolateservice/v1/retrieve_batch' % server_ref.url,
+        {
+          'data': {
+            'digests': items,
+            'namespace': {
+              'compression': '',
+              'digest_hash': 'sha-1',
+              'namespace': 'default',
+            },
+          },
+          'read_timeout': 60,
+        },
+        {
+          # items[1] is in GS, items[2] doesn't fit and items[3] is missing.
+          'items': [
+            {'digest': items[0], 'content': base64.b64encode('0')},
+            {'digest': items[1], 'url': 'https://gs/url'},
+            {'digest': items[2]},
+          ],
+        },
+      ),
+    ])
+    storage = isolate_storage.IsolateServer(server_ref)
+    self.assertEqual({items[0]: '0'}, storage.fetch_batch(items))
+
+  def test_fetch_batch_failure(self):
+    server_ref = isolate_storage.ServerRef('http://example.com', 'default')
+    items = [isolateserver_fake.hash_content(str(i)) for i in xrange(2)]
+    request = (
+      '%s/_ah/api/isolateservice/v1/retrieve_batch' % server_ref.url,
+      {
+        'data': {
+          'digests': items,
+          'namespace': {
+            'compression': '',
+            'digest_hash': 'sha-1',
+            'namespace': 'default',
+          },
+        },
+        'read_timeout': 60,
+      },
+      None,
+    )
+    self.expected_requests([request])
+    storage = isolate_storage.IsolateServer(server_ref)
+    self.assertEqual({}, storage.fetch_batch(items))
+    # It is not retried.
+    self.assertEqual({}, storage.fetch_batch(items))
+
   def test_fetch_failure(self):
     server_ref = isolate_storage.ServerRef('http://example.com', 'default')
     item = isolateserver_fake.hash_content('something')
@@ -821,7 +893,7 @@ class IsolateServerStorageApiTest(TestCase):
       storage.contains([])
 
 
-class IsolateServerStorageSmokeTest(unittest.TestCase):
+class IsolateServerStorageSmokeTest(auto_stub.TestCase):
   """Tests public API of Storage class using file system as a store."""
 
   def setUp(self):
@@ -866,7 +938,53 @@ class IsolateServerStorageSmokeTest(unittest.TestCase):
   def test_upload_items_gzip(self):
     self.run_upload_items_test('default-gzip')
 
-  def run_push_and_fetch_test(self, namespace):
+  def test_upload_items_snapshot(self):
+    cache_dir = os.path.join(self.tempdir, 'snapshots')
+    self.mock(isolate_storage, 'SNAPSHOT_CACHE_DIR', cache_dir)
+    server_ref = isolate_storage.ServerRef(self.server.url, 'default')
+    items = [
+      isolateserver.BufferItem('item %d' % i, server_ref.hash_algo)
+      for i in xrange(4)
+    ]
+    self.server.add_snapshot(
+        'default', 1, [[items[0].digest], [items[1].digest]])
+    # Small uploads don't fetch the snapshot.
+    self.mock(isolateserver, 'MIN_ITEMS_FOR_SNAPSHOT', 5)
+    storage = isolateserver.get_storage(server_ref)
+    self.assertEqual(set(items[:1]), set(storage.upload_items(items[:1])))
+    self.assertFalse(os.path.exists(cache_dir))
+
+    # The items listed in the snapshot are skipped.
+    self.mock(isolateserver, 'MIN_ITEMS_FOR_SNAPSHOT', 1)
+    self.server.contents['default'].clear()
+    storage = isolateserver.get_storage(server_ref)
+    self.assertEqual(set(items[2:]), set(storage.upload_items(items)))
+    self.assertEqual(1, len(os.listdir(cache_dir)))
+    self.assertTrue(os.listdir(cache_dir)[0].endswith('-1'))
+
+    # The cached snapshot is used as long as it is current.
+    self.server.add_snapshot('default', 1, [[]])
+    storage = isolateserver.get_storage(server_ref)
+    self.assertEqual([], storage.upload_items(items))
+
+    # A new snapshot replaces it.
+    self.server.add_snapshot('default', 2, [[items[0].digest]])
+    storage = isolateserver.get_storage(server_ref)
+    self.assertEqual([items[1]], storage.upload_items(items))
+    self.assertEqual(1, len(os.listdir(cache_dir)))
+    self.assertTrue(os.listdir(cache_dir)[0].endswith('-2'))
+    self.assertNotIn(items[0].digest, self.server.contents['default'])
+
+  def test_sorted_digests(self):
+    digests = sorted(hashlib.sha1(str(i)).digest() for i in xrange(5))
+    snapshot = isolate_storage.SortedDigests(''.join(digests[1:4]), 20)
+    self.assertEqual(3, len(snapshot))
+    self.assertEqual(
+        [False, True, True, True, False],
+        [d.encode('hex') in snapshot for d in digests])
+    self.assertNotIn('invalid', snapshot)
+
+  def run_push_and_fetch_test(self, namespace, batch=False):
     storage = isolateserver.get_storage(
         isolate_storage.ServerRef(self.server.url, namespace))
 
@@ -886,7 +1004,11 @@ class IsolateServerStorageSmokeTest(unittest.TestCase):
     pending = set()
     for item in items:
       pending.add(item.digest)
-      queue.add(item.digest)
+      # Small items of known size are fetched in batches.
+      if batch:
+        queue.add(item.digest, item.size)
+      else:
+        queue.add(item.digest)
       queue.wait_on(item.digest)
 
     # Wait for fetch to complete.
@@ -908,6 +1030,42 @@ class IsolateServerStorageSmokeTest(unittest.TestCase):
   def test_push_and_fetch_gzip(self):
     self.run_push_and_fetch_test('default-gzip')
 
+  def test_push_and_fetch_batch(self):
+    self.run_push_and_fetch_test('default', batch=True)
+
+  def test_push_and_fetch_batch_gzip(self):
+    self.run_push_and_fetch_test('default-gzip', batch=True)
+
+  def run_resumable_push_test(self, failures, expirations=0):
+    self.server.enable_resumable(
+        1024, failures=failures, expirations=expirations)
+    self.mock(isolate_storage, 'RESUMABLE_CHUNK_SIZE', 1000)
+    self.mock(isolate_storage.net, 'sleep_before_retry', lambda *_: None)
+    storage = isolateserver.get_storage(
+        isolate_storage.ServerRef(self.server.url, 'default'))
+    data = ''.join(chr(i % 256) for i in xrange(2500))
+    item = isolateserver.BufferItem(data, storage.server_ref.hash_algo)
+    self.assertEqual([item], storage.upload_items([item]))
+    self.assertEqual({'default': {item.digest: data}}, self.server.contents)
+    return self.server.chunks
+
+  def test_push_resumable(self):
+    self.assertEqual(
+        [(0, 999), (1000, 1999), (2000, 2499)],
+        self.run_resumable_push_test(0))
+
+  def test_push_resumable_failures(self):
+    # Each failed chunk is resumed from the half GCS kept.
+    self.assertEqual(
+        [(0, 999), (500, 1499), (1000, 1999), (2000, 2499)],
+        self.run_resumable_push_test(2))
+
+  def test_push_resumable_expired(self):
+    # The retried push starts a new session from the beginning.
+    self.assertEqual(
+        [(0, 999), (0, 999), (1000, 1999), (2000, 2499)],
+        self.run_resumable_push_test(0, expirations=1))
+
   def _archive_smoke(self, size):
     self.server.store_hash_instead()
     files = {}
@@ -1076,28 +1234,50 @@ class IsolateServerDownloadTest(TestCase):
     }
     isolated_data = json.dumps(isolated, sort_keys=True, separators=(',',':'))
     isolated_hash = isolateserver_fake.hash_content(isolated_data)
-    requests = [
-      (v['h'], files[k]) for k, v in isolated['files'].iteritems()
+    namespace = {
+      'namespace': 'default-gzip',
+      'digest_hash': 'sha-1',
+      'compression': 'flate',
+    }
+    # The small files are fetched in a batch, in the order of the isolated file
+    # as loaded by the client.
+    contents = {v['h']: files[k] for k, v in isolated['files'].iteritems()
+                if 'h' in v}
+    digests = [
+      v['h'] for v in json.loads(isolated_data)['files'].itervalues()
       if 'h' in v
     ]
-    requests.append((isolated_hash, isolated_data))
     requests = [
       (
         '%s/_ah/api/isolateservice/v1/retrieve' % server_ref.url,
         {
             'data': {
-                'digest': h.encode('utf-8'),
-                'namespace': {
-                    'namespace': 'default-gzip',
-                    'digest_hash': 'sha-1',
-                    'compression': 'flate',
-                },
+                'digest': isolated_hash.encode('utf-8'),
+                'namespace': namespace,
                 'offset': 0,
             },
             'read_timeout': 60,
         },
-        {'content': base64.b64encode(zlib.compress(v))},
-      ) for h, v in requests
+        {'content': base64.b64encode(zlib.compress(isolated_data))},
+      ),
+      (
+        '%s/_ah/api/isolateservice/v1/retrieve_batch' % server_ref.url,
+        {
+            'data': {
+                'digests': [h.encode('utf-8') for h in digests],
+                'namespace': namespace,
+            },
+            'read_timeout': 60,
+        },
+        {
+          'items': [
+            {
+              'digest': h,
+              'content': base64.b64encode(zlib.compress(contents[h])),
+            } for h in digests
+          ],
+        },
+      ),
     ]
     cmd = [
       'download',
@@ -247,6 +247,14 @@ class HttpServiceTest(RetryLoopMockedTest):
     self.assertEqual(1, len(count))
     self.assertAttempts(1, net.URL_OPEN_TIMEOUT)
 
+  def test_request_HTTP_error_returned(self):
+    def mock_perform_request(request):
+      raise net_utils.make_fake_error(410, request.get_full_url())
+
+    service = self.mocked_http_service(perform_request=mock_perform_request)
+    self.assertEqual(
+        410, service.request('/', data={}, return_http_errors=True).code)
+
   def test_request_HTTP_error_retry_404_endpoints(self):
     response = 'data'
     attempts = []
@@ -586,6 +586,37 @@ class TestSwarmingCollection(NetTestCase):
     expected = [gen_yielded_data(0, output=OUTPUT, exit_code=1)]
     self.assertEqual(expected, get_results(['10100']))
 
+  def test_success_paged(self):
+    # The first page was cut short of a partial UTF-8 character. The output
+    # ends with an empty page.
+    self.expected_requests(
+        [
+          (
+            'https://host:9001/_ah/api/swarming/v1/task/10100/result',
+            {'retry_50x': False},
+            gen_result_response(),
+          ),
+          (
+            'https://host:9001/_ah/api/swarming/v1/task/10100/stdout',
+            {},
+            {'output': OUTPUT[:6], 'next_offset': '6'},
+          ),
+          (
+            'https://host:9001/_ah/api/swarming/v1/task/10100/stdout'
+                '?offset=6',
+            {},
+            {'output': OUTPUT[6:], 'next_offset': str(len(OUTPUT))},
+          ),
+          (
+            'https://host:9001/_ah/api/swarming/v1/task/10100/stdout'
+                '?offset=%d' % len(OUTPUT),
+            {},
+            {'next_offset': str(len(OUTPUT))},
+          ),
+        ])
+    expected = [gen_yielded_data(0, output=OUTPUT)]
+    self.assertEqual(expected, get_results(['10100']))
+
   def test_no_ids(self):
     actual = get_results([])
     self.assertEqual([], actual)
@@ -657,6 +688,98 @@ class TestSwarmingCollection(NetTestCase):
     actual = get_results(['10100', '10200', '10300'])
     self.assertEqual(expected, sorted(actual))
 
+  def test_many_shards_batch(self):
+    self.mock(swarming.threading, 'Event', NonBlockingEvent)
+    base = 'https://host:9001/_ah/api/swarming/v1/'
+    self.expected_requests(
+        [
+          (
+            base + 'tasks/get_results?task_id=10100&task_id=10200&'
+                'task_id=10300&task_id=10400',
+            {'retry_50x': False},
+            {
+              'items': [
+                gen_result_response(task_id=u'10100'),
+                gen_result_response(task_id=u'10200'),
+                gen_result_response(task_id=u'10300', state=u'RUNNING'),
+              ],
+              'not_found': [u'10400'],
+            },
+          ),
+          (
+            base + 'task/10100/stdout',
+            {},
+            {'output': SHARD_OUTPUT_1},
+          ),
+          (
+            base + 'task/10200/stdout',
+            {},
+            {'output': SHARD_OUTPUT_2},
+          ),
+          (
+            base + 'tasks/get_results?task_id=10300&task_id=10400',
+            {'retry_50x': False},
+            {
+              'items': [
+                gen_result_response(task_id=u'10300'),
+                gen_result_response(task_id=u'10400', exit_code=1),
+              ],
+            },
+          ),
+          (
+            base + 'task/10300/stdout',
+            {},
+            {'output': SHARD_OUTPUT_3},
+          ),
+          (
+            base + 'task/10400/stdout',
+            {},
+            {'output': OUTPUT},
+          ),
+        ])
+    expected = [
+      gen_yielded_data(0, output=SHARD_OUTPUT_1, task_id=u'10100'),
+      gen_yielded_data(1, output=SHARD_OUTPUT_2, task_id=u'10200'),
+      gen_yielded_data(2, output=SHARD_OUTPUT_3, task_id=u'10300'),
+      gen_yielded_data(3, output=OUTPUT, task_id=u'10400', exit_code=1),
+    ]
+    actual = get_results(['10100', '10200', '10300', '10400'])
+    self.assertEqual(expected, sorted(actual))
+
+  def test_many_shards_batch_unsupported(self):
+    # The server doesn't support tasks/get_results, the results are retrieved
+    # one at a time.
+    self.mock(logging, 'warning', lambda *_, **__: None)
+    base = 'https://host:9001/_ah/api/swarming/v1/'
+    task_ids = ['10100', '10200', '10300', '10400']
+    requests = [
+      (
+        base + 'tasks/get_results?' +
+            '&'.join('task_id=' + t for t in task_ids),
+        {'retry_50x': False},
+        None,
+      ),
+    ]
+    for task_id in task_ids:
+      requests.extend([
+        (
+          base + 'task/%s/result' % task_id,
+          {'retry_50x': False},
+          gen_result_response(task_id=task_id),
+        ),
+        (
+          base + 'task/%s/stdout' % task_id,
+          {},
+          {'output': OUTPUT},
+        ),
+      ])
+    self.expected_requests(requests)
+    expected = [
+      gen_yielded_data(i, output=OUTPUT, task_id=t)
+      for i, t in enumerate(task_ids)
+    ]
+    self.assertEqual(expected, sorted(get_results(task_ids)))
+
   def test_output_collector_called(self):
     # Three shards, one failed. All results are passed to output collector.
     self.expected_requests(
@@ -5,7 +5,9 @@
 
 """Profiler to compare various compression levels with regards to speed
 and final size when compressing the full set of files from a given
-isolated file.
+isolated file or directory.
+
+'auto' is the per file level chosen by isolateserver.
 """
 
 import bz2
@@ -25,6 +27,8 @@ from third_party.depot_tools import fix_encoding
 from utils import file_path
 from utils import tools
 
+import isolateserver
+
 
 def zip_file(compressor_constructor, compression_level, filename):
   compressed_size = 0
@@ -34,7 +38,7 @@ def zip_file(compressor_constructor, compression_level, filename):
       chunk = f.read(16 * 1024)
       if not chunk:
         break
-      compressed_size += len(compressor.compress(f.read()))
+      compressed_size += len(compressor.compress(chunk))
     compressed_size += len(compressor.flush())
 
   return compressed_size
@@ -49,6 +53,22 @@ def zip_directory(compressor_constructor, compression_level, root_dir):
   return compressed_size
 
 
+def zip_file_auto(filename):
+  level = isolateserver._get_zip_compression_level(filename)
+  with open(filename, 'rb') as f:
+    chunks = iter(lambda: f.read(16 * 1024), '')
+    return sum(len(c) for c in isolateserver.zip_compress(chunks, level))
+
+
+def profile_auto(filenames):
+  start_time = time.time()
+  compressed_size = sum(zip_file_auto(f) for f in filenames)
+  end_time = time.time()
+
+  print('auto at compression level -, total size %11d, time taken %6.3f' %
+        (compressed_size, end_time - start_time))
+
+
 def profile_compress(zip_module_name, compressor_constructor,
                      compression_range, compress_func, compress_target):
   for i in compression_range:
@@ -74,6 +94,9 @@ def main():
   tools.disable_buffering()
   parser = optparse.OptionParser()
   parser.add_option('-s', '--isolated', help='.isolated file to profile with.')
+  parser.add_option(
+      '-d', '--dir',
+      help='Directory to profile with instead, e.g. a build output directory.')
   parser.add_option('--largest_files', type='int',
                     help='If this is set, instead of compressing all the '
                     'files, only the large n files will be compressed')
@@ -81,20 +104,24 @@ def main():
 
   if args:
     parser.error('Unknown args passed in; %s' % args)
-  if not options.isolated:
-    parser.error('The .isolated file must be given.')
+  if bool(options.isolated) == bool(options.dir):
+    parser.error('Exactly one of the .isolated file or directory must be given.')
 
   temp_dir = None
   try:
-    temp_dir = tempfile.mkdtemp(prefix=u'zip_profiler')
+    if options.dir:
+      root_dir = os.path.abspath(options.dir)
+    else:
+      temp_dir = tempfile.mkdtemp(prefix=u'zip_profiler')
+      root_dir = temp_dir
 
-    # Create a directory of the required files
-    subprocess.check_call([os.path.join(ROOT_DIR, 'isolate.py'),
-                           'remap',
-                           '-s', options.isolated,
-                           '--outdir', temp_dir])
+      # Create a directory of the required files
+      subprocess.check_call([os.path.join(ROOT_DIR, 'isolate.py'),
+                             'remap',
+                             '-s', options.isolated,
+                             '--outdir', temp_dir])
 
-    file_set = tree_files(temp_dir)
+    file_set = tree_files(root_dir)
 
     if options.largest_files:
       sorted_by_size = sorted(file_set.iteritems(),  key=lambda x: x[1],
@@ -106,6 +133,7 @@ def main():
 
         profile_compress('zlib', zlib.compressobj, range(10), zip_file,
                          filename)
+        profile_auto([filename])
         profile_compress('bz2', bz2.BZ2Compressor, range(1, 10), zip_file,
                          filename)
     else:
@@ -114,11 +142,13 @@ def main():
 
       # Profile!
       profile_compress('zlib', zlib.compressobj, range(10), zip_directory,
-                       temp_dir)
+                       root_dir)
+      profile_auto(file_set)
       profile_compress('bz2', bz2.BZ2Compressor, range(1, 10), zip_directory,
-                       temp_dir)
+                       root_dir)
   finally:
-    file_path.rmtree(temp_dir)
+    if temp_dir:
+      file_path.rmtree(temp_dir)
 
 
 if __name__ == '__main__':
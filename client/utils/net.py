@@ -424,7 +424,8 @@ class HttpService(object):
       stream=True,
       method=None,
       headers=None,
-      follow_redirects=True):
+      follow_redirects=True,
+      return_http_errors=False):
     """Attempts to open the given url multiple times.
 
     |urlpath| is relative to the server root, i.e. '/some/request?param=1'.
@@ -454,6 +455,9 @@ class HttpService(object):
     otherwise redirect response will be returned as is. It can be recognized
     by the presence of 'Location' response header.
 
+    If |return_http_errors| is True, a response with an HTTP error code that is
+    not retried is returned instead of None, so the caller can look at the code.
+
     If |read_timeout| is not None will configure underlying socket to
     raise TimeoutError exception whenever there's no response from the server
     for more than |read_timeout| seconds. It can happen during any read
@@ -558,7 +562,7 @@ class HttpService(object):
           logging.error(
               'Request to %s failed with HTTP status code %d: %s',
               request.get_full_url(), e.response.code, e.description())
-          return None
+          return e.response if return_http_errors else None
 
         # Retry all other errors.
         logging.warning(